@@ -0,0 +1,295 @@
+"""
+Повестка мероприятий пользователя с повторяющимися событиями (RRULE).
+
+- Серии загружаются из календаря Bitrix24 один раз на AGENDA_HORIZON_DAYS
+  дней вперёд; повторения разворачиваются лениво — порциями по
+  AGENDA_WINDOW_DAYS дней и только когда запрос доходит до ещё не
+  развёрнутого периода. Первое повторение окна вычисляется арифметически,
+  прошлые повторения серии не перебираются.
+- Вхождения лежат в списке, отсортированном по началу. Пересекающие
+  интервал [a, b) ищутся бинарным поиском начал в [a - d, b), где d — самая
+  длинная из коротких (до суток) длительностей; длинные вхождения (отпуска,
+  командировки) — в отдельном маленьком списке. «Ближайшие N», «мероприятия
+  на дату» и проверка пересечений — O(log n + k). Дата за горизонтом
+  запрашивается у портала отдельно (events_on).
+- Повестки кешируются на AGENDA_CACHE_TTL секунд для AGENDA_CACHE_SIZE
+  пользователей.
+
+Время везде местное (config.TIMEZONE), без часового пояса.
+"""
+
+import functools
+import threading
+import time as monotonic_time
+from bisect import bisect_left
+from calendar import monthrange
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from bitrix_api import get_calendar_events
+from config import AGENDA_CACHE_SIZE, AGENDA_CACHE_TTL, AGENDA_HORIZON_DAYS, AGENDA_WINDOW_DAYS, TIMEZONE
+from metrics import cache_hit, cache_miss
+from oauth import current_oauth_user
+from portals import current_portal
+from records import CalendarEvent, bitrix_datetime
+
+# Длиннее — «длинное» вхождение, хранится вне основного индекса
+_LONG = timedelta(days=1)
+_WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+_FREQS = frozenset({"DAILY", "WEEKLY", "MONTHLY", "YEARLY"})
+
+
+class Occurrence(NamedTuple):
+    start: datetime
+    end: datetime
+    event_id: int
+    name: str
+    all_day: bool
+
+
+class Recurrence(NamedTuple):
+    freq: str
+    interval: int
+    count: Optional[int]
+    until: Optional[datetime]
+    # Дни недели (0 — понедельник) для WEEKLY
+    byday: Tuple[int, ...]
+
+
+def local_now() -> datetime:
+    return datetime.now(ZoneInfo(TIMEZONE)).replace(tzinfo=None)
+
+
+def _until(value: str) -> datetime:
+    # UNTIL бывает "01.01.2038" (Bitrix24) или "20380101T000000Z" (RFC 5545)
+    for fmt in ("%Y%m%dT%H%M%SZ", "%Y%m%dT%H%M%S", "%Y%m%d"):
+        try:
+            parsed = datetime.strptime(value, fmt)
+            break
+        except ValueError:
+            pass
+    else:
+        parsed = bitrix_datetime(value)
+    # Дата без времени — включительно до конца дня
+    return datetime.combine(parsed.date(), time.max) if parsed.time() == time.min else parsed
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_rrule(rule: str) -> Optional[Recurrence]:
+    """Правило повторения; None — правило не поддерживается (событие показывается один раз)."""
+    fields = dict(part.split("=", 1) for part in rule.upper().split(";") if "=" in part)
+    freq = fields.get("FREQ", "")
+    if freq not in _FREQS:
+        return None
+    try:
+        interval = max(1, int(fields.get("INTERVAL") or 1))
+        count = int(fields.get("COUNT") or 0) or None
+        until = _until(fields["UNTIL"]) if fields.get("UNTIL") else None
+    except ValueError:
+        return None
+    byday = tuple(sorted({_WEEKDAYS[day[-2:]] for day in fields.get("BYDAY", "").split(",") if day[-2:] in _WEEKDAYS}))
+    return Recurrence(freq, interval, count, until, byday)
+
+
+def _starts(first: datetime, rule: Recurrence, since: datetime) -> Iterator[Tuple[int, datetime]]:
+    """
+    (номер повторения, начало) по порядку, с последнего периода не позже since.
+    Номер нужен для COUNT и считается без перебора пропущенных периодов.
+    """
+    if rule.freq == "DAILY":
+        step = timedelta(days=rule.interval)
+        k = max(0, (since - first) // step)
+        while True:
+            yield k, first + k * step
+            k += 1
+
+    if rule.freq == "WEEKLY":
+        days = rule.byday or (first.weekday(),)
+        first_week = [d for d in days if d >= first.weekday()]
+        week0 = first - timedelta(days=first.weekday())
+        period = timedelta(weeks=rule.interval)
+        k = max(0, (since - week0) // period)
+        index = 0 if k == 0 else len(first_week) + (k - 1) * len(days)
+        while True:
+            monday = week0 + k * period
+            for d in first_week if k == 0 else days:
+                yield index, monday + timedelta(days=d)
+                index += 1
+            k += 1
+
+    # MONTHLY, YEARLY: несуществующие даты (31 число, 29 февраля) пропускаются
+    # и не считаются в COUNT, поэтому с COUNT перебор идёт с начала серии —
+    # он всё равно ограничен числом повторений
+    months = rule.interval * (12 if rule.freq == "YEARLY" else 1)
+    k = 0
+    if rule.count is None:
+        k = max(0, ((since.year - first.year) * 12 + since.month - first.month) // months)
+    index = 0
+    while True:
+        total = first.month - 1 + k * months
+        year, month = first.year + total // 12, total % 12 + 1
+        if first.day <= monthrange(year, month)[1]:
+            yield index, first.replace(year=year, month=month)
+            index += 1
+        k += 1
+
+
+def expand(event: CalendarEvent, start: datetime, end: datetime) -> Iterator[Occurrence]:
+    """Вхождения события, начинающиеся в [start, end)."""
+    rule = parse_rrule(event.rrule) if event.rrule else None
+    if rule is None:
+        if start <= event.start < end:
+            yield Occurrence(event.start, event.end, event.id, event.name, event.all_day)
+        return
+    duration = event.end - event.start
+    for index, begin in _starts(event.start, rule, start):
+        if begin >= end or (rule.until is not None and begin > rule.until) or (rule.count and index >= rule.count):
+            return
+        if begin >= start and begin.date() not in event.exdates:
+            yield Occurrence(begin, begin + duration, event.id, event.name, event.all_day)
+
+
+def _overlaps(occurrence: Occurrence, start: datetime, end: datetime) -> bool:
+    # Событие без длительности пересекает интервал, если начинается в нём
+    return occurrence.start < end and (occurrence.end > start or occurrence.start >= start)
+
+
+class Agenda:
+    """Развёрнутые вхождения серий пользователя; окно расширяется по запросам."""
+
+    def __init__(self, events: Iterable[CalendarEvent], since: datetime, horizon: datetime) -> None:
+        self._events = list(events)
+        durations = [e.end - e.start for e in self._events]
+        self._max_short = max((d for d in durations if d <= _LONG), default=timedelta(0))
+        # Уже идущие к since события тоже попадают в повестку
+        self._hi = since - max(durations, default=timedelta(0))
+        self._horizon = horizon
+        self._starts: List[datetime] = []
+        self._items: List[Occurrence] = []
+        self._long: List[Occurrence] = []
+        # Запросы одного пользователя могут прийти из разных потоков пула портала
+        self._lock = threading.Lock()
+
+    @property
+    def horizon(self) -> datetime:
+        return self._horizon
+
+    def _extend(self, until: datetime) -> None:
+        if until <= self._hi or self._hi >= self._horizon:
+            return
+        # Не меньше AGENDA_WINDOW_DAYS за раз: следующий запрос обычно рядом
+        until = min(max(until, self._hi + timedelta(days=AGENDA_WINDOW_DAYS)), self._horizon)
+        chunk = sorted(o for e in self._events for o in expand(e, self._hi, until))
+        for occurrence in chunk:
+            if occurrence.end - occurrence.start > _LONG:
+                self._long.append(occurrence)
+            else:
+                self._starts.append(occurrence.start)
+                self._items.append(occurrence)
+        self._hi = until
+
+    def _scan(self, start: datetime, end: datetime) -> List[Occurrence]:
+        lo = bisect_left(self._starts, start - self._max_short)
+        hi = bisect_left(self._starts, end)
+        found = [o for o in self._items[lo:hi] if _overlaps(o, start, end)]
+        longs = [o for o in self._long if _overlaps(o, start, end)]
+        return sorted(found + longs) if longs else found
+
+    def overlapping(self, start: datetime, end: datetime) -> List[Occurrence]:
+        """Вхождения, пересекающие [start, end), по началу."""
+        with self._lock:
+            self._extend(end)
+            return self._scan(start, end)
+
+    def on_date(self, day: date) -> List[Occurrence]:
+        start = datetime.combine(day, time.min)
+        return self.overlapping(start, start + timedelta(days=1))
+
+    def upcoming(self, now: datetime, limit: int) -> List[Occurrence]:
+        """Идущие сейчас и ближайшие limit вхождений (в пределах горизонта)."""
+        with self._lock:
+            self._extend(now)
+            while True:
+                lo = bisect_left(self._starts, now - self._max_short)
+                found: List[Occurrence] = []
+                for occurrence in self._items[lo:]:
+                    if _overlaps(occurrence, now, self._horizon):
+                        found.append(occurrence)
+                        if len(found) == limit:
+                            break
+                # Всё, что ещё не развёрнуто, начинается не раньше self._hi
+                if len(found) == limit or self._hi >= self._horizon:
+                    break
+                self._extend(self._hi + timedelta(days=AGENDA_WINDOW_DAYS))
+            longs = [o for o in self._long if _overlaps(o, now, self._horizon)]
+            return sorted(found + longs)[:limit] if longs else found
+
+
+def conflicts(occurrences: Sequence[Occurrence]) -> Set[int]:
+    """
+    Номера вхождений (в списке по началу), пересекающихся с другими, — за один
+    проход. События на весь день время не занимают и конфликтами не считаются.
+    """
+    result: Set[int] = set()
+    latest = -1
+    latest_end = datetime.min
+    for i, occurrence in enumerate(occurrences):
+        if occurrence.all_day:
+            continue
+        if latest >= 0 and occurrence.start < latest_end:
+            result.add(i)
+            result.add(latest)
+        if occurrence.end > latest_end:
+            latest, latest_end = i, occurrence.end
+    return result
+
+
+# (портал, пользователь OAuth, bitrix_user_id) -> (время загрузки, повестка)
+_agendas: "OrderedDict[Tuple, Tuple[float, Agenda]]" = OrderedDict()
+_agendas_lock = threading.Lock()
+
+
+def get_agenda(bitrix_user_id: int, force: bool = False) -> Agenda:
+    """
+    Повестка пользователя от начала сегодняшнего дня на AGENDA_HORIZON_DAYS дней.
+    Серии запрашиваются у портала одним вызовом и кешируются на AGENDA_CACHE_TTL
+    секунд; force=True — загрузить заново.
+    """
+    key = (current_portal().name, current_oauth_user(), bitrix_user_id)
+    now = monotonic_time.monotonic()
+    with _agendas_lock:
+        cached = _agendas.get(key)
+        if not force and cached is not None and now - cached[0] <= AGENDA_CACHE_TTL:
+            _agendas.move_to_end(key)
+            cache_hit("agenda")
+            return cached[1]
+    cache_miss("agenda")
+
+    since = datetime.combine(local_now().date(), time.min)
+    horizon = since + timedelta(days=AGENDA_HORIZON_DAYS)
+    events = get_calendar_events(bitrix_user_id, since.date(), horizon.date())
+    agenda = Agenda(events, since, horizon)
+    with _agendas_lock:
+        _agendas[key] = (now, agenda)
+        _agendas.move_to_end(key)
+        while len(_agendas) > AGENDA_CACHE_SIZE:
+            _agendas.popitem(last=False)
+    return agenda
+
+
+def events_on(bitrix_user_id: int, day: date) -> List[Occurrence]:
+    """Мероприятия на дату; дата за горизонтом повестки — отдельным запросом только за этот день."""
+    agenda = get_agenda(bitrix_user_id)
+    start = datetime.combine(day, time.min)
+    if start < agenda.horizon:
+        return agenda.on_date(day)
+    return Agenda(get_calendar_events(bitrix_user_id, day, day), start, start + timedelta(days=1)).on_date(day)
+
+
+def forget_agenda(bitrix_user_id: int) -> None:
+    """Сбрасывает повестку пользователя (после создания мероприятия)."""
+    with _agendas_lock:
+        for key in [k for k in _agendas if k[2] == bitrix_user_id]:
+            del _agendas[key]
@@ -0,0 +1,225 @@
+"""
+Вложения к задачам: файл или фото с подписью «#123» в личном чате
+(handlers/attachments.py) прикрепляется к задаче 123.
+
+Файл не загружается в память целиком. Поток загрузки читает его из Telegram
+кусками по TASK_FILE_CHUNK_BYTES и сразу отправляет каждый кусок в запрос
+загрузки на Диск Bitrix24 (bitrix_api.upload_disk_file). Следующий кусок
+читается, только когда предыдущий ушёл в сокет: на одну загрузку в памяти —
+один кусок, на процесс — не больше TASK_FILE_MAX_CONCURRENT кусков,
+каким бы большим ни был файл.
+
+- Одновременно идут не больше TASK_FILE_MAX_CONCURRENT загрузок, в своём
+  пуле потоков: долгие загрузки не занимают пул портала, через который идут
+  обычные запросы. Остальные ждут очереди; у одного пользователя в очереди —
+  не больше TASK_FILE_MAX_QUEUED_PER_USER файлов.
+- Загрузка идёт фоновой задачей: обработчик сразу отвечает сообщением о
+  ходе загрузки и правит его не чаще раза в TASK_FILE_PROGRESS_INTERVAL секунд,
+  а остальные сообщения пользователя обрабатываются как обычно.
+- Файл сохраняется на личный диск отправителя и прикрепляется к задаче
+  с его правами (в режиме OAuth) — как и остальные действия в боте.
+  Прикрепить можно только к задаче, где отправитель участвует: в режиме
+  вебхука права портала этого не проверяют.
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
+from telegram.error import BadRequest, TelegramError
+
+from bitrix_api import BitrixAPIError, attach_task_file, get_user_disk_folder, is_task_member, upload_disk_file
+from config import (
+    TASK_FILE_CHUNK_BYTES,
+    TASK_FILE_IO_TIMEOUT,
+    TASK_FILE_MAX_BYTES,
+    TASK_FILE_MAX_CONCURRENT,
+    TASK_FILE_MAX_QUEUED_PER_USER,
+    TASK_FILE_PROGRESS_INTERVAL,
+)
+from metrics import TASK_FILE_BYTES, TASK_FILE_IN_FLIGHT, TASK_FILE_QUEUED, TASK_FILE_UPLOADS
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=TASK_FILE_MAX_CONCURRENT, thread_name_prefix="attachments")
+_slots = asyncio.Semaphore(TASK_FILE_MAX_CONCURRENT)
+# telegram_user_id -> файлы пользователя в очереди и в загрузке
+_queued: Counter = Counter()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class AttachmentError(Exception):
+    pass
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} МБ"
+
+
+def _telegram_session():
+    """HTTP-сессия для скачивания файлов из Telegram; requests импортируется при первом файле."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+
+                _session = requests.Session()
+    return _session
+
+
+class _Progress:
+    """Счётчик переданных байт: пишет поток загрузки, читает цикл правки сообщения."""
+
+    def __init__(self) -> None:
+        self.sent = 0
+
+
+def _telegram_chunks(file_path: str, progress: _Progress) -> Iterator[bytes]:
+    """
+    Куски файла из Telegram. file_path — URL файла (облачный Bot API)
+    или путь на диске (свой Bot API server в режиме local_mode).
+    """
+    if not file_path.startswith(("http://", "https://")):
+        with open(file_path, "rb") as source:
+            while True:
+                chunk = source.read(TASK_FILE_CHUNK_BYTES)
+                if not chunk:
+                    return
+                progress.sent += len(chunk)
+                yield chunk
+
+    import requests
+
+    # В URL файла — токен бота: в тексте ошибок его быть не должно
+    try:
+        with _telegram_session().get(file_path, stream=True, timeout=TASK_FILE_IO_TIMEOUT) as response:
+            if response.status_code != 200:
+                raise AttachmentError(f"Telegram не отдал файл: HTTP {response.status_code}")
+            for chunk in response.iter_content(TASK_FILE_CHUNK_BYTES):
+                progress.sent += len(chunk)
+                yield chunk
+    except requests.RequestException:
+        raise AttachmentError("Не удалось скачать файл из Telegram") from None
+
+
+def _transfer(file_path: str, file_name: str, size: int, task_id: int, bitrix_user_id: int, progress: _Progress) -> int:
+    """Синхронная часть: Telegram -> Диск -> задача. Возвращает ID файла на Диске."""
+    if not is_task_member(task_id, bitrix_user_id):
+        raise AttachmentError(f"задача #{task_id} не найдена или вы в ней не участвуете")
+    folder_id = get_user_disk_folder(bitrix_user_id)
+    file_id = upload_disk_file(folder_id, file_name, _telegram_chunks(file_path, progress), size)
+    attach_task_file(task_id, file_id)
+    return file_id
+
+
+def reserve_upload(telegram_user_id: int) -> bool:
+    """Место в очереди загрузок пользователя; False — очередь заполнена."""
+    if _queued[telegram_user_id] >= TASK_FILE_MAX_QUEUED_PER_USER:
+        return False
+    _queued[telegram_user_id] += 1
+    TASK_FILE_QUEUED.inc()
+    return True
+
+
+def cancel_upload(telegram_user_id: int) -> None:
+    """Возвращает место, занятое reserve_upload, если загрузка так и не началась."""
+    TASK_FILE_QUEUED.dec()
+    _release(telegram_user_id)
+
+
+def _release(telegram_user_id: int) -> None:
+    _queued[telegram_user_id] -= 1
+    if _queued[telegram_user_id] <= 0:
+        del _queued[telegram_user_id]
+
+
+async def _edit(bot, chat_id: int, message_id: int, text: str) -> None:
+    try:
+        await bot.edit_message_text(text, chat_id, message_id)
+    except BadRequest as exc:
+        if "not modified" not in exc.message.lower():
+            logger.info("Не удалось обновить сообщение о загрузке в чате %s: %s", chat_id, exc.message)
+    except TelegramError:
+        # Ход загрузки необязателен; итог попробуем отправить следующей правкой
+        logger.info("Не удалось обновить сообщение о загрузке в чате %s", chat_id)
+
+
+async def upload_attachment(
+    bot,
+    chat_id: int,
+    status_message_id: int,
+    telegram_user_id: int,
+    bitrix_user_id: int,
+    task_id: int,
+    file_id: str,
+    file_name: str,
+    size: Optional[int],
+) -> bool:
+    """
+    Фоновая загрузка вложения (место в очереди уже занято reserve_upload).
+    Ход и итог — правкой сообщения status_message_id. True — файл прикреплён.
+    """
+    label = f"📎 {file_name} → задача #{task_id}"
+    progress = _Progress()
+    queued = True
+    try:
+        async with _slots:
+            queued = False
+            TASK_FILE_QUEUED.dec()
+            TASK_FILE_IN_FLIGHT.inc()
+            try:
+                tg_file = await bot.get_file(file_id)
+                size = tg_file.file_size or size
+                if not size or not tg_file.file_path:
+                    raise AttachmentError("Telegram не сообщил размер файла")
+                if size > TASK_FILE_MAX_BYTES:
+                    raise AttachmentError(f"файл больше {_megabytes(TASK_FILE_MAX_BYTES)}")
+                await _edit(bot, chat_id, status_message_id, f"{label}\nЗагрузка: 0 из {_megabytes(size)}")
+
+                ctx = contextvars.copy_context()
+                call = functools.partial(
+                    ctx.run, _transfer, tg_file.file_path, file_name, size, task_id, bitrix_user_id, progress
+                )
+                future = asyncio.get_running_loop().run_in_executor(_executor, call)
+                shown = 0
+                while not future.done():
+                    await asyncio.wait({future}, timeout=TASK_FILE_PROGRESS_INTERVAL)
+                    if not future.done() and progress.sent != shown:
+                        shown = progress.sent
+                        await _edit(
+                            bot,
+                            chat_id,
+                            status_message_id,
+                            f"{label}\nЗагрузка: {_megabytes(shown)} из {_megabytes(size)} "
+                            f"({shown * 100 // size}%)",
+                        )
+                future.result()
+            finally:
+                TASK_FILE_IN_FLIGHT.dec()
+    except (AttachmentError, BitrixAPIError, TelegramError) as exc:
+        TASK_FILE_UPLOADS.inc("error")
+        logger.warning("Вложение к задаче %s не загружено: %s", task_id, exc)
+        await _edit(bot, chat_id, status_message_id, f"{label}\n❌ Не удалось прикрепить файл: {exc}")
+        return False
+    except Exception:
+        TASK_FILE_UPLOADS.inc("error")
+        logger.exception("Ошибка загрузки вложения к задаче %s", task_id)
+        await _edit(bot, chat_id, status_message_id, f"{label}\n❌ Не удалось прикрепить файл, попробуйте позже.")
+        return False
+    finally:
+        if queued:
+            TASK_FILE_QUEUED.dec()
+        _release(telegram_user_id)
+
+    TASK_FILE_UPLOADS.inc("ok")
+    TASK_FILE_BYTES.inc(amount=size)
+    await _edit(bot, chat_id, status_message_id, f"{label}\n✅ Файл прикреплён ({_megabytes(size)})")
+    return True
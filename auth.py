@@ -2,105 +2,741 @@
 Модуль авторизации пользователей бота.
 
 Логика:
-- У каждого сотрудника есть логин.
-- Пароль один общий (хранится в config.COMMON_PASSWORD).
-- По логину определяем bitrix_user_id и ФИО.
-- Связку telegram_user_id <-> bitrix_user_id храним в SQLite.
+- У каждого сотрудника есть логин (LOGIN или EMAIL в Bitrix24).
+- Вход подтверждается одноразовым кодом из уведомления Bitrix24 или личным
+  паролем (config.LOGIN_METHOD). Коды и пароли хранятся только как хеши
+  scrypt; проверка выполняется в пуле потоков, не блокируя цикл событий.
+- Неудачные попытки считаются в скользящем окне по Telegram-аккаунту
+  и по логину (таблица login_attempts).
+- По логину определяем bitrix_user_id и ФИО. Справочник сотрудников
+  синхронизируется из Bitrix24 в таблицу employees (employees_sync.py),
+  для проверки входа он держится в памяти как словарь логин -> сотрудник.
+- Бот может обслуживать несколько порталов (config.BITRIX_PORTALS):
+  сотрудники, пароли и привязки хранятся с именем портала. Если логин есть
+  на нескольких порталах, при входе его указывают как "портал/логин".
+- Связку telegram_user_id <-> (портал, bitrix_user_id) храним в SQLite
+  и дублируем в общее хранилище (state), чтобы её видели все процессы бота.
+- В режиме OAuth (config.BITRIX_AUTH_MODE) рядом с привязкой хранятся
+  токены сотрудника (таблица user_tokens); кеш и обновление — в oauth.py.
+- Там же хранятся настройки ежедневной сводки задач (digest.py).
+  Локальная копия задач (tasks_sync.py) и доски команд (team_board.py)
+  лежат в той же базе, их таблицы — в replica_store.py и team_board_store.py.
 """
 
+import asyncio
+import hashlib
+import hmac
+import secrets
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Set, Tuple
 
-from config import COMMON_PASSWORD
+from config import (
+    DEFAULT_PORTAL,
+    LOGIN_ATTEMPT_WINDOW,
+    LOGIN_CODE_TTL,
+    LOGIN_KDF_N,
+    LOGIN_KDF_P,
+    LOGIN_KDF_R,
+    LOGIN_KDF_WORKERS,
+    LOGIN_MAX_ATTEMPTS,
+)
+from metrics import SQLITE_LATENCY, cache_hit, cache_miss
+from portals import portal_names
+from state import get_backend
 
 DB_PATH = Path(__file__).resolve().parent / "bot_data.sqlite3"
 
-# ВНИМАНИЕ: заполните маппинг логинов под ваших сотрудников.
-# Ключ: логин (нижний регистр), Значение: словарь с bitrix_user_id и именем.
-LOGIN_MAP = {
-    # "admin": {"bitrix_user_id": 1, "name": "Администратор"},
-}
+# Версия справочника логинов в общем хранилище: увеличивается после каждой
+# синхронизации, по ней процессы бота перечитывают словарь из SQLite
+_LOGIN_INDEX_VERSION_KEY = "employees:login_version"
+
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Соединение с базой. Схема создаётся при первом обращении,
+    а не при запуске бота, чтобы не задерживать первый getUpdates.
+    """
+    if not _schema_ready:
+        init_db()
+    return sqlite3.connect(DB_PATH)
 
 
 def init_db() -> None:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            telegram_user_id INTEGER PRIMARY KEY,
-            login TEXT NOT NULL,
-            bitrix_user_id INTEGER NOT NULL,
-            name TEXT
-        )
-        """
+    global _schema_ready
+    with _schema_lock, SQLITE_LATENCY.time("init_db"):
+        conn = sqlite3.connect(DB_PATH)
+        cur = conn.cursor()
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                telegram_user_id INTEGER PRIMARY KEY,
+                login TEXT NOT NULL,
+                bitrix_user_id INTEGER NOT NULL,
+                name TEXT,
+                portal TEXT NOT NULL DEFAULT ''
+            )
+            """
+        )
+        _migrate_to_portals(cur)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS digest_settings (
+                telegram_user_id INTEGER PRIMARY KEY,
+                send_time TEXT NOT NULL,
+                roles TEXT NOT NULL,
+                last_sent TEXT
+            )
+            """
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS digest_settings_send_time ON digest_settings (send_time)"
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS employees (
+                portal TEXT NOT NULL,
+                bitrix_user_id INTEGER NOT NULL,
+                login TEXT,
+                email TEXT,
+                name TEXT NOT NULL,
+                active INTEGER NOT NULL,
+                timestamp_x TEXT,
+                PRIMARY KEY (portal, bitrix_user_id)
+            )
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS employees_login ON employees (login)")
+        cur.execute("CREATE INDEX IF NOT EXISTS employees_email ON employees (email)")
+        cur.execute("CREATE INDEX IF NOT EXISTS employees_timestamp_x ON employees (portal, timestamp_x)")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS passwords (
+                portal TEXT NOT NULL,
+                bitrix_user_id INTEGER NOT NULL,
+                password_hash TEXT NOT NULL,
+                PRIMARY KEY (portal, bitrix_user_id)
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS login_codes (
+                telegram_user_id INTEGER PRIMARY KEY,
+                login TEXT NOT NULL,
+                code_hash TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_tokens (
+                telegram_user_id INTEGER PRIMARY KEY,
+                portal TEXT NOT NULL,
+                bitrix_user_id INTEGER NOT NULL,
+                client_endpoint TEXT NOT NULL,
+                access_token TEXT NOT NULL,
+                refresh_token TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                refreshed_at REAL NOT NULL
+            )
+            """
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS user_tokens_refreshed_at ON user_tokens (refreshed_at)")
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS login_attempts (
+                attempt_key TEXT NOT NULL,
+                attempted_at REAL NOT NULL
+            )
+            """
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS login_attempts_key ON login_attempts (attempt_key, attempted_at)"
+        )
+        conn.commit()
+        conn.close()
+        _schema_ready = True
+
+
+def _table_columns(cur: sqlite3.Cursor, table: str) -> List[str]:
+    cur.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cur.fetchall()]
+
+
+def _migrate_to_portals(cur: sqlite3.Cursor) -> None:
+    """
+    Перевод базы одно-портального бота: существующие привязки относятся
+    к порталу по умолчанию. Выполняется до создания остальных таблиц в init_db.
+    """
+    if "portal" not in _table_columns(cur, "users"):
+        cur.execute("ALTER TABLE users ADD COLUMN portal TEXT NOT NULL DEFAULT ''")
+    cur.execute("UPDATE users SET portal = ? WHERE portal = ''", (DEFAULT_PORTAL,))
+
+
+# ======== Хеши паролей и кодов ========
+
+_kdf_pool = ThreadPoolExecutor(max_workers=LOGIN_KDF_WORKERS, thread_name_prefix="kdf")
+
+
+def hash_secret(secret: str) -> str:
+    """Хеш scrypt в виде 'scrypt$N$r$p$соль$хеш' (параметры хранятся вместе с хешем)."""
+    salt = secrets.token_bytes(16)
+    digest = hashlib.scrypt(
+        secret.encode("utf-8"), salt=salt, n=LOGIN_KDF_N, r=LOGIN_KDF_R, p=LOGIN_KDF_P,
+        maxmem=0x7FFFFFFF,
+    )
+    return f"scrypt${LOGIN_KDF_N}${LOGIN_KDF_R}${LOGIN_KDF_P}${salt.hex()}${digest.hex()}"
+
+
+def verify_secret(secret: str, stored: str) -> bool:
+    try:
+        scheme, n, r, p, salt, expected = stored.split("$")
+    except ValueError:
+        return False
+    if scheme != "scrypt":
+        return False
+    digest = hashlib.scrypt(
+        secret.encode("utf-8"), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p),
+        maxmem=0x7FFFFFFF,
     )
-    conn.commit()
-    conn.close()
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+async def run_kdf(func, *args):
+    """Вычисление scrypt в пуле потоков: hashlib отпускает GIL на время расчёта."""
+    return await asyncio.get_running_loop().run_in_executor(_kdf_pool, func, *args)
+
+
+# ======== Ограничение попыток входа ========
 
+def _attempt_keys(telegram_user_id: int, login: Optional[str]) -> List[str]:
+    keys = [f"tg:{telegram_user_id}"]
+    if login:
+        keys.append(f"login:{login}")
+    return keys
 
-def validate_credentials(login: str, password: str) -> Optional[Dict]:
+
+def login_attempts_left(telegram_user_id: int, login: Optional[str] = None) -> int:
+    """Сколько попыток осталось в текущем окне (минимум по Telegram-аккаунту и логину)."""
+    since = time.time() - LOGIN_ATTEMPT_WINDOW
+    left = LOGIN_MAX_ATTEMPTS
+    with SQLITE_LATENCY.time("login_attempts_left"):
+        conn = _connect()
+        cur = conn.cursor()
+        for key in _attempt_keys(telegram_user_id, login):
+            cur.execute(
+                "SELECT COUNT(*) FROM login_attempts WHERE attempt_key = ? AND attempted_at > ?",
+                (key, since),
+            )
+            left = min(left, LOGIN_MAX_ATTEMPTS - cur.fetchone()[0])
+        conn.close()
+    return max(0, left)
+
+
+def record_login_attempt(telegram_user_id: int, login: Optional[str] = None) -> None:
+    """Учитывает неудачную попытку (или запрос кода); заодно удаляет вышедшие из окна."""
+    now = time.time()
+    with SQLITE_LATENCY.time("record_login_attempt"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT INTO login_attempts (attempt_key, attempted_at) VALUES (?, ?)",
+            [(key, now) for key in _attempt_keys(telegram_user_id, login)],
+        )
+        cur.execute("DELETE FROM login_attempts WHERE attempted_at <= ?", (now - LOGIN_ATTEMPT_WINDOW,))
+        conn.commit()
+        conn.close()
+
+
+def clear_login_attempts(telegram_user_id: int) -> None:
+    with SQLITE_LATENCY.time("clear_login_attempts"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM login_attempts WHERE attempt_key = ?", (f"tg:{telegram_user_id}",))
+        conn.commit()
+        conn.close()
+
+
+# ======== Проверка входа ========
+
+def _login_result(login: str, employee: Dict) -> Dict:
+    return {
+        "login": login,
+        "bitrix_user_id": employee["bitrix_user_id"],
+        "name": employee["name"] or login,
+        "portal": employee["portal"],
+    }
+
+
+def set_password(login: str, password: str) -> bool:
+    """Личный пароль сотрудника. False — логина нет в справочнике (или он неоднозначен)."""
+    login = login.strip().lower()
+    employee = find_employee(login)
+    if not employee:
+        return False
+    password_hash = hash_secret(password)
+    with SQLITE_LATENCY.time("set_password"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO passwords (portal, bitrix_user_id, password_hash) VALUES (?, ?, ?)
+            ON CONFLICT(portal, bitrix_user_id) DO UPDATE SET password_hash = excluded.password_hash
+            """,
+            (employee["portal"], employee["bitrix_user_id"], password_hash),
+        )
+        conn.commit()
+        conn.close()
+    return True
+
+
+def verify_password(login: str, password: str) -> Optional[Dict]:
     """
-    Проверка логина/пароля.
+    Проверка личного пароля (вызывать через run_kdf).
     Возвращает словарь с данными пользователя при успехе или None.
     """
     login = login.strip().lower()
+    employee = find_employee(login)
+    if not employee:
+        return None
+    with SQLITE_LATENCY.time("get_password_hash"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT password_hash FROM passwords WHERE portal = ? AND bitrix_user_id = ?",
+            (employee["portal"], employee["bitrix_user_id"]),
+        )
+        row = cur.fetchone()
+        conn.close()
+    if not row or not verify_secret(password, row[0]):
+        return None
+    return _login_result(login, employee)
+
 
-    if password != COMMON_PASSWORD:
+def issue_login_code(telegram_user_id: int, login: str) -> Optional[Tuple[str, int, str]]:
+    """
+    Новый одноразовый код для входа (вызывать через run_kdf).
+    Хранится только хеш; предыдущий код этого Telegram-аккаунта перестаёт действовать.
+    Возвращает (портал, bitrix_user_id, код) или None, если логина нет в справочнике.
+    """
+    login = login.strip().lower()
+    employee = find_employee(login)
+    if not employee:
         return None
+    code = f"{secrets.randbelow(10 ** 6):06d}"
+    code_hash = hash_secret(code)
+    with SQLITE_LATENCY.time("issue_login_code"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO login_codes (telegram_user_id, login, code_hash, expires_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(telegram_user_id) DO UPDATE SET
+                login = excluded.login,
+                code_hash = excluded.code_hash,
+                expires_at = excluded.expires_at
+            """,
+            (telegram_user_id, login, code_hash, time.time() + LOGIN_CODE_TTL),
+        )
+        conn.commit()
+        conn.close()
+    return employee["portal"], employee["bitrix_user_id"], code
 
-    user_info = LOGIN_MAP.get(login)
-    if not user_info:
+
+def verify_login_code(telegram_user_id: int, login: str, code: str) -> Optional[Dict]:
+    """
+    Проверка одноразового кода (вызывать через run_kdf).
+    При успехе код удаляется и возвращаются данные пользователя.
+    """
+    login = login.strip().lower()
+    with SQLITE_LATENCY.time("get_login_code"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT login, code_hash, expires_at FROM login_codes WHERE telegram_user_id = ?",
+            (telegram_user_id,),
+        )
+        row = cur.fetchone()
+        conn.close()
+    if not row or row[0] != login or row[2] < time.time():
+        return None
+    if not verify_secret(code.strip(), row[1]):
         return None
+    employee = find_employee(login)
+    if not employee:
+        return None
+    with SQLITE_LATENCY.time("delete_login_code"):
+        conn = _connect()
+        conn.execute("DELETE FROM login_codes WHERE telegram_user_id = ?", (telegram_user_id,))
+        conn.commit()
+        conn.close()
+    return _login_result(login, employee)
 
-    return {
-        "login": login,
-        "bitrix_user_id": user_info["bitrix_user_id"],
-        "name": user_info.get("name") or login,
-    }
+
+# ======== Справочник логинов ========
+
+# Неизвестный логин перечитывает словарь из SQLite не чаще раза в столько секунд:
+# так видна ручная синхронизация из другого процесса (python main.py sync-employees)
+LOGIN_INDEX_MISS_RELOAD_SECONDS = 30
+
+# логин или e-mail -> {портал: сотрудник}
+_login_index: Dict[str, Dict[str, Dict]] = {}
+_login_index_version: Optional[int] = None
+_login_index_loaded_at = 0.0
+_login_index_lock = threading.Lock()
+
+
+def _login_index_current_version() -> int:
+    raw = get_backend().get(_LOGIN_INDEX_VERSION_KEY)
+    return int(raw) if raw else 0
+
+
+def _load_login_index(version: int) -> None:
+    global _login_index, _login_index_version, _login_index_loaded_at
+    with SQLITE_LATENCY.time("load_login_index"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("SELECT portal, bitrix_user_id, login, email, name FROM employees WHERE active = 1")
+        rows = cur.fetchall()
+        conn.close()
+    index: Dict[str, Dict[str, Dict]] = {}
+    for portal, bitrix_user_id, login, email, name in rows:
+        info = {"bitrix_user_id": bitrix_user_id, "name": name, "portal": portal}
+        # Логин важнее e-mail, если они вдруг совпали у разных сотрудников портала
+        if email:
+            index.setdefault(email, {}).setdefault(portal, info)
+        if login:
+            index.setdefault(login, {})[portal] = info
+    _login_index = index
+    _login_index_version = version
+    _login_index_loaded_at = time.monotonic()
+
+
+def _lookup_employee(login: str) -> Optional[Dict]:
+    portal, sep, key = login.partition("/")
+    if not sep:
+        portal, key = None, login
+    configured = portal_names()
+    found = [
+        info for name, info in _login_index.get(key, {}).items()
+        if name in configured and (portal is None or name == portal)
+    ]
+    # Один логин на нескольких порталах без указания портала — не угадываем
+    return found[0] if len(found) == 1 else None
+
+
+def find_employee(login: str) -> Optional[Dict]:
+    """
+    Активный сотрудник по логину или e-mail (в нижнем регистре),
+    при нескольких порталах — также "портал/логин". Результат содержит portal.
+    Поиск по словарю в памяти; словарь перечитывается из SQLite,
+    только когда синхронизация изменила справочник.
+    """
+    version = _login_index_current_version()
+    if version != _login_index_version:
+        with _login_index_lock:
+            if version != _login_index_version:
+                _load_login_index(version)
+        cache_miss("login_index")
+    else:
+        cache_hit("login_index")
+    found = _lookup_employee(login)
+    if found is None and time.monotonic() - _login_index_loaded_at > LOGIN_INDEX_MISS_RELOAD_SECONDS:
+        with _login_index_lock:
+            _load_login_index(version)
+        found = _lookup_employee(login)
+    return found
 
 
-def bind_telegram_user(telegram_user_id: int, login: str, bitrix_user_id: int, name: str) -> None:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO users (telegram_user_id, login, bitrix_user_id, name)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(telegram_user_id) DO UPDATE SET
-            login = excluded.login,
-            bitrix_user_id = excluded.bitrix_user_id,
-            name = excluded.name
-        """,
-        (telegram_user_id, login, bitrix_user_id, name),
+def employees_sync_cursor(portal: str) -> Optional[str]:
+    """Наибольший TIMESTAMP_X среди сохранённых сотрудников портала (None — их нет)."""
+    with SQLITE_LATENCY.time("employees_sync_cursor"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("SELECT MAX(timestamp_x) FROM employees WHERE portal = ?", (portal,))
+        row = cur.fetchone()
+        conn.close()
+    return row[0] if row else None
+
+
+def upsert_employees(
+    portal: str,
+    rows: List[Tuple[int, Optional[str], Optional[str], str, bool, Optional[str]]],
+) -> None:
+    """
+    Сохранение сотрудников портала: (bitrix_user_id, login, email, name, active, timestamp_x).
+    Логин и e-mail хранятся в нижнем регистре.
+    """
+    if not rows:
+        return
+    with SQLITE_LATENCY.time("upsert_employees"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.executemany(
+            """
+            INSERT INTO employees (portal, bitrix_user_id, login, email, name, active, timestamp_x)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(portal, bitrix_user_id) DO UPDATE SET
+                login = excluded.login,
+                email = excluded.email,
+                name = excluded.name,
+                active = excluded.active,
+                timestamp_x = excluded.timestamp_x
+            """,
+            [
+                (
+                    portal,
+                    bitrix_user_id,
+                    (login or "").strip().lower() or None,
+                    (email or "").strip().lower() or None,
+                    name,
+                    1 if active else 0,
+                    timestamp_x,
+                )
+                for bitrix_user_id, login, email, name, active, timestamp_x in rows
+            ],
+        )
+        conn.commit()
+        conn.close()
+    get_backend().incr(_LOGIN_INDEX_VERSION_KEY)
+
+
+def bind_telegram_user(
+    telegram_user_id: int,
+    login: str,
+    bitrix_user_id: int,
+    name: str,
+    portal: str = DEFAULT_PORTAL,
+) -> None:
+    with SQLITE_LATENCY.time("bind_telegram_user"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO users (telegram_user_id, login, bitrix_user_id, name, portal)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(telegram_user_id) DO UPDATE SET
+                login = excluded.login,
+                bitrix_user_id = excluded.bitrix_user_id,
+                name = excluded.name,
+                portal = excluded.portal
+            """,
+            (telegram_user_id, login, bitrix_user_id, name, portal),
+        )
+        conn.commit()
+        conn.close()
+    get_backend().set_json(
+        _binding_key(telegram_user_id),
+        {"login": login, "bitrix_user_id": bitrix_user_id, "name": name, "portal": portal},
     )
-    conn.commit()
-    conn.close()
+
+
+def _binding_key(telegram_user_id: int) -> str:
+    return f"binding:{telegram_user_id}"
 
 
 def get_bound_user(telegram_user_id: int) -> Optional[Dict]:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT login, bitrix_user_id, name FROM users WHERE telegram_user_id = ?",
-        (telegram_user_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
+    backend = get_backend()
+    cached = backend.get_json(_binding_key(telegram_user_id))
+    if cached:
+        cache_hit("binding")
+        # Привязки, сохранённые до появления нескольких порталов
+        cached.setdefault("portal", DEFAULT_PORTAL)
+        return cached
+    cache_miss("binding")
+
+    with SQLITE_LATENCY.time("get_bound_user"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT login, bitrix_user_id, name, portal FROM users WHERE telegram_user_id = ?",
+            (telegram_user_id,),
+        )
+        row = cur.fetchone()
+        conn.close()
     if not row:
         return None
-    login, bitrix_user_id, name = row
-    return {
+    login, bitrix_user_id, name, portal = row
+    bound = {
         "login": login,
         "bitrix_user_id": bitrix_user_id,
         "name": name,
+        "portal": portal,
     }
+    backend.set_json(_binding_key(telegram_user_id), bound)
+    return bound
 
 
 def unbind_telegram_user(telegram_user_id: int) -> None:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM users WHERE telegram_user_id = ?", (telegram_user_id,))
-    conn.commit()
-    conn.close()
+    with SQLITE_LATENCY.time("unbind_telegram_user"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM users WHERE telegram_user_id = ?", (telegram_user_id,))
+        cur.execute("DELETE FROM user_tokens WHERE telegram_user_id = ?", (telegram_user_id,))
+        conn.commit()
+        conn.close()
+    get_backend().delete(_binding_key(telegram_user_id))
+
+
+def bound_bitrix_users(portal: str) -> Set[int]:
+    """bitrix_user_id всех привязанных к боту сотрудников портала."""
+    with SQLITE_LATENCY.time("bound_bitrix_users"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT bitrix_user_id FROM users WHERE portal = ?", (portal,))
+        rows = cur.fetchall()
+        conn.close()
+    return {row[0] for row in rows}
+
+
+# ======== OAuth-токены сотрудников ========
+
+_TOKEN_COLUMNS = (
+    "portal", "bitrix_user_id", "client_endpoint", "access_token", "refresh_token", "expires_at", "refreshed_at"
+)
+
+
+def save_user_tokens(telegram_user_id: int, tokens: Dict) -> None:
+    """tokens — словарь с ключами _TOKEN_COLUMNS."""
+    with SQLITE_LATENCY.time("save_user_tokens"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            INSERT INTO user_tokens (telegram_user_id, {", ".join(_TOKEN_COLUMNS)})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(telegram_user_id) DO UPDATE SET
+                {", ".join(f"{c} = excluded.{c}" for c in _TOKEN_COLUMNS)}
+            """,
+            (telegram_user_id, *(tokens[c] for c in _TOKEN_COLUMNS)),
+        )
+        conn.commit()
+        conn.close()
+
+
+def get_user_tokens(telegram_user_id: int) -> Optional[Dict]:
+    with SQLITE_LATENCY.time("get_user_tokens"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT {', '.join(_TOKEN_COLUMNS)} FROM user_tokens WHERE telegram_user_id = ?",
+            (telegram_user_id,),
+        )
+        row = cur.fetchone()
+        conn.close()
+    return dict(zip(_TOKEN_COLUMNS, row)) if row else None
+
+
+def delete_user_tokens(telegram_user_id: int) -> None:
+    with SQLITE_LATENCY.time("delete_user_tokens"):
+        conn = _connect()
+        conn.execute("DELETE FROM user_tokens WHERE telegram_user_id = ?", (telegram_user_id,))
+        conn.commit()
+        conn.close()
+
+
+def list_stale_refresh_tokens(refreshed_before: float) -> List[int]:
+    """Пользователи, чей refresh-токен выдан раньше refreshed_before (по индексу refreshed_at)."""
+    with SQLITE_LATENCY.time("list_stale_refresh_tokens"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("SELECT telegram_user_id FROM user_tokens WHERE refreshed_at < ?", (refreshed_before,))
+        rows = cur.fetchall()
+        conn.close()
+    return [row[0] for row in rows]
+
+
+# ======== Ежедневная сводка ========
+
+def set_digest_settings(telegram_user_id: int, send_time: str, roles: List[str]) -> None:
+    """send_time — 'ЧЧ:ММ', roles — ключи ролей задач ('do', 'assist', ...)."""
+    with SQLITE_LATENCY.time("set_digest_settings"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO digest_settings (telegram_user_id, send_time, roles)
+            VALUES (?, ?, ?)
+            ON CONFLICT(telegram_user_id) DO UPDATE SET
+                send_time = excluded.send_time,
+                roles = excluded.roles
+            """,
+            (telegram_user_id, send_time, ",".join(roles)),
+        )
+        conn.commit()
+        conn.close()
+
+
+def get_digest_settings(telegram_user_id: int) -> Optional[Dict]:
+    with SQLITE_LATENCY.time("get_digest_settings"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT send_time, roles FROM digest_settings WHERE telegram_user_id = ?",
+            (telegram_user_id,),
+        )
+        row = cur.fetchone()
+        conn.close()
+    if not row:
+        return None
+    return {"send_time": row[0], "roles": row[1].split(",")}
+
+
+def delete_digest_settings(telegram_user_id: int) -> None:
+    with SQLITE_LATENCY.time("delete_digest_settings"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM digest_settings WHERE telegram_user_id = ?", (telegram_user_id,))
+        conn.commit()
+        conn.close()
+
+
+def list_due_digests(now_time: str, today: str) -> List[Tuple[int, int, str, List[str], str, str]]:
+    """
+    Привязанные пользователи, чья сводка на сегодня ещё не отправлена,
+    а время отправки уже наступило (в том числе пропущенное при перезапуске).
+    Возвращает [(telegram_user_id, bitrix_user_id, name, roles, send_time, portal)].
+    """
+    with SQLITE_LATENCY.time("list_due_digests"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT d.telegram_user_id, u.bitrix_user_id, u.name, d.roles, d.send_time, u.portal
+            FROM digest_settings d
+            JOIN users u ON u.telegram_user_id = d.telegram_user_id
+            WHERE d.send_time <= ? AND (d.last_sent IS NULL OR d.last_sent < ?)
+            ORDER BY d.send_time
+            """,
+            (now_time, today),
+        )
+        rows = cur.fetchall()
+        conn.close()
+    return [
+        (tg_id, bx_id, name, roles.split(","), send_time, portal)
+        for tg_id, bx_id, name, roles, send_time, portal in rows
+    ]
+
+
+def mark_digests_sent(telegram_user_ids: List[int], today: str) -> None:
+    if not telegram_user_ids:
+        return
+    with SQLITE_LATENCY.time("mark_digests_sent"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.executemany(
+            "UPDATE digest_settings SET last_sent = ? WHERE telegram_user_id = ?",
+            [(today, tg_id) for tg_id in telegram_user_ids],
+        )
+        conn.commit()
+        conn.close()
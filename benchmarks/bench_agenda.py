@@ -0,0 +1,96 @@
+"""
+Микробенчмарк повестки мероприятий: пользователь с SERIES сериями
+(ежедневные, по дням недели, ежемесячные), начавшимися за два года до сегодня.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_agenda
+    python -m benchmarks.bench_agenda --series 200
+
+Сравнивает прежний подход — на каждое нажатие развернуть все повторения
+от начала серий до горизонта и отфильтровать — с agenda.Agenda: первое
+нажатие (ленивое развёртывание ближайшего окна) и повторные запросы
+к уже развёрнутой повестке.
+"""
+
+import argparse
+import random
+import timeit
+from datetime import datetime, timedelta
+from typing import List
+
+from agenda import Agenda, Occurrence, conflicts, expand
+from config import AGENDA_HORIZON_DAYS
+from records import CalendarEvent
+
+NOW = datetime(2030, 6, 3, 8, 0)
+SINCE = datetime(2030, 6, 3)
+HORIZON = SINCE + timedelta(days=AGENDA_HORIZON_DAYS)
+RULES = (
+    "FREQ=DAILY;INTERVAL=1",
+    "FREQ=WEEKLY;INTERVAL=1;BYDAY=MO,WE,FR",
+    "FREQ=WEEKLY;INTERVAL=2;BYDAY=TU",
+    "FREQ=MONTHLY;INTERVAL=1",
+    None,
+)
+
+
+def make_series(count: int) -> List[CalendarEvent]:
+    rnd = random.Random(1)
+    events = []
+    for i in range(count):
+        rule = RULES[i % len(RULES)]
+        # Разовые встречи — в пределах горизонта, серии — начались давно
+        days = rnd.randrange(AGENDA_HORIZON_DAYS) if rule is None else -rnd.randrange(730)
+        start = SINCE + timedelta(days=days, hours=rnd.randrange(8, 19), minutes=rnd.choice((0, 15, 30, 45)))
+        events.append(CalendarEvent(i, f"Встреча {i}", start, start + timedelta(minutes=30), False, rule, ()))
+    return events
+
+
+def legacy_upcoming(events: List[CalendarEvent], limit: int) -> List[Occurrence]:
+    # Всё от начала серий до горизонта на каждое нажатие
+    occurrences = sorted(o for e in events for o in expand(e, e.start, HORIZON))
+    return [o for o in occurrences if o.end > NOW][:limit]
+
+
+def legacy_on_date(events: List[CalendarEvent], day_start: datetime) -> List[Occurrence]:
+    day_end = day_start + timedelta(days=1)
+    occurrences = sorted(o for e in events for o in expand(e, e.start, HORIZON))
+    return [o for o in occurrences if o.start < day_end and o.end > day_start]
+
+
+def _report(name: str, number: int, seconds: float) -> None:
+    print(f"{name:<44} {seconds / number * 1e6:10.1f} мкс")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Повестка мероприятий")
+    parser.add_argument("--series", type=int, default=50, help="серий в календаре пользователя")
+    ns = parser.parse_args()
+
+    events = make_series(ns.series)
+    day = SINCE + timedelta(days=40)
+    agenda = Agenda(events, SINCE, HORIZON)
+    assert agenda.upcoming(NOW, 10) == legacy_upcoming(events, 10)
+    assert agenda.on_date(day.date()) == legacy_on_date(events, day)
+
+    number = 50
+    print(f"Серий: {ns.series}, горизонт: {AGENDA_HORIZON_DAYS} дн.")
+    _report("прежний: ближайшие 10", number, timeit.timeit(lambda: legacy_upcoming(events, 10), number=number))
+    _report("прежний: на дату", number, timeit.timeit(lambda: legacy_on_date(events, day), number=number))
+    _report(
+        "Agenda: первое нажатие (ближайшие 10)",
+        number,
+        timeit.timeit(lambda: Agenda(events, SINCE, HORIZON).upcoming(NOW, 10), number=number),
+    )
+
+    number = 20000
+    _report("Agenda: ближайшие 10", number, timeit.timeit(lambda: agenda.upcoming(NOW, 10), number=number))
+    _report("Agenda: на дату", number, timeit.timeit(lambda: agenda.on_date(day.date()), number=number))
+    slot = (day + timedelta(hours=10), day + timedelta(hours=11))
+    _report("Agenda: пересечения с часом", number, timeit.timeit(lambda: agenda.overlapping(*slot), number=number))
+    occurrences = agenda.on_date(day.date())
+    _report("conflicts() по дню", number, timeit.timeit(lambda: conflicts(occurrences), number=number))
+
+
+if __name__ == "__main__":
+    main()
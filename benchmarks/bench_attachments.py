@@ -0,0 +1,144 @@
+"""
+Бенчмарк вложений к задачам (attachments.py): файлы идут из заглушки
+Telegram (benchmarks.fake_telegram) на Диск заглушки Bitrix24
+(benchmarks.fake_bitrix) потоком, без загрузки в память целиком.
+
+N пользователей одновременно отправляют по --files файлов по --size-mb МБ
+с подписью «#номер задачи». Отчёт: время и скорость, сколько загрузок шло
+одновременно (не больше TASK_FILE_MAX_CONCURRENT), правки сообщений о ходе
+загрузки, прирост пиковой памяти процесса (RSS) и проверка содержимого —
+размер и CRC32 каждого файла на Диске, прикрепление к задаче.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_attachments
+    python -m benchmarks.bench_attachments --users 8 --size-mb 50 --file-rate-mb 50
+"""
+
+import argparse
+import asyncio
+import logging
+import resource
+import tempfile
+import time
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+import attachments
+import auth
+import handlers.attachments
+import portals
+import tracing
+from benchmarks import fake_bitrix, fake_telegram
+from benchmarks.bench_sessions import TELEGRAM_USER_BASE, Session
+from config import TASK_FILE_MAX_CONCURRENT
+
+
+def _rss_mb() -> float:
+    # ru_maxrss — пик за время жизни процесса, в Linux в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _crc32(size: int) -> int:
+    crc = 0
+    for chunk in fake_telegram.file_chunks(size):
+        crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+async def run_benchmark(ns: argparse.Namespace) -> None:
+    # Импорт здесь: main настраивает логирование и собирает обработчики
+    import main
+
+    logging.getLogger().setLevel(logging.ERROR)
+    tracing.TRACE_SAMPLE_RATE = 0.0
+    portals.BITRIX_PORTAL_RATE = 0.0
+    # Как со своим Bot API server: облачный отдаёт ботам файлы до 20 МБ
+    attachments.TASK_FILE_MAX_BYTES = handlers.attachments.TASK_FILE_MAX_BYTES = 2000 * 1024 * 1024
+    attachments.TASK_FILE_PROGRESS_INTERVAL = ns.progress_interval
+
+    bitrix = fake_bitrix.FakeBitrix(users=ns.users, tasks_per_user=1, latency_ms=ns.bitrix_latency_ms)
+    telegram = fake_telegram.FakeTelegram(latency_ms=ns.telegram_latency_ms, file_rate_mb=ns.file_rate_mb)
+    bitrix_server = fake_bitrix.serve(bitrix)
+    telegram_server = fake_telegram.serve(telegram)
+    portals.configure_portals({"main": fake_bitrix.webhook_url(bitrix_server)})
+
+    tmp = tempfile.TemporaryDirectory()
+    auth.DB_PATH = Path(tmp.name) / "bench.sqlite3"
+    auth.init_db()
+    for i in range(ns.users):
+        auth.bind_telegram_user(TELEGRAM_USER_BASE + i, f"user{i + 1}", i + 1, f"Сотрудник {i + 1}", "main")
+
+    application = main.build_application(
+        with_updater=False,
+        base_url=fake_telegram.base_url(telegram_server),
+        base_file_url=fake_telegram.base_file_url(telegram_server),
+        token="123456:BENCH",
+    )
+    size = int(ns.size_mb * 1024 * 1024)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+
+    try:
+        async with application:
+            sessions = [Session(application, i, latencies) for i in range(ns.users)]
+            rss_before = _rss_mb()
+            started = time.perf_counter()
+            # Задача пользователя i в заглушке — i + 1 (по одной на сотрудника)
+            await asyncio.gather(
+                *(
+                    session.document(
+                        "attach",
+                        fake_telegram.make_file_id(size, session.index * ns.files + n),
+                        f"отчёт {session.index}-{n}.bin",
+                        size,
+                        caption=f"#{session.index + 1}",
+                    )
+                    for session in sessions
+                    for n in range(ns.files)
+                )
+            )
+            handled = time.perf_counter() - started
+            # Загрузки идут фоновыми задачами — ждём их
+            await asyncio.gather(*(t for t in asyncio.all_tasks() if t is not asyncio.current_task()))
+            elapsed = time.perf_counter() - started
+            rss_after = _rss_mb()
+    finally:
+        bitrix_server.shutdown()
+        telegram_server.shutdown()
+        tmp.cleanup()
+
+    expected = ns.users * ns.files
+    crc = _crc32(size)
+    intact = sum(1 for f in bitrix.disk_files.values() if f["SIZE"] == size and f["CRC32"] == crc)
+    attached = sum(len(task.get("files", [])) for task in bitrix.tasks)
+    total_mb = expected * size / (1024 * 1024)
+    print(f"Файлов: {expected} по {ns.size_mb:g} МБ, всего {total_mb:.0f} МБ")
+    print(
+        f"Обработчики ответили за {handled * 1000:.0f} мс, загрузки завершились за {elapsed:.2f} с "
+        f"({total_mb / elapsed:.1f} МБ/с)"
+    )
+    print(
+        f"Одновременных скачиваний из Telegram: максимум {telegram.max_downloads_in_flight} "
+        f"(лимит TASK_FILE_MAX_CONCURRENT = {TASK_FILE_MAX_CONCURRENT})"
+    )
+    print(f"Правок сообщений о ходе загрузки: {telegram.calls['editMessageText']}")
+    print(f"Пиковая память процесса (RSS): {rss_before:.0f} МБ -> {rss_after:.0f} МБ (+{rss_after - rss_before:.0f} МБ)")
+    print(f"На Диске целых файлов (размер и CRC32): {intact} из {expected}, прикреплено к задачам: {attached}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Потоковая загрузка вложений к задачам")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--files", type=int, default=1, help="файлов у каждого пользователя")
+    parser.add_argument("--size-mb", type=float, default=50.0)
+    parser.add_argument("--file-rate-mb", type=float, default=100.0, help="скорость отдачи файла заглушкой Telegram, МБ/с")
+    parser.add_argument("--progress-interval", type=float, default=0.2, help="секунд между правками сообщения")
+    parser.add_argument("--bitrix-latency-ms", type=float, default=5.0)
+    parser.add_argument("--telegram-latency-ms", type=float, default=2.0)
+    ns = parser.parse_args()
+    asyncio.run(run_benchmark(ns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Микробенчмарк построения клавиатур на один клик.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_keyboards
+
+Сравнивает сборку страницы сотрудников без кеша (version=None) и с кешем,
+а также переключение отметки участника на странице.
+"""
+
+import timeit
+
+from keyboards import (
+    employees_keyboard,
+    main_menu_keyboard,
+    tasks_menu_inline,
+    clear_employees_keyboard_cache,
+)
+from records import Employee
+
+EMPLOYEES = [Employee(i, f"Имя{i}", f"Фамилия{i}", f"Имя{i} Фамилия{i}") for i in range(1, 501)]
+PAGE_SIZE = 10
+NUMBER = 20000
+
+
+def _report(name: str, seconds: float) -> None:
+    print(f"{name:<40} {seconds / NUMBER * 1e6:8.2f} мкс/клик")
+
+
+def main() -> None:
+    _report("main_menu_keyboard()", timeit.timeit(main_menu_keyboard, number=NUMBER))
+    _report("tasks_menu_inline()", timeit.timeit(tasks_menu_inline, number=NUMBER))
+
+    _report(
+        "employees_keyboard без кеша",
+        timeit.timeit(
+            lambda: employees_keyboard(EMPLOYEES, page=3, page_size=PAGE_SIZE, prefix="event_att"),
+            number=NUMBER,
+        ),
+    )
+
+    clear_employees_keyboard_cache()
+    _report(
+        "employees_keyboard с кешем",
+        timeit.timeit(
+            lambda: employees_keyboard(EMPLOYEES, page=3, page_size=PAGE_SIZE, prefix="event_att", version=1),
+            number=NUMBER,
+        ),
+    )
+
+    selected = {31, 33, 35, 200, 300}
+    _report(
+        "отметка участников (кеш + 3 отметки)",
+        timeit.timeit(
+            lambda: employees_keyboard(
+                EMPLOYEES, page=3, page_size=PAGE_SIZE, prefix="event_att", version=1, selected=selected
+            ),
+            number=NUMBER,
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Бенчмарк памяти разбора ответов Bitrix24 на синтетическом справочнике.
+
+Справочник из N сотрудников (по умолчанию 5000) разбирается так же, как при
+синхронизации логинов: ответы batch по 50 страниц user.get по 50 записей.
+Сравниваются:
+    dicts   — прежний способ: ответы целиком через json.loads, сырые записи
+              копятся до конца синхронизации, затем из них строятся строки таблицы;
+    records — потоковый разбор (jsonstream.parse_records) сразу в records.DirectoryUser.
+Ответы готовятся заранее и сохраняются во временные файлы; каждый способ
+запускается в отдельном процессе, который читает только их. Пик RSS —
+VmHWM из /proc/self/status, сброшенный перед разбором через
+/proc/self/clear_refs: ru_maxrss дочерний процесс наследует от родителя,
+и прирост по нему был бы нулевым.
+Отчёт: прирост пикового RSS, пик tracemalloc, память результата и время.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_memory
+    python -m benchmarks.bench_memory --users 20000 --json bench_memory.json
+"""
+
+import argparse
+import gc
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.fake_bitrix import FakeBitrix
+from jsonstream import parse_records
+from records import directory_user_from_bitrix
+
+PAGE_SIZE = 50
+PAGES_PER_BATCH = 50
+MODES = ("dicts", "records")
+
+
+def batch_bodies(users: int) -> List[bytes]:
+    """Тела ответов batch, как их вернул бы портал при полной синхронизации."""
+    directory = FakeBitrix(users=users, tasks_per_user=0).users
+    for user in directory:
+        # Реальные записи user.get заметно длиннее: должность, телефоны, отдел
+        user.update(
+            WORK_POSITION="Менеджер по работе с клиентами",
+            PERSONAL_MOBILE="+7 900 000-00-00",
+            UF_DEPARTMENT=[1, 5],
+            PERSONAL_PHOTO=f"https://cdn.example.com/photo/{user['ID']}.jpg",
+        )
+    pages = [directory[i:i + PAGE_SIZE] for i in range(0, len(directory), PAGE_SIZE)]
+    bodies = []
+    for i in range(0, len(pages), PAGES_PER_BATCH):
+        chunk = pages[i:i + PAGES_PER_BATCH]
+        payload = {
+            "result": {
+                "result": {f"p{i + n}": page for n, page in enumerate(chunk)},
+                "result_error": [],
+                "result_total": {f"p{i + n}": users for n in range(len(chunk))},
+                "result_next": {},
+            },
+            "time": {"duration": 0.1},
+        }
+        bodies.append(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+    return bodies
+
+
+def _employee_row(user: Dict[str, Any]) -> tuple:
+    # Прежний employees_sync._employee_row
+    login = user.get("LOGIN") or None
+    email = user.get("EMAIL") or None
+    name = (user.get("NAME", "") + " " + user.get("LAST_NAME", "")).strip()
+    active = user.get("ACTIVE", True) in (True, "Y", "1", 1, "true")
+    return int(user["ID"]), login, email, name or login or email or str(user["ID"]), active, user.get("TIMESTAMP_X")
+
+
+def _sync_dicts(bodies: List[bytes]) -> List[Any]:
+    users: List[Dict[str, Any]] = []
+    for body in bodies:
+        data = json.loads(body)
+        for page in data["result"]["result"].values():
+            users.extend(page)
+    return [_employee_row(u) for u in users]
+
+
+def _sync_records(bodies: List[bytes]) -> List[Any]:
+    users: List[Any] = []
+    for body in bodies:
+        data = parse_records(body.decode("utf-8"), ("result", "result", "*"), directory_user_from_bitrix)
+        for page in data["result"]["result"].values():
+            users.extend(page)
+    return users
+
+
+def _status_kb(field: str) -> int:
+    # Значения /proc/self/status — в килобайтах: "VmHWM:    123456 kB"
+    for line in Path("/proc/self/status").read_text().splitlines():
+        if line.startswith(field + ":"):
+            return int(line.split()[1])
+    raise RuntimeError(f"В /proc/self/status нет {field}")
+
+
+def _reset_peak_rss() -> int:
+    """Сбрасывает пик RSS процесса (VmHWM) до текущего RSS и возвращает его, КБ."""
+    Path("/proc/self/clear_refs").write_text("5")
+    return _status_kb("VmHWM")
+
+
+def run_mode(mode: str, paths: List[str]) -> Dict[str, Any]:
+    """Один способ разбора в текущем процессе."""
+    sync = _sync_dicts if mode == "dicts" else _sync_records
+    bodies = [Path(path).read_bytes() for path in paths]
+    gc.collect()
+    rss_before = _reset_peak_rss()
+
+    started = time.perf_counter()
+    result = sync(bodies)
+    elapsed = time.perf_counter() - started
+    rss_after = _status_kb("VmHWM")
+    del result
+    gc.collect()
+
+    # Второй проход — под tracemalloc, который сильно замедляет выделение памяти
+    tracemalloc.start()
+    result = sync(bodies)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "mode": mode,
+        "users": len(result),
+        "response_kb": round(sum(len(b) for b in bodies) / 1024, 1),
+        "peak_rss_growth_mb": round((rss_after - rss_before) / 1024, 2),
+        "tracemalloc_peak_mb": round(peak / 2 ** 20, 2),
+        "retained_mb": round(retained / 2 ** 20, 2),
+        "elapsed_ms": round(elapsed * 1000, 1),
+    }
+
+
+def run_isolated(mode: str, paths: List[str]) -> Dict[str, Any]:
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_memory", "--child", mode, *paths],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(out.stdout)
+
+
+def print_report(rows: List[Dict[str, Any]]) -> None:
+    print(f"Сотрудников: {rows[0]['users']}, ответов batch: {rows[0]['response_kb']} КБ")
+    print(f"{'способ':<10}{'прирост RSS, МБ':>18}{'пик, МБ':>10}{'результат, МБ':>16}{'время, мс':>12}")
+    for row in rows:
+        print(
+            f"{row['mode']:<10}{row['peak_rss_growth_mb']:>18}{row['tracemalloc_peak_mb']:>10}"
+            f"{row['retained_mb']:>16}{row['elapsed_ms']:>12}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Память разбора справочника сотрудников")
+    parser.add_argument("--users", type=int, default=5000, help="сотрудников в справочнике")
+    parser.add_argument("--json", help="сохранить результат в JSON-файл")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("bodies", nargs="*", help=argparse.SUPPRESS)
+    ns = parser.parse_args()
+
+    if ns.child:
+        print(json.dumps(run_mode(ns.child, ns.bodies)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for n, body in enumerate(batch_bodies(ns.users)):
+            path = Path(tmp) / f"batch{n}.json"
+            path.write_bytes(body)
+            paths.append(str(path))
+        rows = [run_isolated(mode, paths) for mode in MODES]
+    print_report(rows)
+    if ns.json:
+        Path(ns.json).write_text(json.dumps(rows, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Микробенчмарк отрисовки списка задач: окно из 50 задач (страница Bitrix24).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_render
+
+Сравнивает прежнюю сборку текста f-строками (без экранирования и разбиения)
+с rendering.render_task_messages в обеих плотностях и разметках.
+Для каждого варианта — время на окно, число сообщений и длина текста.
+"""
+
+import timeit
+from typing import List
+
+from telegram.constants import ParseMode
+
+from records import Task
+from rendering import DENSITIES, render_task_messages
+
+WINDOW = 50
+NUMBER = 2000
+NOW = "2030-01-15T12:00:00"
+
+TITLES = [
+    "Подготовить отчёт за квартал",
+    "Согласовать договор <ООО «Ромашка»> & приложения",
+    "Исправить ошибку в модуле *оплаты* [срочно]",
+    "Созвон с клиентом_2 по проекту (этап 3.1)",
+    "Обновить регламент отдела продаж — версия 2.0!",
+]
+
+
+def make_window() -> List[Task]:
+    return [
+        Task(
+            id=1000 + i,
+            title=TITLES[i % len(TITLES)] * (1 + i % 3),
+            deadline=f"2030-01-{(i % 28) + 1:02d}T18:00:00+03:00" if i % 7 else None,
+            status=2 if i % 4 else 5,
+            responsible_id=1,
+            created_by=2,
+        )
+        for i in range(WINDOW)
+    ]
+
+
+def legacy_render(tasks: List[Task]) -> str:
+    # Прежний _show_tasks_page
+    lines = ["Список задач:"]
+    for t in tasks:
+        title = t.title or "(без названия)"
+        deadline = t.deadline or ""
+        if deadline:
+            date_part = deadline.split("T")[0] if "T" in deadline else deadline
+        else:
+            date_part = "-"
+        lines.append(f"#{t.id} - {title} (до {date_part})")
+    return "\n".join(lines)
+
+
+def _report(name: str, seconds: float, messages: List[str]) -> None:
+    sizes = "+".join(str(len(m)) for m in messages)
+    print(f"{name:<28} {seconds / NUMBER * 1e6:8.1f} мкс/окно   сообщений: {len(messages)}   символов: {sizes}")
+
+
+def main() -> None:
+    tasks = make_window()
+
+    text = legacy_render(tasks)
+    _report("f-строки (прежний)", timeit.timeit(lambda: legacy_render(tasks), number=NUMBER), [text])
+
+    for parse_mode in (ParseMode.HTML, ParseMode.MARKDOWN_V2):
+        for density in DENSITIES:
+            def render():
+                return render_task_messages("Список задач:", tasks, density, parse_mode, now=NOW)
+
+            _report(f"{density} / {parse_mode}", timeit.timeit(render, number=NUMBER), render())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Бенчмарк локальной копии задач (tasks_sync.py) против запросов в Bitrix24.
+
+Заглушка портала (benchmarks.fake_bitrix) с N сотрудниками, часть из них
+привязана к боту. Сценарий:
+1. полная синхронизация — запросы к порталу и время;
+2. все сочетания роли, статуса и сортировки — первая страница из копии
+   и из Bitrix24 (с задержкой --bitrix-latency-ms);
+3. поиск по названию (FTS5);
+4. на портале меняются --changes задач — дельта: запросы, задачи, время.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_replica
+    python -m benchmarks.bench_replica --employees 500 --bound 200 --bitrix-latency-ms 80
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List
+
+import auth
+import bitrix_api
+import portals
+import tasks_sync
+from benchmarks import fake_bitrix
+
+PAGE = 5
+ROLES = ("do", "assist", "originator", "observer", "all")
+STATUSES = ("active", "completed", "all")
+ORDERS = ("deadline", "changed")
+
+
+def _timed(func: Callable[[], object], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def _line(name: str, samples: List[float]) -> str:
+    return f"{name:<34} p50 {statistics.median(samples):8.2f} мс   max {max(samples):8.2f} мс"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальная копия задач против Bitrix24")
+    parser.add_argument("--employees", type=int, default=300)
+    parser.add_argument("--tasks-per-user", type=int, default=40)
+    parser.add_argument("--bound", type=int, default=100, help="сотрудников, привязанных к боту")
+    parser.add_argument("--bitrix-latency-ms", type=float, default=50.0)
+    parser.add_argument("--changes", type=int, default=20, help="изменённых задач перед дельтой")
+    ns = parser.parse_args()
+
+    bitrix = fake_bitrix.FakeBitrix(
+        users=ns.employees, tasks_per_user=ns.tasks_per_user, latency_ms=ns.bitrix_latency_ms
+    )
+    server = fake_bitrix.serve(bitrix)
+    portals.configure_portals({"main": fake_bitrix.webhook_url(server)})
+    portals.BITRIX_PORTAL_RATE = 0.0
+    tmp = tempfile.TemporaryDirectory()
+    auth.DB_PATH = Path(tmp.name) / "bench.sqlite3"
+    auth.init_db()
+    users = list(range(1, ns.bound + 1))
+    for user_id in users:
+        auth.bind_telegram_user(10_000_000 + user_id, f"user{user_id}", user_id, f"Сотрудник {user_id}", "main")
+
+    try:
+        bitrix.calls.clear()
+        started = time.perf_counter()
+        received = tasks_sync.sync_portal_tasks("main", full=True)
+        print(
+            f"Полная синхронизация: задач {received}, запросов {sum(bitrix.calls.values())} "
+            f"({dict(bitrix.calls)}), {time.perf_counter() - started:.2f} с"
+        )
+
+        rnd = random.Random(1)
+        combos = [(r, s, o) for r in ROLES for s in STATUSES for o in ORDERS]
+
+        def local_page() -> None:
+            role, status, order = rnd.choice(combos)
+            tasks_sync.find_tasks("main", rnd.choice(users), role, status, order, limit=PAGE + 1)
+
+        def remote_page() -> None:
+            role, status, order = rnd.choice(combos)
+            with portals.portal_scope("main"):
+                if role == "all":
+                    bitrix_api.get_all_my_tasks(rnd.choice(users), status, force=True)
+                else:
+                    bitrix_api.get_tasks(rnd.choice(users), role, status, limit=PAGE, order=order)
+
+        def local_search() -> None:
+            tasks_sync.find_tasks(
+                "main", rnd.choice(users), "all", "all", search=f"задача {rnd.randrange(ns.tasks_per_user)}", limit=21
+            )
+
+        print(_line("страница из копии", _timed(local_page, 500)))
+        print(_line("поиск в копии (FTS5)", _timed(local_search, 500)))
+        print(_line("страница из Bitrix24", _timed(remote_page, 30)))
+
+        total = len(bitrix.tasks)
+        for task_id in rnd.sample(range(1, total + 1), ns.changes):
+            bitrix.touch_task(task_id, status=str(rnd.choice((2, 3, 5))))
+        bitrix.calls.clear()
+        started = time.perf_counter()
+        received = tasks_sync.sync_portal_tasks("main")
+        print(
+            f"Дельта после {ns.changes} изменений: задач {received}, "
+            f"запросов {sum(bitrix.calls.values())}, {(time.perf_counter() - started) * 1000:.1f} мс"
+        )
+    finally:
+        server.shutdown()
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
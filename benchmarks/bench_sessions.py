@@ -0,0 +1,300 @@
+"""
+Офлайн-бенчмарк бота: настоящие обработчики против локальных заглушек
+Bitrix24 (benchmarks.fake_bitrix) и Telegram Bot API (benchmarks.fake_telegram).
+
+Каждый из N пользователей проигрывает сценарий:
+    вход (/login с кодом из уведомления) -> список задач и пагинация
+    -> «Все мои задачи» по всем ролям -> создание задачи
+    -> ближайшие мероприятия и мероприятия на дату
+    -> создание мероприятия с выбором участников
+    -> брошенное на выборе участников второе мероприятие.
+
+Отчёт: p50/p95/p99 по шагам и в целом, апдейтов в секунду,
+число вызовов Bitrix24 и Bot API по методам, размер user_data после
+сценариев, после таймаутов диалогов и после выгрузки простаивающих.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_sessions --users 20 --bitrix-latency-ms 50
+    python -m benchmarks.bench_sessions --users 50 --json bench_output.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import re
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date
+from itertools import count
+from pathlib import Path
+from typing import Any, Dict, List
+
+from telegram import Update
+
+import auth
+import bitrix_api
+import employees_sync
+import portals
+import throttling
+import tracing
+from benchmarks import fake_bitrix, fake_telegram
+from callbacks import pack
+from config import CONVERSATION_TIMEOUTS, USER_STATE_IDLE_TTL
+from metrics import BITRIX_COLLAPSED
+from user_state import sweep_user_state, user_data_report
+
+TELEGRAM_USER_BASE = 10_000_000
+_update_ids = count(1)
+_message_ids = count(1)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class Session:
+    """Один пользователь Telegram, отправляющий апдейты напрямую в Application."""
+
+    def __init__(self, application, index: int, latencies: Dict[str, List[float]]) -> None:
+        self.application = application
+        self.index = index
+        self.telegram_id = TELEGRAM_USER_BASE + index
+        self.latencies = latencies
+        self.user = {"id": self.telegram_id, "is_bot": False, "first_name": f"User{index}"}
+        self.chat = {"id": self.telegram_id, "type": "private"}
+        self.last_message_id = next(_message_ids)
+
+    async def _process(self, label: str, raw: Dict[str, Any]) -> None:
+        update = Update.de_json(raw, self.application.bot)
+        started = time.perf_counter()
+        await self.application.process_update(update)
+        self.latencies[label].append(time.perf_counter() - started)
+
+    async def text(self, label: str, text: str) -> None:
+        message = {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": self.chat,
+            "from": self.user,
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        await self._process(label, {"update_id": next(_update_ids), "message": message})
+
+    async def document(self, label: str, file_id: str, file_name: str, size: int, caption: str = "") -> None:
+        message = {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": self.chat,
+            "from": self.user,
+            "caption": caption,
+            "document": {"file_id": file_id, "file_unique_id": file_id, "file_name": file_name, "file_size": size},
+        }
+        await self._process(label, {"update_id": next(_update_ids), "message": message})
+
+    async def click(self, label: str, name: str, *args: Any) -> None:
+        update_id = next(_update_ids)
+        query = {
+            "id": str(update_id),
+            "from": self.user,
+            "chat_instance": str(self.telegram_id),
+            "data": pack(name, *args),
+            "message": {
+                "message_id": self.last_message_id,
+                "date": int(time.time()),
+                "chat": self.chat,
+                "from": fake_telegram.BOT_USER,
+                "text": "...",
+            },
+        }
+        await self._process(label, {"update_id": update_id, "callback_query": query})
+
+
+async def run_session(session: Session, employees: int, bitrix: fake_bitrix.FakeBitrix) -> None:
+    i = session.index
+    bitrix_user_id = (i % employees) + 1
+    await session.text("login", "/login")
+    await session.text("login", f"user{bitrix_user_id}")
+    # Код входа приходит уведомлением в заглушку Bitrix24
+    code = re.search(r"\d{6}", bitrix.notifications[bitrix_user_id][-1]).group(0)
+    await session.text("login", code)
+
+    await session.text("menu", "Задачи")
+    await session.click("tasks.list", "tasks.list")
+    await session.click("tasks.page", "tasks.page", 1)
+    await session.click("tasks.page", "tasks.page", 0)
+    await session.click("tasks.filter", "tasks.filter")
+    await session.click("tasks.filter", "tasks.filter_status", "all")
+    await session.click("tasks.list", "tasks.list")
+    await session.click("tasks.filter", "tasks.filter_role", "all")
+    await session.click("tasks.list_all", "tasks.list")
+    await session.click("tasks.page_all", "tasks.page", 1)
+
+    await session.click("task_create", "tasks.create")
+    await session.text("task_create", f"Задача из бенчмарка {i}")
+    await session.text("task_create", "-")
+    await session.text("task_create.employees", "25.12.2030")
+    await session.click("task_create", "task_resp.select", (i % employees) + 1)
+    await session.click("task_create.confirm", "task_create.confirm")
+
+    await session.text("menu", "Календарь")
+    await session.click("calendar.list", "calendar.list")
+    await session.click("calendar.day", "calendar.day", date(2030, 12, 25).toordinal())
+    await session.click("calendar_create", "calendar.create")
+    await session.text("calendar_create", f"Встреча {i}")
+    await session.text("calendar_create", "-")
+    await session.text("calendar_create.employees", "25.12.2030")
+    for emp_id in (1, 2, 3, 2):
+        await session.click("event_att.select", "event_att.select", emp_id)
+    await session.click("event_att.page", "event_att.page", 1)
+    await session.click("event_att.select", "event_att.select", 12)
+    await session.click("calendar_create", "event_att.done")
+    await session.click("calendar_create", "event_create.confirm")
+
+    # Второе мероприятие бросается на выборе участников: черновик остаётся до таймаута
+    await session.click("calendar_create", "calendar.create")
+    await session.text("calendar_create", f"Брошенная встреча {i}")
+    await session.text("calendar_create", "-")
+    await session.text("calendar_create.employees", "26.12.2030")
+    await session.click("event_att.select", "event_att.select", 5)
+
+
+async def run_benchmark(ns: argparse.Namespace) -> Dict[str, Any]:
+    # Импорт здесь: main настраивает логирование и собирает обработчики
+    import main
+
+    logging.getLogger().setLevel(logging.ERROR)
+    tracing.TRACE_SAMPLE_RATE = 0.0
+    if not ns.throttle:
+        # Сценарии нажимают кнопки без пауз: без флага меряем сами обработчики
+        throttling.THROTTLE_DUPLICATE_WINDOW = 0.0
+        throttling.THROTTLE_USER_RATE = 0.0
+        throttling.THROTTLE_GLOBAL_RATE = 0
+        portals.BITRIX_PORTAL_RATE = 0.0
+
+    bitrix = fake_bitrix.FakeBitrix(
+        users=ns.employees,
+        tasks_per_user=ns.tasks_per_user,
+        page_size=ns.page_size,
+        latency_ms=ns.bitrix_latency_ms,
+        error_rate=ns.error_rate,
+    )
+    telegram = fake_telegram.FakeTelegram(latency_ms=ns.telegram_latency_ms)
+    bitrix_server = fake_bitrix.serve(bitrix)
+    telegram_server = fake_telegram.serve(telegram)
+    portals.configure_portals({"main": fake_bitrix.webhook_url(bitrix_server)})
+
+    tmp = tempfile.TemporaryDirectory()
+    auth.DB_PATH = Path(tmp.name) / "bench.sqlite3"
+    auth.init_db()
+    employees_sync.sync_employees(full=True)
+
+    application = main.build_application(
+        with_updater=False,
+        base_url=fake_telegram.base_url(telegram_server),
+        token="123456:BENCH",
+    )
+    latencies: Dict[str, List[float]] = defaultdict(list)
+
+    try:
+        async with application:
+            sessions = [Session(application, i, latencies) for i in range(ns.users)]
+            started = time.perf_counter()
+            await asyncio.gather(*(run_session(s, ns.employees, bitrix) for s in sessions))
+            elapsed = time.perf_counter() - started
+            # Проверки состояния «через время»: после таймаутов диалогов и после простоя
+            user_data = {"после сценариев": user_data_report(application)}
+            now = time.time() + max(CONVERSATION_TIMEOUTS.values()) + 1
+            swept = await sweep_user_state(application, now=now)
+            user_data[f"после таймаутов ({swept['expired']} диалогов)"] = user_data_report(application)
+            swept = await sweep_user_state(application, now=now + USER_STATE_IDLE_TTL)
+            user_data[f"после простоя ({swept['evicted']} пользователей)"] = user_data_report(application)
+    finally:
+        bitrix_server.shutdown()
+        telegram_server.shutdown()
+        tmp.cleanup()
+
+    all_latencies = [v for values in latencies.values() for v in values]
+    steps = {
+        label: {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+        }
+        for label, values in sorted(latencies.items())
+    }
+    return {
+        "users": ns.users,
+        "updates": len(all_latencies),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(len(all_latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(all_latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(all_latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(all_latencies, 99) * 1000, 2),
+        "steps": steps,
+        "bitrix_calls": dict(bitrix.calls),
+        "bitrix_collapsed": {
+            f"{method}/{mode}": BITRIX_COLLAPSED.value(method, mode)
+            for method in sorted(bitrix_api.READ_METHODS)
+            for mode in ("in_flight", "debounced")
+            if BITRIX_COLLAPSED.value(method, mode)
+        },
+        "telegram_calls": dict(telegram.calls),
+        "throttled": {reason: throttling.THROTTLED_UPDATES.value(reason) for reason in ("duplicate", "user", "global")},
+        "user_data": user_data,
+    }
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(
+        f"Пользователей: {result['users']}, апдейтов: {result['updates']}, "
+        f"время: {result['elapsed_s']} с, {result['updates_per_s']} апдейтов/с"
+    )
+    print(f"Все апдейты: p50 {result['p50_ms']} мс, p95 {result['p95_ms']} мс, p99 {result['p99_ms']} мс")
+    print()
+    print(f"{'шаг':<28}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for label, row in result["steps"].items():
+        print(f"{label:<28}{row['count']:>8}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+    print()
+    print("Вызовы Bitrix24:", ", ".join(f"{k}={v}" for k, v in sorted(result["bitrix_calls"].items())))
+    print("Схлопнуто вызовов Bitrix24:", ", ".join(f"{k}={v:g}" for k, v in sorted(result["bitrix_collapsed"].items())) or "0")
+    print("Вызовы Bot API:", ", ".join(f"{k}={v}" for k, v in sorted(result["telegram_calls"].items())))
+    print("Отброшено нажатий:", ", ".join(f"{k}={v:g}" for k, v in result["throttled"].items()))
+    print()
+    for label, report in result["user_data"].items():
+        print(
+            f"user_data {label}: пользователей {report['users']}, всего {report['total_bytes']} Б, "
+            f"p50 {report['p50_bytes']} Б, p95 {report['p95_bytes']} Б, max {report['max_bytes']} Б, "
+            f"ключи: {', '.join(f'{k}={v}' for k, v in report['top_keys'].items()) or '-'}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк сценариев бота")
+    parser.add_argument("--users", type=int, default=20, help="одновременных пользователей")
+    parser.add_argument("--employees", type=int, default=300, help="сотрудников в заглушке Bitrix24")
+    parser.add_argument("--tasks-per-user", type=int, default=40)
+    parser.add_argument("--page-size", type=int, default=50, help="размер страницы ответов Bitrix24")
+    parser.add_argument("--bitrix-latency-ms", type=float, default=50.0)
+    parser.add_argument("--telegram-latency-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов Bitrix24 с ошибкой")
+    parser.add_argument("--throttle", action="store_true", help="включить ограничение частоты нажатий и запросов к порталу")
+    parser.add_argument("--json", help="сохранить результат в JSON-файл")
+    ns = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(ns))
+    print_report(result)
+    if ns.json:
+        Path(ns.json).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,520 @@
+"""
+Локальная заглушка REST API Bitrix24 для бенчмарков.
+
+Поддерживает методы, которые вызывает бот: user.get, user.current,
+tasks.task.list, tasks.task.add, tasks.task.files.attach, calendar.event.get,
+im.notify.system.add, disk.storage.getlist, disk.folder.uploadfile, batch.
+Задачи отдают changedDate (каждое изменение — новое время, touch_task())
+и понимают фильтры >=CHANGED_DATE, диапазоны ID и MEMBER — для локальной копии задач,
+<DEADLINE — для досок команд.
+У каждого сотрудника в календаре — повторяющиеся серии (RRULE) и разовые встречи. Отправленные уведомления
+сохраняются в notifications (например, коды входа). Задержка, размер страницы и доля ошибок настраиваются.
+
+Диск: disk.folder.uploadfile выдаёт адрес загрузки (POST /disk/upload/<токен>),
+файл по нему читается потоком, сохраняются только имя, размер и CRC32
+(disk_files); прикреплённые к задаче файлы — в task["files"].
+
+OAuth: GET /oauth/token/ выдаёт токены по коду из authorize_code() и по
+refresh-токену; запросы с параметром auth выполняются от имени владельца
+токена, истёкший токен — ответ 401 expired_token (срок — token_ttl).
+
+Запуск отдельно:
+    python -m benchmarks.fake_bitrix --port 8081 --latency-ms 80
+Вебхук для config.BITRIX_PORTALS: http://127.0.0.1:8081/rest/1/bench/
+"""
+
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+
+def _unflatten(pairs: List[Tuple[str, str]]) -> Dict[str, Any]:
+    """fields[TITLE]=x&fields[TAGS][0]=a -> {"fields": {"TITLE": "x", "TAGS": {"0": "a"}}}"""
+    result: Dict[str, Any] = {}
+    for key, value in pairs:
+        parts = key.replace("]", "").split("[")
+        node = result
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return result
+
+
+class FakeBitrix:
+    def __init__(
+        self,
+        users: int = 300,
+        tasks_per_user: int = 40,
+        page_size: int = 50,
+        latency_ms: float = 50.0,
+        error_rate: float = 0.0,
+        seed: int = 1,
+        token_ttl: float = 3600.0,
+    ) -> None:
+        self.page_size = page_size
+        self.token_ttl = token_ttl
+        # access-токен -> (ID пользователя, срок действия); refresh-токен и код -> ID пользователя
+        self.access_tokens: Dict[str, Tuple[int, float]] = {}
+        self.refresh_tokens: Dict[str, int] = {}
+        self.codes: Dict[str, int] = {}
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.notifications: Dict[int, List[str]] = {}
+        # ID файла -> {"NAME", "SIZE", "FOLDER_ID", "CRC32"}; токен загрузки -> ID папки
+        self.disk_files: Dict[int, Dict[str, Any]] = {}
+        self.uploads: Dict[str, int] = {}
+        self.base_url = ""
+        self._lock = threading.Lock()
+        self.users = [
+            {
+                "ID": str(i),
+                "LOGIN": f"user{i}",
+                "EMAIL": f"user{i}@example.com",
+                "NAME": f"Имя{i}",
+                "LAST_NAME": f"Фамилия{i}",
+                "ACTIVE": True,
+                "TIMESTAMP_X": "2025-01-01T00:00:00+03:00",
+            }
+            for i in range(1, users + 1)
+        ]
+        # Часы CHANGED_DATE: каждое изменение задачи получает новое время
+        self._ticks = 0
+        self.tasks: List[Dict[str, Any]] = []
+        for user_id in range(1, users + 1):
+            for n in range(tasks_per_user):
+                task_id = self._add_task(
+                    {
+                        "TITLE": f"Задача {n} пользователя {user_id}",
+                        "DESCRIPTION": "Описание " * 10,
+                        "RESPONSIBLE_ID": user_id,
+                        "CREATED_BY": (user_id % users) + 1,
+                        "DEADLINE": f"2030-01-{(n % 28) + 1:02d}T18:00:00+03:00",
+                        "STATUS": 2 if n % 3 else 5,
+                    }
+                )
+                task = self.tasks[task_id - 1]
+                if n % 5 == 0:
+                    task["accomplices"] = [str((user_id + 1) % users + 1)]
+                if n % 7 == 0:
+                    task["auditors"] = [str((user_id + 2) % users + 1)]
+
+        # Серии в формате calendar.event.get: RRULE словарём, даты — в формате портала
+        self.events: Dict[int, List[Dict[str, Any]]] = {
+            user_id: self._calendar(user_id) for user_id in range(1, users + 1)
+        }
+
+    @staticmethod
+    def _calendar(user_id: int) -> List[Dict[str, Any]]:
+        base = user_id * 100
+        return [
+            {
+                "ID": str(base + 1),
+                "NAME": "Планёрка",
+                "DATE_FROM": "06.01.2025 10:00:00",
+                "DATE_TO": "06.01.2025 10:30:00",
+                "DT_SKIP_TIME": "N",
+                "RRULE": {"FREQ": "WEEKLY", "INTERVAL": "1", "BYDAY": {"MO": "MO", "WE": "WE", "FR": "FR"}, "UNTIL": "01.01.2038"},
+                "EXDATE": "",
+            },
+            {
+                "ID": str(base + 2),
+                "NAME": "Стендап",
+                "DATE_FROM": "01.01.2025 09:30:00",
+                "DATE_TO": "01.01.2025 09:45:00",
+                "DT_SKIP_TIME": "N",
+                "RRULE": {"FREQ": "DAILY", "INTERVAL": "1", "UNTIL": "01.01.2038"},
+                "EXDATE": "",
+            },
+            {
+                "ID": str(base + 3),
+                "NAME": "Отчёт за месяц",
+                "DATE_FROM": f"{(user_id % 28) + 1:02d}.01.2025",
+                "DATE_TO": f"{(user_id % 28) + 1:02d}.01.2025",
+                "DT_SKIP_TIME": "Y",
+                "RRULE": {"FREQ": "MONTHLY", "INTERVAL": "1", "COUNT": "120"},
+                "EXDATE": "",
+            },
+            {
+                "ID": str(base + 4),
+                "NAME": f"Встреча с клиентом {user_id}",
+                "DATE_FROM": "25.12.2030 10:15:00",
+                "DATE_TO": "25.12.2030 11:00:00",
+                "DT_SKIP_TIME": "N",
+                "RRULE": "",
+                "EXDATE": "",
+            },
+        ]
+
+    def _add_task(self, fields: Dict[str, Any]) -> int:
+        task_id = len(self.tasks) + 1
+        self.tasks.append(
+            {
+                "id": str(task_id),
+                "title": fields.get("TITLE", ""),
+                "description": fields.get("DESCRIPTION", ""),
+                "responsibleId": str(fields.get("RESPONSIBLE_ID", "")),
+                "createdBy": str(fields.get("CREATED_BY", "")),
+                "deadline": fields.get("DEADLINE"),
+                "status": str(fields.get("STATUS", 2)),
+                "accomplices": [],
+                "auditors": [],
+                "changedDate": self._stamp(),
+            }
+        )
+        return task_id
+
+    def _stamp(self) -> str:
+        self._ticks += 1
+        return (datetime(2025, 1, 1) + timedelta(seconds=self._ticks)).strftime("%Y-%m-%dT%H:%M:%S+03:00")
+
+    def touch_task(self, task_id: int, **fields: Any) -> None:
+        """Изменение задачи «на портале»: поля в формате tasks.task.list и новый changedDate."""
+        with self._lock:
+            task = self.tasks[task_id - 1]
+            task.update(fields)
+            task["changedDate"] = self._stamp()
+
+    # ======== OAuth ========
+
+    def authorize_code(self, user_id: int) -> str:
+        """Код, который портал передал бы на redirect_uri после входа пользователя."""
+        code = secrets.token_hex(8)
+        with self._lock:
+            self.codes[code] = user_id
+        return code
+
+    def token(self, params: Dict[str, str], endpoint: str) -> Tuple[int, Dict[str, Any]]:
+        with self._lock:
+            self.calls["oauth.token"] += 1
+            if params.get("grant_type") == "authorization_code":
+                user_id = self.codes.pop(params.get("code", ""), None)
+            else:
+                user_id = self.refresh_tokens.pop(params.get("refresh_token", ""), None)
+            if user_id is None:
+                return 400, {"error": "invalid_grant"}
+            access, refresh = secrets.token_hex(16), secrets.token_hex(16)
+            self.access_tokens[access] = (user_id, time.time() + self.token_ttl)
+            self.refresh_tokens[refresh] = user_id
+        return 200, {
+            "access_token": access,
+            "refresh_token": refresh,
+            "expires_in": int(self.token_ttl),
+            "client_endpoint": endpoint,
+            "user_id": user_id,
+        }
+
+    def check_token(self, params: Dict[str, Any]) -> Tuple[Optional[int], Optional[Dict[str, Any]]]:
+        access = params.pop("auth", None)
+        if access is None:
+            return None, None
+        user_id, expires_at = self.access_tokens.get(access, (None, 0.0))
+        if user_id is None:
+            return None, {"error": "invalid_token", "error_description": "Unknown token"}
+        if expires_at < time.time():
+            return None, {"error": "expired_token", "error_description": "The access token provided has expired."}
+        return user_id, None
+
+    # ======== Методы ========
+
+    def _page(self, items: List[Any], start: int) -> Dict[str, Any]:
+        chunk = items[start:start + self.page_size]
+        data: Dict[str, Any] = {"total": len(items)}
+        if start + self.page_size < len(items):
+            data["next"] = start + self.page_size
+        return {"chunk": chunk, **data}
+
+    def user_get(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        users = self.users
+        since = (params.get("FILTER") or {}).get(">=TIMESTAMP_X")
+        if since:
+            users = [u for u in users if u["TIMESTAMP_X"] >= since]
+        if params.get("sort") == "TIMESTAMP_X":
+            users = sorted(users, key=lambda u: u["TIMESTAMP_X"])
+        page = self._page(users, int(params.get("start") or 0))
+        return {"result": page.pop("chunk"), **page}
+
+    def tasks_list(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        filter_ = params.get("filter") or {}
+        statuses = filter_.get("STATUS")
+        if isinstance(statuses, dict):
+            statuses = list(statuses.values())
+        statuses = {str(s) for s in statuses} if statuses else None
+
+        def match(task: Dict[str, Any]) -> bool:
+            if statuses and task["status"] not in statuses:
+                return False
+            if "RESPONSIBLE_ID" in filter_ and task["responsibleId"] != str(filter_["RESPONSIBLE_ID"]):
+                return False
+            if "CREATED_BY" in filter_ and task["createdBy"] != str(filter_["CREATED_BY"]):
+                return False
+            if "ACCOMPLICE" in filter_ and str(filter_["ACCOMPLICE"]) not in task["accomplices"]:
+                return False
+            if "AUDITOR" in filter_ and str(filter_["AUDITOR"]) not in task["auditors"]:
+                return False
+            if ">=CHANGED_DATE" in filter_ and task["changedDate"] < filter_[">=CHANGED_DATE"]:
+                return False
+            if "ID" in filter_ and int(task["id"]) != int(filter_["ID"]):
+                return False
+            if ">ID" in filter_ and int(task["id"]) <= int(filter_[">ID"]):
+                return False
+            if ">=ID" in filter_ and int(task["id"]) < int(filter_[">=ID"]):
+                return False
+            if "<ID" in filter_ and int(task["id"]) >= int(filter_["<ID"]):
+                return False
+            if "MEMBER" in filter_:
+                member = str(filter_["MEMBER"])
+                if member not in (task["responsibleId"], task["createdBy"], *task["accomplices"], *task["auditors"]):
+                    return False
+            if "<=DEADLINE" in filter_ and not (task["deadline"] and task["deadline"][:19] <= filter_["<=DEADLINE"][:19]):
+                return False
+            if "<DEADLINE" in filter_ and not (task["deadline"] and task["deadline"][:19] < filter_["<DEADLINE"][:19]):
+                return False
+            return True
+
+        found = [t for t in self.tasks if match(t)]
+        for field, key in (("DEADLINE", "deadline"), ("CHANGED_DATE", "changedDate")):
+            direction = (params.get("order") or {}).get(field)
+            if direction:
+                found.sort(key=lambda t: t[key] or "", reverse=direction.lower() == "desc")
+        if (params.get("order") or {}).get("ID", "").lower() == "desc":
+            found.reverse()
+        page = self._page(found, int(params.get("start") or 0))
+        return {"result": {"tasks": page.pop("chunk")}, **page}
+
+    def user_current(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {"result": self.users[int(params["_user_id"]) - 1]}
+
+    def task_add(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        fields = dict(params.get("fields") or {})
+        if params.get("_user_id"):
+            fields.setdefault("CREATED_BY", params["_user_id"])
+        with self._lock:
+            task_id = self._add_task(fields)
+        return {"result": {"task": {"id": str(task_id)}}}
+
+    def calendar_events(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        # Фильтр по периоду не нужен: серии начинаются раньше любого запроса
+        return {"result": self.events.get(int(params.get("ownerId") or 0), [])}
+
+    def notify(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.notifications.setdefault(int(params["USER_ID"]), []).append(params.get("MESSAGE", ""))
+        return {"result": 1}
+
+    def task_files_attach(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        task_id, file_id = int(params["taskId"]), int(params["fileId"])
+        if not 0 < task_id <= len(self.tasks) or file_id not in self.disk_files:
+            return {"error": "ERROR_CORE", "error_description": "Задача или файл не найдены"}
+        with self._lock:
+            self.tasks[task_id - 1].setdefault("files", []).append(file_id)
+        return {"result": {"attachmentId": file_id}}
+
+    def disk_storages(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        user_id = int((params.get("filter") or {}).get("ENTITY_ID") or 0)
+        if not 0 < user_id <= len(self.users):
+            return {"result": []}
+        storage = {
+            "ID": str(user_id),
+            "ENTITY_TYPE": "user",
+            "ENTITY_ID": str(user_id),
+            "ROOT_OBJECT_ID": str(100_000 + user_id),
+        }
+        return {"result": [storage]}
+
+    def disk_upload_url(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        token = secrets.token_hex(8)
+        with self._lock:
+            self.uploads[token] = int(params["id"])
+        return {"result": {"field": "file", "uploadUrl": f"{self.base_url}/disk/upload/{token}"}}
+
+    def receive_file(self, token: str, content_type: str, length: int, stream) -> Tuple[int, Dict[str, Any]]:
+        """Приём multipart-файла по адресу загрузки: читается кусками, хранится только CRC32."""
+        with self._lock:
+            folder_id = self.uploads.pop(token, None)
+        if folder_id is None:
+            return 404, {"error": "ERROR_NOT_FOUND", "error_description": "Неизвестный адрес загрузки"}
+        boundary = content_type.partition("boundary=")[2].encode("ascii")
+        tail = b"\r\n--" + boundary + b"--\r\n"
+        head = b""
+        left = length
+        # Заголовок части — до пустой строки; он помещается в первые килобайты
+        while b"\r\n\r\n" not in head and left > 0:
+            piece = stream.read(min(1024, left))
+            if not piece:
+                break
+            head += piece
+            left -= len(piece)
+        headers, _, rest = head.partition(b"\r\n\r\n")
+        name = headers.partition(b'filename="')[2].partition(b'"')[0].decode("utf-8")
+        size = left + len(rest) - len(tail)
+        crc = 0
+        last = b""
+        to_file = size
+        for piece in self._read(stream, left, rest):
+            part = piece[:to_file]
+            crc = zlib.crc32(part, crc)
+            to_file -= len(part)
+            last = (last + piece)[-len(tail):]
+        if size < 0 or last != tail:
+            return 400, {"error": "ERROR_UPLOAD", "error_description": "Файл передан не полностью"}
+        with self._lock:
+            file_id = 1 + len(self.disk_files)
+            self.disk_files[file_id] = {"NAME": name, "SIZE": size, "FOLDER_ID": folder_id, "CRC32": crc}
+        return 200, {"result": {"ID": file_id, "NAME": name, "SIZE": size}}
+
+    @staticmethod
+    def _read(stream, left: int, first: bytes) -> Iterator[bytes]:
+        if first:
+            yield first
+        while left > 0:
+            piece = stream.read(min(64 * 1024, left))
+            if not piece:
+                return
+            left -= len(piece)
+            yield piece
+
+    def batch(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        results: Dict[str, Any] = {}
+        errors: Dict[str, Any] = {}
+        totals: Dict[str, Any] = {}
+        nexts: Dict[str, Any] = {}
+        for key, command in (params.get("cmd") or {}).items():
+            method, _, query = command.partition("?")
+            sub_params = _unflatten(parse_qsl(query, keep_blank_values=True))
+            if params.get("_user_id"):
+                sub_params["_user_id"] = params["_user_id"]
+            reply = self.execute(method, sub_params, count=False)
+            if "error" in reply:
+                errors[key] = reply
+                continue
+            results[key] = reply.get("result")
+            if "total" in reply:
+                totals[key] = reply["total"]
+            if "next" in reply:
+                nexts[key] = reply["next"]
+        return {
+            "result": {
+                "result": results,
+                "result_error": errors or [],
+                "result_total": totals,
+                "result_next": nexts,
+            }
+        }
+
+    def execute(self, method: str, params: Dict[str, Any], count: bool = True) -> Dict[str, Any]:
+        if count:
+            with self._lock:
+                self.calls[method] += 1
+        if self.error_rate and self.random.random() < self.error_rate:
+            return {"error": "QUERY_LIMIT_EXCEEDED", "error_description": "Too many requests"}
+        handler = {
+            "user.get": self.user_get,
+            "user.current": self.user_current,
+            "tasks.task.list": self.tasks_list,
+            "tasks.task.add": self.task_add,
+            "tasks.task.files.attach": self.task_files_attach,
+            "disk.storage.getlist": self.disk_storages,
+            "disk.folder.uploadfile": self.disk_upload_url,
+            "calendar.event.get": self.calendar_events,
+            "im.notify.system.add": self.notify,
+            "batch": self.batch,
+        }.get(method)
+        if handler is None:
+            return {"error": "ERROR_METHOD_NOT_FOUND", "error_description": method}
+        return handler(params)
+
+
+class _Server(ThreadingHTTPServer):
+    # Очередь соединений по умолчанию (5) переполняется, когда все сессии
+    # бенчмарка обращаются к заглушке одновременно
+    request_queue_size = 1024
+
+
+def serve(fake: FakeBitrix, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Запускает сервер в фоновом потоке; фактический порт — server.server_port."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            path, _, query = self.path.partition("?")
+            if path.rstrip("/") != "/oauth/token":
+                self.send_error(404)
+                return
+            host, port = self.server.server_address[:2]
+            status, reply = fake.token(dict(parse_qsl(query)), f"http://{host}:{port}/rest/")
+            self._reply(status, reply)
+
+        def do_POST(self) -> None:
+            if self.path.startswith("/disk/upload/"):
+                status, reply = fake.receive_file(
+                    self.path.rsplit("/", 1)[-1],
+                    self.headers.get("Content-Type", ""),
+                    int(self.headers.get("Content-Length") or 0),
+                    self.rfile,
+                )
+                self._reply(status, reply)
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b"{}"
+            params = json.loads(raw or b"{}")
+            method = urlsplit(self.path).path.rstrip("/").rsplit("/", 1)[-1]
+            if fake.latency:
+                time.sleep(fake.latency)
+            user_id, error = fake.check_token(params)
+            if error:
+                self._reply(401, error)
+                return
+            if user_id is not None:
+                params["_user_id"] = user_id
+            self._reply(200, fake.execute(method, params))
+
+        def _reply(self, status: int, reply: Dict[str, Any]) -> None:
+            body = json.dumps(reply, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args) -> None:
+            return None
+
+    server = _Server((host, port), Handler)
+    server.daemon_threads = True
+    fake.base_url = "http://{}:{}".format(*server.server_address[:2])
+    threading.Thread(target=server.serve_forever, name="fake-bitrix", daemon=True).start()
+    return server
+
+
+def webhook_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/rest/1/bench/"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--users", type=int, default=300)
+    ns = parser.parse_args()
+    srv = serve(
+        FakeBitrix(users=ns.users, page_size=ns.page_size, latency_ms=ns.latency_ms, error_rate=ns.error_rate),
+        port=ns.port,
+    )
+    print(f"Fake Bitrix24: {webhook_url(srv)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        srv.shutdown()
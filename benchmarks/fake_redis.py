@@ -0,0 +1,162 @@
+"""
+Локальная заглушка сервера протокола Redis (RESP2) для проверки RedisBackend
+и запуска нескольких процессов бота без настоящего Redis.
+
+Поддерживает команды, которые использует state.RedisBackend:
+GET, SET [EX], DEL, INCRBY, EXPIRE, HSET, HDEL, HGETALL, RPUSH, BLPOP, PING,
+AUTH, SELECT.
+
+Запуск:
+    python -m benchmarks.fake_redis --port 6390
+"""
+
+import argparse
+import asyncio
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.values: Dict[bytes, Any] = {}
+        self.expires: Dict[bytes, float] = {}
+        self.lists: Dict[bytes, deque] = {}
+        self.list_events: Dict[bytes, asyncio.Event] = {}
+
+    def _alive(self, key: bytes) -> Optional[Any]:
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.values.pop(key, None)
+            self.expires.pop(key, None)
+        return self.values.get(key)
+
+    def _event(self, key: bytes) -> asyncio.Event:
+        return self.list_events.setdefault(key, asyncio.Event())
+
+    async def execute(self, args) -> Any:
+        cmd = args[0].upper()
+        if cmd in (b"PING", b"AUTH", b"SELECT"):
+            return "OK" if cmd != b"PING" else "PONG"
+        if cmd == b"GET":
+            value = self._alive(args[1])
+            return value if isinstance(value, bytes) else None
+        if cmd == b"SET":
+            self.values[args[1]] = args[2]
+            self.expires.pop(args[1], None)
+            if len(args) >= 5 and args[3].upper() == b"EX":
+                self.expires[args[1]] = time.monotonic() + int(args[4])
+            return "OK"
+        if cmd == b"DEL":
+            removed = 0
+            for key in args[1:]:
+                removed += int(self.values.pop(key, None) is not None or self.lists.pop(key, None) is not None)
+                self.expires.pop(key, None)
+            return removed
+        if cmd == b"INCRBY":
+            value = int(self._alive(args[1]) or 0) + int(args[2])
+            self.values[args[1]] = str(value).encode()
+            return value
+        if cmd == b"EXPIRE":
+            self.expires[args[1]] = time.monotonic() + int(args[2])
+            return 1
+        if cmd == b"HSET":
+            mapping = self.values.setdefault(args[1], {})
+            mapping[args[2]] = args[3]
+            return 1
+        if cmd == b"HDEL":
+            mapping = self._alive(args[1]) or {}
+            return int(mapping.pop(args[2], None) is not None)
+        if cmd == b"HGETALL":
+            mapping = self._alive(args[1]) or {}
+            flat = []
+            for field, value in mapping.items():
+                flat.extend([field, value])
+            return flat
+        if cmd == b"RPUSH":
+            items = self.lists.setdefault(args[1], deque())
+            items.extend(args[2:])
+            self._event(args[1]).set()
+            return len(items)
+        if cmd == b"BLPOP":
+            key, timeout = args[1], float(args[-1])
+            deadline = time.monotonic() + timeout
+            while True:
+                items = self.lists.get(key)
+                if items:
+                    return [key, items.popleft()]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                event = self._event(key)
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return None
+        raise ValueError(f"ERR unknown command '{cmd.decode()}'")
+
+
+def _encode(value: Any) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, str):
+        return b"+" + value.encode() + b"\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_encode(v) for v in value)
+    raise TypeError(type(value))
+
+
+async def _read_command(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        return None
+    count = int(line[1:-2])
+    args = []
+    for _ in range(count):
+        length = int((await reader.readline())[1:-2])
+        data = await reader.readexactly(length + 2)
+        args.append(data[:-2])
+    return args
+
+
+async def serve(host: str = "127.0.0.1", port: int = 6390, store: Optional[FakeRedis] = None):
+    store = store or FakeRedis()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                args = await _read_command(reader)
+                if args is None:
+                    break
+                try:
+                    reply = _encode(await store.execute(args))
+                except Exception as e:
+                    reply = b"-" + str(e).encode() + b"\r\n"
+                writer.write(reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def _main(host: str, port: int) -> None:
+    server = await serve(host, port)
+    print(f"Fake Redis слушает {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    ns = parser.parse_args()
+    asyncio.run(_main(ns.host, ns.port))
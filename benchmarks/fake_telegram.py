@@ -0,0 +1,168 @@
+"""
+Локальная заглушка Telegram Bot API для бенчмарков.
+
+Отвечает на методы, которые вызывает бот (getMe, sendMessage,
+editMessageText, answerCallbackQuery, ...), правдоподобными объектами
+и считает вызовы по методам. Для ApplicationBuilder().base_url(...)
+используйте base_url(server), для .base_file_url(...) — base_file_url(server).
+
+Файлы: getFile понимает file_id вида bench-<размер>-<n> (make_file_id), а
+GET /file/bot<токен>/... отдаёт содержимое потоком (file_chunks) — файл
+любого размера не хранится в памяти. Одновременные скачивания —
+в downloads_in_flight / max_downloads_in_flight.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from typing import Any, Dict, Iterator
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+_FILE_ID = re.compile(r"bench-(\d+)-\d+")
+# Содержимое файлов: этот блок, повторённый до нужного размера
+_FILE_BLOCK = bytes(range(256)) * 256
+
+
+def make_file_id(size: int, n: int) -> str:
+    return f"bench-{size}-{n}"
+
+
+def file_chunks(size: int) -> Iterator[bytes]:
+    """Содержимое файла make_file_id(size, ...) кусками по 64 КБ."""
+    left = size
+    while left > 0:
+        chunk = _FILE_BLOCK[:left]
+        left -= len(chunk)
+        yield chunk
+
+
+class FakeTelegram:
+    def __init__(self, latency_ms: float = 0.0, file_rate_mb: float = 0.0) -> None:
+        self.latency = latency_ms / 1000.0
+        # Скорость отдачи файлов, МБ/с (0 — без ограничения)
+        self.file_rate = file_rate_mb * 1024 * 1024
+        self.calls: Counter = Counter()
+        self._message_ids = count(1000)
+        self._lock = threading.Lock()
+        self.downloads_in_flight = 0
+        self.max_downloads_in_flight = 0
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params.get("chat_id") or 0)
+        return {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    def execute(self, method: str, params: Dict[str, Any]) -> Any:
+        with self._lock:
+            self.calls[method] += 1
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "sendDocument", "sendPhoto"):
+            return self._message(params)
+        if method in ("editMessageText", "editMessageReplyMarkup"):
+            if params.get("inline_message_id"):
+                return True
+            return self._message(params)
+        if method == "getUpdates":
+            return []
+        if method == "getFile":
+            file_id = params.get("file_id", "")
+            match = _FILE_ID.fullmatch(file_id)
+            if match is None:
+                return None
+            return {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": int(match.group(1)),
+                "file_path": f"documents/{file_id}.bin",
+            }
+        return True
+
+    def download(self, delta: int) -> None:
+        with self._lock:
+            self.downloads_in_flight += delta
+            self.max_downloads_in_flight = max(self.max_downloads_in_flight, self.downloads_in_flight)
+
+
+class _Server(ThreadingHTTPServer):
+    # Очередь соединений по умолчанию (5) переполняется, когда все сессии
+    # бенчмарка обращаются к заглушке одновременно
+    request_queue_size = 1024
+
+
+def serve(fake: FakeTelegram, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            content_type = self.headers.get("Content-Type", "")
+            params: Dict[str, Any] = {}
+            if content_type.startswith("application/json"):
+                params = json.loads(raw or b"{}")
+            elif content_type.startswith("application/x-www-form-urlencoded"):
+                params = dict(parse_qsl(raw.decode("utf-8")))
+            method = self.path.rsplit("/", 1)[-1]
+            if fake.latency:
+                time.sleep(fake.latency)
+            result = fake.execute(method, params)
+            if result is None:
+                reply = {"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"}
+            else:
+                reply = {"ok": True, "result": result}
+            body = json.dumps(reply).encode("utf-8")
+            self.send_response(200 if result is not None else 400)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            if not self.path.startswith("/file/"):
+                self.do_POST()
+                return
+            match = _FILE_ID.search(self.path)
+            if match is None:
+                self.send_error(404)
+                return
+            size = int(match.group(1))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            fake.download(1)
+            try:
+                for chunk in file_chunks(size):
+                    self.wfile.write(chunk)
+                    if fake.file_rate:
+                        time.sleep(len(chunk) / fake.file_rate)
+            finally:
+                fake.download(-1)
+
+        def log_message(self, format, *args) -> None:
+            return None
+
+    server = _Server((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-telegram", daemon=True).start()
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/bot"
+
+
+def base_file_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/file/bot"
@@ -7,99 +7,565 @@
 - get_calendar_events(...)
 - create_calendar_event(...)
 - get_employees(...)
+- get_employees_cached(...)
+- get_employees_snapshot(...)
+- get_users_changed_since(...)
+- get_tasks_changed_since(...)
+- get_latest_task_change()
+- create_tasks_bulk(...)
+- get_due_tasks_bulk(...)
+- get_team_load(...)
+- get_user_disk_folder(...)
+- upload_disk_file(...)
+- attach_task_file(...)
+- send_notification(...)
 
 Часть методов (особенно календарь) нужно будет адаптировать под ваш портал.
+
+Чтения (READ_METHODS) с одинаковыми параметрами схлопываются:
+параллельные вызовы ждут один запрос, а результат ещё
+BITRIX_READ_DEBOUNCE_SECONDS секунд отдаётся повторным вызовам
+(двойное нажатие кнопки). Любой изменяющий вызов сбрасывает эти результаты.
+Возвращённые данные общие для всех вызвавших — их нельзя изменять.
+
+Запрос уходит на текущий портал (portals.current_portal()): его URL,
+HTTP-сессия, лимит запросов и circuit breaker. Кеши и схлопывание чтений
+тоже раздельные по порталам.
+
+В режиме OAuth запросы апдейта выполняются с токенами его автора
+(oauth.current_token()) и в пределах его лимита запросов; без токенов
+(фоновые задачи) — через вебхук портала.
+
+Списки задач, сотрудников и мероприятий разбираются потоково прямо в компактные записи
+(records.py, jsonstream.parse_records); остальные ответы — кодеком
+config.BITRIX_JSON_CODEC.
 """
 
-from typing import List, Dict, Optional, Any
-import requests
+import heapq
+import json
+import secrets
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from datetime import date, datetime
+from typing import List, Dict, Iterable, Iterator, Optional, Any, Set, Tuple
+from urllib.parse import urlencode
+
+from config import (
+    BITRIX_PORTAL_RATE_WAIT,
+    BITRIX_READ_DEBOUNCE_SECONDS,
+    BITRIX_TIMEOUT,
+    EMPLOYEES_CACHE_TTL,
+    TASKS_MERGED_CACHE_SIZE,
+    TASKS_MERGED_CACHE_TTL,
+    TASK_FILE_IO_TIMEOUT,
+)
+from metrics import (
+    BITRIX_LATENCY,
+    BITRIX_ERRORS,
+    BITRIX_IN_FLIGHT,
+    BITRIX_COLLAPSED,
+    cache_hit,
+    cache_miss,
+)
+from jsonstream import RecordsSpec, dumps, loads, parse_records
+from oauth import OAuthError, UserToken, current_oauth_user, current_token, forget_token, refresh
+from portals import current_portal
+from records import (
+    CalendarEvent,
+    DirectoryUser,
+    Employee,
+    MemberLoad,
+    SyncedTask,
+    Task,
+    calendar_event_from_bitrix,
+    directory_user_from_bitrix,
+    employee_from_bitrix,
+    synced_task_from_bitrix,
+    task_from_bitrix,
+)
+from state import get_backend
+from tracing import span
+
+# Bitrix24 принимает не более 50 команд в одном вызове batch.
+BATCH_MAX_COMMANDS = 50
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
 
-from config import BITRIX_WEBHOOK_BASE_URL
+# Методы без побочных эффектов: их одинаковые вызовы можно схлопывать
+READ_METHODS = frozenset(
+    {"tasks.task.list", "user.get", "user.current", "calendar.event.get", "disk.storage.getlist"}
+)
 
 
 class BitrixAPIError(Exception):
     pass
 
 
-def _call(method: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    url = BITRIX_WEBHOOK_BASE_URL.rstrip("/") + "/" + method
-    response = requests.post(url, json=params or {})
-    if response.status_code != 200:
-        raise BitrixAPIError(f"HTTP {response.status_code}: {response.text}")
-    data = response.json()
-    if isinstance(data, dict) and "error" in data:
-        raise BitrixAPIError(f"{data['error']}: {data.get('error_description')}")
+class PortalUnavailableError(BitrixAPIError):
+    """Портал временно не принимает запросы (circuit breaker или лимит запросов)."""
+
+
+class _TokenRejected(BitrixAPIError):
+    def __init__(self, error: str, description: Optional[str]) -> None:
+        super().__init__(f"{error}: {description}")
+        self.error = error
+
+
+# Ошибки, после которых портал считается перегруженным или недоступным
+_OVERLOAD_ERRORS = frozenset({"QUERY_LIMIT_EXCEEDED", "OVERLOAD_LIMIT", "INTERNAL_SERVER_ERROR"})
+# Ошибки токена пользователя: истёкший обновляется, остальные требуют нового входа
+_TOKEN_ERRORS = frozenset({"expired_token", "invalid_token", "NO_AUTH_FOUND"})
+
+
+def _request(
+    method: str,
+    params: Optional[Dict[str, Any]] = None,
+    records: Optional[RecordsSpec] = None,
+) -> Dict[str, Any]:
+    try:
+        token = current_token()
+    except OAuthError as exc:
+        raise BitrixAPIError(str(exc)) from exc
+    if token is None:
+        return _send(method, params, None, records)
+    access_token = token.access_token
+    try:
+        return _send(method, params, token, records)
+    except _TokenRejected as exc:
+        if exc.error != "expired_token":
+            forget_token(token.telegram_user_id, revoked=True)
+            raise BitrixAPIError("Доступ к Bitrix24 отозван, войдите заново: /login") from exc
+    try:
+        refresh(token, rejected=access_token)
+    except OAuthError as exc:
+        raise BitrixAPIError(str(exc)) from exc
+    return _send(method, params, token, records)
+
+
+def _parse_response(content: bytes, records: Optional[RecordsSpec]) -> Any:
+    if records is None:
+        return loads(content)
+    path, convert = records
+    return parse_records(content.decode("utf-8"), path, convert)
+
+
+def _send(
+    method: str,
+    params: Optional[Dict[str, Any]],
+    token: Optional[UserToken],
+    records: Optional[RecordsSpec] = None,
+) -> Dict[str, Any]:
+    portal = current_portal()
+    if not portal.allow_request():
+        BITRIX_ERRORS.inc(method, portal.name)
+        raise PortalUnavailableError(f"Портал {portal.name} временно недоступен")
+    bucket = token.bucket if token else portal.bucket
+    if not bucket.acquire(BITRIX_PORTAL_RATE_WAIT):
+        BITRIX_ERRORS.inc(method, portal.name)
+        raise PortalUnavailableError(f"Портал {portal.name}: превышен лимит запросов")
+
+    if token:
+        url = token.client_endpoint.rstrip("/") + "/" + method
+        params = {**(params or {}), "auth": token.access_token}
+    else:
+        url = portal.webhook_url + method
+    BITRIX_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    with span("bitrix", method=method, portal=portal.name) as attrs:
+        overloaded = True
+        try:
+            body = dumps(params or {})
+            attrs["request_bytes"] = len(body)
+            response = portal.session().post(url, data=body, headers=_JSON_HEADERS, timeout=BITRIX_TIMEOUT)
+            attrs["response_bytes"] = len(response.content)
+            overloaded = response.status_code >= 500 or response.status_code == 429
+            data = _parse_response(response.content, records) if response.status_code in (200, 400, 401) else None
+            if isinstance(data, dict) and "error" in data:
+                overloaded = overloaded or data["error"] in _OVERLOAD_ERRORS
+                if token and data["error"] in _TOKEN_ERRORS:
+                    raise _TokenRejected(data["error"], data.get("error_description"))
+                raise BitrixAPIError(f"{data['error']}: {data.get('error_description')}")
+            if response.status_code != 200:
+                raise BitrixAPIError(f"HTTP {response.status_code}: {response.text}")
+            return data
+        except Exception:
+            BITRIX_ERRORS.inc(method, portal.name)
+            raise
+        finally:
+            # Ошибки самого запроса (неверные параметры) портал не выключают
+            if overloaded:
+                portal.record_failure()
+            else:
+                portal.record_success()
+            BITRIX_LATENCY.observe(time.perf_counter() - started, method, portal.name)
+            BITRIX_IN_FLIGHT.dec()
+
+
+# ======== Схлопывание одинаковых чтений ========
+
+_inflight: Dict[str, Future] = {}
+_recent: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+# Портал -> число изменяющих вызовов: чтение, начатое до изменения, не запоминается
+_writes: Dict[str, int] = {}
+_inflight_lock = threading.Lock()
+
+
+def _read_key(method: str, params: Optional[Dict[str, Any]]) -> str:
+    # Канонический вид: порядок ключей в параметрах не влияет на ключ.
+    # С токенами пользователя ответ зависит от его прав — ключ свой у каждого
+    user = current_oauth_user()
+    prefix = current_portal().name + (f":u{user}:" if user is not None else ":")
+    return prefix + method + "?" + json.dumps(params or {}, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def _remember(key: str, data: Dict[str, Any], now: float) -> None:
+    expired = [k for k, (at, _) in _recent.items() if now - at > BITRIX_READ_DEBOUNCE_SECONDS]
+    for k in expired:
+        del _recent[k]
+    _recent[key] = (now, data)
+
+
+def _call_read(method: str, params: Optional[Dict[str, Any]], records: Optional[RecordsSpec]) -> Dict[str, Any]:
+    key = _read_key(method, params)
+    if records is not None:
+        # Один и тот же ответ, разобранный в разные записи, — разные результаты
+        key += "#" + records[1].__name__
+    portal = current_portal().name
+    with _inflight_lock:
+        recent = _recent.get(key)
+        if recent is not None and time.monotonic() - recent[0] <= BITRIX_READ_DEBOUNCE_SECONDS:
+            BITRIX_COLLAPSED.inc(method, "debounced")
+            return recent[1]
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+            writes = _writes.get(portal, 0)
+
+    if not leader:
+        BITRIX_COLLAPSED.inc(method, "in_flight")
+        with span("bitrix", method=method, collapsed=True):
+            return future.result()
+
+    try:
+        data = _request(method, params, records)
+    except BaseException as exc:
+        with _inflight_lock:
+            del _inflight[key]
+        future.set_exception(exc)
+        raise
+    with _inflight_lock:
+        del _inflight[key]
+        # Изменение во время запроса: ответ мог его не увидеть
+        if BITRIX_READ_DEBOUNCE_SECONDS and _writes.get(portal, 0) == writes:
+            _remember(key, data, time.monotonic())
+    future.set_result(data)
     return data
 
 
+def clear_read_results() -> None:
+    """Забывает недавние результаты чтений текущего портала (после изменений на нём)."""
+    portal = current_portal().name
+    prefix = portal + ":"
+    with _inflight_lock:
+        _writes[portal] = _writes.get(portal, 0) + 1
+        for key in [k for k in _recent if k.startswith(prefix)]:
+            del _recent[key]
+
+
+def _call(
+    method: str,
+    params: Optional[Dict[str, Any]] = None,
+    records: Optional[RecordsSpec] = None,
+) -> Dict[str, Any]:
+    """records — (путь, преобразование) для потокового разбора списков в ответе."""
+    if method in READ_METHODS:
+        return _call_read(method, params, records)
+    try:
+        return _request(method, params, records)
+    finally:
+        # Изменение на портале: недавние списки могли устареть
+        if not _read_only_batch(method, params):
+            clear_read_results()
+
+
+def _read_only_batch(method: str, params: Optional[Dict[str, Any]]) -> bool:
+    """batch только из чтений (синхронизация, сводки, доски) ничего не меняет на портале."""
+    if method != "batch" or not params:
+        return False
+    commands = (params.get("cmd") or {}).values()
+    return all(command.partition("?")[0] in READ_METHODS for command in commands)
+
+
+def _flatten_params(params: Any, prefix: str = "") -> List[Tuple[str, Any]]:
+    """
+    Разворачивает вложенные параметры в пары в стиле PHP:
+    {"fields": {"TITLE": "x"}} -> [("fields[TITLE]", "x")].
+    Нужно для формирования команд batch.
+    """
+    pairs: List[Tuple[str, Any]] = []
+    if isinstance(params, dict):
+        for key, value in params.items():
+            name = f"{prefix}[{key}]" if prefix else str(key)
+            pairs.extend(_flatten_params(value, name))
+    elif isinstance(params, (list, tuple)):
+        for i, value in enumerate(params):
+            pairs.extend(_flatten_params(value, f"{prefix}[{i}]"))
+    elif params is None:
+        pairs.append((prefix, ""))
+    else:
+        pairs.append((prefix, params))
+    return pairs
+
+
+def _batch_command(method: str, params: Optional[Dict[str, Any]] = None) -> str:
+    if not params:
+        return method
+    return method + "?" + urlencode(_flatten_params(params))
+
+
+def call_batch(
+    commands: List[Tuple[str, str, Optional[Dict[str, Any]]]],
+    halt: bool = False,
+    records: Optional[RecordsSpec] = None,
+    totals: Optional[Dict[str, int]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Выполнение набора команд через метод batch.
+    commands: список (ключ, метод, параметры).
+    Команды автоматически режутся на пачки по BATCH_MAX_COMMANDS.
+    records — как в _call, путь внутри результата каждой команды.
+    totals — словарь, куда записать общее число элементов по ключам
+    списочных команд (result_total), если оно нужно.
+    Возвращает (результаты по ключам, ошибки по ключам).
+    """
+    if records is not None:
+        records = (("result", "result", "*", *records[0]), records[1])
+    results: Dict[str, Any] = {}
+    errors: Dict[str, Any] = {}
+    for i in range(0, len(commands), BATCH_MAX_COMMANDS):
+        chunk = commands[i:i + BATCH_MAX_COMMANDS]
+        cmd = {key: _batch_command(method, params) for key, method, params in chunk}
+        data = _call("batch", {"halt": 1 if halt else 0, "cmd": cmd}, records)
+        payload = data.get("result", {}) or {}
+        chunk_results = payload.get("result", {}) or {}
+        chunk_errors = payload.get("result_error", {}) or {}
+        # При пустом результате Bitrix возвращает список вместо словаря
+        if isinstance(chunk_results, dict):
+            results.update(chunk_results)
+        if isinstance(chunk_errors, dict):
+            errors.update(chunk_errors)
+        chunk_totals = payload.get("result_total", {}) or {}
+        if totals is not None and isinstance(chunk_totals, dict):
+            totals.update((key, int(total)) for key, total in chunk_totals.items())
+    return results, errors
+
+
 # ======== Сотрудники ========
 
-def get_employees() -> List[Dict]:
+def get_employees() -> List[Employee]:
     """
     Получение списка сотрудников.
     Можно кешировать на стороне бота.
-    Возвращаем список словарей:
-    { 'ID': int, 'NAME': str, 'LAST_NAME': str, 'FULL_NAME': str }
+    Возвращаем список записей Employee(id, name, last_name, full_name).
     """
-    data = _call("user.get", {})
+    data = _call("user.get", {}, (("result",), employee_from_bitrix))
     result = data.get("result", [])
-    employees: List[Dict] = []
-    if isinstance(result, list):
-        for item in result:
-            full_name = (item.get("NAME", "") + " " + item.get("LAST_NAME", "")).strip()
-            employees.append(
-                {
-                    "ID": int(item["ID"]),
-                    "NAME": item.get("NAME", ""),
-                    "LAST_NAME": item.get("LAST_NAME", ""),
-                    "FULL_NAME": full_name or item.get("LOGIN", ""),
-                }
-            )
-    return employees
+    return result if isinstance(result, list) else []
+
+
+def get_current_profile() -> Dict:
+    """Профиль пользователя, от имени которого выполняются запросы (user.current)."""
+    return _call("user.current").get("result") or {}
+
+
+def get_users_changed_since(since: Optional[str] = None) -> List[DirectoryUser]:
+    """
+    Все пользователи портала, изменённые не раньше since (TIMESTAMP_X),
+    или все пользователи при since=None — для синхронизации справочника логинов.
+    Первая страница запрашивается обычным вызовом, остальные — одним batch.
+    Возвращает записи DirectoryUser — готовые строки для auth.upsert_employees.
+    """
+    params: Dict[str, Any] = {"sort": "TIMESTAMP_X", "order": "ASC"}
+    if since:
+        params["FILTER"] = {">=TIMESTAMP_X": since}
+    first = _call("user.get", params, (("result",), directory_user_from_bitrix))
+    users: List[DirectoryUser] = list(first.get("result") or [])
+    total = int(first.get("total") or len(users))
+    page_size = len(users)
+    if not page_size or total <= page_size:
+        return users
+
+    commands = [
+        (f"p{start}", "user.get", {**params, "start": start})
+        for start in range(page_size, total, page_size)
+    ]
+    results, errors = call_batch(commands, records=((), directory_user_from_bitrix))
+    if errors:
+        raise BitrixAPIError(f"user.get: ошибки в {len(errors)} страницах")
+    for key, _, _ in commands:
+        users.extend(results.get(key) or [])
+    return users
+
+
+# Портал -> {"items", "loaded_at", "version"}
+_employees_caches: Dict[str, Dict[str, Any]] = {}
+# Версия справочника -> список (последние EMPLOYEES_SNAPSHOTS версий всех порталов):
+# диалог выбора сотрудника хранит в user_data только версию, а листает тот же
+# список, даже если справочник тем временем обновился
+_employees_snapshots: "OrderedDict[int, List[Employee]]" = OrderedDict()
+_employees_snapshots_lock = threading.Lock()
+EMPLOYEES_SNAPSHOTS = 8
+
+
+def _employees_cache() -> Dict[str, Any]:
+    return _employees_caches.setdefault(
+        current_portal().name, {"items": None, "loaded_at": 0.0, "version": 0}
+    )
+
+
+def get_employees_cached(force: bool = False) -> List[Employee]:
+    """
+    То же, что get_employees(), но с кешем на EMPLOYEES_CACHE_TTL секунд:
+    сначала в памяти процесса, затем в общем хранилище (state),
+    чтобы несколько процессов бота не загружали справочник каждый сам.
+    Кеш свой у каждого портала.
+    """
+    cache = _employees_cache()
+    now = time.monotonic()
+    items = cache["items"]
+    if not force and items is not None and now - cache["loaded_at"] <= EMPLOYEES_CACHE_TTL:
+        cache_hit("employees")
+        return items
+
+    backend = get_backend()
+    # В общем кеше записи лежат списками полей Employee
+    shared_key = f"cache:employees:{current_portal().name}:records"
+    shared = None if force else backend.get_json(shared_key)
+    if shared:
+        cache_hit("employees_shared")
+        items = [Employee(*row) for row in shared["items"]]
+        version = shared["version"]
+    else:
+        cache_miss("employees")
+        items = get_employees()
+        # Счётчик версий общий для всех порталов: версии разных порталов не совпадают
+        version = backend.incr("cache:employees:version")
+        backend.set_json(shared_key, {"items": items, "version": version}, ttl=EMPLOYEES_CACHE_TTL)
+
+    cache["items"] = items
+    cache["loaded_at"] = now
+    cache["version"] = version
+    with _employees_snapshots_lock:
+        _employees_snapshots[version] = items
+        _employees_snapshots.move_to_end(version)
+        while len(_employees_snapshots) > EMPLOYEES_SNAPSHOTS:
+            _employees_snapshots.popitem(last=False)
+    return items
+
+
+def get_employees_snapshot(version: Optional[int]) -> List[Employee]:
+    """
+    Список сотрудников версии справочника version (см. employees_directory_version)
+    или текущий, если этой версии в памяти уже нет (например, после перезапуска).
+    """
+    with _employees_snapshots_lock:
+        items = _employees_snapshots.get(version) if version is not None else None
+    if items is not None:
+        cache_hit("employees_snapshot")
+        return items
+    cache_miss("employees_snapshot")
+    return get_employees_cached()
+
+
+def employees_directory_version() -> int:
+    """
+    Версия закешированного справочника сотрудников.
+    Увеличивается при каждой перезагрузке списка, используется как ключ
+    для кеша клавиатур.
+    """
+    return _employees_cache()["version"]
 
 
 # ======== Задачи ========
 
-def get_tasks(bitrix_user_id: int, role: str, status: str, start: int = 0, limit: int = 5) -> Dict:
+# Только поля записей Task: описание в списках не показывается, а занимает больше всего
+TASK_SELECT = ["ID", "TITLE", "RESPONSIBLE_ID", "CREATED_BY", "DEADLINE", "STATUS"]
+_TASK_RECORDS: RecordsSpec = (("result", "tasks"), task_from_bitrix)
+TASK_ROLES = ("do", "assist", "originator", "observer")
+# Статусы фильтра «Активные» / «Завершенные»
+TASK_STATUSES = {"active": (1, 2, 3, 4), "completed": (5, 6)}
+# Порядок списков: по сроку или сначала недавно изменённые
+TASK_ORDERS = {"deadline": {"DEADLINE": "asc"}, "changed": {"CHANGED_DATE": "desc"}}
+# Поля локальной копии задач: участники и время изменения
+SYNC_TASK_SELECT = TASK_SELECT + ["CHANGED_DATE", "ACCOMPLICES", "AUDITORS"]
+# Размер страницы списочных методов Bitrix24
+LIST_PAGE_SIZE = 50
+
+
+def _role_filter(role: str, bitrix_user_id: int) -> Dict[str, Any]:
+    if role == "do":          # Делаю
+        return {"RESPONSIBLE_ID": bitrix_user_id}
+    if role == "assist":      # Помогаю (соисполнитель)
+        return {"ACCOMPLICE": bitrix_user_id}
+    if role == "originator":  # Поручил (постановщик)
+        return {"CREATED_BY": bitrix_user_id}
+    if role == "observer":    # Наблюдаю
+        return {"AUDITOR": bitrix_user_id}
+    return {}
+
+
+def _status_filter(status: str) -> Dict[str, Any]:
+    # Набор статусов примерный, при необходимости поправьте под свои статусы.
+    if status in TASK_STATUSES:
+        return {"STATUS": list(TASK_STATUSES[status])}
+    return {}
+
+
+def _tasks_from_result(result: Any) -> List[Task]:
+    # {"tasks": [...]} в новом формате, просто список — в старом
+    if isinstance(result, dict):
+        return result.get("tasks", []) or []
+    if isinstance(result, list):
+        return result
+    return []
+
+
+def get_tasks(
+    bitrix_user_id: int,
+    role: str,
+    status: str,
+    start: int = 0,
+    limit: int = 5,
+    order: str = "deadline",
+) -> Dict:
     """
     Получение задач по пользователю с фильтрацией и простейшей пагинацией по offset.
 
     role: 'do', 'assist', 'originator', 'observer'
     status: 'active', 'completed', 'all'
+    order: ключ TASK_ORDERS
     Возвращает:
     {
-      'tasks': [ {...}, ... ],
+      'tasks': [Task, ...],
       'total': int,
       'next': Optional[int]
     }
     """
-    filter_: Dict[str, Any] = {}
-
-    # Роль
-    if role == "do":          # Делаю
-        filter_["RESPONSIBLE_ID"] = bitrix_user_id
-    elif role == "assist":    # Помогаю (соисполнитель)
-        filter_["ACCOMPLICE"] = bitrix_user_id
-    elif role == "originator":  # Поручил (постановщик)
-        filter_["CREATED_BY"] = bitrix_user_id
-    elif role == "observer":  # Наблюдаю
-        filter_["AUDITOR"] = bitrix_user_id
-
-    # Статус
-    # Набор статусов примерный, при необходимости поправьте под свои статусы.
-    if status == "active":
-        filter_["STATUS"] = [1, 2, 3, 4]
-    elif status == "completed":
-        filter_["STATUS"] = [5, 6]
+    filter_ = _role_filter(role, bitrix_user_id)
+    filter_.update(_status_filter(status))
 
     params = {
         "filter": filter_,
-        "select": ["ID", "TITLE", "DESCRIPTION", "RESPONSIBLE_ID", "CREATED_BY", "DEADLINE", "STATUS"],
+        "select": TASK_SELECT,
+        "order": TASK_ORDERS.get(order, TASK_ORDERS["deadline"]),
         "start": start,
     }
-    data = _call("tasks.task.list", params)
+    data = _call("tasks.task.list", params, _TASK_RECORDS)
 
-    tasks: List[Dict] = []
+    tasks: List[Task] = []
     next_: Optional[int] = None
 
     # Bitrix может вернуть разные структуры, постараемся отработать все варианты.
@@ -114,7 +580,7 @@ def get_tasks(bitrix_user_id: int, role: str, status: str, start: int = 0, limit
         next_ = data.get("next")
     else:
         # На всякий случай
-        tasks = data.get("tasks", []) or []
+        tasks = [task_from_bitrix(t) for t in data.get("tasks", []) or []]
         next_ = data.get("next")
 
     return {
@@ -124,6 +590,242 @@ def get_tasks(bitrix_user_id: int, role: str, status: str, start: int = 0, limit
     }
 
 
+def get_tasks_changed_since(since: Optional[str] = None, member_id: Optional[int] = None) -> List[SyncedTask]:
+    """
+    Задачи портала, изменённые не раньше since (CHANGED_DATE), — для локальной
+    копии (tasks_sync.py); since=None — все задачи. member_id — только задачи,
+    где пользователь участвует в любой роли.
+    Страницы не по смещению: задача, изменённая или удалённая во время
+    выгрузки, сдвигала бы следующие страницы, и одна задача пропускалась.
+    - Все задачи — диапазонами ID по LIST_PAGE_SIZE (ID уникальны, каждый
+      диапазон — одна неполная страница), диапазоны — через batch;
+    - дельта и задачи сотрудника — по возрастанию ID с фильтром >ID последней
+      полученной задачи, страница за страницей (обычно она одна).
+    """
+    filter_: Dict[str, Any] = {}
+    if since:
+        filter_[">=CHANGED_DATE"] = since
+    if member_id is not None:
+        filter_["MEMBER"] = member_id
+    if not filter_:
+        return _all_tasks_by_id_ranges()
+
+    tasks: List[SyncedTask] = []
+    last_id = 0
+    while True:
+        params = {"filter": {**filter_, ">ID": last_id}, "select": SYNC_TASK_SELECT, "order": {"ID": "asc"}}
+        data = _call("tasks.task.list", params, (("result", "tasks"), synced_task_from_bitrix))
+        page = _tasks_from_result(data.get("result"))
+        tasks.extend(page)
+        if not page or data.get("next") is None:
+            return tasks
+        last_id = page[-1].id
+
+
+def _all_tasks_by_id_ranges() -> List[SyncedTask]:
+    data = _call("tasks.task.list", {"select": ["ID"], "order": {"ID": "desc"}})
+    newest = _tasks_from_result(data.get("result"))
+    if not newest:
+        return []
+    max_id = int(newest[0].get("id") or newest[0].get("ID"))
+    commands = [
+        (
+            f"r{low}",
+            "tasks.task.list",
+            {
+                "filter": {">=ID": low, "<ID": low + LIST_PAGE_SIZE},
+                "select": SYNC_TASK_SELECT,
+                "order": {"ID": "asc"},
+            },
+        )
+        for low in range(1, max_id + 1, LIST_PAGE_SIZE)
+    ]
+    results, errors = call_batch(commands, records=(("tasks",), synced_task_from_bitrix))
+    if errors:
+        raise BitrixAPIError(f"tasks.task.list: ошибки в {len(errors)} диапазонах ID")
+    tasks: List[SyncedTask] = []
+    for key, _, _ in commands:
+        tasks.extend(_tasks_from_result(results.get(key)))
+    return tasks
+
+
+def get_latest_task_change() -> Optional[str]:
+    """
+    Наибольший CHANGED_DATE задач портала (None — задач нет). Запрашивается
+    до выгрузки изменений: следующая дельта начинается с него, и задачи,
+    изменённые во время выгрузки, попадут в неё.
+    """
+    params = {"select": ["ID", "CHANGED_DATE"], "order": {"CHANGED_DATE": "desc"}}
+    data = _call("tasks.task.list", params)
+    tasks = _tasks_from_result(data.get("result"))
+    if not tasks:
+        return None
+    return tasks[0].get("changedDate") or tasks[0].get("CHANGED_DATE")
+
+
+def get_due_tasks_bulk(
+    users: List[Tuple[Any, int, List[str]]],
+    deadline_before: str,
+) -> Dict[Any, List[Task]]:
+    """
+    Активные задачи со сроком не позже deadline_before ('YYYY-MM-DDTHH:MM:SS')
+    для многих пользователей сразу — один batch на 50 пар (пользователь, роль).
+    users: список (ключ, bitrix_user_id, роли).
+    Возвращает {ключ: задачи по возрастанию срока}; задача, попавшая
+    в несколько ролей, встречается один раз. Пользователи, для которых
+    Bitrix24 вернул ошибку, в результат не попадают.
+    """
+    commands = []
+    for n, (_, bitrix_user_id, roles) in enumerate(users):
+        for role in roles:
+            filter_ = _role_filter(role, bitrix_user_id)
+            filter_.update(_status_filter("active"))
+            filter_["<=DEADLINE"] = deadline_before
+            params = {"filter": filter_, "select": TASK_SELECT, "order": {"DEADLINE": "asc"}}
+            commands.append((f"u{n}_{role}", "tasks.task.list", params))
+
+    results, errors = call_batch(commands, records=(("tasks",), task_from_bitrix))
+
+    due: Dict[Any, List[Task]] = {}
+    for n, (key, _, roles) in enumerate(users):
+        if any(f"u{n}_{role}" in errors for role in roles):
+            continue
+        seen = set()
+        tasks: List[Task] = []
+        for role in roles:
+            for task in _tasks_from_result(results.get(f"u{n}_{role}")):
+                if task.id not in seen:
+                    seen.add(task.id)
+                    tasks.append(task)
+        tasks.sort(key=lambda t: t.deadline or "")
+        due[key] = tasks
+    return due
+
+
+def get_team_load(member_ids: List[int], now: str, tasks_per_member: int) -> Dict[int, MemberLoad]:
+    """
+    Открытые задачи участников доски команды — один batch на 25 участников:
+    по участнику две команды, число активных задач (только ID, берётся total)
+    и просроченные со сроком раньше now ('YYYY-MM-DDTHH:MM:SS+ЧЧ:ММ')
+    по возрастанию срока. Участники, для которых Bitrix24 вернул ошибку,
+    в результат не попадают.
+    """
+    commands = []
+    for bitrix_user_id in member_ids:
+        filter_ = _role_filter("do", bitrix_user_id)
+        filter_.update(_status_filter("active"))
+        commands.append((f"a{bitrix_user_id}", "tasks.task.list", {"filter": filter_, "select": ["ID"]}))
+        overdue = {**filter_, "<DEADLINE": now}
+        params = {"filter": overdue, "select": TASK_SELECT, "order": {"DEADLINE": "asc"}}
+        commands.append((f"o{bitrix_user_id}", "tasks.task.list", params))
+
+    totals: Dict[str, int] = {}
+    results, errors = call_batch(commands, records=(("tasks",), task_from_bitrix), totals=totals)
+
+    by_member: Dict[int, MemberLoad] = {}
+    for bitrix_user_id in member_ids:
+        active_key, overdue_key = f"a{bitrix_user_id}", f"o{bitrix_user_id}"
+        if active_key in errors or overdue_key in errors:
+            continue
+        active = _tasks_from_result(results.get(active_key))
+        overdue = _tasks_from_result(results.get(overdue_key))
+        by_member[bitrix_user_id] = MemberLoad(
+            totals.get(active_key, len(active)),
+            totals.get(overdue_key, len(overdue)),
+            tuple(overdue[:tasks_per_member]),
+        )
+    return by_member
+
+
+def _deadline_key(task: Task) -> Tuple[bool, str]:
+    # По возрастанию срока (просроченные — первыми), задачи без срока — в конце
+    return task.deadline is None, task.deadline or ""
+
+
+def merge_role_tasks(by_role: Dict[str, List[Task]]) -> Tuple[List[Tuple[Task, Tuple[str, ...]]], bool]:
+    """
+    Слияние списков задач по ролям в один по сроку: каждая задача один раз,
+    с перечнем ролей, в которых она встретилась.
+    Роль с полной страницей (LIST_PAGE_SIZE) могла вернуть не все задачи:
+    список обрезается по последнему сроку такой роли, чтобы дальше не было
+    пропусков. Возвращает (задачи с ролями, список полный).
+    """
+    roles_of: Dict[int, List[str]] = {}
+    ordered = []
+    limit = None
+    for role, tasks in by_role.items():
+        for task in tasks:
+            roles_of.setdefault(task.id, []).append(role)
+        if len(tasks) >= LIST_PAGE_SIZE:
+            last = _deadline_key(tasks[-1])
+            limit = last if limit is None else min(limit, last)
+        # Сортировка почти упорядоченного списка — линейная
+        ordered.append(sorted(tasks, key=_deadline_key))
+
+    merged: List[Tuple[Task, Tuple[str, ...]]] = []
+    for task in heapq.merge(*ordered, key=_deadline_key):
+        if limit is not None and _deadline_key(task) > limit:
+            break
+        roles = roles_of.pop(task.id, None)
+        # Повтор той же задачи из другой роли
+        if roles is not None:
+            merged.append((task, tuple(roles)))
+    return merged, limit is None
+
+
+# (портал, пользователь OAuth, bitrix_user_id, статус) -> (время загрузки, результат)
+_merged_tasks: "OrderedDict[Tuple, Tuple[float, Dict]]" = OrderedDict()
+_merged_tasks_lock = threading.Lock()
+
+
+def get_all_my_tasks(bitrix_user_id: int, status: str, force: bool = False) -> Dict:
+    """
+    Задачи пользователя во всех ролях (TASK_ROLES) одним batch, слитые по сроку.
+    Результат кешируется на TASKS_MERGED_CACHE_TTL секунд: страницы
+    листаются без запросов к порталу; force=True — загрузить заново.
+    Возвращает {'tasks': [(Task, роли), ...], 'complete': bool}.
+    """
+    key = (current_portal().name, current_oauth_user(), bitrix_user_id, status)
+    now = time.monotonic()
+    with _merged_tasks_lock:
+        cached = _merged_tasks.get(key)
+        if not force and cached is not None and now - cached[0] <= TASKS_MERGED_CACHE_TTL:
+            _merged_tasks.move_to_end(key)
+            cache_hit("tasks_merged")
+            return cached[1]
+    cache_miss("tasks_merged")
+
+    commands = []
+    for role in TASK_ROLES:
+        filter_ = _role_filter(role, bitrix_user_id)
+        filter_.update(_status_filter(status))
+        params = {"filter": filter_, "select": TASK_SELECT, "order": {"DEADLINE": "asc"}}
+        commands.append((role, "tasks.task.list", params))
+    results, errors = call_batch(commands, records=(("tasks",), task_from_bitrix))
+    if errors:
+        raise BitrixAPIError(f"tasks.task.list: ошибки в ролях {', '.join(errors)}")
+
+    tasks, complete = merge_role_tasks({role: _tasks_from_result(results.get(role)) for role in TASK_ROLES})
+    result = {"tasks": tasks, "complete": complete}
+    with _merged_tasks_lock:
+        _merged_tasks[key] = (now, result)
+        _merged_tasks.move_to_end(key)
+        while len(_merged_tasks) > TASKS_MERGED_CACHE_SIZE:
+            _merged_tasks.popitem(last=False)
+    return result
+
+
+def forget_my_tasks(*bitrix_user_ids: int) -> None:
+    """
+    Сбрасывает сводные списки пользователей после создания задач —
+    у постановщика и у исполнителей: новая задача есть в списках обоих.
+    """
+    users = set(bitrix_user_ids)
+    with _merged_tasks_lock:
+        for key in [k for k in _merged_tasks if k[2] in users]:
+            del _merged_tasks[key]
+
+
 def create_task(
     title: str,
     description: str,
@@ -136,6 +838,28 @@ def create_task(
     deadline_iso в формате 'YYYY-MM-DDTHH:MM:SS' или None.
     Возвращает ID созданной задачи.
     """
+    fields = _task_fields(title, description, deadline_iso, responsible_id, _forced_author(created_by))
+
+    data = _call("tasks.task.add", {"fields": fields})
+    task_id = _extract_task_id(data.get("result", {}))
+    if not task_id:
+        raise BitrixAPIError("Не удалось получить ID созданной задачи")
+    return task_id
+
+
+def _forced_author(created_by: Optional[int]) -> Optional[int]:
+    # С токеном пользователя автор задачи — он сам; CREATED_BY нужен только
+    # при работе через вебхук, иначе автором станет владелец вебхука
+    return None if current_oauth_user() is not None and current_token() else created_by
+
+
+def _task_fields(
+    title: str,
+    description: str,
+    deadline_iso: Optional[str],
+    responsible_id: int,
+    created_by: Optional[int] = None,
+) -> Dict[str, Any]:
     fields: Dict[str, Any] = {
         "TITLE": title,
         "DESCRIPTION": description,
@@ -145,33 +869,228 @@ def create_task(
         fields["DEADLINE"] = deadline_iso
     if created_by:
         fields["CREATED_BY"] = created_by
+    return fields
 
-    data = _call("tasks.task.add", {"fields": fields})
+
+def _extract_task_id(res: Any) -> Optional[int]:
     # В разных версиях структура тоже может отличаться
-    res = data.get("result", {})
     if isinstance(res, dict) and "task" in res:
         task_id = res["task"].get("id")
-    else:
+    elif isinstance(res, dict):
         task_id = res.get("task_id") or res.get("ID")
+    else:
+        task_id = res
+    return int(task_id) if task_id else None
 
-    if not task_id:
-        raise BitrixAPIError("Не удалось получить ID созданной задачи")
-    return int(task_id)
 
+def create_tasks_bulk(items: List[Dict], created_by: Optional[int] = None) -> List[Dict]:
+    """
+    Массовое создание задач через batch.
+    items: список словарей с ключами title, description, deadline_iso, responsible_id.
+    Возвращает результат по каждой строке в исходном порядке:
+    { 'index': int, 'task_id': Optional[int], 'error': Optional[str], 'unknown': bool }
+    unknown=True — batch пачки отправлен, но ответ не получен: задачи могли
+    быть созданы, повторять их без проверки нельзя.
+    """
+    created_by = _forced_author(created_by)
+    commands = []
+    for i, item in enumerate(items):
+        fields = _task_fields(
+            title=item["title"],
+            description=item.get("description", ""),
+            deadline_iso=item.get("deadline_iso"),
+            responsible_id=item["responsible_id"],
+            created_by=created_by,
+        )
+        commands.append((f"t{i}", "tasks.task.add", {"fields": fields}))
 
-# ======== Календарь ========
+    # Пачки по отдельности: если batch одной пачки не прошёл, задачи из уже
+    # созданных пачек всё равно попадают в отчёт. Не создана пачка, только если
+    # запрос не был отправлен (circuit breaker, лимит запросов); при обрыве
+    # или таймауте портал мог успеть создать задачи — исход неизвестен
+    results: Dict[str, Any] = {}
+    errors: Dict[str, Any] = {}
+    unknown: Set[str] = set()
+    for start in range(0, len(commands), BATCH_MAX_COMMANDS):
+        chunk = commands[start:start + BATCH_MAX_COMMANDS]
+        try:
+            chunk_results, chunk_errors = call_batch(chunk)
+        except PortalUnavailableError as exc:
+            chunk_errors = {key: f"задача не создана: {exc}" for key, _, _ in chunk}
+            chunk_results = {}
+        except Exception as exc:
+            error = f"ответ портала не получен ({exc}), задача могла быть создана"
+            chunk_errors = {key: error for key, _, _ in chunk}
+            chunk_results = {}
+            unknown.update(key for key, _, _ in chunk)
+        results.update(chunk_results)
+        errors.update(chunk_errors)
+
+    report: List[Dict] = []
+    for i in range(len(items)):
+        key = f"t{i}"
+        if key in errors:
+            err = errors[key]
+            if isinstance(err, dict):
+                err = err.get("error_description") or err.get("error")
+            report.append({"index": i, "task_id": None, "error": str(err), "unknown": key in unknown})
+            continue
+        task_id = _extract_task_id(results.get(key))
+        if task_id:
+            report.append({"index": i, "task_id": task_id, "error": None, "unknown": False})
+        else:
+            report.append(
+                {"index": i, "task_id": None, "error": "Не удалось получить ID созданной задачи", "unknown": True}
+            )
+    return report
+
+
+# ======== Диск и вложения задач ========
+
+# (портал, сотрудник) -> ID корневой папки его диска
+_disk_folders: Dict[Tuple[str, int], int] = {}
+
+
+def get_user_disk_folder(bitrix_user_id: int) -> int:
+    """ID корневой папки личного диска сотрудника (нужен scope disk)."""
+    key = (current_portal().name, bitrix_user_id)
+    folder_id = _disk_folders.get(key)
+    if folder_id is None:
+        data = _call("disk.storage.getlist", {"filter": {"ENTITY_TYPE": "user", "ENTITY_ID": bitrix_user_id}})
+        storages = data.get("result") or []
+        if not storages:
+            raise BitrixAPIError("Не найден диск сотрудника в Bitrix24")
+        folder_id = _disk_folders[key] = int(storages[0]["ROOT_OBJECT_ID"])
+    return folder_id
+
+
+class _MultipartBody:
+    """
+    Тело multipart/form-data с одним файлом, которое requests отправляет
+    по кускам из chunks. Длина известна заранее (__len__) — запрос уходит
+    с Content-Length, без chunked-кодирования, которого порталы не ждут.
+    """
+
+    def __init__(self, field: str, file_name: str, chunks: Iterable[bytes], size: int) -> None:
+        boundary = secrets.token_hex(16)
+        file_name = file_name.replace('"', "'").replace("\r", " ").replace("\n", " ")
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{file_name}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode("utf-8")
+        self._tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+        self._chunks = chunks
+        self._size = size
 
-def get_calendar_events(bitrix_user_id: int, limit: int = 10) -> List[Dict]:
+    def __len__(self) -> int:
+        return len(self._head) + self._size + len(self._tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._head
+        sent = 0
+        for chunk in self._chunks:
+            sent += len(chunk)
+            if sent > self._size:
+                raise BitrixAPIError("Файл оказался больше заявленного размера")
+            yield chunk
+        if sent != self._size:
+            # Запрос обрывается: портал не сохранит неполный файл
+            raise BitrixAPIError(f"Файл оборвался: получено {sent} из {self._size} байт")
+        yield self._tail
+
+
+def upload_disk_file(folder_id: int, file_name: str, chunks: Iterable[bytes], size: int) -> int:
     """
-    Получение ближайших событий календаря пользователя.
+    Загрузка файла в папку Диска: disk.folder.uploadfile выдаёт адрес загрузки,
+    туда файл уходит потоком из chunks (ровно size байт) — целиком в памяти
+    он не бывает. Возвращает ID файла на Диске.
+    """
+    data = _call("disk.folder.uploadfile", {"id": folder_id, "generateUniqueName": True})
+    target = data.get("result") or {}
+    upload_url = target.get("uploadUrl")
+    if not upload_url:
+        raise BitrixAPIError("Bitrix24 не выдал адрес для загрузки файла")
+    body = _MultipartBody(target.get("field") or "file", file_name, chunks, size)
+
+    portal = current_portal()
+    BITRIX_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    with span("bitrix", method="disk.upload", portal=portal.name) as attrs:
+        attrs["request_bytes"] = len(body)
+        try:
+            # Таймаут — на каждую операцию с сокетом, а не на всю загрузку
+            response = portal.session().post(
+                upload_url, data=body, headers={"Content-Type": body.content_type}, timeout=TASK_FILE_IO_TIMEOUT
+            )
+            reply = loads(response.content) if response.status_code in (200, 400, 401) else None
+            if isinstance(reply, dict) and "error" in reply:
+                raise BitrixAPIError(f"{reply['error']}: {reply.get('error_description')}")
+            if response.status_code != 200:
+                raise BitrixAPIError(f"HTTP {response.status_code}: {response.text}")
+        except Exception:
+            BITRIX_ERRORS.inc("disk.upload", portal.name)
+            raise
+        finally:
+            BITRIX_LATENCY.observe(time.perf_counter() - started, "disk.upload", portal.name)
+            BITRIX_IN_FLIGHT.dec()
 
-    ЭТУ ФУНКЦИЮ НУЖНО ДОРАБОТАТЬ под ваш портал:
-    - Можно использовать метод calendar.event.get или calendar.events.list и т.п.
-    - Сейчас возвращается пустой список, поэтому бот честно пишет:
-      "Ближайших мероприятий не найдено."
+    file_id = (reply.get("result") or {}).get("ID") if isinstance(reply, dict) else None
+    if not file_id:
+        raise BitrixAPIError("Не удалось получить ID загруженного файла")
+    return int(file_id)
+
+
+def is_task_member(task_id: int, bitrix_user_id: int) -> bool:
     """
-    # TODO: реализовать конкретный вызов API календаря Bitrix24.
-    return []
+    Участвует ли сотрудник в задаче в любой роли. Вебхук видит все задачи
+    портала — без этой проверки через него можно прикрепить файл к чужой задаче.
+    """
+    params = {"filter": {"ID": task_id, "MEMBER": bitrix_user_id}, "select": ["ID"]}
+    data = _call("tasks.task.list", params)
+    return bool(_tasks_from_result(data.get("result")))
+
+
+def attach_task_file(task_id: int, file_id: int) -> None:
+    """Прикрепляет файл Диска к задаче."""
+    _call("tasks.task.files.attach", {"taskId": task_id, "fileId": file_id})
+
+
+# ======== Уведомления ========
+
+def send_notification(bitrix_user_id: int, message: str) -> None:
+    """Системное уведомление пользователю портала (нужен scope im у вебхука)."""
+    _call("im.notify.system.add", {"USER_ID": bitrix_user_id, "MESSAGE": message})
+
+
+# ======== Календарь ========
+
+def get_calendar_events(bitrix_user_id: int, date_from: date, date_to: date) -> List[CalendarEvent]:
+    """
+    События личного календаря пользователя, попадающие в [date_from, date_to].
+    Повторяющиеся приходят одной записью серии с RRULE — их вхождения
+    разворачивает agenda.py — или уже развёрнутыми вхождениями периода.
+    Нужен scope calendar у вебхука (приложения).
+    """
+    params = {
+        "type": "user",
+        "ownerId": bitrix_user_id,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+    }
+    data = _call("calendar.event.get", params, (("result",), calendar_event_from_bitrix))
+    # Серия, которую портал развернул сам, приходит несколькими вхождениями с одним
+    # ID. Начало серии (DTSTART) у них не передаётся, поэтому COUNT и UNTIL не от
+    # чего отсчитать: берутся сами вхождения периода, как разовые события
+    items: List[CalendarEvent] = data.get("result") or []
+    instances = Counter(event.id for event in items)
+    events: Dict[Tuple[int, datetime], CalendarEvent] = {}
+    for event in items:
+        if instances[event.id] > 1:
+            event = event._replace(rrule=None, exdates=())
+        events.setdefault((event.id, event.start), event)
+    return list(events.values())
 
 
 def create_calendar_event(
@@ -0,0 +1,277 @@
+"""
+Компактное кодирование callback_data для inline-кнопок.
+
+Каждое действие регистрируется в таблице маршрутов под коротким кодом и с
+типами аргументов. Кнопка кодируется как "<код>:<арг1>:<арг2>...", где целые
+числа записываются в base62, например:
+    pack("event_att.select", 12345)  ->  "as:3d7"
+
+Разбор выполняется одним поиском в словаре по коду, без регулярных
+выражений и цепочек startswith.
+
+Если закодированная строка не помещается в лимит Telegram (64 байта),
+аргументы сохраняются на стороне бота в LRU-реестре, ограниченном по памяти,
+а в кнопку попадает только короткий токен "~<токен>".
+"""
+
+import os
+import string
+import sys
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, NamedTuple, Tuple
+
+from config import CALLBACK_REGISTRY_MAX_BYTES
+
+CALLBACK_DATA_LIMIT = 64
+
+_SEP = ":"
+_TOKEN_PREFIX = "~"
+_ALPHABET = string.digits + string.ascii_letters
+_BASE = len(_ALPHABET)
+_DIGITS = {ch: i for i, ch in enumerate(_ALPHABET)}
+
+
+class CallbackDataError(Exception):
+    """Неизвестные, устаревшие или повреждённые данные кнопки."""
+
+
+class CallbackRoute(NamedTuple):
+    name: str
+    code: str
+    arg_types: Tuple[type, ...]
+
+
+_ROUTES_BY_NAME: Dict[str, CallbackRoute] = {}
+_ROUTES_BY_CODE: Dict[str, CallbackRoute] = {}
+
+
+def register(name: str, code: str, *arg_types: type) -> CallbackRoute:
+    if code in _ROUTES_BY_CODE or name in _ROUTES_BY_NAME:
+        raise ValueError(f"Маршрут уже зарегистрирован: {name} ({code})")
+    if _SEP in code or code.startswith(_TOKEN_PREFIX):
+        raise ValueError(f"Недопустимый код маршрута: {code}")
+    route = CallbackRoute(name, code, tuple(arg_types))
+    _ROUTES_BY_NAME[name] = route
+    _ROUTES_BY_CODE[code] = route
+    return route
+
+
+# ======== Таблица маршрутов ========
+
+register("tasks.list", "tl")
+register("tasks.page", "tp", int)
+register("tasks.create", "tc")
+register("tasks.bulk", "tb")
+register("tasks.filter", "tf")
+register("tasks.filter_role", "tr", str)
+register("tasks.filter_status", "ts", str)
+register("tasks.role_menu", "tR")
+register("tasks.status_menu", "tS")
+register("tasks.density", "tD")
+register("tasks.order", "tO")
+
+register("task_resp.page", "rp", int)
+register("task_resp.select", "rs", int)
+register("task_create.confirm", "cc")
+register("task_create.cancel", "cx")
+
+register("bulk_create.confirm", "bc")
+register("bulk_create.cancel", "bx")
+
+register("calendar.list", "cl")
+register("calendar.day", "cd", int)
+register("calendar.create", "cn")
+
+register("event_att.page", "ap", int)
+register("event_att.select", "as", int)
+register("event_att.done", "ad")
+register("event_att.cancel", "ax")
+register("event_create.confirm", "ec")
+register("event_create.cancel", "ex")
+
+register("board.refresh", "bR")
+
+
+# ======== Кодирование значений ========
+
+def _encode_int(value: int) -> str:
+    if value == 0:
+        return "0"
+    sign = ""
+    if value < 0:
+        sign = "-"
+        value = -value
+    digits = []
+    while value:
+        value, rem = divmod(value, _BASE)
+        digits.append(_ALPHABET[rem])
+    return sign + "".join(reversed(digits))
+
+
+def _decode_int(value: str) -> int:
+    sign = 1
+    if value.startswith("-"):
+        sign = -1
+        value = value[1:]
+    if not value:
+        raise CallbackDataError("Пустое число")
+    result = 0
+    for ch in value:
+        digit = _DIGITS.get(ch)
+        if digit is None:
+            raise CallbackDataError(f"Недопустимый символ: {ch}")
+        result = result * _BASE + digit
+    return sign * result
+
+
+def _encode_value(value: Any, type_: type) -> str:
+    if type_ is bool:
+        return "1" if value else "0"
+    if type_ is int:
+        return _encode_int(int(value))
+    return str(value)
+
+
+def _decode_value(value: str, type_: type) -> Any:
+    if type_ is bool:
+        return value == "1"
+    if type_ is int:
+        return _decode_int(value)
+    return value
+
+
+# ======== Реестр длинных payload ========
+
+class CallbackRegistry:
+    """
+    LRU-реестр аргументов кнопок, не помещающихся в 64 байта.
+    Ограничен приблизительным объёмом памяти, а не количеством записей.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._items: "OrderedDict[str, Tuple[str, Tuple[Any, ...], int]]" = OrderedDict()
+        # Соль процесса: после перезапуска старые токены не совпадут с новыми
+        self._salt = _encode_int(int.from_bytes(os.urandom(3), "big"))
+        self._counter = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, name: str, args: Tuple[Any, ...]) -> str:
+        self._counter += 1
+        token = self._salt + _encode_int(self._counter)
+        size = sys.getsizeof(token) + sys.getsizeof(args) + sum(sys.getsizeof(a) for a in args)
+        self._items[token] = (name, args, size)
+        self.size_bytes += size
+        while self.size_bytes > self.max_bytes and len(self._items) > 1:
+            _, (_, _, old_size) = self._items.popitem(last=False)
+            self.size_bytes -= old_size
+        return token
+
+    def get(self, token: str) -> Tuple[str, Tuple[Any, ...]]:
+        item = self._items.get(token)
+        if item is None:
+            raise CallbackDataError("Данные кнопки устарели")
+        self._items.move_to_end(token)
+        return item[0], item[1]
+
+
+registry = CallbackRegistry(CALLBACK_REGISTRY_MAX_BYTES)
+
+
+# ======== Публичный интерфейс ========
+
+def pack(name: str, *args: Any) -> str:
+    """Кодирует действие и аргументы в callback_data."""
+    route = _ROUTES_BY_NAME[name]
+    if len(args) != len(route.arg_types):
+        raise ValueError(f"{name}: ожидается аргументов {len(route.arg_types)}, передано {len(args)}")
+
+    parts = [route.code]
+    fits = True
+    for value, type_ in zip(args, route.arg_types):
+        encoded = _encode_value(value, type_)
+        if _SEP in encoded:
+            fits = False
+            break
+        parts.append(encoded)
+
+    if fits:
+        data = _SEP.join(parts)
+        if len(data.encode("utf-8")) <= CALLBACK_DATA_LIMIT:
+            return data
+
+    return _TOKEN_PREFIX + registry.put(name, tuple(args))
+
+
+def unpack(data: str) -> Tuple[str, Tuple[Any, ...]]:
+    """
+    Разбирает callback_data в (имя действия, аргументы).
+    Результат разбора кешируется, поэтому повторный вызов в обработчике бесплатен.
+    """
+    if not data:
+        raise CallbackDataError("Пустые данные кнопки")
+    if data.startswith(_TOKEN_PREFIX):
+        return registry.get(data[1:])
+    return _unpack_inline(data)
+
+
+@lru_cache(maxsize=2048)
+def _unpack_inline(data: str) -> Tuple[str, Tuple[Any, ...]]:
+    code, _, rest = data.partition(_SEP)
+    route = _ROUTES_BY_CODE.get(code)
+    if route is None:
+        raise CallbackDataError(f"Неизвестная кнопка: {data}")
+
+    raw_args = rest.split(_SEP) if rest else []
+    if len(raw_args) != len(route.arg_types):
+        raise CallbackDataError(f"Неверное число аргументов: {data}")
+    return route.name, tuple(_decode_value(v, t) for v, t in zip(raw_args, route.arg_types))
+
+
+def ensure_route(name: str) -> CallbackRoute:
+    route = _ROUTES_BY_NAME.get(name)
+    if route is None:
+        raise ValueError(f"Неизвестный маршрут: {name}")
+    return route
+
+
+def callback_name(data: Any) -> str:
+    """Имя действия или пустая строка, если данные не разбираются."""
+    if not isinstance(data, str):
+        return ""
+    try:
+        return unpack(data)[0]
+    except CallbackDataError:
+        return ""
+
+
+def matcher(*names: str) -> Callable[[Any], bool]:
+    """
+    Фильтр для CallbackQueryHandler(pattern=...): одна проверка по множеству
+    имён вместо регулярного выражения.
+    Имя вида "event_att.*" означает все действия с этим префиксом.
+    """
+    expanded = set()
+    for name in names:
+        if name.endswith(".*"):
+            prefix = name[:-1]
+            expanded.update(n for n in _ROUTES_BY_NAME if n.startswith(prefix))
+        else:
+            expanded.add(ensure_route(name).name)
+    allowed = frozenset(expanded)
+
+    def _match(data: Any) -> bool:
+        return callback_name(data) in allowed
+
+    return _match
+
+
+async def stale_callback(update, context) -> None:
+    """Ответ на нажатие кнопки, данные которой не разбираются (старое сообщение)."""
+    await update.callback_query.answer(
+        "Кнопка устарела. Откройте меню заново.", show_alert=False
+    )
@@ -4,18 +4,217 @@
 ПЕРЕД ЗАПУСКОМ:
 1. Заполните TELEGRAM_BOT_TOKEN токеном вашего бота.
 2. Укажите данные доступа к Bitrix24 (домен и вебхук).
-3. Задайте общий пароль для авторизации сотрудников.
+3. Выберите способ входа сотрудников (LOGIN_METHOD).
 """
 
 TELEGRAM_BOT_TOKEN = "PASTE_YOUR_TELEGRAM_BOT_TOKEN_HERE"
 
-# Общий пароль для всех сотрудников (согласно ТЗ)
-COMMON_PASSWORD = "CHANGE_ME_COMMON_PASSWORD"
+# Способ входа (/login):
+#   "code"     — одноразовый код приходит уведомлением в Bitrix24
+#                (вебхуку нужен доступ к scope im);
+#   "password" — личный пароль, задаётся командой `python main.py set-password <логин>`
+LOGIN_METHOD = "code"
+
+# Срок действия одноразового кода (в секундах)
+LOGIN_CODE_TTL = 300
+
+# Параметры scrypt для хешей паролей и кодов и число потоков для их проверки.
+# Уже сохранённые хеши хранят свои параметры, поэтому их можно менять.
+LOGIN_KDF_N = 2 ** 14
+LOGIN_KDF_R = 8
+LOGIN_KDF_P = 1
+LOGIN_KDF_WORKERS = 2
+
+# Не больше LOGIN_MAX_ATTEMPTS неудачных попыток входа (и запросов кода)
+# за LOGIN_ATTEMPT_WINDOW секунд — отдельно на Telegram-аккаунт и на логин
+LOGIN_MAX_ATTEMPTS = 5
+LOGIN_ATTEMPT_WINDOW = 900
 
 # Конфигурация Bitrix24
 # Вариант с входящим вебхуком:
 # Пример: https://my-domain.bitrix24.ru/rest/1/xxxxxxxxxx/
 BITRIX_WEBHOOK_BASE_URL = "https://your-bitrix-domain/rest/1/WEBHOOK_CODE/"
 
+# Несколько порталов в одном боте: имя портала -> URL входящего вебхука.
+# Портал пользователя запоминается при входе; если логин есть на нескольких
+# порталах, при входе указывается "портал/логин".
+BITRIX_PORTALS = {"main": BITRIX_WEBHOOK_BASE_URL}
+DEFAULT_PORTAL = "main"
+
+# Как бот обращается к Bitrix24 от имени сотрудников:
+#   "webhook" — все запросы через вебхук портала (общий лимит запросов,
+#               автор изменений — владелец вебхука);
+#   "oauth"   — локальное приложение Bitrix24: каждый сотрудник входит через
+#               OAuth, запросы идут с его токеном и в пределах его лимита.
+#               Фоновые задачи (сводки, справочник) по-прежнему идут через вебхук.
+BITRIX_AUTH_MODE = "webhook"
+
+# Локальное приложение (режим "oauth"): client_id/client_secret из карточки
+# приложения и публичный адрес бота, на который Bitrix24 вернёт пользователя
+# (в приложении указывается как "{OAUTH_PUBLIC_URL}/oauth/callback")
+BITRIX_OAUTH_CLIENT_ID = ""
+BITRIX_OAUTH_CLIENT_SECRET = ""
+BITRIX_OAUTH_TOKEN_URL = "https://oauth.bitrix.info/oauth/token/"
+OAUTH_PUBLIC_URL = "https://bot.example.com"
+OAUTH_CALLBACK_HOST = "0.0.0.0"
+OAUTH_CALLBACK_PORT = 8088
+
+# Обновление токенов: за BITRIX_OAUTH_REFRESH_MARGIN секунд до истечения —
+# у пользователей, обращавшихся к боту за последние BITRIX_OAUTH_ACTIVE_WINDOW
+# секунд; у остальных — только чтобы не истёк refresh-токен (живёт 28 дней).
+# BITRIX_USER_RATE — лимит запросов в секунду на одного сотрудника.
+BITRIX_OAUTH_REFRESH_MARGIN = 300
+BITRIX_OAUTH_ACTIVE_WINDOW = 3600
+BITRIX_OAUTH_REFRESH_TOKEN_TTL = 28 * 24 * 3600
+BITRIX_USER_RATE = 2.0
+
+# Изоляция порталов друг от друга:
+# - BITRIX_POOL_SIZE потоков и HTTP-соединений на портал, таймаут запроса BITRIX_TIMEOUT;
+# - не больше BITRIX_PORTAL_RATE запросов в секунду (с запасом BITRIX_PORTAL_BURST),
+#   ждать свободного слота не дольше BITRIX_PORTAL_RATE_WAIT секунд;
+# - после BITRIX_BREAKER_FAILURES ошибок подряд портал считается недоступным
+#   BITRIX_BREAKER_COOLDOWN секунд, запросы к нему сразу завершаются ошибкой
+BITRIX_POOL_SIZE = 8
+BITRIX_TIMEOUT = 30
+BITRIX_PORTAL_RATE = 2.0
+BITRIX_PORTAL_BURST = 50
+BITRIX_PORTAL_RATE_WAIT = 5.0
+BITRIX_BREAKER_FAILURES = 5
+BITRIX_BREAKER_COOLDOWN = 30
+
+# JSON-кодек запросов и ответов Bitrix24: "auto" — orjson, если установлен
+# (pip install orjson), иначе стандартный json; "json" или "orjson" — явно.
+# Списки задач и сотрудников в любом случае разбираются потоково (jsonstream.py).
+BITRIX_JSON_CODEC = "auto"
+
+# Сколько апдейтов обрабатывается одновременно (апдейты одного пользователя —
+# всегда по очереди). Медленный портал не задерживает пользователей других порталов.
+MAX_CONCURRENT_UPDATES = 32
+
 # Часовой пояс, можно использовать в будущем
 TIMEZONE = "Europe/Moscow"
+
+# Время жизни кеша списка сотрудников (в секундах)
+EMPLOYEES_CACHE_TTL = 600
+
+# Сводный список «Все мои задачи» (все роли одним batch): сколько секунд
+# листать страницы из уже загруженного списка и для скольких пользователей его хранить
+TASKS_MERGED_CACHE_TTL = 60
+TASKS_MERGED_CACHE_SIZE = 1000
+
+# Повестка «Мои мероприятия»: серии из календаря загружаются на AGENDA_HORIZON_DAYS
+# дней вперёд и хранятся AGENDA_CACHE_TTL секунд (для AGENDA_CACHE_SIZE пользователей),
+# повторяющиеся события разворачиваются порциями по AGENDA_WINDOW_DAYS дней
+AGENDA_HORIZON_DAYS = 90
+AGENDA_WINDOW_DAYS = 14
+AGENDA_CACHE_TTL = 300
+AGENDA_CACHE_SIZE = 1000
+
+# Локальная копия задач (bot_data.sqlite3) для фильтров, сортировки и поиска /find:
+# раз в TASKS_SYNC_INTERVAL секунд забираются задачи, изменённые с прошлого раза
+# (по CHANGED_DATE), раз в TASKS_SYNC_FULL_INTERVAL — полная сверка (удалённые задачи).
+# Копия старше TASKS_REPLICA_MAX_AGE секунд не используется — запросы идут в Bitrix24.
+# TASKS_SYNC_INTERVAL = 0 — отключить копию.
+TASKS_SYNC_INTERVAL = 60
+TASKS_SYNC_FULL_INTERVAL = 24 * 3600
+TASKS_REPLICA_MAX_AGE = 300
+
+# Максимальное количество строк при массовом создании задач
+BULK_TASKS_MAX_ROWS = 200
+
+# Состояние пользователей в памяти (user_state.py), проверка раз в USER_STATE_SWEEP_INTERVAL секунд:
+# - диалог без ответа дольше CONVERSATION_TIMEOUTS[имя диалога] секунд завершается,
+#   черновик удаляется (диалога нет в словаре — без таймаута);
+# - user_data тех, кто не писал боту USER_STATE_IDLE_TTL секунд, выгружается из памяти
+#   (с общим хранилищем остаётся в нём, без него сбрасываются и настройки фильтра задач);
+# - диалог, после шага которого user_data больше USER_DATA_MAX_BYTES (в pickle), прерывается
+CONVERSATION_TIMEOUTS = {
+    "login": 600,
+    "task_create": 1800,
+    "bulk_create": 1800,
+    "calendar_create": 1800,
+}
+USER_STATE_IDLE_TTL = 24 * 3600
+USER_DATA_MAX_BYTES = 256 * 1024
+USER_STATE_SWEEP_INTERVAL = 60
+
+# Вложения к задачам (attachments.py): файл или фото с подписью «#123» в личном чате.
+# Файл идёт из Telegram на Диск Bitrix24 потоком, кусками по TASK_FILE_CHUNK_BYTES,
+# не загружаясь в память целиком; одновременно — не больше TASK_FILE_MAX_CONCURRENT
+# загрузок на процесс (остальные ждут в очереди), у пользователя в очереди —
+# не больше TASK_FILE_MAX_QUEUED_PER_USER файлов. Ход загрузки — правкой сообщения
+# не чаще раза в TASK_FILE_PROGRESS_INTERVAL секунд.
+# Облачный Bot API отдаёт ботам файлы до 20 МБ; больше — только через свой
+# Bot API server (https://github.com/tdlib/telegram-bot-api, до 2000 МБ).
+TASK_FILE_MAX_BYTES = 20 * 1024 * 1024
+TASK_FILE_CHUNK_BYTES = 256 * 1024
+TASK_FILE_MAX_CONCURRENT = 2
+TASK_FILE_MAX_QUEUED_PER_USER = 5
+TASK_FILE_PROGRESS_INTERVAL = 3.0
+# Таймаут чтения/записи одного куска при загрузке (секунды), а не всей загрузки
+TASK_FILE_IO_TIMEOUT = 60
+
+# Лимит памяти (в байтах) для реестра длинных callback_data на стороне бота
+CALLBACK_REGISTRY_MAX_BYTES = 1024 * 1024
+
+# Общее хранилище состояния: "memory" (один процесс) или "redis" (несколько процессов)
+STATE_BACKEND = "memory"
+REDIS_URL = "redis://localhost:6379/0"
+
+# Шардирование апдейтов по telegram_user_id между процессами.
+# При WORKER_COUNT > 1 запускаются: один процесс `python main.py ingress`
+# и WORKER_COUNT процессов `python main.py worker <номер>`.
+WORKER_COUNT = 1
+
+# Как часто (в секундах) состояние диалогов сбрасывается в общее хранилище
+STATE_PERSISTENCE_INTERVAL = 5
+
+# HTTP-эндпоинт /metrics в формате Prometheus (0 — отключить)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# Трассировка апдейтов: доля апдейтов, выгружаемых в JSON lines (0.0 - 1.0),
+# файл выгрузки ("" — не выгружать) и порог "медленного" апдейта в секундах
+TRACE_SAMPLE_RATE = 0.01
+TRACE_EXPORT_PATH = "traces.jsonl"
+TRACE_SLOW_UPDATE_SECONDS = 3.0
+# Файл выгрузки ротируется по размеру (байт), хранятся TRACE_EXPORT_BACKUPS старых;
+# трассы пишет отдельный поток, в очереди к нему — не больше TRACE_EXPORT_QUEUE_SIZE
+# (лишние отбрасываются, а не задерживают обработку апдейтов)
+TRACE_EXPORT_MAX_BYTES = 50 * 1024 * 1024
+TRACE_EXPORT_BACKUPS = 3
+TRACE_EXPORT_QUEUE_SIZE = 10000
+
+# Ограничение частоты нажатий inline-кнопок (0 — без ограничения):
+# повторное нажатие той же кнопки в течение окна (сек) схлопывается,
+# на пользователя — THROTTLE_USER_BURST нажатий подряд и THROTTLE_USER_RATE в секунду,
+# на всех пользователей и процессы — THROTTLE_GLOBAL_RATE нажатий в секунду
+THROTTLE_DUPLICATE_WINDOW = 1.0
+THROTTLE_USER_BURST = 5
+THROTTLE_USER_RATE = 2.0
+THROTTLE_GLOBAL_RATE = 30
+
+# Сколько секунд результат чтения из Bitrix24 (списки задач, сотрудники)
+# отдаётся повторным одинаковым запросам, например при двойном нажатии (0 — не отдавать)
+BITRIX_READ_DEBOUNCE_SECONDS = 1.0
+
+# Ежедневная сводка задач (/digest): часовой пояс времени отправки,
+# время по умолчанию, сколько задач показывать в сообщении и
+# сколько сообщений в секунду отправлять (лимит Telegram — около 30)
+DIGEST_TIMEZONE = "Europe/Moscow"
+DIGEST_DEFAULT_TIME = "09:00"
+DIGEST_MAX_TASKS = 15
+DIGEST_SEND_RATE = 20
+
+# Доска команды в групповом чате (/board): закреплённое сообщение с открытыми
+# задачами участников пересчитывается раз в TEAM_BOARD_INTERVAL секунд
+# и редактируется, только если текст изменился. Кнопка «Обновить» — не чаще
+# раза в TEAM_BOARD_REFRESH_COOLDOWN секунд на чат; под каждым участником —
+# до TEAM_BOARD_TASKS_PER_MEMBER самых просроченных задач
+TEAM_BOARD_INTERVAL = 300
+TEAM_BOARD_REFRESH_COOLDOWN = 30
+TEAM_BOARD_MAX_MEMBERS = 50
+TEAM_BOARD_TASKS_PER_MEMBER = 3
+
+# Как часто (в секундах) синхронизировать справочник логинов сотрудников из Bitrix24
+EMPLOYEES_SYNC_INTERVAL = 900
@@ -0,0 +1,200 @@
+"""
+Ежедневная сводка задач ("задачи на сегодня").
+
+Пользователь включает сводку командой /digest (время и роли хранятся
+в SQLite, см. auth.py). Раз в минуту планировщик:
+1. выбирает пользователей, чьё время отправки наступило, а сводка
+   сегодня ещё не отправлена (одним запросом, по индексу send_time);
+2. группами по DIGEST_GROUP_SIZE запрашивает их просроченные и
+   сегодняшние задачи через batch (get_due_tasks_bulk);
+3. формирует тексты и отправляет их с ограничением DIGEST_SEND_RATE
+   сообщений в секунду, соблюдая RetryAfter от Telegram;
+4. отмечает отправленные сводки, чтобы не повторять их после перезапуска.
+
+При шардировании каждый процесс рассылает сводки только своим
+пользователям (shard_for), поэтому сводки не дублируются.
+Задачи пользователей разных порталов запрашиваются параллельно, каждый —
+в пуле своего портала; недоступный портал откладывает только свои сводки.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import date, datetime
+from typing import Any, Dict, List, Tuple
+from zoneinfo import ZoneInfo
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+from auth import delete_digest_settings, list_due_digests, mark_digests_sent
+from bitrix_api import get_due_tasks_bulk
+from config import DIGEST_MAX_TASKS, DIGEST_SEND_RATE, DIGEST_TIMEZONE, WORKER_COUNT
+from portals import portal_scope, run_in_portal
+from records import Task
+from shards import shard_for
+
+logger = logging.getLogger(__name__)
+
+ROLE_TITLES = {
+    "do": "Делаю",
+    "assist": "Помогаю",
+    "originator": "Поручил",
+    "observer": "Наблюдаю",
+}
+
+# Сколько пользователей обрабатывать за один проход (запрос задач + отправка)
+DIGEST_GROUP_SIZE = 100
+# Через сколько секунд повторить сводку, которую не удалось собрать или отправить
+DIGEST_RETRY_SECONDS = 600
+
+# telegram_user_id -> время (monotonic), раньше которого не повторять
+_retry_not_before: Dict[int, float] = {}
+
+
+def digest_timezone() -> ZoneInfo:
+    return ZoneInfo(DIGEST_TIMEZONE)
+
+
+# ======== Текст сводки ========
+
+def _format_deadline(deadline: str, today: date) -> str:
+    # '2030-01-05T18:00:00+03:00' -> '18:00' для сегодняшних, '05.01' для прочих
+    date_part, _, time_part = deadline.partition("T")
+    if date_part == today.isoformat():
+        return time_part[:5] or date_part
+    try:
+        return datetime.strptime(date_part, "%Y-%m-%d").strftime("%d.%m")
+    except ValueError:
+        return date_part
+
+
+def render_digest(tasks: List[Task], today: date, max_tasks: int = DIGEST_MAX_TASKS) -> str:
+    """Текст сводки: сначала просроченные задачи, затем сегодняшние."""
+    header = f"Задачи на {today.strftime('%d.%m.%Y')}"
+    if not tasks:
+        return header + "\n\nЗадач со сроком на сегодня нет."
+
+    today_iso = today.isoformat()
+    overdue: List[str] = []
+    due_today: List[str] = []
+    for t in tasks[:max_tasks]:
+        title = t.title or "(без названия)"
+        deadline = t.deadline or ""
+        line = f"#{t.id} - {title} (до {_format_deadline(deadline, today)})"
+        (overdue if deadline[:10] < today_iso else due_today).append(line)
+
+    lines = [header]
+    if overdue:
+        lines += ["", "Просрочено:"] + overdue
+    if due_today:
+        lines += ["", "Сегодня:"] + due_today
+    if len(tasks) > max_tasks:
+        lines += ["", f"...и ещё {len(tasks) - max_tasks}. Все задачи — в разделе «Задачи»."]
+    return "\n".join(lines)
+
+
+# ======== Отправка ========
+
+async def send_rate_limited(bot, messages: List[Tuple[int, str]], rate: float = DIGEST_SEND_RATE):
+    """
+    Отправка сообщений не чаще rate в секунду.
+    Возвращает (доставленные chat_id, chat_id заблокировавших бота, chat_id с ошибкой).
+    """
+    loop = asyncio.get_running_loop()
+    interval = 1.0 / rate if rate else 0.0
+    next_at = loop.time()
+    sent: List[int] = []
+    blocked: List[int] = []
+    failed: List[int] = []
+    for chat_id, text in messages:
+        delay = next_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        next_at = max(next_at, loop.time()) + interval
+        for attempt in range(2):
+            try:
+                await bot.send_message(chat_id, text)
+                sent.append(chat_id)
+            except RetryAfter as exc:
+                if attempt:
+                    failed.append(chat_id)
+                    break
+                # Telegram просит подождать — сдвигаем и весь остальной поток
+                await asyncio.sleep(exc.retry_after)
+                next_at = loop.time() + interval
+                continue
+            except Forbidden:
+                blocked.append(chat_id)
+            except TelegramError:
+                logger.warning("Не удалось отправить сводку в чат %s", chat_id, exc_info=True)
+                failed.append(chat_id)
+            break
+    return sent, blocked, failed
+
+
+# ======== Планировщик ========
+
+async def _due_tasks_in_portal(portal: str, users, deadline_before: str) -> Dict[Any, List[Task]]:
+    try:
+        with portal_scope(portal):
+            return await run_in_portal(get_due_tasks_bulk, users, deadline_before)
+    except Exception:
+        logger.warning("Не удалось получить задачи для сводок с портала %s", portal, exc_info=True)
+        return {}
+
+
+async def _due_tasks(group, deadline_before: str) -> Dict[Any, List[Task]]:
+    """Задачи для группы строк list_due_digests: по запросу на портал, параллельно."""
+    by_portal: Dict[str, List[Tuple[int, int, List[str]]]] = {}
+    for tg_id, bitrix_user_id, _, roles, _, portal in group:
+        by_portal.setdefault(portal, []).append((tg_id, bitrix_user_id, roles))
+    due: Dict[Any, List[Task]] = {}
+    for part in await asyncio.gather(
+        *(_due_tasks_in_portal(portal, users, deadline_before) for portal, users in by_portal.items())
+    ):
+        due.update(part)
+    return due
+
+
+async def send_due_digests(bot, now: datetime, shard: int = 0, worker_count: int = WORKER_COUNT) -> int:
+    """Один проход планировщика. Возвращает число отправленных сводок."""
+    today = now.date()
+    rows = await asyncio.to_thread(list_due_digests, now.strftime("%H:%M"), today.isoformat())
+    monotonic = time.monotonic()
+    rows = [
+        row for row in rows
+        if shard_for(row[0], worker_count) == shard and _retry_not_before.get(row[0], 0) <= monotonic
+    ]
+    total_sent = 0
+    for i in range(0, len(rows), DIGEST_GROUP_SIZE):
+        group = rows[i:i + DIGEST_GROUP_SIZE]
+        due = await _due_tasks(group, f"{today.isoformat()}T23:59:59")
+
+        messages = [(tg_id, render_digest(due[tg_id], today)) for tg_id, *_ in group if tg_id in due]
+        sent, blocked, failed = await send_rate_limited(bot, messages)
+
+        await asyncio.to_thread(mark_digests_sent, sent, today.isoformat())
+        for tg_id in blocked:
+            await asyncio.to_thread(delete_digest_settings, tg_id)
+        retry_at = time.monotonic() + DIGEST_RETRY_SECONDS
+        for tg_id in failed + [tg_id for tg_id, *_ in group if tg_id not in due]:
+            _retry_not_before[tg_id] = retry_at
+        for tg_id in sent:
+            _retry_not_before.pop(tg_id, None)
+        total_sent += len(sent)
+
+    if rows:
+        logger.info("Сводки: отправлено %s из %s", total_sent, len(rows))
+    return total_sent
+
+
+async def run_digest_scheduler(application, shard: int = 0, worker_count: int = WORKER_COUNT) -> None:
+    """Бесконечный цикл: проход планировщика в начале каждой минуты."""
+    tz = digest_timezone()
+    while True:
+        try:
+            await send_due_digests(application.bot, datetime.now(tz), shard, worker_count)
+        except Exception:
+            logger.exception("Ошибка при рассылке сводок")
+        now = datetime.now(tz)
+        await asyncio.sleep(60 - now.second - now.microsecond / 1_000_000)
@@ -0,0 +1,53 @@
+"""
+Синхронизация справочника логинов сотрудников из Bitrix24.
+
+Пользователи портала (user.get: LOGIN, EMAIL, ACTIVE) сохраняются в таблицу
+employees (auth.py). Первая синхронизация загружает всех, следующие —
+только изменённых с наибольшего сохранённого TIMESTAMP_X.
+После каждой синхронизации процессы бота перечитывают словарь логинов
+(auth.find_employee), перезапуск не нужен.
+
+Синхронизацию выполняет один процесс (шард 0) раз в EMPLOYEES_SYNC_INTERVAL
+секунд; вручную: `python main.py sync-employees`. Порталы синхронизируются
+независимо: ошибка или медленный ответ одного не задерживает остальные.
+"""
+
+import asyncio
+import logging
+from auth import employees_sync_cursor, upsert_employees
+from bitrix_api import get_users_changed_since
+from config import EMPLOYEES_SYNC_INTERVAL
+from portals import portal_names, portal_scope, run_in_portal
+
+logger = logging.getLogger(__name__)
+
+
+def sync_portal_employees(portal: str, full: bool = False) -> int:
+    """Одна синхронизация портала. Возвращает число полученных записей."""
+    with portal_scope(portal):
+        since = None if full else employees_sync_cursor(portal)
+        users = get_users_changed_since(since)
+    # Записи DirectoryUser — уже строки таблицы employees
+    upsert_employees(portal, users)
+    return len(users)
+
+
+def sync_employees(full: bool = False) -> int:
+    """Синхронизация всех порталов по очереди (для ручного запуска)."""
+    return sum(sync_portal_employees(portal, full) for portal in portal_names())
+
+
+async def _sync_in_portal(portal: str) -> None:
+    try:
+        with portal_scope(portal):
+            count = await run_in_portal(sync_portal_employees, portal)
+        logger.info("Справочник логинов портала %s синхронизирован, записей: %s", portal, count)
+    except Exception:
+        logger.exception("Ошибка синхронизации справочника логинов портала %s", portal)
+
+
+async def run_employee_sync(interval: float = EMPLOYEES_SYNC_INTERVAL) -> None:
+    """Бесконечный цикл синхронизации; первая — сразу при запуске."""
+    while True:
+        await asyncio.gather(*(_sync_in_portal(portal) for portal in portal_names()))
+        await asyncio.sleep(interval)
@@ -0,0 +1,84 @@
+"""
+Вложения к задачам: файл или фото с подписью «#номер задачи» в личном чате.
+
+Обработчик только проверяет подпись и размер и отвечает сообщением о ходе
+загрузки; сама загрузка — фоновой задачей (attachments.upload_attachment).
+"""
+
+import re
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from attachments import cancel_upload, reserve_upload, upload_attachment
+from config import TASK_FILE_MAX_BYTES, TASK_FILE_MAX_QUEUED_PER_USER
+from handlers.common import NOT_AUTHORIZED_TEXT, get_current_user
+from metrics import timed_handler
+
+USAGE_TEXT = (
+    "Чтобы прикрепить файл к задаче, отправьте его с подписью — номером задачи, например #123. "
+    "В альбоме подпишите каждый файл."
+)
+
+
+def _task_id(caption: Optional[str]) -> Optional[int]:
+    caption = caption or ""
+    match = re.search(r"#(\d+)", caption) or re.fullmatch(r"\s*(\d+)\s*", caption)
+    return int(match.group(1)) if match else None
+
+
+@timed_handler
+async def attach_file_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.message
+    bound = get_current_user(update, context)
+    if not bound:
+        await message.reply_text(NOT_AUTHORIZED_TEXT)
+        return
+
+    task_id = _task_id(message.caption)
+    if task_id is None:
+        await message.reply_text(USAGE_TEXT)
+        return
+
+    if message.document is not None:
+        attachment = message.document
+        file_name = attachment.file_name or f"file_{message.message_id}"
+    else:
+        # Самый большой из размеров фото
+        attachment = message.photo[-1]
+        file_name = f"photo_{message.message_id}.jpg"
+    if attachment.file_size and attachment.file_size > TASK_FILE_MAX_BYTES:
+        await message.reply_text(
+            f"Файл больше {TASK_FILE_MAX_BYTES // (1024 * 1024)} МБ — Telegram не отдаёт ботам такие файлы."
+        )
+        return
+
+    telegram_user_id = update.effective_user.id
+    if not reserve_upload(telegram_user_id):
+        await message.reply_text(
+            f"У вас уже {TASK_FILE_MAX_QUEUED_PER_USER} файлов в очереди. Дождитесь их загрузки."
+        )
+        return
+
+    try:
+        status = await message.reply_text(f"📎 {file_name} → задача #{task_id}\nОжидает загрузки…")
+    except BaseException:
+        # Загрузка не начнётся (в том числе при отмене обработчика) — место в очереди пользователя освобождается
+        cancel_upload(telegram_user_id)
+        raise
+    # Фоновая задача получает копию контекста: портал и токены пользователя
+    context.application.create_task(
+        upload_attachment(
+            context.bot,
+            message.chat_id,
+            status.message_id,
+            telegram_user_id,
+            bound["bitrix_user_id"],
+            task_id,
+            attachment.file_id,
+            file_name,
+            attachment.file_size,
+        ),
+        update=update,
+    )
@@ -1,9 +1,32 @@
+import logging
 from enum import IntEnum
 
-from telegram import Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes, ConversationHandler
 
-from auth import validate_credentials, bind_telegram_user, unbind_telegram_user
+from auth import (
+    bind_telegram_user,
+    clear_login_attempts,
+    issue_login_code,
+    login_attempts_left,
+    record_login_attempt,
+    run_kdf,
+    unbind_telegram_user,
+    verify_login_code,
+    verify_password,
+)
+from bitrix_api import send_notification
+from config import LOGIN_ATTEMPT_WINDOW, LOGIN_CODE_TTL, LOGIN_METHOD
+from handlers.common import reset_current_user
+from metrics import timed_handler
+from oauth import authorize_url, forget_token, oauth_enabled
+from portals import portal_names, portal_scope, run_in_portal
+
+logger = logging.getLogger(__name__)
+
+TOO_MANY_ATTEMPTS_TEXT = (
+    f"Слишком много попыток входа. Попробуйте снова через {LOGIN_ATTEMPT_WINDOW // 60} мин."
+)
 
 
 class AuthStates(IntEnum):
@@ -11,48 +34,144 @@ class AuthStates(IntEnum):
     PASSWORD = 2
 
 
+def _end_login(context) -> int:
+    context.user_data.pop("login_attempt", None)
+    context.user_data.pop("login_in_progress", None)
+    return ConversationHandler.END
+
+
+@timed_handler
 async def login_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    await update.message.reply_text("Введите ваш логин:")
+    if oauth_enabled():
+        await _send_authorize_links(update)
+        return ConversationHandler.END
+    if login_attempts_left(update.effective_user.id) <= 0:
+        await update.message.reply_text(TOO_MANY_ATTEMPTS_TEXT)
+        return ConversationHandler.END
+    # Флаг пропускает шаги диалога через auth_middleware
+    context.user_data["login_in_progress"] = True
+    prompt = "Введите ваш логин или e-mail в Битрикс24:"
+    if len(portal_names()) > 1:
+        prompt += (
+            "\nЕсли учётная запись есть на нескольких порталах, укажите портал: "
+            + ", ".join(f"{name}/логин" for name in portal_names())
+        )
+    await update.message.reply_text(prompt)
     return AuthStates.LOGIN
 
 
+async def _send_authorize_links(update: Update) -> None:
+    # Вход через приложение Bitrix24: пароль и коды не нужны, по возврату
+    # с портала бот сам пришлёт сообщение об успешном входе
+    names = portal_names()
+    buttons = [
+        [
+            InlineKeyboardButton(
+                f"Войти: {name}" if len(names) > 1 else "Войти",
+                url=authorize_url(update.effective_user.id, name),
+            )
+        ]
+        for name in names
+    ]
+    await update.message.reply_text(
+        "Войдите через Битрикс24 — ссылка действует 10 минут:",
+        reply_markup=InlineKeyboardMarkup(buttons),
+    )
+
+
+@timed_handler
 async def login_login(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    login = update.message.text.strip()
+    telegram_user_id = update.effective_user.id
+    login = update.message.text.strip().lower()
+    if login_attempts_left(telegram_user_id, login) <= 0:
+        await update.message.reply_text(TOO_MANY_ATTEMPTS_TEXT)
+        return _end_login(context)
     context.user_data["login_attempt"] = login
-    await update.message.reply_text("Введите общий пароль:")
+
+    if LOGIN_METHOD != "code":
+        await update.message.reply_text("Введите ваш пароль:")
+        return AuthStates.PASSWORD
+
+    # Запрос кода тоже считается попыткой: иначе можно заваливать сотрудника уведомлениями
+    record_login_attempt(telegram_user_id, login)
+    issued = await run_kdf(issue_login_code, telegram_user_id, login)
+    if issued:
+        portal, bitrix_user_id, code = issued
+        try:
+            with portal_scope(portal):
+                await run_in_portal(
+                    send_notification,
+                    bitrix_user_id,
+                    f"Код для входа в Telegram-бота: {code}. Никому его не сообщайте.",
+                )
+        except Exception:
+            logger.exception("Не удалось отправить код входа пользователю %s", bitrix_user_id)
+            await update.message.reply_text("Не удалось отправить код. Попробуйте позже.")
+            return _end_login(context)
+    # Одинаковый ответ для существующих и несуществующих логинов
+    await update.message.reply_text(
+        f"Если логин верный, код отправлен уведомлением в Битрикс24 "
+        f"(действует {LOGIN_CODE_TTL // 60} мин). Введите код:"
+    )
     return AuthStates.PASSWORD
 
 
+@timed_handler
 async def login_password(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    password = update.message.text.strip()
+    telegram_user_id = update.effective_user.id
+    secret = update.message.text.strip()
     login = context.user_data.get("login_attempt")
+    if not login:
+        return _end_login(context)
+
+    # Лимит проверяется до дорогого хеширования
+    if login_attempts_left(telegram_user_id, login) <= 0:
+        await update.message.reply_text(TOO_MANY_ATTEMPTS_TEXT)
+        return _end_login(context)
+
+    if LOGIN_METHOD == "code":
+        user_info = await run_kdf(verify_login_code, telegram_user_id, login, secret)
+    else:
+        user_info = await run_kdf(verify_password, login, secret)
 
-    user_info = validate_credentials(login, password)
     if not user_info:
+        record_login_attempt(telegram_user_id, login)
+        if login_attempts_left(telegram_user_id, login) <= 0:
+            await update.message.reply_text(TOO_MANY_ATTEMPTS_TEXT)
+            return _end_login(context)
+        what = "код" if LOGIN_METHOD == "code" else "логин или пароль"
         await update.message.reply_text(
-            "Неверный логин или пароль. Попробуйте ещё раз с /login."
+            f"Неверный {what}. Попробуйте ещё раз или отмените вход командой /cancel."
         )
-        return ConversationHandler.END
+        return AuthStates.PASSWORD
 
+    _end_login(context)
+    clear_login_attempts(telegram_user_id)
     bind_telegram_user(
-        telegram_user_id=update.effective_user.id,
+        telegram_user_id=telegram_user_id,
         login=user_info["login"],
         bitrix_user_id=user_info["bitrix_user_id"],
         name=user_info["name"],
+        portal=user_info["portal"],
     )
+    reset_current_user(context)
     await update.message.reply_text(
         f"Успешный вход. Вы авторизованы как: {user_info['name']}."
     )
     return ConversationHandler.END
 
 
+@timed_handler
 async def login_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("Авторизация отменена.")
-    return ConversationHandler.END
+    return _end_login(context)
 
 
+@timed_handler
 async def logout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     unbind_telegram_user(update.effective_user.id)
+    forget_token(update.effective_user.id)
+    reset_current_user(context)
     await update.message.reply_text(
         "Вы вышли из аккаунта. Для повторного входа используйте /login."
     )
@@ -0,0 +1,158 @@
+"""
+Команда /board — доска команды в групповом чате.
+
+    /board                      — создать доску (автор — первый участник) или показать состав
+    /board join | leave         — добавить себя в команду или выйти
+    /board remove логин […]     — убрать сотрудников (владелец доски)
+    /board off                  — удалить доску (владелец доски)
+
+Добавить в команду можно только себя: задачи участника видны всему чату,
+поэтому на доску попадают лишь те, кто согласился сам.
+
+Текст доски собирает и обновляет team_board.py; кнопка «Обновить» под ней —
+не чаще раза в TEAM_BOARD_REFRESH_COOLDOWN секунд на чат.
+"""
+
+import time
+from typing import Dict, List, Tuple
+
+from telegram import Chat, Update
+from telegram.error import TelegramError
+from telegram.ext import ContextTypes
+
+from auth import find_employee
+from config import TEAM_BOARD_MAX_MEMBERS, TEAM_BOARD_REFRESH_COOLDOWN
+from handlers.common import get_current_user
+from metrics import timed_handler
+from team_board import refresh_board
+from team_board_store import (
+    add_team_board_member,
+    create_team_board,
+    delete_team_board,
+    get_team_board,
+    remove_team_board_members,
+)
+
+USAGE_TEXT = (
+    "Доска команды — закреплённое сообщение с открытыми и просроченными задачами участников.\n\n"
+    "/board — создать доску в этом чате\n"
+    "/board join — добавить себя, /board leave — выйти\n"
+    "/board remove логин … — убрать сотрудников\n"
+    "/board off — удалить доску\n\n"
+    "Задачи участника видны всему чату, поэтому каждый добавляет себя сам. "
+    "remove и off доступны тому, кто создал доску."
+)
+
+# chat_id -> время (monotonic) последнего обновления по кнопке
+_refreshed_at: Dict[int, float] = {}
+
+
+def _members_text(board: Dict) -> str:
+    names = ", ".join(name for _, name in board["members"]) or "нет"
+    return f"Участники ({len(board['members'])}): {names}."
+
+
+def _resolve(logins: List[str], portal: str) -> Tuple[List[Tuple[int, str]], List[str]]:
+    """Сотрудники портала доски по логинам: (найденные (id, имя), не найденные логины)."""
+    found: List[Tuple[int, str]] = []
+    missing: List[str] = []
+    for login in logins:
+        employee = find_employee(f"{portal}/{login.lower()}")
+        if employee is None:
+            missing.append(login)
+        else:
+            found.append((employee["bitrix_user_id"], employee["name"]))
+    return found, missing
+
+
+@timed_handler
+async def board_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Авторизацию проверяет auth_middleware: команда не входит в PUBLIC_COMMANDS
+    chat = update.effective_chat
+    if chat.type not in (Chat.GROUP, Chat.SUPERGROUP):
+        await update.message.reply_text("Доска команды работает в групповых чатах.\n\n" + USAGE_TEXT)
+        return
+
+    bound = get_current_user(update, context)
+    telegram_user_id = update.effective_user.id
+    args = context.args or []
+    command = args[0].lower() if args else ""
+    board = get_team_board(chat.id)
+
+    if not command:
+        if board is not None:
+            await update.message.reply_text(_members_text(board) + "\n\n" + USAGE_TEXT)
+            return
+        create_team_board(chat.id, bound["portal"], telegram_user_id)
+        add_team_board_member(chat.id, telegram_user_id, bound["bitrix_user_id"], bound["name"])
+        await refresh_board(context.bot, chat.id)
+        return
+
+    if board is None:
+        await update.message.reply_text("В этом чате нет доски команды. Создайте её командой /board.")
+        return
+    if bound["portal"] != board["portal"]:
+        await update.message.reply_text("Доска этого чата относится к другому порталу Bitrix24.")
+        return
+
+    if command in ("join", "leave"):
+        if command == "join":
+            if len(board["members"]) >= TEAM_BOARD_MAX_MEMBERS:
+                await update.message.reply_text(f"В команде уже {TEAM_BOARD_MAX_MEMBERS} участников.")
+                return
+            add_team_board_member(chat.id, telegram_user_id, bound["bitrix_user_id"], bound["name"])
+        else:
+            remove_team_board_members(chat.id, [bound["bitrix_user_id"]])
+        await refresh_board(context.bot, chat.id)
+        return
+
+    if command == "add":
+        await update.message.reply_text(
+            "Задачи участника видны всему чату, поэтому добавить можно только себя: "
+            "попросите коллег выполнить /board join."
+        )
+        return
+    if command not in ("remove", "off"):
+        await update.message.reply_text(USAGE_TEXT)
+        return
+    if board["owner"] != telegram_user_id:
+        await update.message.reply_text("Это может сделать только тот, кто создал доску.")
+        return
+
+    if command == "off":
+        delete_team_board(chat.id)
+        if board["message_id"] is not None:
+            try:
+                await context.bot.unpin_chat_message(chat.id, board["message_id"])
+            except TelegramError:
+                pass
+        await update.message.reply_text("Доска команды удалена.")
+        return
+
+    logins = [login for arg in args[1:] for login in arg.split(",") if login]
+    if not logins:
+        await update.message.reply_text(f"Укажите логины: /board {command} ivanov petrova")
+        return
+    found, missing = _resolve(logins, board["portal"])
+    remove_team_board_members(chat.id, [member for member, _ in found])
+    if missing:
+        await update.message.reply_text("Не найдены в справочнике: " + ", ".join(missing))
+    if found:
+        await refresh_board(context.bot, chat.id)
+
+
+@timed_handler
+async def board_refresh_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработка callback board.refresh — пересчёт доски сейчас."""
+    query = update.callback_query
+    chat_id = query.message.chat_id
+    now = time.monotonic()
+    if now - _refreshed_at.get(chat_id, float("-inf")) < TEAM_BOARD_REFRESH_COOLDOWN:
+        await query.answer("Доска только что обновлена.")
+        return
+    _refreshed_at[chat_id] = now
+    changed = await refresh_board(context.bot, chat_id)
+    if changed is None:
+        await query.answer("Доска команды в этом чате удалена.")
+    else:
+        await query.answer("Доска обновлена." if changed else "Изменений нет.")
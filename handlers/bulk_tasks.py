@@ -0,0 +1,326 @@
+"""
+Массовое создание задач.
+
+Пользователь присылает многострочное сообщение или CSV-файл, где каждая строка:
+    Название; Ответственный; Срок
+
+- Ответственный: ID сотрудника в Bitrix24 или его ФИО (пусто — сам пользователь).
+- Срок: dd.mm.yyyy или пусто/'-' (без срока).
+
+Все строки разбираются за один проход по закешированному справочнику сотрудников,
+после подтверждения задачи создаются пачками через batch.
+"""
+
+import csv
+import io
+from datetime import datetime, time
+from enum import IntEnum
+from typing import List, Dict, Optional, Tuple
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes, ConversationHandler
+
+from bitrix_api import get_employees_cached, create_tasks_bulk, forget_my_tasks
+from callbacks import pack, unpack
+from config import BULK_TASKS_MAX_ROWS
+from handlers.common import NOT_AUTHORIZED_TEXT, get_current_user, parse_date_ddmmyyyy
+from metrics import timed_handler
+from portals import run_in_portal
+from records import Employee
+from rendering import TITLE_MAX, split_messages
+from tasks_sync import remember_created_tasks
+
+
+class BulkTaskStates(IntEnum):
+    INPUT = 1
+    CONFIRM = 2
+
+
+# Сколько строк показывать в предпросмотре и отчёте; длинные списки всё равно
+# делятся на несколько сообщений (split_messages)
+PREVIEW_ROWS = 30
+CSV_MAX_BYTES = 512 * 1024
+
+_HEADER_WORDS = {"title", "название", "задача"}
+
+
+def _split_rows(text: str, from_file: bool = False) -> List[List[str]]:
+    """
+    Разбивает текст на строки и колонки.
+    Разделитель — ';' или табуляция; запятая только для CSV-файлов,
+    чтобы не резать названия задач в обычном сообщении.
+    """
+    sample = text[:4096]
+    if ";" in sample:
+        delimiter = ";"
+    elif "\t" in sample:
+        delimiter = "\t"
+    elif from_file:
+        delimiter = ","
+    else:
+        delimiter = ";"
+    rows = []
+    for row in csv.reader(io.StringIO(text), delimiter=delimiter):
+        cells = [c.strip() for c in row]
+        if any(cells):
+            rows.append(cells)
+    if rows and rows[0][0].lower() in _HEADER_WORDS:
+        rows = rows[1:]
+    return rows
+
+
+def _build_employee_index(employees: List[Employee]) -> Dict[str, Employee]:
+    """
+    Индекс сотрудников для поиска ответственного по одной строке:
+    ID, "Имя Фамилия", "Фамилия Имя" и фамилия (если она уникальна).
+    """
+    index: Dict[str, Employee] = {}
+    last_names: Dict[str, List[Employee]] = {}
+    for emp in employees:
+        index[str(emp.id)] = emp
+        name = emp.name.strip().lower()
+        last = emp.last_name.strip().lower()
+        full = emp.full_name.strip().lower()
+        if full:
+            index.setdefault(full, emp)
+        if name and last:
+            index.setdefault(f"{last} {name}", emp)
+        if last:
+            last_names.setdefault(last, []).append(emp)
+    for last, matches in last_names.items():
+        if len(matches) == 1:
+            index.setdefault(last, matches[0])
+    return index
+
+
+def parse_bulk_rows(
+    text: str, employees: List[Employee], default_responsible: Employee, from_file: bool = False
+) -> Tuple[List[Dict], List[str]]:
+    """
+    Разбор строк массового создания.
+    Возвращает (готовые к созданию задачи, список ошибок по строкам).
+    """
+    index = _build_employee_index(employees)
+    items: List[Dict] = []
+    errors: List[str] = []
+
+    for line_no, cells in enumerate(_split_rows(text, from_file), start=1):
+        title = cells[0] if cells else ""
+        responsible = cells[1] if len(cells) > 1 else ""
+        deadline = cells[2] if len(cells) > 2 else ""
+
+        if not title:
+            errors.append(f"Строка {line_no}: не указано название.")
+            continue
+
+        if responsible:
+            emp = index.get(" ".join(responsible.lower().split()))
+            if not emp:
+                errors.append(f"Строка {line_no}: сотрудник «{responsible}» не найден.")
+                continue
+        else:
+            emp = default_responsible
+
+        deadline_iso: Optional[str] = None
+        if deadline and deadline != "-":
+            dt = parse_date_ddmmyyyy(deadline)
+            if not dt:
+                errors.append(f"Строка {line_no}: дата «{deadline}» не в формате dd.mm.yyyy.")
+                continue
+            deadline_iso = datetime.combine(dt.date(), time(hour=18, minute=0)).isoformat()
+
+        items.append(
+            {
+                "line": line_no,
+                "title": title,
+                "description": "",
+                "deadline_iso": deadline_iso,
+                "responsible_id": emp.id,
+                "responsible_name": emp.full_name,
+            }
+        )
+
+    return items, errors
+
+
+def _clip(text: str) -> str:
+    # Как в списках задач (rendering.TITLE_MAX): одна строка не займёт всё сообщение
+    return text if len(text) <= TITLE_MAX else text[:TITLE_MAX - 1] + "…"
+
+
+def _preview_messages(items: List[Dict], errors: List[str]) -> List[str]:
+    lines = []
+    for item in items[:PREVIEW_ROWS]:
+        deadline = item["deadline_iso"].split("T")[0] if item["deadline_iso"] else "-"
+        lines.append(f"{item['line']}. {_clip(item['title'])} — {item['responsible_name']} (до {deadline})")
+    if len(items) > PREVIEW_ROWS:
+        lines.append(f"... и ещё {len(items) - PREVIEW_ROWS}")
+    if errors:
+        lines.append("")
+        lines.append(f"Пропущено строк с ошибками: {len(errors)}")
+        lines.extend(_clip(error) for error in errors[:PREVIEW_ROWS])
+        if len(errors) > PREVIEW_ROWS:
+            lines.append(f"... и ещё {len(errors) - PREVIEW_ROWS}")
+    lines.append("")
+    return split_messages(f"Будет создано задач: {len(items)}", lines, footer="Создать задачи?")
+
+
+# ======== Диалог ========
+
+@timed_handler
+async def bulk_create_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Точка входа (callback tasks.bulk)."""
+    query = update.callback_query
+    await query.answer()
+
+    bound = get_current_user(update, context)
+    if not bound:
+        await query.edit_message_text(
+            NOT_AUTHORIZED_TEXT
+        )
+        return ConversationHandler.END
+
+    await query.edit_message_text(
+        "Массовое создание задач.\n"
+        "Отправьте сообщение или CSV-файл, каждая строка в формате:\n"
+        "Название; Ответственный; Срок\n\n"
+        "Ответственный — ФИО или ID (пусто — вы), срок — dd.mm.yyyy (пусто — без срока).\n"
+        "Для отмены используйте /cancel."
+    )
+    return BulkTaskStates.INPUT
+
+
+@timed_handler
+async def bulk_create_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Приём строк из текста сообщения или CSV-вложения."""
+    bound = get_current_user(update, context)
+    if not bound:
+        await update.message.reply_text(
+            NOT_AUTHORIZED_TEXT
+        )
+        return ConversationHandler.END
+
+    document = update.message.document
+    if document:
+        if document.file_size and document.file_size > CSV_MAX_BYTES:
+            await update.message.reply_text("Файл слишком большой. Отправьте файл поменьше или разбейте его.")
+            return BulkTaskStates.INPUT
+        tg_file = await document.get_file()
+        raw = bytes(await tg_file.download_as_bytearray())
+        text = raw.decode("utf-8-sig", errors="replace")
+    else:
+        text = update.message.text or ""
+
+    employees = await run_in_portal(get_employees_cached)
+    default_responsible = Employee(bound["bitrix_user_id"], "", "", bound["name"])
+    items, errors = parse_bulk_rows(text, employees, default_responsible, from_file=bool(document))
+
+    if len(items) > BULK_TASKS_MAX_ROWS:
+        await update.message.reply_text(
+            f"Слишком много строк ({len(items)}). Максимум за один раз: {BULK_TASKS_MAX_ROWS}."
+        )
+        return BulkTaskStates.INPUT
+
+    if not items:
+        lines = ["Не найдено ни одной корректной строки."]
+        lines.extend(errors[:PREVIEW_ROWS])
+        lines.append("Отправьте строки ещё раз или /cancel.")
+        await update.message.reply_text("\n".join(lines))
+        return BulkTaskStates.INPUT
+
+    context.user_data["bulk_tasks"] = items
+    buttons = [
+        [
+            InlineKeyboardButton("Создать", callback_data=pack("bulk_create.confirm")),
+            InlineKeyboardButton("Отмена", callback_data=pack("bulk_create.cancel")),
+        ]
+    ]
+    # Кнопки — под последним сообщением предпросмотра
+    *first, last = _preview_messages(items, errors)
+    for text in first:
+        await update.message.reply_text(text)
+    await update.message.reply_text(last, reply_markup=InlineKeyboardMarkup(buttons))
+    return BulkTaskStates.CONFIRM
+
+
+@timed_handler
+async def bulk_create_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    name, _ = unpack(query.data)
+
+    if name == "bulk_create.cancel":
+        context.user_data.pop("bulk_tasks", None)
+        await query.edit_message_text("Массовое создание задач отменено.")
+        return ConversationHandler.END
+
+    if name == "bulk_create.confirm":
+        bound = get_current_user(update, context)
+        if not bound:
+            await query.edit_message_text(
+                NOT_AUTHORIZED_TEXT
+            )
+            return ConversationHandler.END
+
+        items = context.user_data.pop("bulk_tasks", [])
+        await query.edit_message_text(f"Создаю задачи: {len(items)}...")
+        try:
+            report = await run_in_portal(create_tasks_bulk, items, created_by=bound["bitrix_user_id"])
+        except Exception as e:
+            await query.edit_message_text(
+                f"Ошибка при создании задач: {e}"
+            )
+            return ConversationHandler.END
+
+        # И исполнители строк с неизвестным исходом: задача могла появиться
+        forget_my_tasks(bound["bitrix_user_id"], *(item["responsible_id"] for item in items))
+        created = [r for r in report if r["task_id"]]
+        remember_created_tasks(
+            bound["portal"],
+            [
+                (
+                    r["task_id"],
+                    items[r["index"]]["title"],
+                    items[r["index"]].get("deadline_iso"),
+                    items[r["index"]]["responsible_id"],
+                    bound["bitrix_user_id"],
+                )
+                for r in created
+            ],
+        )
+        failed = [r for r in report if not r["task_id"] and not r["unknown"]]
+        unknown = [r for r in report if not r["task_id"] and r["unknown"]]
+        lines = []
+        for r in created[:PREVIEW_ROWS]:
+            item = items[r["index"]]
+            lines.append(f"#{r['task_id']} - {_clip(item['title'])}")
+        if len(created) > PREVIEW_ROWS:
+            lines.append(f"... и ещё {len(created) - PREVIEW_ROWS}")
+        for title, rows in (
+            ("Ошибки:", failed),
+            ("Исход неизвестен — проверьте эти задачи в Bitrix24, прежде чем создавать их снова:", unknown),
+        ):
+            if not rows:
+                continue
+            lines.append("")
+            lines.append(title)
+            for r in rows[:PREVIEW_ROWS]:
+                item = items[r["index"]]
+                lines.append(_clip(f"Строка {item['line']} ({item['title']}): {r['error']}"))
+            if len(rows) > PREVIEW_ROWS:
+                lines.append(f"... и ещё {len(rows) - PREVIEW_ROWS}")
+        # Задачи уже созданы: отчёт не должен упасть на лимите длины сообщения
+        first, *rest = split_messages(f"Создано задач: {len(created)} из {len(items)}.", lines)
+        await query.edit_message_text(first)
+        for text in rest:
+            await context.bot.send_message(update.effective_chat.id, text)
+        return ConversationHandler.END
+
+    return ConversationHandler.END
+
+
+@timed_handler
+async def bulk_create_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    context.user_data.pop("bulk_tasks", None)
+    await update.message.reply_text("Массовое создание задач отменено.")
+    return ConversationHandler.END
@@ -1,12 +1,27 @@
+from datetime import date, timedelta
+import logging
 from enum import IntEnum
-from typing import List, Dict, Optional, Set
+from typing import List, Dict, Sequence, Set
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 
-from auth import get_bound_user
-from bitrix_api import get_calendar_events, get_employees, create_calendar_event
-from keyboards import employees_keyboard
+from agenda import Occurrence, conflicts, events_on, forget_agenda, get_agenda, local_now
+from bitrix_api import (
+    get_employees_cached,
+    get_employees_snapshot,
+    employees_directory_version,
+    create_calendar_event,
+)
+from callbacks import pack, unpack
+from handlers.common import NOT_AUTHORIZED_TEXT, get_current_user, parse_date_ddmmyyyy
+from keyboards import calendar_agenda_inline, employees_keyboard
+from metrics import timed_handler
+from portals import run_in_portal
+from records import Employee
+
+
+logger = logging.getLogger(__name__)
 
 
 class CalendarCreateStates(IntEnum):
@@ -18,55 +33,90 @@ class CalendarCreateStates(IntEnum):
 
 
 EMPLOYEES_PAGE_SIZE = 10
+UPCOMING_EVENTS_LIMIT = 10
 
-
-def _ensure_authorized_from_update_or_query(update_or_query) -> Optional[Dict]:
-    if hasattr(update_or_query, "effective_user"):
-        user = update_or_query.effective_user
-    else:
-        user = update_or_query.from_user
-    return get_bound_user(user.id)
+_WEEKDAY_NAMES = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+CONFLICT_MARK = "⚠️ "
 
 
 # ======== Просмотр мероприятий ========
 
+def _occurrence_time(occurrence: Occurrence) -> str:
+    if occurrence.all_day:
+        last_day = occurrence.end - timedelta(days=1)
+        return "весь день" if last_day <= occurrence.start else f"по {last_day:%d.%m}"
+    if occurrence.end - occurrence.start > timedelta(days=1):
+        return f"{occurrence.start:%H:%M} – {occurrence.end:%d.%m %H:%M}"
+    return f"{occurrence.start:%H:%M}–{occurrence.end:%H:%M}"
+
+
+def _occurrence_lines(occurrences: Sequence[Occurrence], with_date: bool) -> List[str]:
+    overlapping = conflicts(occurrences)
+    lines = []
+    for i, occurrence in enumerate(occurrences):
+        mark = CONFLICT_MARK if i in overlapping else ""
+        when = _occurrence_time(occurrence)
+        if with_date:
+            when = f"{occurrence.start:%d.%m} ({_WEEKDAY_NAMES[occurrence.start.weekday()]}) {when}"
+        lines.append(f"{mark}{when} {occurrence.name or '(без названия)'}")
+    return lines
+
+
+@timed_handler
 async def calendar_list_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработка callback calendar:list — показать ближайшие мероприятия."""
+    """Обработка callback calendar.list — показать ближайшие мероприятия."""
     query = update.callback_query
     await query.answer()
 
-    bound = _ensure_authorized_from_update_or_query(update)
-    if not bound:
-        await query.edit_message_text(
-            "Вы не авторизованы. Используйте /login для входа."
-        )
+    # Авторизацию проверяет роутер (requires_auth=True)
+    bound = get_current_user(update, context)
+    now = local_now()
+    agenda = await run_in_portal(get_agenda, bound["bitrix_user_id"])
+    occurrences = agenda.upcoming(now, UPCOMING_EVENTS_LIMIT)
+    keyboard = calendar_agenda_inline(None, now.date())
+    if not occurrences:
+        await query.edit_message_text("Ближайших мероприятий не найдено.", reply_markup=keyboard)
         return
 
-    events = get_calendar_events(bound["bitrix_user_id"], limit=10)
-    if not events:
-        await query.edit_message_text("Ближайших мероприятий не найдено.")
-        return
+    lines = ["Ближайшие мероприятия:"] + _occurrence_lines(occurrences, with_date=True)
+    await query.edit_message_text("\n".join(lines), reply_markup=keyboard)
+
+
+@timed_handler
+async def calendar_day_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработка callback calendar.day — мероприятия на дату (с отметкой пересечений)."""
+    query = update.callback_query
+    await query.answer()
 
-    lines = ["Ближайшие мероприятия:"]
-    for ev in events:
-        name = ev.get("NAME") or ev.get("TITLE") or "(без названия)"
-        date = ev.get("DATE_FROM") or ev.get("DATE") or ""
-        lines.append(f"- {name} ({date})")
+    bound = get_current_user(update, context)
+    _, args = unpack(query.data)
+    today = local_now().date()
+    day = max(date.fromordinal(args[0]), today)
+    occurrences = await run_in_portal(events_on, bound["bitrix_user_id"], day)
+    keyboard = calendar_agenda_inline(day, today)
+    title = f"{day:%d.%m.%Y} ({_WEEKDAY_NAMES[day.weekday()]})"
+    if not occurrences:
+        await query.edit_message_text(f"{title}: мероприятий нет.", reply_markup=keyboard)
+        return
 
-    await query.edit_message_text("\n".join(lines))
+    lines = [f"Мероприятия на {title}:"] + _occurrence_lines(occurrences, with_date=False)
+    if conflicts(occurrences):
+        lines += ["", f"{CONFLICT_MARK}— мероприятия пересекаются по времени."]
+    await query.edit_message_text("\n".join(lines), reply_markup=keyboard)
 
 
 # ======== Создание мероприятия (диалог) ========
 
+@timed_handler
 async def calendar_create_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Точка входа в диалог создания события (callback calendar:create)."""
+    """Точка входа в диалог создания события (callback calendar.create)."""
     query = update.callback_query
     await query.answer()
 
-    bound = _ensure_authorized_from_update_or_query(update)
+    bound = get_current_user(update, context)
     if not bound:
         await query.edit_message_text(
-            "Вы не авторизованы. Используйте /login для входа."
+            NOT_AUTHORIZED_TEXT
         )
         return ConversationHandler.END
 
@@ -74,6 +124,7 @@ async def calendar_create_entry(update: Update, context: ContextTypes.DEFAULT_TY
     return CalendarCreateStates.TITLE
 
 
+@timed_handler
 async def calendar_create_title(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data["calendar_create"] = {
         "title": update.message.text.strip(),
@@ -82,6 +133,7 @@ async def calendar_create_title(update: Update, context: ContextTypes.DEFAULT_TY
     return CalendarCreateStates.DESCRIPTION
 
 
+@timed_handler
 async def calendar_create_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     desc = update.message.text.strip()
     if desc == "-":
@@ -91,17 +143,10 @@ async def calendar_create_description(update: Update, context: ContextTypes.DEFA
     return CalendarCreateStates.DATE
 
 
-def _parse_date_ddmmyyyy(value: str):
-    from datetime import datetime
-    try:
-        return datetime.strptime(value, "%d.%m.%Y")
-    except ValueError:
-        return None
-
-
+@timed_handler
 async def calendar_create_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     text = update.message.text.strip()
-    dt = _parse_date_ddmmyyyy(text)
+    dt = parse_date_ddmmyyyy(text)
     if not dt:
         await update.message.reply_text(
             "Дата в неправильном формате. Введите в виде dd.mm.yyyy, например 25.12.2025:"
@@ -111,8 +156,9 @@ async def calendar_create_date(update: Update, context: ContextTypes.DEFAULT_TYP
     date_iso = dt.date().isoformat()
     context.user_data["calendar_create"]["date_iso"] = date_iso
 
-    employees = get_employees()
-    context.user_data["employees_cache"] = employees
+    # В user_data — только версия справочника, сам список общий (get_employees_snapshot)
+    employees = await run_in_portal(get_employees_cached)
+    context.user_data["employees_version"] = employees_directory_version()
     context.user_data["employees_page"] = 0
     context.user_data["attendees_selected"] = set()  # type: ignore
 
@@ -130,32 +176,49 @@ async def calendar_create_date(update: Update, context: ContextTypes.DEFAULT_TYP
     return CalendarCreateStates.ATTENDEES
 
 
-def _attendees_keyboard(employees: List[Dict], context, prefix: str) -> InlineKeyboardMarkup:
-    page = context.user_data.get("employees_page", 0)
-    from keyboards import employees_keyboard as base_emp_keyboard
+_ATTENDEES_CONTROL_ROWS: Dict[str, tuple] = {}
 
-    kb = base_emp_keyboard(employees, page=page, page_size=EMPLOYEES_PAGE_SIZE, prefix=prefix)
 
-    rows = kb.inline_keyboard.copy()
-    rows.append(
-        [
-            InlineKeyboardButton("Готово", callback_data=f"{prefix}:done"),
-            InlineKeyboardButton("Отмена", callback_data=f"{prefix}:cancel"),
-        ]
+def _attendees_control_row(prefix: str) -> tuple:
+    row = _ATTENDEES_CONTROL_ROWS.get(prefix)
+    if row is None:
+        row = (
+            InlineKeyboardButton("Готово", callback_data=pack(f"{prefix}.done")),
+            InlineKeyboardButton("Отмена", callback_data=pack(f"{prefix}.cancel")),
+        )
+        _ATTENDEES_CONTROL_ROWS[prefix] = row
+    return row
+
+
+def _attendees_keyboard(employees: List[Employee], context, prefix: str) -> InlineKeyboardMarkup:
+    """
+    Страница сотрудников берётся из кеша клавиатур, отмеченные участники
+    подменяются точечно, без пересборки всей сетки.
+    """
+    return employees_keyboard(
+        employees,
+        page=context.user_data.get("employees_page", 0),
+        page_size=EMPLOYEES_PAGE_SIZE,
+        prefix=prefix,
+        version=context.user_data.get("employees_version"),
+        selected=context.user_data.get("attendees_selected"),
+        extra_rows=(_attendees_control_row(prefix),),
     )
-    return InlineKeyboardMarkup(rows)
 
 
+@timed_handler
 async def calendar_attendees_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    data = query.data
-    employees: List[Dict] = context.user_data.get("employees_cache", [])
+    name, args = unpack(query.data)
+    employees: List[Employee] = await run_in_portal(
+        get_employees_snapshot, context.user_data.get("employees_version")
+    )
     page = context.user_data.get("employees_page", 0)
     selected: Set[int] = context.user_data.get("attendees_selected", set())
 
-    if data.startswith("event_att:page:"):
-        page = int(data.split(":")[-1])
+    if name == "event_att.page":
+        page = args[0]
         context.user_data["employees_page"] = page
         kb = _attendees_keyboard(employees, context, prefix="event_att")
         await query.edit_message_text(
@@ -164,8 +227,8 @@ async def calendar_attendees_callback(update: Update, context: ContextTypes.DEFA
         )
         return CalendarCreateStates.ATTENDEES
 
-    if data.startswith("event_att:select:"):
-        emp_id = int(data.split(":")[-1])
+    if name == "event_att.select":
+        emp_id = args[0]
         if emp_id in selected:
             selected.remove(emp_id)
         else:
@@ -178,11 +241,11 @@ async def calendar_attendees_callback(update: Update, context: ContextTypes.DEFA
         )
         return CalendarCreateStates.ATTENDEES
 
-    if data == "event_att:cancel":
+    if name == "event_att.cancel":
         await query.edit_message_text("Создание мероприятия отменено.")
         return ConversationHandler.END
 
-    if data == "event_att:done":
+    if name == "event_att.done":
         payload = context.user_data.get("calendar_create", {})
         title = payload.get("title", "")
         description = payload.get("description", "")
@@ -199,12 +262,15 @@ async def calendar_attendees_callback(update: Update, context: ContextTypes.DEFA
             f"Дата: {date_iso}",
             f"Количество участников: {len(attendees_ids)}",
             "",
-            "Создать мероприятие?",
         ]
+        busy = await _busy_on(update, context, date_iso)
+        if busy:
+            lines += ["В этот день у вас уже есть:"] + _occurrence_lines(busy, with_date=False) + [""]
+        lines.append("Создать мероприятие?")
         buttons = [
             [
-                InlineKeyboardButton("Создать", callback_data="event_create:confirm"),
-                InlineKeyboardButton("Отмена", callback_data="event_create:cancel"),
+                InlineKeyboardButton("Создать", callback_data=pack("event_create.confirm")),
+                InlineKeyboardButton("Отмена", callback_data=pack("event_create.cancel")),
             ]
         ]
         await query.edit_message_text(
@@ -216,26 +282,40 @@ async def calendar_attendees_callback(update: Update, context: ContextTypes.DEFA
     return CalendarCreateStates.ATTENDEES
 
 
+async def _busy_on(update: Update, context, date_iso: str) -> List[Occurrence]:
+    # Подсказка о пересечениях; без повестки создание всё равно возможно
+    bound = get_current_user(update, context)
+    if not bound or not date_iso:
+        return []
+    try:
+        return await run_in_portal(events_on, bound["bitrix_user_id"], date.fromisoformat(date_iso))
+    except Exception:
+        logger.warning("Не удалось получить повестку пользователя %s", bound["bitrix_user_id"], exc_info=True)
+        return []
+
+
+@timed_handler
 async def calendar_create_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    data = query.data
+    name, _ = unpack(query.data)
 
-    if data == "event_create:cancel":
+    if name == "event_create.cancel":
         await query.edit_message_text("Создание мероприятия отменено.")
         return ConversationHandler.END
 
-    if data == "event_create:confirm":
-        bound = _ensure_authorized_from_update_or_query(update)
+    if name == "event_create.confirm":
+        bound = get_current_user(update, context)
         if not bound:
             await query.edit_message_text(
-                "Вы не авторизованы. Используйте /login для входа."
+                NOT_AUTHORIZED_TEXT
             )
             return ConversationHandler.END
 
         payload = context.user_data.get("calendar_create", {})
         try:
-            event_id = create_calendar_event(
+            event_id = await run_in_portal(
+                create_calendar_event,
                 owner_id=bound["bitrix_user_id"],
                 name=payload.get("title", ""),
                 description=payload.get("description", ""),
@@ -248,6 +328,7 @@ async def calendar_create_confirm_callback(update: Update, context: ContextTypes
             )
             return ConversationHandler.END
 
+        forget_agenda(bound["bitrix_user_id"])
         await query.edit_message_text(
             f"Мероприятие создано (ID: {event_id})."
         )
@@ -256,6 +337,7 @@ async def calendar_create_confirm_callback(update: Update, context: ContextTypes
     return ConversationHandler.END
 
 
+@timed_handler
 async def calendar_create_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("Создание мероприятия отменено.")
     return ConversationHandler.END
@@ -0,0 +1,145 @@
+"""
+Общие помощники для обработчиков.
+
+Привязка Telegram -> Bitrix24 запрашивается из SQLite не более одного раза
+за апдейт: результат кешируется в контексте (BotContext), который
+python-telegram-bot создаёт заново для каждого апдейта.
+
+auth_middleware регистрируется в группе -1 и выполняется до всех остальных
+обработчиков: она разрешает привязку и сразу отвечает неавторизованным
+пользователям, не пропуская апдейт дальше. Она же выбирает портал Bitrix24
+пользователя (portals.set_current_portal) и, в режиме OAuth, его токены
+(oauth.use_user_tokens) для всех обработчиков апдейта. Привязка к порталу,
+убранному из BITRIX_PORTALS, снимается с просьбой войти снова.
+"""
+
+from datetime import datetime
+from typing import Dict, Optional
+
+from telegram import Chat, Update
+from telegram.ext import ApplicationHandlerStop, CallbackContext, ExtBot
+
+from auth import get_bound_user, unbind_telegram_user
+from metrics import timed_handler
+from oauth import forget_token, use_user_tokens
+from portals import portal_names, set_current_portal
+from tracing import span
+
+NOT_AUTHORIZED_TEXT = "Вы не авторизованы. Используйте /login для входа."
+PORTAL_REMOVED_TEXT = "Портал {} больше не подключён к боту. Войдите снова: /login."
+
+# Команды, доступные без авторизации
+PUBLIC_COMMANDS = frozenset({"start", "login", "cancel", "logout"})
+
+_UNSET = object()
+
+# Счётчики обращений к базе за привязкой (для проверки "одна выборка на апдейт")
+auth_lookup_stats = {"updates": 0, "lookups": 0, "max_per_update": 0}
+
+
+class BotContext(CallbackContext[ExtBot, dict, dict, dict]):
+    """Контекст апдейта с кешем привязанного пользователя."""
+
+    def __init__(self, application, chat_id=None, user_id=None):
+        super().__init__(application, chat_id=chat_id, user_id=user_id)
+        self.bound_user = _UNSET
+        self.auth_lookups = 0
+
+
+def get_current_user(update: Update, context) -> Optional[Dict]:
+    """
+    Привязанный пользователь Bitrix24 для автора апдейта (или None).
+    Повторные вызовы в рамках одного апдейта не обращаются к базе.
+    """
+    cached = getattr(context, "bound_user", _UNSET)
+    if cached is not _UNSET:
+        return cached
+    user = update.effective_user
+    with span("auth_lookup"):
+        bound = get_bound_user(user.id) if user else None
+    auth_lookup_stats["lookups"] += 1
+    try:
+        context.bound_user = bound
+        context.auth_lookups += 1
+        if context.auth_lookups > auth_lookup_stats["max_per_update"]:
+            auth_lookup_stats["max_per_update"] = context.auth_lookups
+    except AttributeError:
+        pass
+    return bound
+
+
+def reset_current_user(context) -> None:
+    """Сброс кеша после /login или /logout в рамках того же апдейта."""
+    try:
+        context.bound_user = _UNSET
+    except AttributeError:
+        pass
+
+
+def parse_date_ddmmyyyy(value: str) -> Optional[datetime]:
+    """Дата, введённая пользователем как dd.mm.yyyy; None — другой формат."""
+    try:
+        return datetime.strptime(value, "%d.%m.%Y")
+    except ValueError:
+        return None
+
+
+def _command_name(text: str) -> str:
+    # "/login@my_bot arg" -> "login"
+    return text.split()[0][1:].split("@")[0].lower()
+
+
+@timed_handler
+async def auth_middleware(update: Update, context) -> None:
+    """
+    Предобработка апдейта (группа -1): разрешает привязку один раз и
+    останавливает обработку для неавторизованных пользователей.
+    Пропускаются публичные команды и шаги диалога входа.
+    """
+    auth_lookup_stats["updates"] += 1
+    set_current_portal(None)
+    use_user_tokens(None)
+    if update.effective_user is None:
+        return
+    bound = get_current_user(update, context)
+    reply = NOT_AUTHORIZED_TEXT
+    if bound and bound["portal"] not in portal_names():
+        # Портал убран из BITRIX_PORTALS: привязка снимается один раз, дальше
+        # пользователь — как не вошедший
+        unbind_telegram_user(update.effective_user.id)
+        forget_token(update.effective_user.id)
+        reply = PORTAL_REMOVED_TEXT.format(bound["portal"])
+        bound = None
+        try:
+            context.bound_user = None
+        except AttributeError:
+            pass
+    if bound:
+        set_current_portal(bound["portal"])
+        use_user_tokens(update.effective_user.id)
+        return
+
+    message = update.message
+    if message is not None:
+        text = message.text or ""
+        if text.startswith("/") and _command_name(text) in PUBLIC_COMMANDS:
+            return
+        if context.user_data.get("login_in_progress"):
+            return
+        # В групповом чате отвечаем только на команды, а не на переписку участников
+        if message.chat.type != Chat.PRIVATE and not text.startswith("/"):
+            raise ApplicationHandlerStop
+        await message.reply_text(reply)
+        raise ApplicationHandlerStop
+
+    query = update.callback_query
+    if query is not None:
+        if query.message is not None and query.message.chat.type != Chat.PRIVATE:
+            # Общее сообщение группы (доска команды) не затираем
+            await query.answer(reply, show_alert=True)
+        else:
+            await query.answer()
+            await query.edit_message_text(reply)
+        raise ApplicationHandlerStop
+
+    raise ApplicationHandlerStop
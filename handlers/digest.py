@@ -0,0 +1,105 @@
+"""
+Команда /digest — настройка ежедневной сводки задач.
+
+    /digest                       — текущие настройки и подсказка
+    /digest 09:00                 — сводка в 09:00 по роли "Делаю"
+    /digest 09:00 do,originator   — сводка по нескольким ролям
+    /digest now                   — прислать сводку сейчас
+    /digest off                   — отключить сводку
+
+Рассылку выполняет планировщик из digest.py.
+"""
+
+import re
+from datetime import datetime
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from auth import delete_digest_settings, get_digest_settings, mark_digests_sent, set_digest_settings
+from bitrix_api import get_due_tasks_bulk
+from config import DIGEST_DEFAULT_TIME, DIGEST_TIMEZONE
+from digest import ROLE_TITLES, digest_timezone, render_digest
+from handlers.common import get_current_user
+from metrics import timed_handler
+from portals import run_in_portal
+
+_TIME_RE = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+
+USAGE_TEXT = (
+    "Ежедневная сводка задач со сроком на сегодня и просроченных.\n\n"
+    f"/digest {DIGEST_DEFAULT_TIME} — включить (роль «Делаю»)\n"
+    f"/digest {DIGEST_DEFAULT_TIME} do,originator — выбрать роли\n"
+    "/digest now — прислать сводку сейчас\n"
+    "/digest off — отключить\n\n"
+    "Роли: " + ", ".join(f"{key} — {title}" for key, title in ROLE_TITLES.items()) + "\n"
+    f"Время указывается по часовому поясу {DIGEST_TIMEZONE}."
+)
+
+
+def _roles_text(roles) -> str:
+    return ", ".join(ROLE_TITLES.get(r, r) for r in roles)
+
+
+@timed_handler
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Авторизацию проверяет auth_middleware: команда не входит в PUBLIC_COMMANDS
+    bound = get_current_user(update, context)
+    telegram_user_id = update.effective_user.id
+    args = context.args or []
+
+    if not args:
+        settings = get_digest_settings(telegram_user_id)
+        if settings:
+            current = f"Сводка включена: {settings['send_time']}, роли: {_roles_text(settings['roles'])}."
+        else:
+            current = "Сводка отключена."
+        await update.message.reply_text(current + "\n\n" + USAGE_TEXT)
+        return
+
+    command = args[0].lower()
+    if command == "off":
+        delete_digest_settings(telegram_user_id)
+        await update.message.reply_text("Ежедневная сводка отключена.")
+        return
+
+    if command == "now":
+        settings = get_digest_settings(telegram_user_id)
+        roles = settings["roles"] if settings else ["do"]
+        today = datetime.now(digest_timezone()).date()
+        due = await run_in_portal(
+            get_due_tasks_bulk,
+            [(telegram_user_id, bound["bitrix_user_id"], roles)],
+            f"{today.isoformat()}T23:59:59",
+        )
+        if telegram_user_id not in due:
+            await update.message.reply_text("Не удалось получить задачи из Bitrix24. Попробуйте позже.")
+            return
+        await update.message.reply_text(render_digest(due[telegram_user_id], today))
+        return
+
+    match = _TIME_RE.match(command)
+    if not match:
+        await update.message.reply_text("Не понял время. Формат: ЧЧ:ММ, например 09:00.\n\n" + USAGE_TEXT)
+        return
+    send_time = f"{int(match.group(1)):02d}:{match.group(2)}"
+
+    roles = ["do"]
+    if len(args) > 1:
+        roles = [r.strip().lower() for r in ",".join(args[1:]).split(",") if r.strip()]
+        unknown = [r for r in roles if r not in ROLE_TITLES]
+        if unknown or not roles:
+            await update.message.reply_text(
+                f"Неизвестные роли: {', '.join(unknown) or '-'}.\n\n" + USAGE_TEXT
+            )
+            return
+        roles = list(dict.fromkeys(roles))
+
+    set_digest_settings(telegram_user_id, send_time, roles)
+    now = datetime.now(digest_timezone())
+    if send_time <= now.strftime("%H:%M"):
+        # Время на сегодня уже прошло — первая сводка придёт завтра
+        mark_digests_sent([telegram_user_id], now.date().isoformat())
+    await update.message.reply_text(
+        f"Сводка включена: каждый день в {send_time}, роли: {_roles_text(roles)}."
+    )
@@ -1,13 +1,19 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from auth import get_bound_user
+from handlers.common import get_current_user
 from keyboards import main_menu_keyboard, tasks_menu_inline, calendar_menu_inline
+from metrics import timed_handler
 
+TASKS_MENU_TEXT = (
+    "Раздел Задачи. Выберите действие:\n\n"
+    "Чтобы прикрепить файл к задаче, отправьте его с подписью #номер задачи."
+)
 
+
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user = update.effective_user
-    bound = get_bound_user(user.id)
+    bound = get_current_user(update, context)
     if bound:
         text = (
             f"Здравствуйте, {bound['name']}!\n"
@@ -25,19 +31,21 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.callback_query.edit_message_text(text, reply_markup=main_menu_keyboard())
 
 
+@timed_handler
 async def show_tasks_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.message:
         await update.message.reply_text(
-            "Раздел Задачи. Выберите действие:",
+            TASKS_MENU_TEXT,
             reply_markup=tasks_menu_inline(),
         )
     elif update.callback_query:
         await update.callback_query.edit_message_text(
-            "Раздел Задачи. Выберите действие:",
+            TASKS_MENU_TEXT,
             reply_markup=tasks_menu_inline(),
         )
 
 
+@timed_handler
 async def show_calendar_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.message:
         await update.message.reply_text(
@@ -51,9 +59,9 @@ async def show_calendar_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
 
 
+@timed_handler
 async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    user = update.effective_user
-    bound = get_bound_user(user.id)
+    bound = get_current_user(update, context)
     if not bound:
         await update.message.reply_text(
             "Вы не авторизованы. Используйте команду /login для входа."
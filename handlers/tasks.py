@@ -1,12 +1,30 @@
+from datetime import datetime
 from enum import IntEnum
-from typing import List, Dict, Optional
+from typing import List, Dict
+from zoneinfo import ZoneInfo
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.constants import ParseMode
 from telegram.ext import ContextTypes, ConversationHandler
 
-from auth import get_bound_user
-from bitrix_api import get_tasks, get_employees, create_task
+from bitrix_api import (
+    create_task,
+    employees_directory_version,
+    forget_my_tasks,
+    get_all_my_tasks,
+    get_employees_cached,
+    get_employees_snapshot,
+    get_tasks,
+)
+from callbacks import pack, unpack
+from config import TIMEZONE
+from handlers.common import NOT_AUTHORIZED_TEXT, get_current_user, parse_date_ddmmyyyy
 from keyboards import tasks_pagination_inline, employees_keyboard
+from metrics import timed_handler
+from portals import run_in_portal
+from records import Employee
+from rendering import ROLE_NAMES, render_task_messages
+from tasks_sync import find_tasks, remember_created_tasks
 
 
 class TaskCreateStates(IntEnum):
@@ -19,123 +37,161 @@ class TaskCreateStates(IntEnum):
 
 TASKS_PAGE_SIZE = 5
 EMPLOYEES_PAGE_SIZE = 10
+SEARCH_RESULTS_LIMIT = 20
 
-
-def _ensure_authorized_from_update_or_query(update_or_query) -> Optional[Dict]:
-    """
-    Принимает либо Update, либо CallbackQuery и возвращает привязанного пользователя
-    (или None, если не авторизован).
-    """
-    if hasattr(update_or_query, "effective_user"):
-        user = update_or_query.effective_user
-    else:
-        # fallback
-        user = update_or_query.from_user
-    from auth import get_bound_user as _gb
-    return _gb(user.id)
+ORDER_NAMES = {"deadline": "по сроку", "changed": "недавно изменённые"}
 
 
 # ======== Просмотр и фильтр задач (callback-и) ========
+# Авторизацию для этих маршрутов проверяет роутер (requires_auth=True).
+
+def _tasks_filter(context) -> Dict:
+    filt = context.user_data.setdefault("tasks_filter", {})
+    filt.setdefault("role", "do")
+    filt.setdefault("status", "active")
+    filt.setdefault("density", "compact")
+    filt.setdefault("order", "deadline")
+    return filt
 
-async def handle_tasks_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработка callback'ов из меню задач: список, пагинация, фильтр."""
+
+@timed_handler
+async def tasks_list_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
-    data = query.data
+    _tasks_filter(context)
+    # Открытие списка загружает его заново, страницы листаются из кеша
+    await _show_tasks_page(query, context, get_current_user(update, context), page=0, refresh=True)
 
-    bound = _ensure_authorized_from_update_or_query(update)
-    if not bound:
-        await query.edit_message_text(
-            "Вы не авторизованы. Используйте /login для входа."
-        )
-        return
 
-    # Инициализируем фильтр если нужно
-    context.user_data.setdefault("tasks_filter", {})
-    filt = context.user_data["tasks_filter"]
-    filt.setdefault("role", "do")
-    filt.setdefault("status", "active")
+@timed_handler
+async def tasks_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+    _, (page,) = unpack(query.data)
+    _tasks_filter(context)
+    await _show_tasks_page(query, context, get_current_user(update, context), page=page)
+
 
-    if data == "tasks:list":
-        await _show_tasks_page(query, context, page=0)
-    elif data.startswith("tasks:page:"):
-        page = int(data.split(":")[-1])
-        await _show_tasks_page(query, context, page=page)
-    elif data == "tasks:filter":
-        await _show_filter_menu(query, context)
-    elif data.startswith("tasks:filter:role:"):
-        role_key = data.split(":")[-1]
-        context.user_data["tasks_filter"]["role"] = role_key
-        await _show_filter_menu(query, context, message="Роль обновлена.")
-    elif data.startswith("tasks:filter:status:"):
-        status_key = data.split(":")[-1]
-        context.user_data["tasks_filter"]["status"] = status_key
-        await _show_filter_menu(query, context, message="Статус обновлен.")
-
-
-async def handle_tasks_filter_submenus(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Подменю выбора роли/статуса."""
+@timed_handler
+async def tasks_filter_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+    _tasks_filter(context)
+    await _show_filter_menu(query, context)
+
+
+@timed_handler
+async def tasks_filter_role_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+    _, (role_key,) = unpack(query.data)
+    _tasks_filter(context)["role"] = role_key
+    await _show_filter_menu(query, context, message="Роль обновлена.")
+
+
+@timed_handler
+async def tasks_filter_status_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+    _, (status_key,) = unpack(query.data)
+    _tasks_filter(context)["status"] = status_key
+    await _show_filter_menu(query, context, message="Статус обновлен.")
+
+
+@timed_handler
+async def tasks_density_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Переключение вида списка: компактный / подробный."""
+    query = update.callback_query
+    await query.answer()
+    filt = _tasks_filter(context)
+    filt["density"] = "detailed" if filt["density"] == "compact" else "compact"
+    await _show_filter_menu(query, context, message="Вид списка обновлён.")
+
+
+@timed_handler
+async def tasks_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Переключение сортировки: по сроку / сначала недавно изменённые."""
+    query = update.callback_query
+    await query.answer()
+    filt = _tasks_filter(context)
+    filt["order"] = "changed" if filt["order"] == "deadline" else "deadline"
+    await _show_filter_menu(query, context, message="Сортировка обновлена.")
+
+
+@timed_handler
+async def tasks_role_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Подменю выбора роли."""
     query = update.callback_query
     await query.answer()
-    data = query.data
 
     filt = context.user_data.get("tasks_filter", {"role": "do", "status": "active"})
+    role = filt.get("role", "do")
+    text = "Выберите роль:"
+    buttons = [
+        [InlineKeyboardButton(("✅ " if role == "do" else "") + "Делаю", callback_data=pack("tasks.filter_role", "do"))],
+        [InlineKeyboardButton(("✅ " if role == "assist" else "") + "Помогаю", callback_data=pack("tasks.filter_role", "assist"))],
+        [InlineKeyboardButton(("✅ " if role == "originator" else "") + "Поручил", callback_data=pack("tasks.filter_role", "originator"))],
+        [InlineKeyboardButton(("✅ " if role == "observer" else "") + "Наблюдаю", callback_data=pack("tasks.filter_role", "observer"))],
+        [InlineKeyboardButton(("✅ " if role == "all" else "") + "Все мои роли", callback_data=pack("tasks.filter_role", "all"))],
+        [InlineKeyboardButton("Назад", callback_data=pack("tasks.filter"))],
+    ]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons))
 
-    if data == "tasks:filter_role_menu":
-        role = filt.get("role", "do")
-        text = "Выберите роль:"
-        buttons = [
-            [InlineKeyboardButton(("✅ " if role == "do" else "") + "Делаю", callback_data="tasks:filter:role:do")],
-            [InlineKeyboardButton(("✅ " if role == "assist" else "") + "Помогаю", callback_data="tasks:filter:role:assist")],
-            [InlineKeyboardButton(("✅ " if role == "originator" else "") + "Поручил", callback_data="tasks:filter:role:originator")],
-            [InlineKeyboardButton(("✅ " if role == "observer" else "") + "Наблюдаю", callback_data="tasks:filter:role:observer")],
-            [InlineKeyboardButton("Назад", callback_data="tasks:filter")],
-        ]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons))
-    elif data == "tasks:filter_status_menu":
-        status = filt.get("status", "active")
-        text = "Выберите статус:"
-        buttons = [
-            [InlineKeyboardButton(("✅ " if status == "active" else "") + "Активные", callback_data="tasks:filter:status:active")],
-            [InlineKeyboardButton(("✅ " if status == "completed" else "") + "Завершенные", callback_data="tasks:filter:status:completed")],
-            [InlineKeyboardButton(("✅ " if status == "all" else "") + "Все", callback_data="tasks:filter:status:all")],
-            [InlineKeyboardButton("Назад", callback_data="tasks:filter")],
-        ]
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons))
+
+@timed_handler
+async def tasks_status_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Подменю выбора статуса."""
+    query = update.callback_query
+    await query.answer()
+
+    filt = context.user_data.get("tasks_filter", {"role": "do", "status": "active"})
+    status = filt.get("status", "active")
+    text = "Выберите статус:"
+    buttons = [
+        [InlineKeyboardButton(("✅ " if status == "active" else "") + "Активные", callback_data=pack("tasks.filter_status", "active"))],
+        [InlineKeyboardButton(("✅ " if status == "completed" else "") + "Завершенные", callback_data=pack("tasks.filter_status", "completed"))],
+        [InlineKeyboardButton(("✅ " if status == "all" else "") + "Все", callback_data=pack("tasks.filter_status", "all"))],
+        [InlineKeyboardButton("Назад", callback_data=pack("tasks.filter"))],
+    ]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons))
 
 
 async def _show_filter_menu(query, context, message: str = ""):
     filt = context.user_data.get("tasks_filter", {"role": "do", "status": "active"})
     role = filt.get("role", "do")
     status = filt.get("status", "active")
+    density = filt.get("density", "compact")
+    order = filt.get("order", "deadline")
 
     text_lines = []
     if message:
         text_lines.append(message)
     text_lines.append("Текущий фильтр задач:")
-    role_map = {
-        "do": "Делаю",
-        "assist": "Помогаю",
-        "originator": "Поручил",
-        "observer": "Наблюдаю",
-    }
     status_map = {
         "active": "Активные",
         "completed": "Завершенные",
         "all": "Все",
     }
-    text_lines.append(f"Роль: {role_map.get(role, role)}")
+    text_lines.append(f"Роль: {ROLE_NAMES.get(role, role)}")
     text_lines.append(f"Статус: {status_map.get(status, status)}")
+    text_lines.append(f"Сортировка: {ORDER_NAMES.get(order, order)}")
     text_lines.append("")
     text_lines.append("Выберите, что изменить:")
 
     buttons = [
         [
-            InlineKeyboardButton("Роль", callback_data="tasks:filter_role_menu"),
-            InlineKeyboardButton("Статус", callback_data="tasks:filter_status_menu"),
+            InlineKeyboardButton("Роль", callback_data=pack("tasks.role_menu")),
+            InlineKeyboardButton("Статус", callback_data=pack("tasks.status_menu")),
+        ],
+        [
+            InlineKeyboardButton(
+                "Вид: подробный" if density == "detailed" else "Вид: компактный",
+                callback_data=pack("tasks.density"),
+            ),
+            InlineKeyboardButton("Сортировка", callback_data=pack("tasks.order")),
         ],
         [
-            InlineKeyboardButton("Показать задачи", callback_data="tasks:list"),
+            InlineKeyboardButton("Показать задачи", callback_data=pack("tasks.list")),
         ],
     ]
 
@@ -145,63 +201,138 @@ async def _show_filter_menu(query, context, message: str = ""):
     )
 
 
-async def _show_tasks_page(query, context, page: int):
-    bound = _ensure_authorized_from_update_or_query(query)
-    if not bound:
-        await query.edit_message_text(
-            "Вы не авторизованы. Используйте /login для входа."
-        )
-        return
-
+async def _show_tasks_page(query, context, bound: Dict, page: int, refresh: bool = False):
     filt = context.user_data.get("tasks_filter", {"role": "do", "status": "active"})
     role = filt.get("role", "do")
     status = filt.get("status", "active")
-
+    density = filt.get("density", "compact")
+    order = filt.get("order", "deadline")
     start = page * TASKS_PAGE_SIZE
-    data = get_tasks(
+
+    # Сначала локальная копия задач: лишняя запись в выборке — признак следующей страницы
+    local = find_tasks(
+        bound["portal"], bound["bitrix_user_id"], role, status, order, offset=start, limit=TASKS_PAGE_SIZE + 1
+    )
+    if local is not None:
+        if not local:
+            await query.edit_message_text("По выбранному фильтру задач не найдено.")
+            return
+        header = "Все мои задачи:" if role == "all" else "Список задач:"
+        items = local[:TASKS_PAGE_SIZE] if role == "all" else [task for task, _ in local[:TASKS_PAGE_SIZE]]
+        messages = render_task_messages(header, items, density, now=_now())
+        await _send_messages(query, messages, tasks_pagination_inline(page, page > 0, len(local) > TASKS_PAGE_SIZE))
+        return
+
+    if role == "all":
+        await _show_merged_tasks_page(query, bound, status, page, refresh, density)
+        return
+
+    data = await run_in_portal(
+        get_tasks,
         bitrix_user_id=bound["bitrix_user_id"],
         role=role,
         status=status,
         start=start,
         limit=TASKS_PAGE_SIZE,
+        order=order,
     )
     tasks = data.get("tasks", [])
     if not tasks:
         await query.edit_message_text("По выбранному фильтру задач не найдено.")
         return
 
-    lines = ["Список задач:"]
-    for t in tasks:
-        task_id = t.get("id") or t.get("ID")
-        title = t.get("title") or t.get("TITLE") or "(без названия)"
-        deadline = t.get("deadline") or t.get("DEADLINE") or ""
-        if deadline:
-            # Обрезаем до даты
-            date_part = deadline.split("T")[0] if "T" in deadline else deadline
-        else:
-            date_part = "-"
-        lines.append(f"#{task_id} - {title} (до {date_part})")
-
     has_next = bool(data.get("next") is not None)
     has_prev = page > 0
+    messages = render_task_messages("Список задач:", tasks, density, now=_now())
+    await _send_messages(query, messages, tasks_pagination_inline(page, has_prev, has_next))
+
+
+def _now() -> str:
+    return datetime.now(ZoneInfo(TIMEZONE)).strftime("%Y-%m-%dT%H:%M:%S")
+
 
+async def _send_messages(query, messages: List[str], reply_markup) -> None:
+    """
+    Первое сообщение заменяет текущее, остальные отправляются следом;
+    кнопки — у последнего, чтобы листать с конца списка.
+    """
+    last = len(messages) - 1
     await query.edit_message_text(
-        "\n".join(lines),
-        reply_markup=tasks_pagination_inline(page, has_prev, has_next),
+        messages[0], parse_mode=ParseMode.HTML, reply_markup=reply_markup if last == 0 else None
     )
+    for i, text in enumerate(messages[1:], start=1):
+        await query.message.reply_text(
+            text, parse_mode=ParseMode.HTML, reply_markup=reply_markup if i == last else None
+        )
+
+
+async def _show_merged_tasks_page(
+    query, bound: Dict, status: str, page: int, refresh: bool, density: str = "compact"
+):
+    """Страница сводного списка по всем ролям: один batch, дальше — из кеша."""
+    data = await run_in_portal(get_all_my_tasks, bound["bitrix_user_id"], status, force=refresh)
+    tasks = data["tasks"]
+    if not tasks:
+        await query.edit_message_text("По выбранному фильтру задач не найдено.")
+        return
+
+    start = page * TASKS_PAGE_SIZE
+    has_next = start + TASKS_PAGE_SIZE < len(tasks)
+    footer = ""
+    if not has_next and not data["complete"]:
+        footer = "Показаны задачи с ближайшими сроками, остальные — в фильтре по отдельной роли."
+    messages = render_task_messages(
+        "Все мои задачи:", tasks[start:start + TASKS_PAGE_SIZE], density, footer=footer, now=_now()
+    )
+    await _send_messages(query, messages, tasks_pagination_inline(page, page > 0, has_next))
+
+
+# ======== Поиск по названию ========
+
+@timed_handler
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/find <слова> — поиск по названиям задач во всех ролях (локальная копия, FTS5)."""
+    # Авторизацию проверяет auth_middleware: команда не входит в PUBLIC_COMMANDS
+    bound = get_current_user(update, context)
+    text = " ".join(context.args or []).strip()
+    if not text:
+        await update.message.reply_text("Укажите слова из названия задачи, например: /find отчёт квартал")
+        return
+
+    filt = _tasks_filter(context)
+    found = find_tasks(
+        bound["portal"], bound["bitrix_user_id"], "all", filt["status"], filt["order"],
+        search=text, limit=SEARCH_RESULTS_LIMIT + 1,
+    )
+    if found is None:
+        await update.message.reply_text(
+            "Поиск станет доступен после загрузки ваших задач — обычно это занимает минуту. Попробуйте позже."
+        )
+        return
+    if not found:
+        await update.message.reply_text("Задач с такими словами в названии не найдено.")
+        return
+
+    footer = f"Показаны первые {SEARCH_RESULTS_LIMIT}, уточните запрос." if len(found) > SEARCH_RESULTS_LIMIT else ""
+    messages = render_task_messages(
+        f"Найдено по запросу «{text}»:", found[:SEARCH_RESULTS_LIMIT], filt["density"], footer=footer, now=_now()
+    )
+    for message in messages:
+        await update.message.reply_text(message, parse_mode=ParseMode.HTML)
 
 
 # ======== Создание задачи (диалог) ========
 
+@timed_handler
 async def create_task_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Точка входа в диалог создания задачи (callback tasks:create)."""
+    """Точка входа в диалог создания задачи (callback tasks.create)."""
     query = update.callback_query
     await query.answer()
 
-    bound = _ensure_authorized_from_update_or_query(update)
+    bound = get_current_user(update, context)
     if not bound:
         await query.edit_message_text(
-            "Вы не авторизованы. Используйте /login для входа."
+            NOT_AUTHORIZED_TEXT
         )
         return ConversationHandler.END
 
@@ -209,6 +340,7 @@ async def create_task_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return TaskCreateStates.TITLE
 
 
+@timed_handler
 async def task_create_title(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data["task_create"] = {
         "title": update.message.text.strip(),
@@ -217,6 +349,7 @@ async def task_create_title(update: Update, context: ContextTypes.DEFAULT_TYPE)
     return TaskCreateStates.DESCRIPTION
 
 
+@timed_handler
 async def task_create_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     desc = update.message.text.strip()
     if desc == "-":
@@ -226,14 +359,7 @@ async def task_create_description(update: Update, context: ContextTypes.DEFAULT_
     return TaskCreateStates.DEADLINE
 
 
-def _parse_date_ddmmyyyy(value: str):
-    from datetime import datetime
-    try:
-        return datetime.strptime(value, "%d.%m.%Y")
-    except ValueError:
-        return None
-
-
+@timed_handler
 async def task_create_deadline(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     from datetime import datetime, time
 
@@ -241,7 +367,7 @@ async def task_create_deadline(update: Update, context: ContextTypes.DEFAULT_TYP
     if text == "-":
         deadline_iso = None
     else:
-        dt = _parse_date_ddmmyyyy(text)
+        dt = parse_date_ddmmyyyy(text)
         if not dt:
             await update.message.reply_text(
                 "Дата в неправильном формате. Введите в виде dd.mm.yyyy, например 25.12.2025:"
@@ -254,8 +380,9 @@ async def task_create_deadline(update: Update, context: ContextTypes.DEFAULT_TYP
     context.user_data["task_create"]["deadline_iso"] = deadline_iso
 
     # Выбор ответственного
-    employees = get_employees()
-    context.user_data["employees_cache"] = employees
+    # В user_data — только версия справочника, сам список общий (get_employees_snapshot)
+    employees = await run_in_portal(get_employees_cached)
+    context.user_data["employees_version"] = employees_directory_version()
     context.user_data["employees_page"] = 0
 
     if not employees:
@@ -264,36 +391,49 @@ async def task_create_deadline(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return ConversationHandler.END
 
-    kb = employees_keyboard(employees, page=0, page_size=EMPLOYEES_PAGE_SIZE, prefix="task_resp")
+    kb = employees_keyboard(
+        employees,
+        page=0,
+        page_size=EMPLOYEES_PAGE_SIZE,
+        prefix="task_resp",
+        version=context.user_data["employees_version"],
+    )
     await update.message.reply_text("Выберите ответственного:", reply_markup=kb)
     return TaskCreateStates.RESPONSIBLE_SELECT
 
 
+@timed_handler
 async def task_create_responsible_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    data = query.data
-    employees: List[Dict] = context.user_data.get("employees_cache", [])
+    name, args = unpack(query.data)
+    employees: List[Employee] = await run_in_portal(
+        get_employees_snapshot, context.user_data.get("employees_version")
+    )
     page = context.user_data.get("employees_page", 0)
 
-    if data.startswith("task_resp:page:"):
-        page = int(data.split(":")[-1])
+    if name == "task_resp.page":
+        page = args[0]
         context.user_data["employees_page"] = page
-        kb = employees_keyboard(employees, page=page, page_size=EMPLOYEES_PAGE_SIZE, prefix="task_resp")
+        kb = employees_keyboard(
+            employees,
+            page=page,
+            page_size=EMPLOYEES_PAGE_SIZE,
+            prefix="task_resp",
+            version=context.user_data.get("employees_version"),
+        )
         await query.edit_message_text("Выберите ответственного:", reply_markup=kb)
         return TaskCreateStates.RESPONSIBLE_SELECT
 
-    if data.startswith("task_resp:select:"):
-        emp_id = int(data.split(":")[-1])
-        emp = next((e for e in employees if int(e["ID"]) == emp_id), None)
+    if name == "task_resp.select":
+        emp_id = args[0]
+        emp = next((e for e in employees if e.id == emp_id), None)
         if not emp:
             await query.edit_message_text("Ошибка выбора сотрудника. Попробуйте ещё раз.")
             return TaskCreateStates.RESPONSIBLE_SELECT
 
         context.user_data["task_create"]["responsible_id"] = emp_id
-        context.user_data["task_create"]["responsible_name"] = emp.get("FULL_NAME") or (
-            (emp.get("NAME", "") + " " + emp.get("LAST_NAME", "")).strip()
-        )
+        context.user_data["task_create"]["responsible_name"] = emp.full_name
 
         data_ = context.user_data["task_create"]
         summary_lines = [
@@ -307,8 +447,8 @@ async def task_create_responsible_callback(update: Update, context: ContextTypes
         ]
         buttons = [
             [
-                InlineKeyboardButton("Создать", callback_data="task_create:confirm"),
-                InlineKeyboardButton("Отмена", callback_data="task_create:cancel"),
+                InlineKeyboardButton("Создать", callback_data=pack("task_create.confirm")),
+                InlineKeyboardButton("Отмена", callback_data=pack("task_create.cancel")),
             ]
         ]
         await query.edit_message_text(
@@ -320,25 +460,27 @@ async def task_create_responsible_callback(update: Update, context: ContextTypes
     return TaskCreateStates.RESPONSIBLE_SELECT
 
 
+@timed_handler
 async def task_create_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    data = query.data
-    if data == "task_create:cancel":
+    name, _ = unpack(query.data)
+    if name == "task_create.cancel":
         await query.edit_message_text("Создание задачи отменено.")
         return ConversationHandler.END
 
-    if data == "task_create:confirm":
-        bound = _ensure_authorized_from_update_or_query(update)
+    if name == "task_create.confirm":
+        bound = get_current_user(update, context)
         if not bound:
             await query.edit_message_text(
-                "Вы не авторизованы. Используйте /login для входа."
+                NOT_AUTHORIZED_TEXT
             )
             return ConversationHandler.END
 
         payload = context.user_data.get("task_create", {})
         try:
-            task_id = create_task(
+            task_id = await run_in_portal(
+                create_task,
                 title=payload.get("title", ""),
                 description=payload.get("description", ""),
                 deadline_iso=payload.get("deadline_iso"),
@@ -351,6 +493,19 @@ async def task_create_confirm_callback(update: Update, context: ContextTypes.DEF
             )
             return ConversationHandler.END
 
+        forget_my_tasks(bound["bitrix_user_id"], payload.get("responsible_id"))
+        remember_created_tasks(
+            bound["portal"],
+            [
+                (
+                    task_id,
+                    payload.get("title", ""),
+                    payload.get("deadline_iso"),
+                    payload.get("responsible_id"),
+                    bound["bitrix_user_id"],
+                )
+            ],
+        )
         await query.edit_message_text(
             f"Задача успешно создана. ID: {task_id}."
         )
@@ -359,6 +514,7 @@ async def task_create_confirm_callback(update: Update, context: ContextTypes.DEF
     return ConversationHandler.END
 
 
+@timed_handler
 async def task_create_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("Создание задачи отменено.")
     return ConversationHandler.END
@@ -0,0 +1,130 @@
+"""
+JSON для обмена с Bitrix24: подключаемый кодек и потоковый разбор ответов.
+
+Кодек (config.BITRIX_JSON_CODEC) кодирует запросы и разбирает обычные
+ответы: orjson, если установлен, иначе стандартный json.
+
+parse_records() разбирает большие ответы (списки задач, справочник
+сотрудников), не строя их целиком: элементы массивов по заданному пути
+по одному декодируются C-сканером стандартного json и сразу передаются
+в convert (компактные записи из records.py). Остальные поля (total, next,
+ошибки) декодируются как обычно. В памяти одновременно только текст
+ответа и готовые записи, без промежуточного дерева словарей.
+"""
+
+import json
+import re
+from json.decoder import scanstring
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from config import BITRIX_JSON_CODEC
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_SPACES = frozenset(" \t\n\r")
+_scan_once = json.JSONDecoder().scan_once
+
+# Путь внутри ответа и преобразование элементов найденных массивов
+RecordsSpec = Tuple[Sequence[str], Callable[[Any], Any]]
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode("ascii")
+
+
+def _select_codec(name: str):
+    if name in ("auto", "orjson"):
+        try:
+            import orjson
+        except ImportError:
+            if name == "orjson":
+                raise
+        else:
+            return "orjson", orjson.loads, orjson.dumps
+    return "json", json.loads, _json_dumps
+
+
+# loads(bytes | str) -> объект, dumps(объект) -> bytes
+CODEC, loads, dumps = _select_codec(BITRIX_JSON_CODEC)
+
+
+def parse_records(text: str, path: Sequence[str], convert: Callable[[Any], Any]) -> Any:
+    """
+    Разбор ответа, в котором массивы по пути path (ключи объектов, "*" —
+    любой ключ) заменяются списками convert(элемент). Массив, встретившийся
+    на пути раньше, чем путь закончился, тоже считается целевым: так
+    обрабатывается старый формат, где result — сразу список.
+    """
+    idx = _WHITESPACE.match(text, 0).end()
+    value, idx = _parse(text, idx, tuple(path), convert)
+    if _WHITESPACE.match(text, idx).end() != len(text):
+        raise ValueError(f"Лишние данные после JSON в позиции {idx}")
+    return value
+
+
+def _decode(text: str, idx: int) -> Tuple[Any, int]:
+    try:
+        return _scan_once(text, idx)
+    except StopIteration as exc:
+        raise ValueError(f"Некорректный JSON в позиции {exc.value}") from None
+
+
+def _parse(text: str, idx: int, path: Optional[Tuple[str, ...]], convert) -> Tuple[Any, int]:
+    if path is None:
+        return _decode(text, idx)
+    char = text[idx:idx + 1]
+    if char == "[":
+        return _parse_array(text, idx, convert)
+    if char == "{" and path:
+        return _parse_object(text, idx, path, convert)
+    return _decode(text, idx)
+
+
+def _parse_object(text: str, idx: int, path: Tuple[str, ...], convert) -> Tuple[Dict[str, Any], int]:
+    result: Dict[str, Any] = {}
+    idx = _WHITESPACE.match(text, idx + 1).end()
+    if text[idx:idx + 1] == "}":
+        return result, idx + 1
+    while True:
+        if text[idx:idx + 1] != '"':
+            raise ValueError(f"Ожидался ключ объекта в позиции {idx}")
+        key, idx = scanstring(text, idx + 1)
+        idx = _WHITESPACE.match(text, idx).end()
+        if text[idx:idx + 1] != ":":
+            raise ValueError(f"Ожидалось ':' в позиции {idx}")
+        idx = _WHITESPACE.match(text, idx + 1).end()
+        rest = path[1:] if path[0] in ("*", key) else None
+        result[key], idx = _parse(text, idx, rest, convert)
+        idx = _WHITESPACE.match(text, idx).end()
+        char = text[idx:idx + 1]
+        if char == "}":
+            return result, idx + 1
+        if char != ",":
+            raise ValueError(f"Ожидалось ',' или '}}' в позиции {idx}")
+        idx = _WHITESPACE.match(text, idx + 1).end()
+
+
+def _parse_array(text: str, idx: int, convert) -> Tuple[List[Any], int]:
+    items: List[Any] = []
+    idx = _WHITESPACE.match(text, idx + 1).end()
+    if text[idx:idx + 1] == "]":
+        return items, idx + 1
+    append = items.append
+    scan_once = _scan_once
+    try:
+        while True:
+            item, idx = scan_once(text, idx)
+            append(convert(item))
+            char = text[idx:idx + 1]
+            # Bitrix24 отдаёт JSON без пробелов: регулярное выражение — только если они есть
+            if char in _SPACES:
+                idx = _WHITESPACE.match(text, idx).end()
+                char = text[idx:idx + 1]
+            if char == "]":
+                return items, idx + 1
+            if char != ",":
+                raise ValueError(f"Ожидалось ',' или ']' в позиции {idx}")
+            idx += 1
+            if text[idx:idx + 1] in _SPACES:
+                idx = _WHITESPACE.match(text, idx).end()
+    except StopIteration as exc:
+        raise ValueError(f"Некорректный JSON в позиции {exc.value}") from None
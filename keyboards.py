@@ -1,76 +1,204 @@
 """
 Клавиатуры (Reply и Inline) для бота.
+
+Статические меню собираются один раз при импорте модуля (объекты
+python-telegram-bot неизменяемы, поэтому их можно отдавать повторно).
+Страницы выбора сотрудников кешируются по ключу
+(версия справочника, страница, размер страницы, префикс).
 """
 
-from typing import List, Dict
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import List, Dict, Optional, Iterable, Tuple
 from telegram import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
+from callbacks import pack
+from metrics import cache_hit, cache_miss
+from records import Employee
 
-def main_menu_keyboard() -> ReplyKeyboardMarkup:
-    buttons = [
+# Максимальное число закешированных страниц сотрудников
+EMPLOYEES_KEYBOARD_CACHE_SIZE = 256
+
+SELECTED_MARK = "✅ "
+
+
+_MAIN_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    [
         [KeyboardButton("Задачи"), KeyboardButton("Календарь")],
         [KeyboardButton("Мой профиль")],
-    ]
-    return ReplyKeyboardMarkup(buttons, resize_keyboard=True)
+    ],
+    resize_keyboard=True,
+)
 
-
-def tasks_menu_inline() -> InlineKeyboardMarkup:
-    buttons = [
+_TASKS_MENU_INLINE = InlineKeyboardMarkup(
+    [
         [
-            InlineKeyboardButton("Мои задачи", callback_data="tasks:list"),
-            InlineKeyboardButton("Создать задачу", callback_data="tasks:create"),
+            InlineKeyboardButton("Мои задачи", callback_data=pack("tasks.list")),
+            InlineKeyboardButton("Создать задачу", callback_data=pack("tasks.create")),
         ],
         [
-            InlineKeyboardButton("Изменить фильтр", callback_data="tasks:filter"),
+            InlineKeyboardButton("Изменить фильтр", callback_data=pack("tasks.filter")),
+            InlineKeyboardButton("Создать списком", callback_data=pack("tasks.bulk")),
         ],
     ]
-    return InlineKeyboardMarkup(buttons)
+)
 
-
-def calendar_menu_inline() -> InlineKeyboardMarkup:
-    buttons = [
+_CALENDAR_MENU_INLINE = InlineKeyboardMarkup(
+    [
         [
-            InlineKeyboardButton("Мои мероприятия", callback_data="calendar:list"),
-            InlineKeyboardButton("Создать мероприятие", callback_data="calendar:create"),
+            InlineKeyboardButton("Мои мероприятия", callback_data=pack("calendar.list")),
+            InlineKeyboardButton("Создать мероприятие", callback_data=pack("calendar.create")),
         ]
     ]
-    return InlineKeyboardMarkup(buttons)
+)
+
+_TEAM_BOARD_INLINE = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("🔄 Обновить", callback_data=pack("board.refresh"))]]
+)
+
+_FILTER_BUTTON_ROW = (InlineKeyboardButton("Изменить фильтр", callback_data=pack("tasks.filter")),)
+
+
+def main_menu_keyboard() -> ReplyKeyboardMarkup:
+    return _MAIN_MENU_KEYBOARD
+
+
+def tasks_menu_inline() -> InlineKeyboardMarkup:
+    return _TASKS_MENU_INLINE
+
+
+def calendar_menu_inline() -> InlineKeyboardMarkup:
+    return _CALENDAR_MENU_INLINE
+
+
+def team_board_inline() -> InlineKeyboardMarkup:
+    return _TEAM_BOARD_INLINE
+
+
+def calendar_agenda_inline(day: Optional[date], today: date) -> InlineKeyboardMarkup:
+    """
+    Под списком ближайших мероприятий (day=None) — переход на сегодня и завтра,
+    под мероприятиями дня — соседние дни (не раньше сегодняшнего) и ближайшие.
+    Дата в кнопке — порядковый номер дня (date.toordinal()).
+    """
+    if day is None:
+        row = [
+            InlineKeyboardButton("Сегодня", callback_data=pack("calendar.day", today.toordinal())),
+            InlineKeyboardButton("Завтра", callback_data=pack("calendar.day", today.toordinal() + 1)),
+        ]
+        return InlineKeyboardMarkup([row])
+    row = []
+    if day > today:
+        previous = day - timedelta(days=1)
+        row.append(InlineKeyboardButton(f"◀️ {previous:%d.%m}", callback_data=pack("calendar.day", previous.toordinal())))
+    following = day + timedelta(days=1)
+    row.append(InlineKeyboardButton(f"{following:%d.%m} ▶️", callback_data=pack("calendar.day", following.toordinal())))
+    return InlineKeyboardMarkup([row, [InlineKeyboardButton("Ближайшие", callback_data=pack("calendar.list"))]])
 
 
 def tasks_pagination_inline(page: int, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
     buttons = []
     row = []
     if has_prev:
-        row.append(InlineKeyboardButton("◀️ Назад", callback_data=f"tasks:page:{page-1}"))
+        row.append(InlineKeyboardButton("◀️ Назад", callback_data=pack("tasks.page", page - 1)))
     if has_next:
-        row.append(InlineKeyboardButton("▶️ Далее", callback_data=f"tasks:page:{page+1}"))
+        row.append(InlineKeyboardButton("▶️ Далее", callback_data=pack("tasks.page", page + 1)))
     if row:
         buttons.append(row)
-    buttons.append([InlineKeyboardButton("Изменить фильтр", callback_data="tasks:filter")])
+    buttons.append(_FILTER_BUTTON_ROW)
     return InlineKeyboardMarkup(buttons)
 
 
-def employees_keyboard(employees: List[Dict], page: int, page_size: int, prefix: str) -> InlineKeyboardMarkup:
+# ======== Выбор сотрудников ========
+
+_employees_pages: "OrderedDict[Tuple, Tuple]" = OrderedDict()
+
+
+def _build_employees_page(
+    employees: List[Employee], page: int, page_size: int, prefix: str
+) -> Tuple[Tuple[Tuple[InlineKeyboardButton, ...], ...], Dict[int, int]]:
     """
-    Клавиатура выбора сотрудника/участника.
-    prefix - префикс callback_data, например 'task_resp' или 'event_attendee'.
+    Строит строки страницы и индекс {ID сотрудника: номер строки},
+    по которому потом точечно подменяются кнопки с отметкой выбора.
     """
     start = page * page_size
     end = start + page_size
-    items = employees[start:end]
     rows = []
-    for emp in items:
-        label = emp.get("FULL_NAME") or f"{emp.get('NAME', '')} {emp.get('LAST_NAME', '')}".strip()
+    positions: Dict[int, int] = {}
+    for emp in employees[start:end]:
+        positions[emp.id] = len(rows)
         rows.append(
-            [InlineKeyboardButton(label, callback_data=f"{prefix}:select:{emp['ID']}")]
+            (InlineKeyboardButton(emp.full_name, callback_data=pack(f"{prefix}.select", emp.id)),)
         )
 
     nav_row = []
     if page > 0:
-        nav_row.append(InlineKeyboardButton("◀️", callback_data=f"{prefix}:page:{page-1}"))
+        nav_row.append(InlineKeyboardButton("◀️", callback_data=pack(f"{prefix}.page", page - 1)))
     if end < len(employees):
-        nav_row.append(InlineKeyboardButton("▶️", callback_data=f"{prefix}:page:{page+1}"))
+        nav_row.append(InlineKeyboardButton("▶️", callback_data=pack(f"{prefix}.page", page + 1)))
     if nav_row:
-        rows.append(nav_row)
+        rows.append(tuple(nav_row))
+
+    return tuple(rows), positions
 
+
+def _employees_page(
+    employees: List[Employee], page: int, page_size: int, prefix: str, version: Optional[int]
+) -> Tuple[Tuple[Tuple[InlineKeyboardButton, ...], ...], Dict[int, int]]:
+    if version is None:
+        return _build_employees_page(employees, page, page_size, prefix)
+
+    key = (version, page, page_size, prefix)
+    cached = _employees_pages.get(key)
+    if cached is not None:
+        cache_hit("employees_keyboard")
+        _employees_pages.move_to_end(key)
+        return cached
+
+    cache_miss("employees_keyboard")
+    cached = _build_employees_page(employees, page, page_size, prefix)
+    _employees_pages[key] = cached
+    if len(_employees_pages) > EMPLOYEES_KEYBOARD_CACHE_SIZE:
+        _employees_pages.popitem(last=False)
+    return cached
+
+
+def employees_keyboard(
+    employees: List[Employee],
+    page: int,
+    page_size: int,
+    prefix: str,
+    version: Optional[int] = None,
+    selected: Optional[Iterable[int]] = None,
+    extra_rows: Iterable[Tuple[InlineKeyboardButton, ...]] = (),
+) -> InlineKeyboardMarkup:
+    """
+    Клавиатура выбора сотрудника/участника.
+    prefix - префикс маршрута callback'а, например 'task_resp' или 'event_att'.
+    version - версия справочника сотрудников; если указана, страница берётся из кеша.
+    selected - ID отмеченных сотрудников: на странице заменяются только их кнопки.
+    extra_rows - дополнительные строки внизу клавиатуры (например, 'Готово'/'Отмена').
+    """
+    rows, positions = _employees_page(employees, page, page_size, prefix, version)
+
+    if selected:
+        if not isinstance(selected, (set, frozenset)):
+            selected = set(selected)
+        marked = [emp_id for emp_id in positions if emp_id in selected]
+        if marked:
+            rows_list = list(rows)
+            for emp_id in marked:
+                i = positions[emp_id]
+                button = rows_list[i][0]
+                rows_list[i] = (
+                    InlineKeyboardButton(SELECTED_MARK + button.text, callback_data=button.callback_data),
+                )
+            rows = tuple(rows_list)
+
+    if extra_rows:
+        rows = rows + tuple(extra_rows)
     return InlineKeyboardMarkup(rows)
+
+
+def clear_employees_keyboard_cache() -> None:
+    _employees_pages.clear()
@@ -1,15 +1,36 @@
+import asyncio
+import functools
 import logging
+import sys
+from typing import Optional
+
+# Первым: отсчёт времени запуска начинается с импорта startup
+import startup
+from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
-    ConversationHandler,
+    ContextTypes,
+    TypeHandler,
     filters,
 )
 
-from config import TELEGRAM_BOT_TOKEN
-from auth import init_db, get_bound_user
+from callbacks import matcher, stale_callback
+from digest import run_digest_scheduler
+from team_board import run_board_refresher
+from employees_sync import run_employee_sync, sync_employees
+from tasks_sync import run_task_sync, sync_tasks
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    STATE_BACKEND,
+    STATE_PERSISTENCE_INTERVAL,
+    WORKER_COUNT,
+    MAX_CONCURRENT_UPDATES,
+    METRICS_HOST,
+    METRICS_PORT,
+)
 from handlers.start import start, show_tasks_menu, show_calendar_menu, show_profile
 from handlers.auth_handler import (
     login_start,
@@ -19,9 +40,21 @@ from handlers.auth_handler import (
     logout,
     AuthStates,
 )
+from handlers.attachments import attach_file_message
+from handlers.common import BotContext, auth_middleware
+from handlers.board import board_command, board_refresh_callback
+from handlers.digest import digest_command
 from handlers.tasks import (
-    handle_tasks_callback,
-    handle_tasks_filter_submenus,
+    tasks_list_callback,
+    tasks_page_callback,
+    tasks_filter_callback,
+    tasks_filter_role_callback,
+    tasks_filter_status_callback,
+    tasks_role_menu_callback,
+    tasks_status_menu_callback,
+    tasks_density_callback,
+    tasks_order_callback,
+    find_command,
     create_task_start,
     task_create_title,
     task_create_description,
@@ -31,8 +64,16 @@ from handlers.tasks import (
     task_create_cancel,
     TaskCreateStates,
 )
+from handlers.bulk_tasks import (
+    bulk_create_start,
+    bulk_create_input,
+    bulk_create_confirm_callback,
+    bulk_create_cancel,
+    BulkTaskStates,
+)
 from handlers.calendar_handler import (
     calendar_list_callback,
+    calendar_day_callback,
     calendar_create_entry,
     calendar_create_title,
     calendar_create_description,
@@ -43,115 +84,288 @@ from handlers.calendar_handler import (
     CalendarCreateStates,
 )
 from keyboards import main_menu_keyboard
+from metrics import start_metrics_server
+from oauth import oauth_enabled, run_token_refresher, start_callback_server as start_oauth_callback_server
+from router import Router
+from shards import PerUserUpdateProcessor
+from startup import FirstPollRequest
+from throttling import throttle_middleware
+from tracing import TraceIdFilter, TracingRequest
+from user_state import DialogHandler, StateApplication, run_user_state_janitor
 
 
 logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    format="%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s",
     level=logging.INFO,
 )
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(TraceIdFilter())
 logger = logging.getLogger(__name__)
+startup.mark("импорт")
 
 
-async def text_router(update, context):
-    """Обработчик текстовых сообщений с главного меню."""
-    if not update.message:
-        return
-    text = update.message.text.strip()
-
-    if text == "Задачи":
-        if not get_bound_user(update.effective_user.id):
-            await update.message.reply_text(
-                "Вы не авторизованы. Используйте /login для входа."
-            )
-            return
-        await show_tasks_menu(update, context)
-    elif text == "Календарь":
-        if not get_bound_user(update.effective_user.id):
-            await update.message.reply_text(
-                "Вы не авторизованы. Используйте /login для входа."
-            )
-            return
-        await show_calendar_menu(update, context)
-    elif text == "Мой профиль":
-        await show_profile(update, context)
-    else:
-        await update.message.reply_text(
-            "Я вас не понял. Используйте кнопки меню или команды /start, /login.",
-            reply_markup=main_menu_keyboard(),
-        )
+async def unknown_text(update, context):
+    """Ответ на текст, не совпавший ни с одной кнопкой меню."""
+    await update.message.reply_text(
+        "Я вас не понял. Используйте кнопки меню или команды /start, /login.",
+        reply_markup=main_menu_keyboard(),
+    )
 
 
-def main():
-    init_db()
+def build_router() -> Router:
+    """Таблица маршрутов: кнопки главного меню и callback'и вне диалогов."""
+    router = Router(fallback_text=unknown_text)
+
+    router.text("Задачи", show_tasks_menu, requires_auth=True)
+    router.text("Календарь", show_calendar_menu, requires_auth=True)
+    router.text("Мой профиль", show_profile)
+
+    router.callback(["tasks.list"], tasks_list_callback, requires_auth=True)
+    router.callback(["tasks.page"], tasks_page_callback, requires_auth=True)
+    router.callback(["tasks.filter"], tasks_filter_callback, requires_auth=True)
+    router.callback(["tasks.filter_role"], tasks_filter_role_callback, requires_auth=True)
+    router.callback(["tasks.filter_status"], tasks_filter_status_callback, requires_auth=True)
+    router.callback(["tasks.role_menu"], tasks_role_menu_callback, requires_auth=True)
+    router.callback(["tasks.status_menu"], tasks_status_menu_callback, requires_auth=True)
+    router.callback(["tasks.density"], tasks_density_callback, requires_auth=True)
+    router.callback(["tasks.order"], tasks_order_callback, requires_auth=True)
+    router.callback(["calendar.list"], calendar_list_callback, requires_auth=True)
+    router.callback(["calendar.day"], calendar_day_callback, requires_auth=True)
+    router.callback(["board.refresh"], board_refresh_callback, requires_auth=True)
+    return router
 
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+
+async def on_initialized(application, shard: int = 0) -> None:
+    """post_init: Application инициализирован (getMe выполнен)."""
+    startup.mark("initialize")
+    if application.updater is None:
+        # Worker шарда не делает getUpdates — отложенный запуск сразу
+        startup.run_deferred()
+    # Ежедневные сводки: каждый процесс рассылает их пользователям своего шарда
+    application.create_task(
+        run_digest_scheduler(application, shard, WORKER_COUNT)
+    )
+    # Таймауты диалогов и выгрузка простаивающих user_data — в каждом процессе для своих пользователей
+    application.create_task(run_user_state_janitor(application))
+    # Справочник логинов синхронизирует один процесс
+    if shard == 0:
+        application.create_task(run_employee_sync())
+        # Локальная копия задач — тоже в одном процессе, остальные читают её из SQLite
+        application.create_task(run_task_sync())
+        # Доски команд групповых чатов: один пересчёт на все чаты
+        application.create_task(run_board_refresher(application))
+    if oauth_enabled():
+        # Возврат с портала принимает один процесс, токены обновляет каждый для своих пользователей
+        if shard == 0:
+            start_oauth_callback_server(application)
+        application.create_task(run_token_refresher(shard, WORKER_COUNT))
+
+
+def build_application(
+    with_updater: bool = True,
+    base_url: Optional[str] = None,
+    token: str = TELEGRAM_BOT_TOKEN,
+    base_file_url: Optional[str] = None,
+    shard: int = 0,
+):
+    """
+    Сборка приложения со всеми обработчиками.
+    with_updater=False — для worker'а шарда: апдейты приходят из общего хранилища,
+    shard — номер этого worker'а.
+    base_url — адрес Bot API (для бенчмарков с локальной заглушкой Telegram),
+    base_file_url — адрес скачивания файлов той же заглушки.
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .application_class(StateApplication)
+        .request(TracingRequest(connection_pool_size=256))
+        .get_updates_request(FirstPollRequest())
+        .context_types(ContextTypes(context=BotContext))
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_init(functools.partial(on_initialized, shard=shard))
+    )
+    if STATE_BACKEND != "memory":
+        from persistence import BackendPersistence
+
+        builder = builder.persistence(BackendPersistence(update_interval=STATE_PERSISTENCE_INTERVAL))
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    if not with_updater:
+        builder = builder.updater(None)
+    application = builder.build()
+    persistent = application.persistence is not None
+
+    # Предобработка: лишние нажатия кнопок отбрасываются до всего остального,
+    # затем привязка пользователя разрешается один раз на апдейт
+    application.add_handler(TypeHandler(Update, throttle_middleware), group=-2)
+    application.add_handler(TypeHandler(Update, auth_middleware), group=-1)
 
     # /start
     application.add_handler(CommandHandler("start", start))
 
     # Авторизация /login
-    login_conv = ConversationHandler(
+    login_conv = DialogHandler(
         entry_points=[CommandHandler("login", login_start)],
         states={
             AuthStates.LOGIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, login_login)],
             AuthStates.PASSWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, login_password)],
         },
         fallbacks=[CommandHandler("cancel", login_cancel)],
+        name="login",
+        draft_keys=("login_attempt", "login_in_progress"),
+        timeout_text="Вход отменён: не было ответа {minutes} мин. Начните заново: /login",
+        persistent=persistent,
     )
     application.add_handler(login_conv)
     application.add_handler(CommandHandler("logout", logout))
 
+    # Ежедневная сводка задач
+    application.add_handler(CommandHandler("digest", digest_command))
+
+    # Доска команды в групповом чате
+    application.add_handler(CommandHandler("board", board_command))
+
+    # Поиск по названиям задач (локальная копия)
+    application.add_handler(CommandHandler("find", find_command))
+
     # Создание задач (диалог)
-    task_create_conv = ConversationHandler(
+    task_create_conv = DialogHandler(
         entry_points=[
-            CallbackQueryHandler(create_task_start, pattern="^tasks:create$")
+            CallbackQueryHandler(create_task_start, pattern=matcher("tasks.create"))
         ],
         states={
             TaskCreateStates.TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, task_create_title)],
             TaskCreateStates.DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, task_create_description)],
             TaskCreateStates.DEADLINE: [MessageHandler(filters.TEXT & ~filters.COMMAND, task_create_deadline)],
             TaskCreateStates.RESPONSIBLE_SELECT: [
-                CallbackQueryHandler(task_create_responsible_callback, pattern="^task_resp:")
+                CallbackQueryHandler(task_create_responsible_callback, pattern=matcher("task_resp.*"))
             ],
             TaskCreateStates.CONFIRM: [
-                CallbackQueryHandler(task_create_confirm_callback, pattern="^task_create:")
+                CallbackQueryHandler(task_create_confirm_callback, pattern=matcher("task_create.*"))
             ],
         },
         fallbacks=[CommandHandler("cancel", task_create_cancel)],
+        name="task_create",
+        draft_keys=("task_create", "employees_version", "employees_page"),
+        timeout_text="Создание задачи отменено: не было ответа {minutes} мин.",
+        persistent=persistent,
     )
     application.add_handler(task_create_conv)
 
+    # Массовое создание задач (текст или CSV)
+    bulk_create_conv = DialogHandler(
+        entry_points=[
+            CallbackQueryHandler(bulk_create_start, pattern=matcher("tasks.bulk"))
+        ],
+        states={
+            BulkTaskStates.INPUT: [
+                MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.Document.ALL, bulk_create_input)
+            ],
+            BulkTaskStates.CONFIRM: [
+                CallbackQueryHandler(bulk_create_confirm_callback, pattern=matcher("bulk_create.*"))
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", bulk_create_cancel)],
+        name="bulk_create",
+        draft_keys=("bulk_tasks",),
+        timeout_text="Массовое создание задач отменено: не было ответа {minutes} мин.",
+        persistent=persistent,
+    )
+    application.add_handler(bulk_create_conv)
+
     # Создание мероприятий (диалог)
-    calendar_create_conv = ConversationHandler(
+    calendar_create_conv = DialogHandler(
         entry_points=[
-            CallbackQueryHandler(calendar_create_entry, pattern="^calendar:create$")
+            CallbackQueryHandler(calendar_create_entry, pattern=matcher("calendar.create"))
         ],
         states={
             CalendarCreateStates.TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, calendar_create_title)],
             CalendarCreateStates.DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, calendar_create_description)],
             CalendarCreateStates.DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, calendar_create_date)],
             CalendarCreateStates.ATTENDEES: [
-                CallbackQueryHandler(calendar_attendees_callback, pattern="^event_att:")
+                CallbackQueryHandler(calendar_attendees_callback, pattern=matcher("event_att.*"))
             ],
             CalendarCreateStates.CONFIRM: [
-                CallbackQueryHandler(calendar_create_confirm_callback, pattern="^event_create:")
+                CallbackQueryHandler(calendar_create_confirm_callback, pattern=matcher("event_create.*"))
             ],
         },
         fallbacks=[CommandHandler("cancel", calendar_create_cancel)],
+        name="calendar_create",
+        draft_keys=("calendar_create", "employees_version", "employees_page", "attendees_selected"),
+        timeout_text="Создание мероприятия отменено: не было ответа {minutes} мин.",
+        persistent=persistent,
     )
     application.add_handler(calendar_create_conv)
 
-    # Callback'и задач: список/фильтр
-    application.add_handler(CallbackQueryHandler(handle_tasks_callback, pattern=r"^tasks:(list|page:.*|filter$|filter:role:.*|filter:status:.*)$"))
-    application.add_handler(CallbackQueryHandler(handle_tasks_filter_submenus, pattern=r"^tasks:filter_(role_menu|status_menu)$"))
+    # Остальные callback'и: один обработчик и поиск по таблице маршрутов
+    router = build_router()
+    application.add_handler(CallbackQueryHandler(router.route_callback, pattern=router.matches_callback))
+
+    # Файлы и фото с подписью «#номер» — вложения к задаче (после диалогов:
+    # CSV-файл массового создания задач забирает диалог)
+    application.add_handler(
+        MessageHandler(filters.ChatType.PRIVATE & (filters.Document.ALL | filters.PHOTO), attach_file_message)
+    )
+
+    # Кнопки из старых сообщений и устаревшие токены
+    application.add_handler(CallbackQueryHandler(stale_callback))
+
+    # Текстовые сообщения (главное меню) — только в личном чате с ботом
+    application.add_handler(
+        MessageHandler(filters.TEXT & ~filters.COMMAND & filters.ChatType.PRIVATE, router.route_text)
+    )
 
-    # Callback'и календаря: список мероприятий
-    application.add_handler(CallbackQueryHandler(calendar_list_callback, pattern=r"^calendar:list$"))
+    startup.mark("сборка обработчиков")
+    return application
 
-    # Текстовые сообщения (главное меню)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_router))
 
-    application.run_polling()
+def main():
+    # Схема SQLite создаётся при первом обращении к базе (auth._connect),
+    # справочник сотрудников прогревается после первого getUpdates (startup.py).
+    #
+    # python main.py                 — один процесс (по умолчанию)
+    # python main.py ingress         — приём апдейтов и раскладка по шардам
+    # python main.py worker <номер>  — обработка одного шарда
+    # python main.py sync-employees  — полная синхронизация справочника логинов
+    # python main.py sync-tasks      — полная синхронизация локальной копии задач
+    # python main.py set-password <логин> — личный пароль (LOGIN_METHOD = "password")
+    # Порт /metrics: ingress — METRICS_PORT, worker N — METRICS_PORT + N + 1
+    args = sys.argv[1:]
+    if args[:1] == ["sync-employees"]:
+        print(f"Получено записей: {sync_employees(full=True)}")
+    elif args[:1] == ["sync-tasks"]:
+        print(f"Получено задач: {sync_tasks(full=True)}")
+    elif args[:1] == ["set-password"] and len(args) == 2:
+        import getpass
+
+        from auth import set_password
+
+        password = getpass.getpass("Новый пароль: ")
+        if len(password) < 8:
+            raise SystemExit("Пароль должен быть не короче 8 символов")
+        if not set_password(args[1], password):
+            raise SystemExit("Логин не найден в справочнике. Выполните python main.py sync-employees")
+        print("Пароль сохранён.")
+    elif args[:1] == ["ingress"]:
+        from sharding import run_ingress
+
+        start_metrics_server(METRICS_PORT, METRICS_HOST)
+        asyncio.run(run_ingress(TELEGRAM_BOT_TOKEN, WORKER_COUNT))
+    elif args[:1] == ["worker"]:
+        from sharding import run_worker
+
+        shard = int(args[1])
+        if not 0 <= shard < WORKER_COUNT:
+            raise SystemExit(f"Номер worker'а должен быть от 0 до {WORKER_COUNT - 1}")
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT + shard + 1, METRICS_HOST)
+        asyncio.run(run_worker(build_application(with_updater=False, shard=shard), shard))
+    else:
+        start_metrics_server(METRICS_PORT, METRICS_HOST)
+        build_application().run_polling()
 
 
 if __name__ == "__main__":
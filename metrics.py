@@ -0,0 +1,257 @@
+"""
+Метрики в формате Prometheus (text exposition 0.0.4) без клиентской библиотеки prometheus.
+
+- Counter / Gauge / Histogram с метками;
+- timed_handler — декоратор для обработчиков Telegram (время и число активных);
+- start_metrics_server — HTTP-эндпоинт /metrics в фоновом потоке.
+
+На горячем пути только perf_counter, bisect по границам корзин
+и увеличение чисел в словаре, без аллокаций строк. Метрики обновляются
+и из пулов потоков (вызовы Bitrix24, загрузки вложений), поэтому у каждой
+своя блокировка: изменение значения и копирование для /metrics — под ней.
+"""
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from telegram.ext import ApplicationHandlerStop
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Для каждой комбинации меток: [счётчики корзин..., +Inf, сумма]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 2)
+            row[bucket] += 1
+            row[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels: str) -> int:
+        row = self._values.get(labels)
+        return int(sum(row[:-1])) if row else 0
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            rows = [(labels, list(row)) for labels, row in self._values.items()]
+        for labels, row in rows:
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = _labels_text(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += row[len(self.buckets)]
+            le = _labels_text(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            base = _labels_text(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{base} {row[-1]}")
+            lines.append(f"{self.name}_count{base} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ======== Метрики бота ========
+
+BITRIX_LATENCY = Histogram(
+    "bitrix_request_duration_seconds", "Время вызова метода REST API Bitrix24", ["method", "portal"]
+)
+BITRIX_ERRORS = Counter("bitrix_request_errors_total", "Ошибки вызовов Bitrix24", ["method", "portal"])
+BITRIX_BREAKER_OPEN = Gauge(
+    "bitrix_breaker_open", "Портал Bitrix24 временно считается недоступным (1)", ["portal"]
+)
+BITRIX_IN_FLIGHT = Gauge("bitrix_requests_in_flight", "Выполняющиеся запросы к Bitrix24")
+OAUTH_REFRESHES = Counter(
+    "oauth_token_refreshes_total", "Обновления OAuth-токенов сотрудников", ["result"]
+)
+BITRIX_COLLAPSED = Counter(
+    "bitrix_collapsed_calls_total",
+    "Вызовы Bitrix24, обслуженные чужим запросом (in_flight) или недавним результатом (debounced)",
+    ["method", "mode"],
+)
+
+HANDLER_LATENCY = Histogram(
+    "handler_duration_seconds", "Время работы обработчика Telegram", ["handler"]
+)
+HANDLER_ERRORS = Counter("handler_errors_total", "Исключения в обработчиках", ["handler"])
+HANDLERS_IN_FLIGHT = Gauge("handlers_in_flight", "Выполняющиеся обработчики")
+
+SQLITE_LATENCY = Histogram(
+    "sqlite_query_duration_seconds",
+    "Время запросов к SQLite",
+    ["query"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5),
+)
+
+USER_DATA_USERS = Gauge("user_data_users", "Пользователи с непустым user_data в памяти процесса")
+USER_DATA_BYTES = Gauge(
+    "user_data_bytes", "Размер user_data в байтах pickle: сумма и распределение по пользователям", ["stat"]
+)
+USER_STATE_EVICTIONS = Counter(
+    "user_state_evictions_total", "Очистка состояния пользователей: timeout, idle, budget", ["reason"]
+)
+
+TASK_FILE_UPLOADS = Counter("task_file_uploads_total", "Загрузки вложений к задачам", ["result"])
+TASK_FILE_BYTES = Counter("task_file_bytes_total", "Байты вложений, переданные на Диск Bitrix24")
+TASK_FILE_IN_FLIGHT = Gauge("task_file_uploads_in_flight", "Выполняющиеся загрузки вложений")
+TASK_FILE_QUEUED = Gauge("task_file_uploads_queued", "Вложения, ожидающие очереди на загрузку")
+
+TRACES_DROPPED = Counter("traces_dropped_total", "Трассы, не выгруженные из-за переполненной очереди записи")
+
+CACHE_REQUESTS = Counter("cache_requests_total", "Обращения к кешам", ["cache", "result"])
+
+
+def cache_hit(cache: str) -> None:
+    CACHE_REQUESTS.inc(cache, "hit")
+
+
+def cache_miss(cache: str) -> None:
+    CACHE_REQUESTS.inc(cache, "miss")
+
+
+def timed_handler(func):
+    """Декоратор для async-обработчиков: время, ошибки и число активных."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        HANDLERS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+            HANDLERS_IN_FLIGHT.dec()
+
+    return wrapper
+
+
+# ======== HTTP-эндпоинт ========
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        return None
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """Запускает /metrics в фоновом потоке. port=0 — эндпоинт отключён."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
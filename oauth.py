@@ -0,0 +1,379 @@
+"""
+Вход сотрудников через OAuth локального приложения Bitrix24
+(config.BITRIX_AUTH_MODE = "oauth").
+
+1. /login присылает ссылку авторизации на портал; параметр state связывает
+   её с Telegram-аккаунтом и порталом (хранится в state на 10 минут).
+2. Bitrix24 возвращает пользователя на {OAUTH_PUBLIC_URL}/oauth/callback —
+   HTTP-эндпоинт в процессе бота (start_callback_server). Код обменивается
+   на access/refresh-токены, они сохраняются рядом с привязкой (auth.py),
+   пользователь получает сообщение об успешном входе.
+3. auth_middleware выбирает токены автора апдейта (use_user_tokens), и
+   bitrix_api выполняет запросы с ними: каждый сотрудник расходует свой
+   лимит запросов, автором изменений становится он сам.
+
+Токены держатся в памяти процесса (с шардированием пользователь всегда
+попадает в один процесс). Истёкший токен обновляется при обращении, а
+run_token_refresher обновляет их заранее: у активных пользователей — до
+истечения access-токена, у остальных — пока не истёк refresh-токен.
+"""
+
+import asyncio
+import html
+import logging
+import secrets
+import threading
+import time
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from auth import (
+    bind_telegram_user,
+    delete_user_tokens,
+    get_user_tokens,
+    list_stale_refresh_tokens,
+    save_user_tokens,
+)
+from config import (
+    BITRIX_AUTH_MODE,
+    BITRIX_OAUTH_ACTIVE_WINDOW,
+    BITRIX_OAUTH_CLIENT_ID,
+    BITRIX_OAUTH_CLIENT_SECRET,
+    BITRIX_OAUTH_REFRESH_MARGIN,
+    BITRIX_OAUTH_REFRESH_TOKEN_TTL,
+    BITRIX_OAUTH_TOKEN_URL,
+    BITRIX_TIMEOUT,
+    BITRIX_USER_RATE,
+    OAUTH_CALLBACK_HOST,
+    OAUTH_CALLBACK_PORT,
+    OAUTH_PUBLIC_URL,
+    WORKER_COUNT,
+)
+from metrics import OAUTH_REFRESHES, cache_hit, cache_miss
+from portals import TokenBucket, get_portal, portal_scope
+from shards import shard_for
+from state import get_backend
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_PATH = "/oauth/callback"
+# Сколько живёт ссылка авторизации
+STATE_TTL = 600
+# Токен, истекающий раньше чем через столько секунд, обновляется перед запросом
+_MIN_VALID_SECONDS = 30
+
+
+class OAuthError(Exception):
+    pass
+
+
+class UserToken:
+    """Токены одного сотрудника и его собственный лимит запросов."""
+
+    def __init__(self, telegram_user_id: int, stored: Dict) -> None:
+        self.telegram_user_id = telegram_user_id
+        self.portal: str = stored["portal"]
+        self.bitrix_user_id: int = stored["bitrix_user_id"]
+        self.client_endpoint: str = stored["client_endpoint"]
+        self.access_token: str = stored["access_token"]
+        self.refresh_token: str = stored["refresh_token"]
+        self.expires_at: float = stored["expires_at"]
+        self.refreshed_at: float = stored["refreshed_at"]
+        self.last_used = time.monotonic()
+        self.bucket = TokenBucket(BITRIX_USER_RATE, burst=max(1, int(BITRIX_USER_RATE * 2)))
+        self.lock = threading.Lock()
+
+    def to_stored(self) -> Dict:
+        return {
+            "portal": self.portal,
+            "bitrix_user_id": self.bitrix_user_id,
+            "client_endpoint": self.client_endpoint,
+            "access_token": self.access_token,
+            "refresh_token": self.refresh_token,
+            "expires_at": self.expires_at,
+            "refreshed_at": self.refreshed_at,
+        }
+
+
+_tokens: Dict[int, UserToken] = {}
+_tokens_lock = threading.Lock()
+_current_user: ContextVar[Optional[int]] = ContextVar("oauth_user", default=None)
+
+
+def oauth_enabled() -> bool:
+    return BITRIX_AUTH_MODE == "oauth"
+
+
+def use_user_tokens(telegram_user_id: Optional[int]) -> None:
+    """Запросы к Bitrix24 до конца обработки апдейта — с токенами этого пользователя."""
+    _current_user.set(telegram_user_id if oauth_enabled() else None)
+
+
+def current_oauth_user() -> Optional[int]:
+    return _current_user.get()
+
+
+def current_token() -> Optional[UserToken]:
+    """
+    Токены текущего пользователя (None — запрос идёт через вебхук портала).
+    Почти истёкший access-токен обновляется здесь же.
+    """
+    telegram_user_id = _current_user.get()
+    if telegram_user_id is None:
+        return None
+    token = _tokens.get(telegram_user_id)
+    if token is None:
+        cache_miss("oauth_token")
+        stored = get_user_tokens(telegram_user_id)
+        if not stored:
+            return None
+        with _tokens_lock:
+            token = _tokens.setdefault(telegram_user_id, UserToken(telegram_user_id, stored))
+    else:
+        cache_hit("oauth_token")
+    token.last_used = time.monotonic()
+    refresh(token, min_valid=_MIN_VALID_SECONDS)
+    return token
+
+
+def forget_token(telegram_user_id: int, revoked: bool = False) -> None:
+    """Убирает токены из кеша; revoked=True — и из базы (доступ отозван)."""
+    with _tokens_lock:
+        _tokens.pop(telegram_user_id, None)
+    if revoked:
+        delete_user_tokens(telegram_user_id)
+
+
+# ======== Обмен и обновление токенов ========
+
+def _token_request(params: Dict[str, str]) -> Dict:
+    import requests
+
+    query = {"client_id": BITRIX_OAUTH_CLIENT_ID, "client_secret": BITRIX_OAUTH_CLIENT_SECRET, **params}
+    try:
+        response = requests.get(BITRIX_OAUTH_TOKEN_URL, params=query, timeout=BITRIX_TIMEOUT)
+        data = response.json()
+    except (requests.RequestException, ValueError) as exc:
+        raise OAuthError(f"Сервер авторизации недоступен: {exc}") from exc
+    if not isinstance(data, dict) or "error" in data or "access_token" not in data:
+        error = data.get("error") if isinstance(data, dict) else data
+        raise OAuthError(f"Ошибка авторизации Bitrix24: {error}")
+    return data
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def _apply_token_response(token_fields: Dict, data: Dict) -> Dict:
+    """
+    Новые токены в token_fields. Портал ответа (client_endpoint) должен
+    совпадать с порталом в token_fields: с приложением, установленным на
+    нескольких порталах, иначе можно привязаться к одному порталу с
+    пользователем другого.
+    """
+    endpoint = data.get("client_endpoint")
+    if not endpoint or _host(endpoint) != _host(token_fields["client_endpoint"]):
+        raise OAuthError("Авторизация пришла не с того портала")
+    now = time.time()
+    token_fields.update(
+        access_token=data["access_token"],
+        refresh_token=data["refresh_token"],
+        expires_at=now + int(data.get("expires_in") or 3600),
+        refreshed_at=now,
+        client_endpoint=endpoint,
+    )
+    return token_fields
+
+
+def refresh(token: UserToken, min_valid: float = 0.0, rejected: Optional[str] = None, force: bool = False) -> bool:
+    """
+    Обновляет токены, если access-токен истекает раньше чем через min_valid
+    секунд, если его отклонил портал (rejected — отклонённый access-токен)
+    или всегда при force. Параллельные вызовы обновляют один раз.
+    """
+    def needed() -> bool:
+        return force or token.access_token == rejected or token.expires_at - time.time() <= min_valid
+
+    if not needed():
+        return False
+    with token.lock:
+        # Пока ждали блокировку, токен мог обновить другой поток
+        if not needed():
+            return False
+        try:
+            data = _token_request({"grant_type": "refresh_token", "refresh_token": token.refresh_token})
+            stored = _apply_token_response(token.to_stored(), data)
+        except OAuthError:
+            OAUTH_REFRESHES.inc("error")
+            raise
+        save_user_tokens(token.telegram_user_id, stored)
+        token.access_token = stored["access_token"]
+        token.refresh_token = stored["refresh_token"]
+        token.expires_at = stored["expires_at"]
+        token.refreshed_at = stored["refreshed_at"]
+        token.client_endpoint = stored["client_endpoint"]
+    OAUTH_REFRESHES.inc("ok")
+    return True
+
+
+def refresh_due_tokens(shard: int = 0, worker_count: int = WORKER_COUNT) -> int:
+    """
+    Один проход фонового обновления. Возвращает число обновлённых токенов.
+    Токены давно не обращавшихся пользователей вытесняются из памяти.
+    """
+    now = time.monotonic()
+    with _tokens_lock:
+        idle = [tg for tg, t in _tokens.items() if now - t.last_used > BITRIX_OAUTH_ACTIVE_WINDOW]
+        for tg in idle:
+            del _tokens[tg]
+        active = list(_tokens.values())
+
+    due = {t.telegram_user_id: (t, BITRIX_OAUTH_REFRESH_MARGIN, False) for t in active}
+    # Refresh-токен обновляется за сутки до истечения, даже если пользователь неактивен
+    stale_before = time.time() - (BITRIX_OAUTH_REFRESH_TOKEN_TTL - 24 * 3600)
+    for telegram_user_id in list_stale_refresh_tokens(stale_before):
+        if shard_for(telegram_user_id, worker_count) != shard:
+            continue
+        token = _tokens.get(telegram_user_id)
+        if token is None:
+            stored = get_user_tokens(telegram_user_id)
+            if not stored:
+                continue
+            token = UserToken(telegram_user_id, stored)
+        due[telegram_user_id] = (token, 0.0, True)
+
+    refreshed = 0
+    for token, margin, force in due.values():
+        try:
+            refreshed += refresh(token, min_valid=margin, force=force)
+        except OAuthError:
+            logger.warning("Не удалось обновить токен пользователя %s", token.telegram_user_id, exc_info=True)
+    return refreshed
+
+
+async def run_token_refresher(shard: int = 0, worker_count: int = WORKER_COUNT, interval: float = 60) -> None:
+    """Бесконечный цикл заблаговременного обновления токенов."""
+    while True:
+        try:
+            count = await asyncio.to_thread(refresh_due_tokens, shard, worker_count)
+            if count:
+                logger.info("Обновлено OAuth-токенов: %s", count)
+        except Exception:
+            logger.exception("Ошибка обновления OAuth-токенов")
+        await asyncio.sleep(interval)
+
+
+# ======== Авторизация ========
+
+def redirect_uri() -> str:
+    return OAUTH_PUBLIC_URL.rstrip("/") + CALLBACK_PATH
+
+
+def authorize_url(telegram_user_id: int, portal: str) -> str:
+    """Ссылка на страницу авторизации приложения на портале."""
+    state = secrets.token_urlsafe(24)
+    get_backend().set_json(
+        f"oauth:state:{state}", {"telegram_user_id": telegram_user_id, "portal": portal}, ttl=STATE_TTL
+    )
+    query = urlencode({"client_id": BITRIX_OAUTH_CLIENT_ID, "state": state, "redirect_uri": redirect_uri()})
+    return f"{get_portal(portal).domain}/oauth/authorize/?{query}"
+
+
+def complete_authorization(state: str, code: str, domain: Optional[str] = None) -> Dict:
+    """
+    Завершение входа по возврату с портала: обмен кода на токены и привязка.
+    Возвращает данные привязки (telegram_user_id, name, ...).
+    """
+    backend = get_backend()
+    pending = backend.get_json(f"oauth:state:{state}")
+    if not pending:
+        raise OAuthError("Ссылка для входа устарела, запросите новую командой /login")
+    backend.delete(f"oauth:state:{state}")
+    portal = get_portal(pending["portal"])
+    # domain из адреса возврата необязателен и задаётся вызывающим: портал
+    # проверяется ещё раз по ответу сервера авторизации (_apply_token_response)
+    if domain and domain.lower() != _host(portal.domain):
+        raise OAuthError("Авторизация пришла не с того портала")
+
+    data = _token_request({"grant_type": "authorization_code", "code": code})
+    telegram_user_id = pending["telegram_user_id"]
+    stored = _apply_token_response(
+        {
+            "portal": portal.name,
+            "bitrix_user_id": int(data["user_id"]),
+            "client_endpoint": portal.domain + "/rest/",
+        },
+        data,
+    )
+    save_user_tokens(telegram_user_id, stored)
+    forget_token(telegram_user_id)
+
+    # Импорт здесь: bitrix_api сам импортирует этот модуль
+    from bitrix_api import get_current_profile
+
+    user_scope = _current_user.set(telegram_user_id)
+    try:
+        with portal_scope(portal.name):
+            profile = get_current_profile()
+    finally:
+        _current_user.reset(user_scope)
+    name = (profile.get("NAME", "") + " " + profile.get("LAST_NAME", "")).strip()
+    login = (profile.get("EMAIL") or str(stored["bitrix_user_id"])).lower()
+    bind_telegram_user(telegram_user_id, login, stored["bitrix_user_id"], name or login, portal.name)
+    return {"telegram_user_id": telegram_user_id, "name": name or login, "portal": portal.name}
+
+
+_PAGE = (
+    "<!doctype html><html><head><meta charset='utf-8'><title>Вход в бота</title></head>"
+    "<body><p>{}</p></body></html>"
+)
+
+
+def start_callback_server(application, host: str = OAUTH_CALLBACK_HOST, port: int = OAUTH_CALLBACK_PORT):
+    """
+    HTTP-эндпоинт возврата с портала в фоновом потоке.
+    Вызывать из цикла событий бота: через него отправляется сообщение о входе.
+    """
+    loop = asyncio.get_running_loop()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            path, _, query = self.path.partition("?")
+            if path != CALLBACK_PATH:
+                self.send_error(404)
+                return
+            params = {k: v[0] for k, v in parse_qs(query).items()}
+            try:
+                if not params.get("state") or not params.get("code"):
+                    raise OAuthError("Не хватает параметров авторизации")
+                bound = complete_authorization(params["state"], params["code"], params.get("domain"))
+            except Exception as exc:
+                logger.warning("Не удалось завершить OAuth-вход: %s", exc)
+                text = str(exc) if isinstance(exc, OAuthError) else "Не удалось выполнить вход, попробуйте позже."
+                self._reply(400, text)
+                return
+            asyncio.run_coroutine_threadsafe(
+                application.bot.send_message(
+                    bound["telegram_user_id"], f"Успешный вход. Вы авторизованы как: {bound['name']}."
+                ),
+                loop,
+            )
+            self._reply(200, "Вход выполнен. Можно вернуться в Telegram.")
+
+        def _reply(self, status: int, text: str) -> None:
+            body = _PAGE.format(html.escape(text)).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args) -> None:
+            return None
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="oauth-callback", daemon=True).start()
+    return server
@@ -0,0 +1,116 @@
+"""
+Хранение user_data, chat_data, bot_data и состояний ConversationHandler
+в общем хранилище (state.StateBackend).
+
+Подключается в main() через ApplicationBuilder().persistence(...).
+Данные пользователя подгружаются при первом его апдейте в процессе
+(refresh_user_data), поэтому после перезапуска или смены процесса
+диалог продолжается с того же шага. Дальше источником истины остаётся
+память процесса: апдейты одного пользователя всегда идут в один шард.
+
+Значения сериализуются pickle (в user_data лежат множества и т.п.),
+поэтому хранилище должно быть доступно только процессам бота.
+"""
+
+import pickle
+from typing import Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from state import StateBackend, get_backend
+
+_CONV_PREFIX = "conv:"
+_USER_PREFIX = "user_data:"
+_CHAT_PREFIX = "chat_data:"
+_BOT_KEY = "bot_data"
+
+
+def _conv_field(key) -> str:
+    return ":".join(str(part) for part in key)
+
+
+def _conv_key(field: str):
+    return tuple(int(part) if part.lstrip("-").isdigit() else part for part in field.split(":"))
+
+
+class BackendPersistence(BasePersistence):
+    def __init__(self, backend: Optional[StateBackend] = None, update_interval: float = 5) -> None:
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._backend = backend or get_backend()
+
+    def _load(self, key: str, default):
+        raw = self._backend.get(key)
+        return pickle.loads(raw) if raw is not None else default
+
+    def _store(self, key: str, value) -> None:
+        self._backend.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    # ======== Чтение при старте ========
+    # user_data/chat_data грузятся лениво в refresh_*, при старте ничего не читаем.
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return self._load(_BOT_KEY, {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        raw = self._backend.hgetall(_CONV_PREFIX + name)
+        return {_conv_key(field): pickle.loads(value) for field, value in raw.items()}
+
+    # ======== Запись ========
+
+    async def update_conversation(self, name: str, key, new_state: Optional[object]) -> None:
+        if new_state is None:
+            self._backend.hdel(_CONV_PREFIX + name, _conv_field(key))
+        else:
+            self._backend.hset(_CONV_PREFIX + name, _conv_field(key), pickle.dumps(new_state))
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._store(f"{_USER_PREFIX}{user_id}", data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._store(f"{_CHAT_PREFIX}{chat_id}", data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        self._store(_BOT_KEY, data)
+
+    async def update_callback_data(self, data) -> None:
+        return None
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._backend.delete(f"{_USER_PREFIX}{user_id}")
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._backend.delete(f"{_CHAT_PREFIX}{chat_id}")
+
+    # ======== Подгрузка перед апдейтом ========
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_data:
+            return
+        stored = self._load(f"{_USER_PREFIX}{user_id}", None)
+        if stored:
+            user_data.update(stored)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        if chat_data:
+            return
+        stored = self._load(f"{_CHAT_PREFIX}{chat_id}", None)
+        if stored:
+            chat_data.update(stored)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        return None
+
+    async def flush(self) -> None:
+        return None
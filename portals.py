@@ -0,0 +1,188 @@
+"""
+Несколько порталов Bitrix24 в одном процессе бота.
+
+У каждого портала (config.BITRIX_PORTALS) свои:
+- пул потоков и HTTP-соединений (requests.Session) — запросы к медленному
+  порталу не занимают потоки и соединения остальных;
+- token bucket на BITRIX_PORTAL_RATE запросов в секунду;
+- circuit breaker: после BITRIX_BREAKER_FAILURES ошибок подряд запросы
+  к порталу BITRIX_BREAKER_COOLDOWN секунд сразу завершаются ошибкой,
+  затем пропускается один пробный запрос.
+
+Текущий портал хранится в contextvars (как текущая трасса в tracing.py):
+auth_middleware выставляет его по привязке пользователя, фоновые задачи —
+через portal_scope(). bitrix_api берёт URL, сессию и лимиты из current_portal().
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+from config import (
+    BITRIX_BREAKER_COOLDOWN,
+    BITRIX_BREAKER_FAILURES,
+    BITRIX_POOL_SIZE,
+    BITRIX_PORTAL_BURST,
+    BITRIX_PORTAL_RATE,
+    BITRIX_PORTALS,
+    DEFAULT_PORTAL,
+)
+from metrics import BITRIX_BREAKER_OPEN
+
+
+class TokenBucket:
+    """Лимит запросов: rate в секунду, не больше burst подряд (rate=None — из конфига портала)."""
+
+    def __init__(self, rate: Optional[float] = None, burst: int = BITRIX_PORTAL_BURST) -> None:
+        self._rate = rate
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait: float) -> bool:
+        """
+        Берёт слот, при необходимости ожидая его.
+        False — ждать пришлось бы дольше max_wait секунд.
+        """
+        rate = BITRIX_PORTAL_RATE if self._rate is None else self._rate
+        if not rate:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._refilled_at) * rate)
+            self._refilled_at = now
+            wait = (1.0 - self._tokens) / rate if self._tokens < 1.0 else 0.0
+            if wait > max_wait:
+                return False
+            # Слот резервируется сразу, ожидание — уже вне блокировки
+            self._tokens -= 1.0
+        if wait:
+            time.sleep(wait)
+        return True
+
+
+class Portal:
+    def __init__(self, name: str, webhook_url: str) -> None:
+        self.name = name
+        self.webhook_url = webhook_url.rstrip("/") + "/"
+        self.executor = ThreadPoolExecutor(max_workers=BITRIX_POOL_SIZE, thread_name_prefix=f"bitrix-{name}")
+        self.bucket = TokenBucket()
+        self._session = None
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+
+    @property
+    def domain(self) -> str:
+        """Адрес портала (https://my.bitrix24.ru) — для OAuth-авторизации."""
+        parts = urlsplit(self.webhook_url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def session(self):
+        """HTTP-сессия портала; requests импортируется при первом запросе."""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=BITRIX_POOL_SIZE))
+                    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=BITRIX_POOL_SIZE))
+                    self._session = session
+        return self._session
+
+    # ======== Circuit breaker ========
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < BITRIX_BREAKER_COOLDOWN:
+                return False
+            # Пробный запрос; остальные ждут его результата ещё один период
+            self._opened_at = time.monotonic()
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self._opened_at is not None:
+                self._opened_at = None
+                BITRIX_BREAKER_OPEN.set(self.name, value=0)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= BITRIX_BREAKER_FAILURES:
+                if self._opened_at is None:
+                    BITRIX_BREAKER_OPEN.set(self.name, value=1)
+                self._opened_at = time.monotonic()
+
+
+_portals: Dict[str, Portal] = {}
+_portals_lock = threading.Lock()
+_current: ContextVar[Optional[str]] = ContextVar("current_portal", default=None)
+
+
+def configure_portals(webhooks: Dict[str, str]) -> None:
+    """Замена списка порталов (например, локальной заглушкой в бенчмарках)."""
+    global BITRIX_PORTALS
+    with _portals_lock:
+        BITRIX_PORTALS = dict(webhooks)
+        _portals.clear()
+
+
+def portal_names():
+    return list(BITRIX_PORTALS)
+
+
+def get_portal(name: Optional[str] = None) -> Portal:
+    name = name or DEFAULT_PORTAL
+    portal = _portals.get(name)
+    if portal is None:
+        with _portals_lock:
+            portal = _portals.get(name)
+            if portal is None:
+                if name not in BITRIX_PORTALS:
+                    raise KeyError(f"Неизвестный портал Bitrix24: {name}")
+                portal = _portals[name] = Portal(name, BITRIX_PORTALS[name])
+    return portal
+
+
+def current_portal() -> Portal:
+    return get_portal(_current.get())
+
+
+def set_current_portal(name: Optional[str]) -> None:
+    """Портал для оставшейся части обработки апдейта (None — портал по умолчанию)."""
+    _current.set(name)
+
+
+@contextmanager
+def portal_scope(name: Optional[str]) -> Iterator[Portal]:
+    """Портал для блока кода — для фоновых задач (сводки, синхронизация)."""
+    token = _current.set(name)
+    try:
+        yield get_portal(name)
+    finally:
+        _current.reset(token)
+
+
+async def run_in_portal(func, *args, **kwargs):
+    """
+    Синхронный вызов Bitrix24 в пуле потоков текущего портала, с копией
+    contextvars (портал и трасса видны внутри вызова).
+    """
+    portal = current_portal()
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(portal.executor, call)
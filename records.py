@@ -0,0 +1,187 @@
+"""
+Компактные записи из ответов Bitrix24.
+
+Списки задач, сотрудников и мероприятий разбираются потоково (jsonstream.parse_records):
+каждый элемент result сразу превращается в кортеж только с нужными полями,
+словари ответа целиком не строятся и не копируются. NamedTuple занимает
+в несколько раз меньше памяти, чем dict с теми же данными, и сериализуется
+в JSON как список (так справочник лежит в общем кеше state).
+"""
+
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+
+class Employee(NamedTuple):
+    """Сотрудник для выбора ответственных и участников."""
+
+    id: int
+    name: str
+    last_name: str
+    full_name: str
+
+
+class DirectoryUser(NamedTuple):
+    """Строка справочника логинов — в порядке столбцов auth.upsert_employees."""
+
+    id: int
+    login: Optional[str]
+    email: Optional[str]
+    name: str
+    active: bool
+    timestamp: Optional[str]
+
+
+class Task(NamedTuple):
+    id: int
+    title: str
+    deadline: Optional[str]
+    status: int
+    responsible_id: int
+    created_by: int
+
+
+class SyncedTask(NamedTuple):
+    """Задача для локальной копии (tasks_sync.py): поля Task, участники и время изменения."""
+
+    id: int
+    title: str
+    deadline: Optional[str]
+    status: int
+    responsible_id: int
+    created_by: int
+    changed_date: Optional[str]
+    accomplices: Tuple[int, ...]
+    auditors: Tuple[int, ...]
+
+
+class MemberLoad(NamedTuple):
+    """Открытые задачи участника доски команды (team_board.py)."""
+
+    active: int
+    overdue: int
+    # Самые просроченные задачи, по возрастанию срока
+    oldest_overdue: Tuple[Task, ...]
+
+
+class CalendarEvent(NamedTuple):
+    """
+    Мероприятие или серия повторений: start/end — первое вхождение
+    (местное время, end не включается), rrule — правило повторения
+    в виде "FREQ=WEEKLY;INTERVAL=1;BYDAY=MO,WE" или None.
+    """
+
+    id: int
+    name: str
+    start: datetime
+    end: datetime
+    all_day: bool
+    rrule: Optional[str]
+    exdates: Tuple[date, ...]
+
+
+def _field(item: Dict[str, Any], camel: str, upper: str) -> Any:
+    # tasks.task.list отдаёт поля в camelCase, старые методы — в верхнем регистре
+    value = item.get(camel)
+    return item.get(upper) if value is None else value
+
+
+def employee_from_bitrix(item: Dict[str, Any]) -> Employee:
+    name = item.get("NAME") or ""
+    last_name = item.get("LAST_NAME") or ""
+    full_name = (name + " " + last_name).strip()
+    return Employee(int(item["ID"]), name, last_name, full_name or item.get("LOGIN") or "")
+
+
+def directory_user_from_bitrix(item: Dict[str, Any]) -> DirectoryUser:
+    login = item.get("LOGIN") or None
+    email = item.get("EMAIL") or None
+    name = ((item.get("NAME") or "") + " " + (item.get("LAST_NAME") or "")).strip()
+    # ACTIVE приходит как true/false или "Y"/"N" в зависимости от версии портала
+    active = item.get("ACTIVE", True) in (True, "Y", "1", 1, "true")
+    user_id = int(item["ID"])
+    return DirectoryUser(user_id, login, email, name or login or email or str(user_id), active, item.get("TIMESTAMP_X"))
+
+
+def task_from_bitrix(item: Dict[str, Any]) -> Task:
+    return Task(
+        int(_field(item, "id", "ID")),
+        _field(item, "title", "TITLE") or "",
+        _field(item, "deadline", "DEADLINE") or None,
+        int(_field(item, "status", "STATUS") or 0),
+        int(_field(item, "responsibleId", "RESPONSIBLE_ID") or 0),
+        int(_field(item, "createdBy", "CREATED_BY") or 0),
+    )
+
+
+def _ids(value: Any) -> Tuple[int, ...]:
+    # Списки участников приходят массивом строк, иногда — объектом {"0": "5"}
+    if isinstance(value, dict):
+        value = value.values()
+    return tuple(int(v) for v in value or () if v)
+
+
+def synced_task_from_bitrix(item: Dict[str, Any]) -> SyncedTask:
+    task = task_from_bitrix(item)
+    return SyncedTask(
+        *task,
+        _field(item, "changedDate", "CHANGED_DATE") or None,
+        _ids(_field(item, "accomplices", "ACCOMPLICES")),
+        _ids(_field(item, "auditors", "AUDITORS")),
+    )
+
+
+# Форматы дат календаря: портал отдаёт "25.12.2030 09:00:00" или "25.12.2030"
+_BITRIX_DATETIME_FORMATS = ("%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%d.%m.%Y")
+
+
+def bitrix_datetime(value: str) -> datetime:
+    """Дата календаря Bitrix24 (формат портала или ISO) в местном времени без пояса."""
+    for fmt in _BITRIX_DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return datetime.fromisoformat(value).replace(tzinfo=None)
+
+
+def _rrule_string(rrule: Any) -> Optional[str]:
+    # calendar.event.get отдаёт RRULE словарём ({"FREQ": "WEEKLY", "BYDAY": {"MO": "MO"}}),
+    # старые версии — строкой "FREQ=WEEKLY;BYDAY=MO"
+    if not rrule:
+        return None
+    if isinstance(rrule, str):
+        return rrule
+    parts = []
+    for key, value in rrule.items():
+        if isinstance(value, dict):
+            value = ",".join(value.values())
+        elif isinstance(value, list):
+            value = ",".join(map(str, value))
+        if value not in (None, ""):
+            parts.append(f"{key}={value}")
+    return ";".join(parts) or None
+
+
+def calendar_event_from_bitrix(item: Dict[str, Any]) -> CalendarEvent:
+    start = bitrix_datetime(item["DATE_FROM"])
+    end = bitrix_datetime(item.get("DATE_TO") or item["DATE_FROM"])
+    all_day = item.get("DT_SKIP_TIME") == "Y"
+    if all_day:
+        # Событие на весь день: DATE_TO — последний день включительно
+        end = datetime.combine(end.date(), datetime.min.time()) + timedelta(days=1)
+    exdates = tuple(
+        bitrix_datetime(day).date() for day in (item.get("EXDATE") or "").split(";") if day
+    )
+    # RINDEX — номер вхождения серии, которую портал уже развернул сам:
+    # DATE_FROM у него — начало вхождения, а не серии, и повторно его не разворачивают
+    expanded = item.get("RINDEX") not in (None, "")
+    return CalendarEvent(
+        int(item["ID"]),
+        item.get("NAME") or "",
+        start,
+        max(end, start),
+        all_day,
+        None if expanded else _rrule_string(item.get("RRULE")),
+        exdates,
+    )
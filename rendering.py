@@ -0,0 +1,196 @@
+"""
+Отрисовка списков задач в сообщения Telegram.
+
+- Шаблоны строки задачи для каждой плотности ("compact" — строка на задачу,
+  "detailed" — несколько строк) и разметки (HTML, MarkdownV2) собираются
+  один раз при импорте: на задачу — один вызов str.format.
+- Экранирование — один раз при подстановке значения в шаблон (сама разметка
+  уже в шаблонах, готовый текст повторно не обрабатывается). Постоянные
+  подписи (статусы) экранированы заранее, одинаковые сроки — один раз за список.
+  Внутри — str.replace на C: для кириллицы он в разы быстрее и str.translate,
+  и re.sub.
+- Длинный список режется на сообщения не длиннее MessageLimit.MAX_TEXT_LENGTH
+  по границам задач, поэтому теги и экранирование не разрываются.
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from telegram.constants import MessageLimit, ParseMode
+
+from records import Task
+
+DENSITIES = ("compact", "detailed")
+
+ROLE_NAMES = {
+    "do": "Делаю",
+    "assist": "Помогаю",
+    "originator": "Поручил",
+    "observer": "Наблюдаю",
+    "all": "Все мои",
+}
+STATUS_NAMES = {
+    1: "Новая",
+    2: "Ждёт выполнения",
+    3: "Выполняется",
+    4: "Ждёт контроля",
+    5: "Завершена",
+    6: "Отложена",
+}
+# Статусы завершённых задач (как в bitrix_api._status_filter)
+COMPLETED_STATUSES = frozenset({5, 6})
+# Длиннее название обрезается: одна задача всегда помещается в сообщение
+TITLE_MAX = 300
+
+# Обратная косая черта — первой, чтобы не экранировать добавленные
+_MARKDOWN_V2_SPECIAL = "\\_*[]()~`>#+-=|{}.!"
+
+
+def _escape_html(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _escape_markdown_v2(text: str) -> str:
+    for char in _MARKDOWN_V2_SPECIAL:
+        if char in text:
+            text = text.replace(char, "\\" + char)
+    return text
+
+
+_ESCAPES = {ParseMode.HTML: _escape_html, ParseMode.MARKDOWN_V2: _escape_markdown_v2}
+_STATUS_ESCAPED = {
+    parse_mode: {status: esc(name) for status, name in STATUS_NAMES.items()}
+    for parse_mode, esc in _ESCAPES.items()
+}
+
+# (плотность, разметка) -> (шаблон задачи, шаблон ролей, разделитель задач)
+_TEMPLATES = {
+    ("compact", ParseMode.HTML): (
+        "{mark}<b>#{id}</b> {title} (до {deadline}){roles}".format,
+        " · {}".format,
+        "\n",
+    ),
+    ("detailed", ParseMode.HTML): (
+        "{mark}<b>#{id} {title}</b>\nСрок: {deadline}\nСтатус: {status}{roles}".format,
+        "\nРоли: {}".format,
+        "\n\n",
+    ),
+    ("compact", ParseMode.MARKDOWN_V2): (
+        "{mark}*\\#{id}* {title} \\(до {deadline}\\){roles}".format,
+        " · {}".format,
+        "\n",
+    ),
+    ("detailed", ParseMode.MARKDOWN_V2): (
+        "{mark}*\\#{id} {title}*\nСрок: {deadline}\nСтатус: {status}{roles}".format,
+        "\nРоли: {}".format,
+        "\n\n",
+    ),
+}
+
+TaskItem = Union[Task, Tuple[Task, Sequence[str]]]
+
+
+def escape(text: str, parse_mode: str = ParseMode.HTML) -> str:
+    return _ESCAPES[parse_mode](text)
+
+
+def _deadline(deadline: Optional[str], density: str) -> str:
+    if not deadline:
+        return "без срока" if density == "detailed" else "-"
+    date_part, _, time_part = deadline.partition("T")
+    if density == "compact":
+        return date_part
+    year, month, day = date_part.split("-")
+    return f"{day}.{month}.{year} {time_part[:5]}".rstrip()
+
+
+def render_tasks(
+    tasks: Iterable[TaskItem],
+    density: str = "compact",
+    parse_mode: str = ParseMode.HTML,
+    now: Optional[str] = None,
+) -> Tuple[List[str], str]:
+    """
+    Отрисованные задачи и разделитель между ними.
+    tasks — записи Task или пары (Task, роли); now ('YYYY-MM-DDTHH:MM:SS') —
+    для отметки просроченных.
+    """
+    line, roles_line, separator = _TEMPLATES[density, parse_mode]
+    esc = _ESCAPES[parse_mode]
+    statuses = _STATUS_ESCAPED[parse_mode]
+    deadlines: Dict[Optional[str], str] = {}
+    entries = []
+    for item in tasks:
+        task, roles = item if isinstance(item, tuple) and not isinstance(item, Task) else (item, ())
+        title = task.title or "(без названия)"
+        if len(title) > TITLE_MAX:
+            title = title[:TITLE_MAX - 1] + "…"
+        overdue = (
+            now is not None
+            and task.deadline is not None
+            and task.deadline[:19] < now
+            and task.status not in COMPLETED_STATUSES
+        )
+        deadline = deadlines.get(task.deadline)
+        if deadline is None:
+            deadline = deadlines[task.deadline] = esc(_deadline(task.deadline, density))
+        entries.append(
+            line(
+                mark="❗ " if overdue else "",
+                id=task.id,
+                title=esc(title),
+                deadline=deadline,
+                status=statuses.get(task.status) or str(task.status),
+                roles=roles_line(", ".join(ROLE_NAMES[r] for r in roles)) if roles else "",
+            )
+        )
+    return entries, separator
+
+
+def split_messages(
+    header: str,
+    entries: Sequence[str],
+    separator: str = "\n",
+    footer: str = "",
+    limit: int = MessageLimit.MAX_TEXT_LENGTH,
+) -> List[str]:
+    """
+    Собирает сообщения не длиннее limit: заголовок — в первом, подпись — в
+    последнем, задачи не разрываются. header и footer уже в нужной разметке.
+    """
+    messages: List[str] = []
+    parts: List[str] = [header] if header else []
+    size = len(header)
+    for entry in entries:
+        added = len(entry) + (len(separator) if parts else 0)
+        if parts and size + added > limit:
+            messages.append(separator.join(parts))
+            parts, size = [], 0
+            added = len(entry)
+        parts.append(entry)
+        size += added
+    if footer:
+        if parts and size + len(separator) + len(footer) > limit:
+            messages.append(separator.join(parts))
+            parts = []
+        parts.append(footer)
+    if parts:
+        messages.append(separator.join(parts))
+    return messages
+
+
+def render_task_messages(
+    header: str,
+    tasks: Iterable[TaskItem],
+    density: str = "compact",
+    parse_mode: str = ParseMode.HTML,
+    footer: str = "",
+    now: Optional[str] = None,
+) -> List[str]:
+    """Список задач целиком: заголовок и подпись — обычный текст, экранируются здесь."""
+    entries, separator = render_tasks(tasks, density, parse_mode, now)
+    return split_messages(
+        escape(header, parse_mode),
+        entries,
+        separator,
+        escape(footer, parse_mode) if footer else "",
+    )
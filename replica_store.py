@@ -0,0 +1,338 @@
+"""
+Хранилище локальной копии задач (tasks_sync.py) в общей базе бота (auth.DB_PATH).
+
+- tasks — задачи портала с индексами по ролям, статусу и сроку;
+  task_members — соисполнители и наблюдатели;
+- tasks_fts — полнотекстовый индекс FTS5 по названию, обновляется триггерами;
+- tasks_sync и tasks_sync_users — курсор и время синхронизаций портала
+  и сотрудники, чьи задачи уже загружены.
+
+Таблицы создаются при первом обращении, как и таблицы auth.py.
+"""
+
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import auth
+from metrics import SQLITE_LATENCY
+from records import SyncedTask, Task
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    if not _schema_ready:
+        with _schema_lock, SQLITE_LATENCY.time("init_replica_db"):
+            if not _schema_ready:
+                conn = sqlite3.connect(auth.DB_PATH)
+                _create_schema(conn.cursor())
+                conn.commit()
+                conn.close()
+                _schema_ready = True
+    return sqlite3.connect(auth.DB_PATH)
+
+
+def _create_schema(cur: sqlite3.Cursor) -> None:
+    # Суррогатный id — стабильный rowid для внешнего содержимого tasks_fts
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            portal TEXT NOT NULL,
+            task_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            deadline TEXT,
+            status INTEGER NOT NULL,
+            responsible_id INTEGER NOT NULL,
+            created_by INTEGER NOT NULL,
+            changed_date TEXT,
+            UNIQUE (portal, task_id)
+        )
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS tasks_responsible ON tasks (portal, responsible_id, status, deadline)"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS tasks_created_by ON tasks (portal, created_by, status, deadline)")
+    cur.execute("CREATE INDEX IF NOT EXISTS tasks_status_deadline ON tasks (portal, status, deadline)")
+    cur.execute("CREATE INDEX IF NOT EXISTS tasks_changed_date ON tasks (portal, changed_date)")
+    # Соисполнители ('assist') и наблюдатели ('observer')
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS task_members (
+            portal TEXT NOT NULL,
+            bitrix_user_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            task_id INTEGER NOT NULL,
+            PRIMARY KEY (portal, bitrix_user_id, role, task_id)
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS task_members_task ON task_members (portal, task_id)")
+    cur.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+            title, content='tasks', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    # unicode61 не приравнивает «ё» к «е»: в индекс попадает название с заменой
+    # (удаление из индекса — с той же заменой, иначе индекс разойдётся с таблицей)
+    new_title = "replace(replace(new.title, 'ё', 'е'), 'Ё', 'Е')"
+    old_title = "replace(replace(old.title, 'ё', 'е'), 'Ё', 'Е')"
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts (rowid, title) VALUES (new.id, {new_title});
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, title) VALUES ('delete', old.id, {old_title});
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF title ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, title) VALUES ('delete', old.id, {old_title});
+            INSERT INTO tasks_fts (rowid, title) VALUES (new.id, {new_title});
+        END
+        """
+    )
+    # Курсор CHANGED_DATE и время синхронизаций портала; пользователи, чьи задачи уже загружены
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tasks_sync (
+            portal TEXT PRIMARY KEY,
+            cursor TEXT,
+            synced_at REAL NOT NULL,
+            full_synced_at REAL NOT NULL
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tasks_sync_users (
+            portal TEXT NOT NULL,
+            bitrix_user_id INTEGER NOT NULL,
+            PRIMARY KEY (portal, bitrix_user_id)
+        )
+        """
+    )
+
+
+
+# Условия ролей (как bitrix_api._role_filter); :portal и :user — параметры запроса
+_REPLICA_ROLE_SQL = {
+    "do": "t.responsible_id = :user",
+    "assist": (
+        "t.task_id IN (SELECT task_id FROM task_members"
+        " WHERE portal = :portal AND bitrix_user_id = :user AND role = 'assist')"
+    ),
+    "originator": "t.created_by = :user",
+    "observer": (
+        "t.task_id IN (SELECT task_id FROM task_members"
+        " WHERE portal = :portal AND bitrix_user_id = :user AND role = 'observer')"
+    ),
+}
+_REPLICA_ORDER_SQL = {
+    "deadline": "t.deadline IS NULL, t.deadline, t.task_id",
+    "changed": "t.changed_date DESC, t.task_id DESC",
+}
+_MEMBER_SQL = (
+    "EXISTS (SELECT 1 FROM task_members m WHERE m.portal = t.portal AND m.bitrix_user_id = :user"
+    " AND m.role = '{}' AND m.task_id = t.task_id)"
+)
+_SEARCH_WORD = re.compile(r"\w+")
+
+
+def _fts_query(text: str) -> str:
+    # Каждое слово — префикс ("отч" найдёт "отчёт"), все слова обязательны;
+    # «ё» — как в индексе (см. _create_schema)
+    text = text.replace("ё", "е").replace("Ё", "Е")
+    return " ".join(f'"{word}"*' for word in _SEARCH_WORD.findall(text))
+
+
+def find_replica_tasks(
+    portal: str,
+    bitrix_user_id: int,
+    role: str,
+    statuses: Optional[Sequence[int]] = None,
+    order: str = "deadline",
+    search: Optional[str] = None,
+    offset: int = 0,
+    limit: int = -1,
+) -> List[Tuple[Task, Tuple[str, ...]]]:
+    """
+    Задачи пользователя из локальной копии: role — ключ роли или 'all' (любая),
+    statuses — None для всех статусов, order — 'deadline' или 'changed',
+    search — слова из названия (FTS5). Возвращает [(Task, роли пользователя в задаче)].
+    """
+    params: Dict[str, object] = {"portal": portal, "user": bitrix_user_id, "limit": limit, "offset": offset}
+    if role == "all":
+        conditions = ["(" + " OR ".join(_REPLICA_ROLE_SQL.values()) + ")"]
+    else:
+        conditions = [_REPLICA_ROLE_SQL[role]]
+    if statuses is not None:
+        names = [f":s{i}" for i in range(len(statuses))]
+        params.update(zip((name[1:] for name in names), statuses))
+        conditions.append(f"t.status IN ({', '.join(names)})")
+    if search is not None:
+        params["search"] = _fts_query(search)
+        if not params["search"]:
+            return []
+        conditions.append("t.id IN (SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH :search)")
+    sql = f"""
+        SELECT t.task_id, t.title, t.deadline, t.status, t.responsible_id, t.created_by,
+               t.responsible_id = :user, {_MEMBER_SQL.format("assist")},
+               t.created_by = :user, {_MEMBER_SQL.format("observer")}
+        FROM tasks t
+        WHERE t.portal = :portal AND {" AND ".join(conditions)}
+        ORDER BY {_REPLICA_ORDER_SQL.get(order, _REPLICA_ORDER_SQL["deadline"])}
+        LIMIT :limit OFFSET :offset
+    """
+    with SQLITE_LATENCY.time("find_replica_tasks"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        conn.close()
+    return [
+        (
+            Task(*row[:6]),
+            tuple(role_key for role_key, flag in zip(("do", "assist", "originator", "observer"), row[6:]) if flag),
+        )
+        for row in rows
+    ]
+
+
+def upsert_replica_tasks(portal: str, tasks: Sequence[SyncedTask]) -> None:
+    """Сохранение задач в локальную копию вместе с соисполнителями и наблюдателями."""
+    if not tasks:
+        return
+    with SQLITE_LATENCY.time("upsert_replica_tasks"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.executemany(
+            """
+            INSERT INTO tasks (portal, task_id, title, deadline, status, responsible_id, created_by, changed_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(portal, task_id) DO UPDATE SET
+                title = excluded.title,
+                deadline = excluded.deadline,
+                status = excluded.status,
+                responsible_id = excluded.responsible_id,
+                created_by = excluded.created_by,
+                changed_date = excluded.changed_date
+            """,
+            [(portal, *task[:7]) for task in tasks],
+        )
+        cur.executemany(
+            "DELETE FROM task_members WHERE portal = ? AND task_id = ?",
+            [(portal, task.id) for task in tasks],
+        )
+        cur.executemany(
+            "INSERT OR IGNORE INTO task_members (portal, bitrix_user_id, role, task_id) VALUES (?, ?, ?, ?)",
+            [
+                (portal, user_id, role, task.id)
+                for task in tasks
+                for role, members in (("assist", task.accomplices), ("observer", task.auditors))
+                for user_id in members
+            ],
+        )
+        conn.commit()
+        conn.close()
+
+
+def delete_replica_tasks(portal: str, task_ids: Sequence[int]) -> None:
+    if not task_ids:
+        return
+    with SQLITE_LATENCY.time("delete_replica_tasks"):
+        conn = _connect()
+        cur = conn.cursor()
+        rows = [(portal, task_id) for task_id in task_ids]
+        cur.executemany("DELETE FROM tasks WHERE portal = ? AND task_id = ?", rows)
+        cur.executemany("DELETE FROM task_members WHERE portal = ? AND task_id = ?", rows)
+        conn.commit()
+        conn.close()
+
+
+def replica_task_ids(portal: str) -> Set[int]:
+    with SQLITE_LATENCY.time("replica_task_ids"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("SELECT task_id FROM tasks WHERE portal = ?", (portal,))
+        rows = cur.fetchall()
+        conn.close()
+    return {row[0] for row in rows}
+
+
+def get_tasks_sync_state(portal: str) -> Optional[Dict]:
+    """{'cursor', 'synced_at', 'full_synced_at', 'users'} или None, если портал ещё не синхронизирован."""
+    with SQLITE_LATENCY.time("get_tasks_sync_state"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("SELECT cursor, synced_at, full_synced_at FROM tasks_sync WHERE portal = ?", (portal,))
+        row = cur.fetchone()
+        cur.execute("SELECT bitrix_user_id FROM tasks_sync_users WHERE portal = ?", (portal,))
+        users = {r[0] for r in cur.fetchall()}
+        conn.close()
+    if not row:
+        return None
+    return {"cursor": row[0], "synced_at": row[1], "full_synced_at": row[2], "users": users}
+
+
+def save_tasks_sync_state(
+    portal: str,
+    cursor: Optional[str],
+    synced_at: float,
+    full_synced_at: float,
+    users: Set[int],
+) -> None:
+    """users — пользователи, чьи задачи теперь полностью есть в копии."""
+    with SQLITE_LATENCY.time("save_tasks_sync_state"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO tasks_sync (portal, cursor, synced_at, full_synced_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(portal) DO UPDATE SET
+                cursor = excluded.cursor,
+                synced_at = excluded.synced_at,
+                full_synced_at = excluded.full_synced_at
+            """,
+            (portal, cursor, synced_at, full_synced_at),
+        )
+        cur.execute("DELETE FROM tasks_sync_users WHERE portal = ?", (portal,))
+        cur.executemany(
+            "INSERT INTO tasks_sync_users (portal, bitrix_user_id) VALUES (?, ?)",
+            [(portal, user_id) for user_id in users],
+        )
+        conn.commit()
+        conn.close()
+
+
+def replica_synced_at(portal: str, bitrix_user_id: int) -> Optional[float]:
+    """Время последней синхронизации копии, если задачи пользователя в ней есть, иначе None."""
+    with SQLITE_LATENCY.time("replica_synced_at"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT s.synced_at FROM tasks_sync s
+            JOIN tasks_sync_users u ON u.portal = s.portal
+            WHERE s.portal = ? AND u.bitrix_user_id = ?
+            """,
+            (portal, bitrix_user_id),
+        )
+        row = cur.fetchone()
+        conn.close()
+    return row[0] if row else None
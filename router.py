@@ -0,0 +1,65 @@
+"""
+Декларативная таблица маршрутов для текстовых кнопок меню и callback'ов.
+
+- Подписи кнопок главного меню ищутся в словаре по точному совпадению.
+- Callback'и ищутся по имени действия из callbacks.unpack().
+- Требование авторизации — метаданные маршрута: привязка пользователя
+  проверяется один раз перед вызовом обработчика, а сам обработчик
+  получает её через handlers.common.get_current_user() без повторного запроса.
+"""
+
+from typing import Awaitable, Callable, Dict, Iterable, NamedTuple, Optional
+
+from telegram import Update
+
+from callbacks import callback_name, ensure_route
+from handlers.common import NOT_AUTHORIZED_TEXT, get_current_user
+
+Handler = Callable[[Update, object], Awaitable[object]]
+
+
+class Route(NamedTuple):
+    handler: Handler
+    requires_auth: bool
+
+
+class Router:
+    def __init__(self, fallback_text: Optional[Handler] = None) -> None:
+        self._text: Dict[str, Route] = {}
+        self._callbacks: Dict[str, Route] = {}
+        self._fallback_text = fallback_text
+
+    def text(self, caption: str, handler: Handler, requires_auth: bool = False) -> None:
+        self._text[caption] = Route(handler, requires_auth)
+
+    def callback(self, names: Iterable[str], handler: Handler, requires_auth: bool = False) -> None:
+        for name in names:
+            ensure_route(name)
+            self._callbacks[name] = Route(handler, requires_auth)
+
+    def matches_callback(self, data) -> bool:
+        return callback_name(data) in self._callbacks
+
+    async def route_text(self, update: Update, context) -> None:
+        if not update.message or not update.message.text:
+            return
+        route = self._text.get(update.message.text.strip())
+        if route is None:
+            if self._fallback_text is not None:
+                await self._fallback_text(update, context)
+            return
+        if route.requires_auth and not get_current_user(update, context):
+            await update.message.reply_text(NOT_AUTHORIZED_TEXT)
+            return
+        await route.handler(update, context)
+
+    async def route_callback(self, update: Update, context) -> None:
+        query = update.callback_query
+        route = self._callbacks.get(callback_name(query.data))
+        if route is None:
+            return
+        if route.requires_auth and not get_current_user(update, context):
+            await query.answer()
+            await query.edit_message_text(NOT_AUTHORIZED_TEXT)
+            return
+        await route.handler(update, context)
@@ -0,0 +1,87 @@
+"""
+Шардирование апдейтов между несколькими процессами бота.
+
+Telegram отдаёт апдейты через getUpdates только одному получателю, поэтому:
+- процесс ingress (`python main.py ingress`) опрашивает Telegram и раскладывает
+  апдейты по спискам `updates:<шард>` в общем хранилище;
+- каждый worker (`python main.py worker <номер>`) забирает апдейты только из
+  своего списка и обрабатывает их последовательно.
+
+Шард выбирается по telegram_user_id, поэтому все апдейты одного пользователя
+попадают в один процесс и обрабатываются строго по порядку.
+
+Внутри процесса апдейты разных пользователей обрабатываются параллельно
+(shards.PerUserUpdateProcessor): пользователь медленного портала Bitrix24 не
+задерживает остальных, а апдейты одного пользователя идут по очереди.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Optional
+
+from telegram import Bot, Update
+
+from shards import shard_for
+from state import StateBackend, get_backend
+
+logger = logging.getLogger(__name__)
+
+QUEUE_PREFIX = "updates:"
+# Сколько секунд worker ждёт апдейт в одном запросе к хранилищу
+POLL_TIMEOUT = 5
+
+
+def _update_user_id(raw: dict) -> Optional[int]:
+    # Первое поле апдейта (кроме update_id) — сам объект: message, callback_query, ...
+    for key, value in raw.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user")
+        if isinstance(sender, dict):
+            return sender.get("id")
+    return None
+
+
+async def run_ingress(token: str, worker_count: int, backend: Optional[StateBackend] = None) -> None:
+    """Опрос getUpdates и раскладка апдейтов по очередям шардов."""
+    backend = backend or get_backend()
+    offset = 0
+    async with Bot(token) as bot:
+        logger.info("Ingress запущен, шардов: %s", worker_count)
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30)
+            except Exception:
+                logger.exception("Ошибка getUpdates, повтор через 1 с")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                raw = update.to_dict()
+                shard = shard_for(_update_user_id(raw), worker_count)
+                payload = json.dumps(raw, ensure_ascii=False).encode("utf-8")
+                await asyncio.to_thread(backend.rpush, f"{QUEUE_PREFIX}{shard}", payload)
+                offset = update.update_id + 1
+
+
+async def run_worker(application, shard: int, backend: Optional[StateBackend] = None) -> None:
+    """
+    Обработка апдейтов своего шарда. Приложение создаётся без Updater,
+    апдейты кладутся в application.update_queue в порядке поступления.
+    """
+    backend = backend or get_backend()
+    queue_key = f"{QUEUE_PREFIX}{shard}"
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logger.info("Worker %s запущен", shard)
+        try:
+            while True:
+                payload = await asyncio.to_thread(backend.blpop, queue_key, POLL_TIMEOUT)
+                if payload is None:
+                    continue
+                update = Update.de_json(json.loads(payload), application.bot)
+                await application.update_queue.put(update)
+        finally:
+            await application.stop()
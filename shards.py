@@ -0,0 +1,64 @@
+"""
+Порядок апдейтов по пользователям — общий для всех режимов запуска.
+
+- shard_for — процесс (шард), который обслуживает пользователя: все его
+  апдейты, сводки и обновления токенов идут в один процесс.
+- PerUserUpdateProcessor — внутри процесса апдейты разных пользователей
+  обрабатываются параллельно, а апдейты одного пользователя — по очереди.
+
+Модуль без побочных эффектов и не зависит от общего хранилища: очереди
+шардов и режимы ingress/worker — в sharding, он импортируется только в них.
+"""
+
+import asyncio
+from typing import Dict, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+
+def shard_for(user_id: Optional[int], worker_count: int) -> int:
+    """Номер шарда для пользователя; апдейты без пользователя идут в шард 0."""
+    if not user_id or worker_count <= 1:
+        return 0
+    return user_id % worker_count
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    До max_concurrent_updates апдейтов одновременно, но апдейты одного
+    пользователя — строго по очереди (диалоги и нажатия не перемешиваются).
+    Очередь пользователя ждёт до захвата общего слота, поэтому один
+    пользователь не занимает все слоты своими апдейтами.
+    """
+
+    def __init__(self, max_concurrent_updates: int) -> None:
+        super().__init__(max_concurrent_updates)
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        self._user_waiting: Dict[int, int] = {}
+
+    async def process_update(self, update, coroutine) -> None:
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            await super().process_update(update, coroutine)
+            return
+        lock = self._user_locks.get(user.id)
+        if lock is None:
+            lock = self._user_locks[user.id] = asyncio.Lock()
+        self._user_waiting[user.id] = self._user_waiting.get(user.id, 0) + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self._user_waiting[user.id] -= 1
+            if not self._user_waiting[user.id]:
+                del self._user_waiting[user.id]
+                del self._user_locks[user.id]
+
+    async def do_process_update(self, update, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,91 @@
+"""
+Быстрый запуск бота и отчёт о времени запуска.
+
+До первого ответа пользователю бот делает только необходимое: импорт
+telegram и обработчиков, сборку Application, getMe и первый getUpdates.
+Всё остальное откладывается:
+- схема SQLite создаётся при первом обращении к базе (auth._connect);
+- requests импортируется при первом вызове Bitrix24;
+- справочник сотрудников прогревается в фоновом потоке после первого
+  успешного getUpdates.
+
+Этапы отмечаются через mark(), после первого getUpdates в лог пишется
+разбивка по времени, например:
+    Запуск: импорт 310 мс, сборка обработчиков 4 мс, initialize 120 мс,
+    первый getUpdates 45 мс; всего 479 мс
+"""
+
+import logging
+import threading
+import time
+from typing import List, Optional, Tuple
+
+# До импорта telegram: он занимает большую часть времени запуска
+_started = time.perf_counter()
+
+from telegram.request import HTTPXRequest  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+_marks: List[Tuple[str, float]] = []
+_deferred_started = False
+_deferred_lock = threading.Lock()
+
+
+def mark(stage: str) -> None:
+    """Отмечает завершение этапа запуска."""
+    _marks.append((stage, time.perf_counter()))
+
+
+def report() -> str:
+    parts = []
+    previous = _started
+    for stage, at in _marks:
+        parts.append(f"{stage} {(at - previous) * 1000:.0f} мс")
+        previous = at
+    return "Запуск: " + ", ".join(parts) + f"; всего {(previous - _started) * 1000:.0f} мс"
+
+
+def _warm_up() -> None:
+    # Импорт здесь: bitrix_api тянет requests, это не нужно до первого апдейта
+    from bitrix_api import get_employees_cached
+    from portals import portal_names, portal_scope
+
+    for portal in portal_names():
+        started = time.perf_counter()
+        try:
+            with portal_scope(portal):
+                get_employees_cached()
+        except Exception:
+            logger.warning("Не удалось прогреть справочник сотрудников портала %s", portal, exc_info=True)
+            continue
+        logger.info(
+            "Справочник сотрудников портала %s прогрет за %.0f мс", portal, (time.perf_counter() - started) * 1000
+        )
+
+
+def run_deferred(stage: Optional[str] = None) -> None:
+    """
+    Отложенная часть запуска: отчёт о времени и фоновый прогрев кешей.
+    Выполняется один раз: после первого getUpdates или, для worker'а
+    шарда без getUpdates, после initialize.
+    """
+    global _deferred_started
+    with _deferred_lock:
+        if _deferred_started:
+            return
+        _deferred_started = True
+    if stage:
+        mark(stage)
+    logger.info(report())
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+
+
+class FirstPollRequest(HTTPXRequest):
+    """Запросы getUpdates: после первого успешного запускает run_deferred."""
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        if not _deferred_started and code == 200:
+            run_deferred("первый getUpdates")
+        return code, payload
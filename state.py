@@ -0,0 +1,327 @@
+"""
+Общее хранилище состояния бота.
+
+Всё, что должно быть видно нескольким процессам бота (привязки пользователей,
+состояние диалогов, кеши, счётчики лимитов, очереди апдейтов по шардам),
+хранится через интерфейс StateBackend:
+
+- MemoryBackend — хранилище в памяти процесса (по умолчанию, один процесс);
+- RedisBackend  — клиент протокола Redis (RESP) без внешних зависимостей,
+  работает с Redis, KeyDB, Dragonfly и любой локальной заглушкой протокола.
+
+Выбор реализации — config.STATE_BACKEND ("memory" или "redis").
+Значения хранятся в байтах; для JSON есть помощники get_json/set_json.
+"""
+
+import json
+import socket
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from config import STATE_BACKEND, REDIS_URL
+
+
+class StateBackendError(Exception):
+    pass
+
+
+class _ConnectionClosed(StateBackendError):
+    pass
+
+
+class StateBackend:
+    """Интерфейс хранилища. Все методы синхронные и потокобезопасные."""
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[int] = None) -> int:
+        """Атомарное увеличение счётчика; ttl задаётся при создании ключа."""
+        raise NotImplementedError
+
+    def hset(self, key: str, field: str, value: bytes) -> None:
+        raise NotImplementedError
+
+    def hdel(self, key: str, field: str) -> None:
+        raise NotImplementedError
+
+    def hgetall(self, key: str) -> Dict[str, bytes]:
+        raise NotImplementedError
+
+    def rpush(self, key: str, value: bytes) -> None:
+        raise NotImplementedError
+
+    def blpop(self, key: str, timeout: float) -> Optional[bytes]:
+        """Забирает первый элемент списка, ожидая не дольше timeout секунд."""
+        raise NotImplementedError
+
+    # ======== Помощники ========
+
+    def get_json(self, key: str) -> Any:
+        raw = self.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set_json(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        self.set(key, json.dumps(value, ensure_ascii=False).encode("utf-8"), ttl=ttl)
+
+
+# ======== В памяти процесса ========
+
+class MemoryBackend(StateBackend):
+    def __init__(self) -> None:
+        self._values: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._lists: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._list_ready = threading.Condition(self._lock)
+
+    def _alive(self, key: str) -> Optional[Any]:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    @staticmethod
+    def _expiry(ttl: Optional[int]) -> Optional[float]:
+        return time.monotonic() + ttl if ttl else None
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._alive(key)
+            return value if isinstance(value, bytes) else None
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None) -> None:
+        with self._lock:
+            self._values[key] = (value, self._expiry(ttl))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+            self._lists.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[int] = None) -> int:
+        with self._lock:
+            value = self._alive(key)
+            if value is None:
+                new = amount
+                self._values[key] = (str(new).encode(), self._expiry(ttl))
+            else:
+                new = int(value) + amount
+                self._values[key] = (str(new).encode(), self._values[key][1])
+            return new
+
+    def hset(self, key: str, field: str, value: bytes) -> None:
+        with self._lock:
+            mapping = self._alive(key)
+            if not isinstance(mapping, dict):
+                mapping = {}
+                self._values[key] = (mapping, None)
+            mapping[field] = value
+
+    def hdel(self, key: str, field: str) -> None:
+        with self._lock:
+            mapping = self._alive(key)
+            if isinstance(mapping, dict):
+                mapping.pop(field, None)
+
+    def hgetall(self, key: str) -> Dict[str, bytes]:
+        with self._lock:
+            mapping = self._alive(key)
+            return dict(mapping) if isinstance(mapping, dict) else {}
+
+    def rpush(self, key: str, value: bytes) -> None:
+        with self._list_ready:
+            self._lists.setdefault(key, deque()).append(value)
+            self._list_ready.notify_all()
+
+    def blpop(self, key: str, timeout: float) -> Optional[bytes]:
+        deadline = time.monotonic() + timeout
+        with self._list_ready:
+            while True:
+                items = self._lists.get(key)
+                if items:
+                    return items.popleft()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._list_ready.wait(remaining)
+
+
+# ======== Протокол Redis ========
+
+class _RespConnection:
+    """Одно соединение RESP2. Используется только из одного потока."""
+
+    def __init__(self, host: str, port: int, db: int, password: Optional[str], timeout: float) -> None:
+        self._default_timeout = timeout
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._sock.makefile("rb")
+        if password:
+            self.command("AUTH", password)
+        if db:
+            self.command("SELECT", str(db))
+
+    def close(self) -> None:
+        try:
+            self._file.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+    @staticmethod
+    def _encode(args: Tuple[Any, ...]) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, bytes):
+                data = arg
+            else:
+                data = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read(self) -> Any:
+        line = self._file.readline()
+        if not line:
+            raise _ConnectionClosed("Соединение с хранилищем закрыто")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise StateBackendError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            if count < 0:
+                return None
+            return [self._read() for _ in range(count)]
+        raise StateBackendError(f"Неизвестный ответ: {line!r}")
+
+    def command(self, *args: Any, timeout: Optional[float] = None) -> Any:
+        if timeout is not None:
+            self._sock.settimeout(timeout)
+        try:
+            self._sock.sendall(self._encode(args))
+            return self._read()
+        finally:
+            if timeout is not None:
+                self._sock.settimeout(self._default_timeout)
+
+
+class RedisBackend(StateBackend):
+    """
+    Минимальный клиент Redis: по одному соединению на поток,
+    повторное подключение при обрыве.
+    """
+
+    def __init__(self, url: str, timeout: float = 5.0) -> None:
+        parsed = urlparse(url)
+        self._host = parsed.hostname or "localhost"
+        self._port = parsed.port or 6379
+        self._db = int(parsed.path.lstrip("/") or 0)
+        self._password = parsed.password
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self) -> _RespConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _RespConnection(self._host, self._port, self._db, self._password, self._timeout)
+            self._local.conn = conn
+        return conn
+
+    def _command(self, *args: Any, timeout: Optional[float] = None) -> Any:
+        try:
+            return self._conn().command(*args, timeout=timeout)
+        except (OSError, _ConnectionClosed):
+            # Одна попытка переподключения; ошибки команд от сервера пробрасываются
+            conn = getattr(self._local, "conn", None)
+            if conn is not None:
+                conn.close()
+            self._local.conn = None
+            return self._conn().command(*args, timeout=timeout)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None) -> None:
+        if ttl:
+            self._command("SET", key, value, "EX", int(ttl))
+        else:
+            self._command("SET", key, value)
+
+    def delete(self, key: str) -> None:
+        self._command("DEL", key)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[int] = None) -> int:
+        value = self._command("INCRBY", key, amount)
+        if ttl and value == amount:
+            self._command("EXPIRE", key, int(ttl))
+        return value
+
+    def hset(self, key: str, field: str, value: bytes) -> None:
+        self._command("HSET", key, field, value)
+
+    def hdel(self, key: str, field: str) -> None:
+        self._command("HDEL", key, field)
+
+    def hgetall(self, key: str) -> Dict[str, bytes]:
+        items: List[bytes] = self._command("HGETALL", key) or []
+        return {items[i].decode("utf-8"): items[i + 1] for i in range(0, len(items), 2)}
+
+    def rpush(self, key: str, value: bytes) -> None:
+        self._command("RPUSH", key, value)
+
+    def blpop(self, key: str, timeout: float) -> Optional[bytes]:
+        # Redis принимает таймаут в секундах; сокету даём запас
+        reply = self._command("BLPOP", key, max(1, int(timeout)), timeout=timeout + self._timeout)
+        if not reply:
+            return None
+        return reply[1]
+
+
+# ======== Текущее хранилище ========
+
+_backend: Optional[StateBackend] = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(kind: str = STATE_BACKEND, url: str = REDIS_URL) -> StateBackend:
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "redis":
+        return RedisBackend(url)
+    raise ValueError(f"Неизвестный тип хранилища: {kind}")
+
+
+def get_backend() -> StateBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend: StateBackend) -> None:
+    """Подмена хранилища (например, локальной заглушкой при проверках)."""
+    global _backend
+    _backend = backend
@@ -0,0 +1,156 @@
+"""
+Локальная копия задач в bot_data.sqlite3 (таблицы в replica_store.py).
+
+Фильтры по ролям и статусам, сортировка и поиск по названию (FTS5)
+выполняются в SQLite за миллисекунды, а Bitrix24 получает только небольшие
+инкрементальные запросы синхронизации.
+
+Синхронизация портала — раз в TASKS_SYNC_INTERVAL секунд в одном процессе (шард 0):
+1. первая и раз в TASKS_SYNC_FULL_INTERVAL — полная: из всех задач портала
+   сохраняются те, где участвует хотя бы один привязанный к боту сотрудник,
+   остальные (удалённые в Bitrix24 или без таких участников) удаляются;
+2. в остальное время — дельта: задачи с CHANGED_DATE не раньше курсора;
+   задача, в которой больше нет привязанных участников, удаляется из копии.
+   Курсор — наибольший CHANGED_DATE на портале, запрошенный перед выгрузкой
+   (get_latest_task_change): задачи, изменённые во время выгрузки, попадут
+   в следующую дельту. Страницы выгрузки — по ID (>ID), не по смещению;
+3. задачи сотрудников, привязавшихся после прошлой синхронизации,
+   загружаются отдельно (фильтр MEMBER).
+
+Копия используется для пользователя, только если его задачи уже загружены,
+а последняя синхронизация была не раньше TASKS_REPLICA_MAX_AGE секунд назад;
+иначе запросы, как и раньше, идут в Bitrix24. Задачи, созданные через бота,
+записываются в копию сразу (remember_created_tasks), не дожидаясь дельты.
+
+Вручную: `python main.py sync-tasks` (полная синхронизация).
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from auth import bound_bitrix_users
+from bitrix_api import TASK_STATUSES, get_latest_task_change, get_tasks_changed_since
+from config import TASKS_REPLICA_MAX_AGE, TASKS_SYNC_FULL_INTERVAL, TASKS_SYNC_INTERVAL, TIMEZONE
+from metrics import cache_hit, cache_miss
+from portals import portal_names, portal_scope, run_in_portal
+from records import SyncedTask, Task
+from replica_store import (
+    delete_replica_tasks,
+    find_replica_tasks,
+    get_tasks_sync_state,
+    replica_synced_at,
+    replica_task_ids,
+    save_tasks_sync_state,
+    upsert_replica_tasks,
+)
+
+logger = logging.getLogger(__name__)
+
+# Статус новой задачи в Bitrix24 — «Ждёт выполнения»
+_NEW_TASK_STATUS = 2
+
+
+def _relevant(task: SyncedTask, users: Set[int]) -> bool:
+    return (
+        task.responsible_id in users
+        or task.created_by in users
+        or not users.isdisjoint(task.accomplices)
+        or not users.isdisjoint(task.auditors)
+    )
+
+
+def sync_portal_tasks(portal: str, full: bool = False) -> int:
+    """Одна синхронизация портала. Возвращает число полученных из Bitrix24 задач."""
+    started = time.time()
+    state = get_tasks_sync_state(portal)
+    full = full or state is None or started - state["full_synced_at"] >= TASKS_SYNC_FULL_INTERVAL
+    users = bound_bitrix_users(portal)
+
+    with portal_scope(portal):
+        # Следующая дельта — с CHANGED_DATE, который был на портале до выгрузки
+        # (>=: задачи, изменённые в ту же секунду позже, не теряются)
+        latest = get_latest_task_change()
+        if full:
+            tasks = get_tasks_changed_since(None)
+            keep = [t for t in tasks if _relevant(t, users)]
+            upsert_replica_tasks(portal, keep)
+            delete_replica_tasks(portal, sorted(replica_task_ids(portal) - {t.id for t in keep}))
+            save_tasks_sync_state(portal, latest, started, started, users)
+            return len(tasks)
+
+        tasks = get_tasks_changed_since(state["cursor"])
+        upsert_replica_tasks(portal, [t for t in tasks if _relevant(t, users)])
+        delete_replica_tasks(portal, [t.id for t in tasks if not _relevant(t, users)])
+        received = len(tasks)
+        for user_id in sorted(users - state["users"]):
+            own = get_tasks_changed_since(None, member_id=user_id)
+            upsert_replica_tasks(portal, own)
+            received += len(own)
+    save_tasks_sync_state(portal, latest or state["cursor"], started, state["full_synced_at"], users)
+    return received
+
+
+def sync_tasks(full: bool = False) -> int:
+    """Синхронизация всех порталов по очереди (для ручного запуска)."""
+    return sum(sync_portal_tasks(portal, full) for portal in portal_names())
+
+
+async def _sync_in_portal(portal: str) -> None:
+    try:
+        with portal_scope(portal):
+            count = await run_in_portal(sync_portal_tasks, portal)
+        logger.debug("Задачи портала %s синхронизированы, получено: %s", portal, count)
+    except Exception:
+        logger.exception("Ошибка синхронизации задач портала %s", portal)
+
+
+async def run_task_sync(interval: float = TASKS_SYNC_INTERVAL) -> None:
+    """Бесконечный цикл синхронизации; первая — сразу при запуске."""
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.gather(*(_sync_in_portal(portal) for portal in portal_names()))
+        await asyncio.sleep(interval)
+
+
+def find_tasks(
+    portal: str,
+    bitrix_user_id: int,
+    role: str,
+    status: str,
+    order: str = "deadline",
+    search: Optional[str] = None,
+    offset: int = 0,
+    limit: int = -1,
+) -> Optional[List[Tuple[Task, Tuple[str, ...]]]]:
+    """
+    Задачи пользователя из локальной копии (см. replica_store.find_replica_tasks)
+    или None, если копия для него не готова или устарела — тогда нужен Bitrix24.
+    """
+    synced_at = replica_synced_at(portal, bitrix_user_id) if TASKS_SYNC_INTERVAL > 0 else None
+    if synced_at is None or time.time() - synced_at > TASKS_REPLICA_MAX_AGE:
+        cache_miss("tasks_replica")
+        return None
+    cache_hit("tasks_replica")
+    return find_replica_tasks(
+        portal, bitrix_user_id, role, TASK_STATUSES.get(status), order, search, offset, limit
+    )
+
+
+def remember_created_tasks(portal: str, tasks: Iterable[Tuple[int, str, Optional[str], int, int]]) -> None:
+    """Задачи, созданные через бота: (id, название, срок, ответственный, автор)."""
+    if TASKS_SYNC_INTERVAL <= 0:
+        return
+    # Время изменения — для сортировки «недавно изменённые»; следующая дельта его заменит
+    changed = datetime.now(ZoneInfo(TIMEZONE)).isoformat(timespec="seconds")
+    upsert_replica_tasks(
+        portal,
+        [
+            SyncedTask(task_id, title, deadline, _NEW_TASK_STATUS, responsible_id, created_by, changed, (), ())
+            for task_id, title, deadline, responsible_id, created_by in tasks
+        ],
+    )
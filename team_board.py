@@ -0,0 +1,244 @@
+"""
+Доска команды в групповом чате (/board, handlers/board.py).
+
+Руководитель создаёт доску в чате отдела, участники добавляются только
+сами (/board join): названия их задач видны всему чату. В чате одно
+закреплённое сообщение: по каждому участнику — число открытых задач,
+просроченных и самые просроченные из них. Одно обновление доски заменяет
+N отдельных запросов «мои задачи».
+
+Раз в TEAM_BOARD_INTERVAL секунд (один процесс, шард 0):
+1. участники всех досок портала собираются в один набор — сотрудник,
+   состоящий в нескольких командах, запрашивается один раз;
+2. нагрузка запрашивается через batch (get_team_load, две команды
+   на участника); порталы — параллельно, каждый в своём пуле. В режиме
+   OAuth задачи участника запрашиваются с его собственными токенами
+   (один batch на участника), с вебхуком — одним набором на портал;
+3. текст каждой доски сравнивается по хешу с последним отправленным
+   (хранится в SQLite, team_board_store.py): сообщение редактируется,
+   только если текст изменился, поэтому доска без изменений не стоит
+   запросов к Bot API.
+
+Если сообщение доски удалено, бот отправляет и закрепляет новое;
+если бота удалили из чата — доска удаляется.
+"""
+
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+from bitrix_api import get_team_load
+from config import TEAM_BOARD_INTERVAL, TEAM_BOARD_TASKS_PER_MEMBER, TIMEZONE
+from keyboards import team_board_inline
+from oauth import current_token, oauth_enabled, use_user_tokens
+from portals import portal_scope, run_in_portal
+from records import MemberLoad
+from rendering import escape
+from team_board_store import delete_team_board, get_team_board, list_team_boards, save_team_board_message
+
+logger = logging.getLogger(__name__)
+
+# Длиннее название просроченной задачи на доске обрезается
+_TITLE_MAX = 60
+
+
+# ======== Текст доски ========
+
+def _member_lines(name: str, load: Optional[MemberLoad]) -> List[str]:
+    if load is None:
+        return [f"<b>{escape(name)}</b> — нет данных"]
+    summary = f"<b>{escape(name)}</b> — открытых: {load.active}"
+    if load.overdue:
+        summary += f", ❗ просрочено: {load.overdue}"
+    lines = [summary]
+    for task in load.oldest_overdue:
+        title = task.title or "(без названия)"
+        if len(title) > _TITLE_MAX:
+            title = title[:_TITLE_MAX - 1] + "…"
+        date_part = (task.deadline or "")[:10]
+        day = ".".join(reversed(date_part.split("-")[1:]))
+        lines.append(f"    #{task.id} {escape(title)} (до {day})")
+    return lines
+
+
+def render_board(members: Sequence[Tuple[int, str]], loads: Dict[int, MemberLoad]) -> str:
+    """
+    Текст доски (HTML) — только из задач, без времени обновления: одинаковые
+    задачи дают одинаковый текст и хеш. Не длиннее одного сообщения.
+    """
+    if not members:
+        return "<b>Доска команды</b>\n\nУчастников пока нет: /board join."
+
+    header = "<b>Доска команды</b> — открытые задачи участников (ответственный)"
+    active = sum(loads[m].active for m, _ in members if m in loads)
+    overdue = sum(loads[m].overdue for m, _ in members if m in loads)
+    footer = f"Всего открытых: {active}, просрочено: {overdue}"
+    # Запас под «…и ещё N» и подпись
+    budget = MessageLimit.MAX_TEXT_LENGTH - len(header) - len(footer) - 64
+    blocks: List[str] = []
+    for shown, (bitrix_user_id, name) in enumerate(members):
+        block = "\n".join(_member_lines(name, loads.get(bitrix_user_id)))
+        budget -= len(block) + 2
+        if budget < 0:
+            blocks.append(f"…и ещё участников: {len(members) - shown}")
+            break
+        blocks.append(block)
+    return "\n\n".join([header] + blocks + [footer])
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+# ======== Обновление ========
+
+def _now() -> str:
+    return datetime.now(ZoneInfo(TIMEZONE)).isoformat(timespec="seconds")
+
+
+def _team_load(member_ids: List[int], now: str) -> Dict[int, MemberLoad]:
+    # Режим вебхука: запросы через вебхук портала, а не с правами нажавшего
+    # «Обновить» (сброс действует только в копии контекста)
+    use_user_tokens(None)
+    return get_team_load(member_ids, now, TEAM_BOARD_TASKS_PER_MEMBER)
+
+
+def _member_load(telegram_user_id: int, bitrix_user_id: int, now: str) -> Dict[int, MemberLoad]:
+    # Режим OAuth: с токенами самого участника. Без токенов (вышел из бота)
+    # запрос ушёл бы через вебхук портала — участник остаётся без данных
+    use_user_tokens(telegram_user_id)
+    if current_token() is None:
+        return {}
+    return get_team_load([bitrix_user_id], now, TEAM_BOARD_TASKS_PER_MEMBER)
+
+
+async def _loads_in_portal(portal: str, members: Dict[int, int], now: str) -> Optional[Dict[int, MemberLoad]]:
+    """members — {bitrix_user_id: telegram_user_id}."""
+    try:
+        with portal_scope(portal):
+            if not oauth_enabled():
+                return await run_in_portal(_team_load, sorted(members), now)
+            results = await asyncio.gather(
+                *(run_in_portal(_member_load, members[m], m, now) for m in sorted(members)),
+                return_exceptions=True,
+            )
+    except Exception:
+        logger.warning("Не удалось получить задачи для досок команд портала %s", portal, exc_info=True)
+        return None
+    loads: Dict[int, MemberLoad] = {}
+    for member, result in zip(sorted(members), results):
+        if isinstance(result, Exception):
+            logger.info("Не удалось получить задачи участника %s досок портала %s: %s", member, portal, result)
+        else:
+            loads.update(result)
+    return loads
+
+
+async def _send_board(bot, board: Dict, text: str) -> Optional[int]:
+    message = await bot.send_message(
+        board["chat_id"], text, parse_mode=ParseMode.HTML, reply_markup=team_board_inline()
+    )
+    try:
+        await bot.pin_chat_message(board["chat_id"], message.message_id, disable_notification=True)
+    except TelegramError:
+        # Нет прав администратора — доска работает и без закрепления
+        logger.info("Не удалось закрепить доску в чате %s", board["chat_id"])
+    return message.message_id
+
+
+async def publish_board(bot, board: Dict, text: str) -> bool:
+    """
+    Отправляет доску, если её текст изменился (по хешу). True — сообщение
+    отправлено или отредактировано.
+    """
+    digest = content_hash(text)
+    chat_id, message_id = board["chat_id"], board["message_id"]
+    if message_id is not None and digest == board["content_hash"]:
+        return False
+    try:
+        if message_id is not None:
+            try:
+                await bot.edit_message_text(
+                    text, chat_id, message_id, parse_mode=ParseMode.HTML, reply_markup=team_board_inline()
+                )
+            except BadRequest as exc:
+                if "not modified" in exc.message.lower():
+                    await asyncio.to_thread(save_team_board_message, chat_id, message_id, digest)
+                    return False
+                if "not found" not in exc.message.lower():
+                    raise
+                # Сообщение удалили из чата — отправляем новое
+                message_id = None
+        if message_id is None:
+            message_id = await _send_board(bot, board, text)
+    except Forbidden:
+        logger.info("Бот удалён из чата %s, доска команды удалена", chat_id)
+        await asyncio.to_thread(delete_team_board, chat_id)
+        return False
+    except RetryAfter as exc:
+        # Остальные доски — в следующий проход, хеш не сохранён
+        logger.warning("Обновление доски %s отложено Telegram на %s с", chat_id, exc.retry_after)
+        return False
+    except TelegramError:
+        logger.warning("Не удалось обновить доску команды в чате %s", chat_id, exc_info=True)
+        return False
+    await asyncio.to_thread(save_team_board_message, chat_id, message_id, digest)
+    board["message_id"], board["content_hash"] = message_id, digest
+    return True
+
+
+async def refresh_boards(bot, boards: Optional[List[Dict]] = None) -> int:
+    """
+    Пересчёт досок (по умолчанию — всех): участники каждого портала
+    запрашиваются одним набором batch. Возвращает число изменённых сообщений.
+    """
+    if boards is None:
+        boards = await asyncio.to_thread(list_team_boards)
+    members_by_portal: Dict[str, Dict[int, int]] = {}
+    for board in boards:
+        members_by_portal.setdefault(board["portal"], {}).update(board["member_users"])
+
+    now = _now()
+    portals = list(members_by_portal)
+    results = await asyncio.gather(
+        *(_loads_in_portal(portal, members_by_portal[portal], now) for portal in portals)
+    )
+    loads_by_portal = dict(zip(portals, results))
+
+    changed = 0
+    for board in boards:
+        loads = loads_by_portal[board["portal"]]
+        if loads is None:
+            # Портал недоступен — доска остаётся прежней до следующего прохода
+            continue
+        if await publish_board(bot, board, render_board(board["members"], loads)):
+            changed += 1
+    return changed
+
+
+async def refresh_board(bot, chat_id: int) -> Optional[bool]:
+    """Пересчёт одной доски; None — доски в чате нет, иначе изменилось ли сообщение."""
+    board = await asyncio.to_thread(get_team_board, chat_id)
+    if board is None:
+        return None
+    return await refresh_boards(bot, [board]) > 0
+
+
+async def run_board_refresher(application, interval: float = TEAM_BOARD_INTERVAL) -> None:
+    """Бесконечный цикл обновления досок (interval <= 0 — отключено)."""
+    if interval <= 0:
+        return
+    while True:
+        try:
+            changed = await refresh_boards(application.bot)
+            if changed:
+                logger.info("Доски команд: обновлено сообщений %s", changed)
+        except Exception:
+            logger.exception("Ошибка при обновлении досок команд")
+        await asyncio.sleep(interval)
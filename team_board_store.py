@@ -0,0 +1,183 @@
+"""
+Хранилище досок команд (team_board.py, handlers/board.py) в общей базе
+бота (auth.DB_PATH): доска группового чата, её сообщение с хешем текста
+и участники — добавившие себя сотрудники с их telegram_user_id.
+
+Таблицы создаются при первом обращении, как и таблицы auth.py.
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import auth
+from metrics import SQLITE_LATENCY
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    if not _schema_ready:
+        with _schema_lock, SQLITE_LATENCY.time("init_team_board_db"):
+            if not _schema_ready:
+                conn = sqlite3.connect(auth.DB_PATH)
+                _create_schema(conn.cursor())
+                conn.commit()
+                conn.close()
+                _schema_ready = True
+    return sqlite3.connect(auth.DB_PATH)
+
+
+def _create_schema(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS team_boards (
+            chat_id INTEGER PRIMARY KEY,
+            portal TEXT NOT NULL,
+            owner_telegram_user_id INTEGER NOT NULL,
+            message_id INTEGER,
+            content_hash TEXT,
+            updated_at REAL
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS team_board_members (
+            chat_id INTEGER NOT NULL,
+            bitrix_user_id INTEGER NOT NULL,
+            telegram_user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (chat_id, bitrix_user_id)
+        )
+        """
+    )
+
+
+def create_team_board(chat_id: int, portal: str, owner_telegram_user_id: int) -> bool:
+    """Доска группового чата; False — она уже есть."""
+    with SQLITE_LATENCY.time("create_team_board"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT OR IGNORE INTO team_boards (chat_id, portal, owner_telegram_user_id) VALUES (?, ?, ?)",
+            (chat_id, portal, owner_telegram_user_id),
+        )
+        created = cur.rowcount > 0
+        conn.commit()
+        conn.close()
+    return created
+
+
+def _team_boards(cur: sqlite3.Cursor, where: str, params: Tuple) -> List[Dict]:
+    cur.execute(
+        f"""
+        SELECT chat_id, portal, owner_telegram_user_id, message_id, content_hash, updated_at
+        FROM team_boards {where}
+        """,
+        params,
+    )
+    boards = {
+        row[0]: {
+            "chat_id": row[0],
+            "portal": row[1],
+            "owner": row[2],
+            "message_id": row[3],
+            "content_hash": row[4],
+            "updated_at": row[5],
+            "members": [],
+            "member_users": {},
+        }
+        for row in cur.fetchall()
+    }
+    if boards:
+        cur.execute(
+            f"""
+            SELECT m.chat_id, m.bitrix_user_id, m.telegram_user_id, m.name FROM team_board_members m
+            JOIN team_boards USING (chat_id) {where}
+            ORDER BY m.name, m.bitrix_user_id
+            """,
+            params,
+        )
+        for chat_id, bitrix_user_id, telegram_user_id, name in cur.fetchall():
+            boards[chat_id]["members"].append((bitrix_user_id, name))
+            boards[chat_id]["member_users"][bitrix_user_id] = telegram_user_id
+    return list(boards.values())
+
+
+def get_team_board(chat_id: int) -> Optional[Dict]:
+    """
+    {'chat_id', 'portal', 'owner', 'message_id', 'content_hash', 'updated_at',
+    'members': [(bitrix_user_id, имя), ...] по имени,
+    'member_users': {bitrix_user_id: telegram_user_id}} или None.
+    """
+    with SQLITE_LATENCY.time("get_team_board"):
+        conn = _connect()
+        boards = _team_boards(conn.cursor(), "WHERE chat_id = ?", (chat_id,))
+        conn.close()
+    return boards[0] if boards else None
+
+
+def list_team_boards() -> List[Dict]:
+    """Все доски (как get_team_board)."""
+    with SQLITE_LATENCY.time("list_team_boards"):
+        conn = _connect()
+        boards = _team_boards(conn.cursor(), "", ())
+        conn.close()
+    return boards
+
+
+def delete_team_board(chat_id: int) -> None:
+    with SQLITE_LATENCY.time("delete_team_board"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM team_boards WHERE chat_id = ?", (chat_id,))
+        cur.execute("DELETE FROM team_board_members WHERE chat_id = ?", (chat_id,))
+        conn.commit()
+        conn.close()
+
+
+def add_team_board_member(chat_id: int, telegram_user_id: int, bitrix_user_id: int, name: str) -> None:
+    """Участник, добавивший себя сам (его Telegram — для запросов с его токенами)."""
+    with SQLITE_LATENCY.time("add_team_board_member"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO team_board_members (chat_id, bitrix_user_id, telegram_user_id, name)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id, bitrix_user_id) DO UPDATE SET
+                telegram_user_id = excluded.telegram_user_id, name = excluded.name
+            """,
+            (chat_id, bitrix_user_id, telegram_user_id, name),
+        )
+        conn.commit()
+        conn.close()
+
+
+def remove_team_board_members(chat_id: int, bitrix_user_ids: Sequence[int]) -> None:
+    with SQLITE_LATENCY.time("remove_team_board_members"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.executemany(
+            "DELETE FROM team_board_members WHERE chat_id = ? AND bitrix_user_id = ?",
+            [(chat_id, bitrix_user_id) for bitrix_user_id in bitrix_user_ids],
+        )
+        conn.commit()
+        conn.close()
+
+
+def save_team_board_message(chat_id: int, message_id: Optional[int], content_hash: Optional[str]) -> None:
+    """Сообщение доски и хеш его текста после отправки или редактирования."""
+    with SQLITE_LATENCY.time("save_team_board_message"):
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE team_boards SET message_id = ?, content_hash = ?, updated_at = ? WHERE chat_id = ?",
+            (message_id, content_hash, time.time(), chat_id),
+        )
+        conn.commit()
+        conn.close()
@@ -0,0 +1,148 @@
+"""
+Ограничение частоты нажатий inline-кнопок (load shedding).
+
+Обработчик throttle_middleware регистрируется в группе -2, до проверки
+авторизации, и пропускает дальше не все callback-запросы:
+- повторное нажатие той же кнопки в том же сообщении в течение
+  THROTTLE_DUPLICATE_WINDOW секунд схлопывается с предыдущим;
+- у каждого пользователя свой token bucket (THROTTLE_USER_BURST нажатий
+  подряд, дальше THROTTLE_USER_RATE в секунду);
+- общий лимит THROTTLE_GLOBAL_RATE нажатий в секунду на всех пользователей
+  и все процессы — счётчик в общем хранилище (state.py).
+
+Отброшенный запрос сразу получает answerCallbackQuery с коротким
+уведомлением, поэтому у пользователя не висят "часики" на кнопке.
+Текстовые сообщения не ограничиваются: они двигают шаги диалогов.
+
+Состояние пользователя хранится в памяти процесса: при шардировании
+все апдейты пользователя приходят в один и тот же worker. Общий счётчик
+запрашивается в пуле потоков: запрос к Redis не блокирует цикл событий.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Tuple
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop
+
+from config import (
+    THROTTLE_DUPLICATE_WINDOW,
+    THROTTLE_GLOBAL_RATE,
+    THROTTLE_USER_BURST,
+    THROTTLE_USER_RATE,
+)
+from metrics import Counter, timed_handler
+from state import StateBackendError, get_backend
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_NOTICE = "Слишком часто. Подождите секунду."
+
+# Сколько пользователей держать в памяти до очистки неактивных
+MAX_TRACKED_USERS = 10_000
+
+_GLOBAL_KEY = "throttle:global:"
+
+THROTTLED_UPDATES = Counter(
+    "throttled_callbacks_total", "Отброшенные нажатия кнопок", ["reason"]
+)
+
+# user_id -> [токены, время последнего пополнения]
+_buckets: Dict[int, List[float]] = {}
+# user_id -> (message_id, callback_data, время нажатия)
+_last_clicks: Dict[int, Tuple[int, str, float]] = {}
+
+
+def _take_user_token(user_id: int, now: float) -> bool:
+    bucket = _buckets.get(user_id)
+    if bucket is None:
+        if len(_buckets) >= MAX_TRACKED_USERS:
+            _prune(now)
+        bucket = _buckets[user_id] = [float(THROTTLE_USER_BURST), now]
+    else:
+        tokens = bucket[0] + (now - bucket[1]) * THROTTLE_USER_RATE
+        bucket[0] = min(float(THROTTLE_USER_BURST), tokens)
+        bucket[1] = now
+    if bucket[0] < 1.0:
+        return False
+    bucket[0] -= 1.0
+    return True
+
+
+def _prune(now: float) -> None:
+    """Забывает пользователей, чьи корзины уже успели наполниться."""
+    refill = THROTTLE_USER_BURST / THROTTLE_USER_RATE
+    for user_id in [u for u, (_, last) in _buckets.items() if now - last >= refill]:
+        del _buckets[user_id]
+
+
+def _prune_clicks(now: float) -> None:
+    """Забывает нажатия старше окна схлопывания — с ними уже нечего сравнивать."""
+    for user_id in [u for u, (_, _, at) in _last_clicks.items() if now - at >= THROTTLE_DUPLICATE_WINDOW]:
+        del _last_clicks[user_id]
+
+
+def _is_duplicate(user_id: int, message_id: int, data: str, now: float) -> bool:
+    last = _last_clicks.get(user_id)
+    if last is None and len(_last_clicks) >= MAX_TRACKED_USERS:
+        _prune_clicks(now)
+    _last_clicks[user_id] = (message_id, data, now)
+    return (
+        last is not None
+        and last[0] == message_id
+        and last[1] == data
+        and now - last[2] < THROTTLE_DUPLICATE_WINDOW
+    )
+
+
+def _take_global_token() -> bool:
+    """Блокирующий запрос к общему хранилищу — только через asyncio.to_thread."""
+    # Окно в одну секунду; четыре ключа по кругу, чтобы не копить ключи в памяти
+    second = int(time.time())
+    try:
+        count = get_backend().incr(f"{_GLOBAL_KEY}{second % 4}", ttl=2)
+    except StateBackendError:
+        logger.warning("Общий лимит нажатий недоступен, пропускаю без проверки", exc_info=True)
+        return True
+    return count <= THROTTLE_GLOBAL_RATE
+
+
+async def admit_callback(user_id: int, message_id: int, data: str) -> str:
+    """
+    Решение по нажатию кнопки: "" — пропустить, иначе причина отказа
+    ("duplicate", "user" или "global").
+    """
+    now = time.monotonic()
+    if THROTTLE_DUPLICATE_WINDOW and _is_duplicate(user_id, message_id, data, now):
+        return "duplicate"
+    if THROTTLE_USER_RATE and not _take_user_token(user_id, now):
+        return "user"
+    if THROTTLE_GLOBAL_RATE and not await asyncio.to_thread(_take_global_token):
+        return "global"
+    return ""
+
+
+def reset_throttling() -> None:
+    _buckets.clear()
+    _last_clicks.clear()
+
+
+@timed_handler
+async def throttle_middleware(update: Update, context) -> None:
+    """Предобработка (группа -2): отбрасывает лишние нажатия кнопок."""
+    query = update.callback_query
+    if query is None or update.effective_user is None:
+        return
+    message_id = query.message.message_id if query.message else 0
+    reason = await admit_callback(update.effective_user.id, message_id, query.data or "")
+    if not reason:
+        return
+    THROTTLED_UPDATES.inc(reason)
+    if reason == "duplicate":
+        # Первое нажатие уже обрабатывается — просто гасим "часики"
+        await query.answer()
+    else:
+        await query.answer(THROTTLED_NOTICE)
+    raise ApplicationHandlerStop
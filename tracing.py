@@ -0,0 +1,199 @@
+"""
+Трассировка пути апдейта: приём -> проверка авторизации -> вызовы Bitrix24
+-> запросы к Telegram Bot API.
+
+Каждый апдейт получает correlation ID, шаги записываются как спаны.
+Текущая трасса хранится в contextvars, поэтому синхронные вызовы
+bitrix_api._call внутри обработчиков попадают в трассу без явной передачи.
+
+Экспорт:
+- в JSON lines (TRACE_EXPORT_PATH) — для доли апдейтов TRACE_SAMPLE_RATE.
+  Файл пишет отдельный поток, а не цикл событий, и ротирует его
+  по TRACE_EXPORT_MAX_BYTES;
+- медленные апдейты (дольше TRACE_SLOW_UPDATE_SECONDS) пишутся в лог
+  всегда, с именами методов Bitrix24 и размерами ответов.
+"""
+
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, Iterator, List, Optional
+
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+
+from config import (
+    TRACE_EXPORT_BACKUPS,
+    TRACE_EXPORT_MAX_BYTES,
+    TRACE_EXPORT_PATH,
+    TRACE_EXPORT_QUEUE_SIZE,
+    TRACE_SAMPLE_RATE,
+    TRACE_SLOW_UPDATE_SECONDS,
+)
+from metrics import TRACES_DROPPED, Histogram
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_LATENCY = Histogram(
+    "telegram_request_duration_seconds", "Время запроса к Telegram Bot API", ["method"]
+)
+
+
+class Trace:
+    __slots__ = ("trace_id", "update_id", "user_id", "started", "spans", "sampled")
+
+    def __init__(self, update_id: Optional[int], user_id: Optional[int], sampled: bool) -> None:
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.update_id = update_id
+        self.user_id = user_id
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.sampled = sampled
+
+    def add_span(self, name: str, started: float, **attrs: Any) -> None:
+        span = {
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 2),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        if attrs:
+            span.update(attrs)
+        self.spans.append(span)
+
+    def to_dict(self, duration: float) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "update_id": self.update_id,
+            "user_id": self.user_id,
+            "duration_ms": round(duration * 1000, 2),
+            "spans": self.spans,
+        }
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_export_queue: "queue.Queue[str]" = queue.Queue(maxsize=TRACE_EXPORT_QUEUE_SIZE)
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def current_trace_id() -> str:
+    trace = _current.get()
+    return trace.trace_id if trace else "-"
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Спан внутри текущей трассы. В блоке можно дописать атрибуты
+    в возвращённый словарь (например, размер ответа).
+    Вне трассы ничего не записывается.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield attrs
+        return
+    started = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        trace.add_span(name, started, **attrs)
+
+
+def _write_traces() -> None:
+    """Поток записи: строки из очереди -> файл выгрузки с ротацией по размеру."""
+    handler = RotatingFileHandler(
+        TRACE_EXPORT_PATH, maxBytes=TRACE_EXPORT_MAX_BYTES, backupCount=TRACE_EXPORT_BACKUPS, encoding="utf-8"
+    )
+    while True:
+        line = _export_queue.get()
+        # emit сам ротирует файл и сбрасывает буфер после каждой строки
+        handler.emit(logging.makeLogRecord({"msg": line}))
+
+
+def _export(record: Dict[str, Any]) -> None:
+    global _writer
+    if not TRACE_EXPORT_PATH:
+        return
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_write_traces, name="traces", daemon=True)
+                _writer.start()
+    try:
+        _export_queue.put_nowait(json.dumps(record, ensure_ascii=False))
+    except queue.Full:
+        TRACES_DROPPED.inc()
+
+
+def _finish(trace: Trace) -> None:
+    duration = time.perf_counter() - trace.started
+    slow = duration >= TRACE_SLOW_UPDATE_SECONDS
+    if not trace.sampled and not slow:
+        return
+    record = trace.to_dict(duration)
+    if trace.sampled:
+        _export(record)
+    if slow:
+        steps = ", ".join(
+            f"{s['name']}"
+            + (f"[{s['method']}]" if "method" in s else "")
+            + (f" {s['response_bytes']}B" if "response_bytes" in s else "")
+            + f" {s['duration_ms']}ms"
+            for s in trace.spans
+        )
+        logger.warning(
+            "Медленный апдейт %s (trace %s, user %s): %.0f мс; %s",
+            trace.update_id,
+            trace.trace_id,
+            trace.user_id,
+            duration * 1000,
+            steps,
+        )
+
+
+class TraceIdFilter(logging.Filter):
+    """Добавляет %(trace_id)s в записи лога."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id()
+        return True
+
+
+class TracingApplication(Application):
+    """Application, открывающий трассу на каждый апдейт."""
+
+    async def process_update(self, update: object) -> None:
+        update_id = getattr(update, "update_id", None)
+        user = getattr(update, "effective_user", None)
+        trace = Trace(update_id, user.id if user else None, random.random() < TRACE_SAMPLE_RATE)
+        token = _current.set(trace)
+        try:
+            with span("dispatch"):
+                await super().process_update(update)
+        finally:
+            _current.reset(token)
+            _finish(trace)
+
+
+class TracingRequest(HTTPXRequest):
+    """Запросы к Bot API со спаном и метрикой времени по методу."""
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        with span("telegram", method=api_method) as attrs:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            attrs["response_bytes"] = len(payload)
+        TELEGRAM_LATENCY.observe(time.perf_counter() - started, api_method)
+        return code, payload
@@ -0,0 +1,239 @@
+"""
+Ограничение состояния пользователей в памяти процесса (context.user_data и диалоги).
+
+- DialogHandler — ConversationHandler, который помнит время последнего шага
+  каждого диалога. Диалог без ответа дольше CONVERSATION_TIMEOUTS[имя] секунд
+  завершает планировщик (run_user_state_janitor): пользователю приходит
+  сообщение, черновик удаляется. Черновик (draft_keys) удаляется при любом
+  завершении диалога — готово, отмена, ошибка, таймаут.
+- Жёсткий лимит USER_DATA_MAX_BYTES на user_data пользователя — в байтах pickle,
+  так же оно хранится в общем хранилище: диалог, после шага которого лимит
+  превышен, прерывается, черновик удаляется.
+- StateApplication запоминает время последнего апдейта пользователя;
+  user_data и данные личного чата тех, кто не писал боту USER_STATE_IDLE_TTL
+  секунд, выгружаются из памяти. С общим хранилищем (persistence) они
+  остаются там и подгружаются при следующем апдейте; без него сбрасываются
+  и настройки фильтра задач.
+- user_data_report() — распределение размеров user_data (p50/p95/max и
+  ключи, занимающие больше всего); публикуется в /metrics при каждой проверке.
+
+Планировщик работает в каждом процессе: диалоги и user_data живут в памяти
+того процесса, который обслуживает пользователя.
+"""
+
+import asyncio
+import logging
+import pickle
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+from telegram.error import TelegramError
+from telegram.ext import ConversationHandler
+
+from config import CONVERSATION_TIMEOUTS, USER_DATA_MAX_BYTES, USER_STATE_IDLE_TTL, USER_STATE_SWEEP_INTERVAL
+from metrics import USER_DATA_BYTES, USER_DATA_USERS, USER_STATE_EVICTIONS
+from tracing import TracingApplication
+
+logger = logging.getLogger(__name__)
+
+BUDGET_EXCEEDED_TEXT = "Черновик получился слишком большим и удалён. Начните заново с меньшим объёмом данных."
+
+
+def user_data_size(user_data: Dict[str, Any]) -> int:
+    """Размер user_data в байтах pickle — столько же занимает запись в общем хранилище."""
+    return len(pickle.dumps(dict(user_data), protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class DialogHandler(ConversationHandler):
+    """
+    Диалог с таймаутом и черновиком в user_data.
+    draft_keys — ключи user_data, которые диалог создаёт и которые удаляются
+    при его завершении; timeout_text — сообщение пользователю по таймауту
+    ({minutes} заменяется длительностью таймаута в минутах).
+    Таймаут — CONVERSATION_TIMEOUTS[name] секунд (нет в словаре — без таймаута).
+    """
+
+    def __init__(self, *args: Any, draft_keys: Sequence[str] = (), timeout_text: str = "", **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.draft_keys = tuple(draft_keys)
+        self.timeout_text = timeout_text
+        self.dialog_timeout = CONVERSATION_TIMEOUTS.get(self.name or "", 0)
+        # Ключ диалога (chat_id, user_id) -> time.time() последнего шага
+        self._last_step: Dict[Any, float] = {}
+
+    def drop_draft(self, user_data: Optional[Dict[str, Any]]) -> None:
+        if user_data:
+            for key in self.draft_keys:
+                user_data.pop(key, None)
+
+    async def handle_update(self, update, application, check_result, context) -> Optional[object]:
+        key = check_result[1]
+        self._last_step[key] = time.time()
+        try:
+            return await super().handle_update(update, application, check_result, context)
+        finally:
+            if key not in self._conversations:
+                self._last_step.pop(key, None)
+                self.drop_draft(context.user_data)
+            elif context.user_data and user_data_size(context.user_data) > USER_DATA_MAX_BYTES:
+                self._end(key, context.user_data)
+                USER_STATE_EVICTIONS.inc("budget")
+                logger.warning("Диалог %s пользователя %s прерван: превышен лимит user_data", self.name, key[-1])
+                try:
+                    await context.bot.send_message(key[0], BUDGET_EXCEEDED_TEXT)
+                except TelegramError:
+                    pass
+
+    def _end(self, key: Any, user_data: Optional[Dict[str, Any]]) -> None:
+        self._update_state(self.END, key)
+        self._last_step.pop(key, None)
+        self.drop_draft(user_data)
+
+    def has_user(self, user_id: int) -> bool:
+        return any(key[-1] == user_id for key in self._conversations)
+
+    def expired(self, now: float) -> List[Any]:
+        """
+        Ключи диалогов без шагов дольше таймаута. Диалоги, восстановленные из
+        хранилища после перезапуска, отсчитывают таймаут с первой проверки.
+        """
+        for key in list(self._last_step):
+            if key not in self._conversations:
+                del self._last_step[key]
+        if not self.dialog_timeout:
+            return []
+        for key in self._conversations:
+            self._last_step.setdefault(key, now)
+        return [key for key, at in self._last_step.items() if now - at > self.dialog_timeout]
+
+    async def expire(self, application, now: float) -> int:
+        """Завершает просроченные диалоги. Возвращает их число."""
+        keys = self.expired(now)
+        for key in keys:
+            user_id = key[-1]
+            self._end(key, application.user_data.get(user_id))
+            application.mark_data_for_update_persistence(user_ids=user_id)
+            if self.timeout_text:
+                try:
+                    minutes = max(1, round(self.dialog_timeout / 60))
+                    await application.bot.send_message(key[0], self.timeout_text.format(minutes=minutes))
+                except TelegramError:
+                    logger.info("Не удалось сообщить пользователю %s о таймауте диалога", user_id)
+        return len(keys)
+
+
+class StateApplication(TracingApplication):
+    """Application, запоминающий время последнего апдейта каждого пользователя."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        # user_id -> time.time() последнего апдейта
+        self.last_seen: Dict[int, float] = {}
+
+    async def process_update(self, update: object) -> None:
+        user = getattr(update, "effective_user", None)
+        if user is not None:
+            self.last_seen[user.id] = time.time()
+        await super().process_update(update)
+
+    def evict_user(self, user_id: int) -> bool:
+        """
+        Выгружает user_data и данные личного чата пользователя из памяти.
+        Пока изменения не записаны в persistence, выгружать нельзя — False.
+        """
+        if self.persistence is not None and user_id in self._user_ids_to_be_updated_in_persistence:
+            return False
+        # Без persistence список ожидающих записи никто не очищает
+        self._user_ids_to_be_updated_in_persistence.discard(user_id)
+        self._user_data.pop(user_id, None)
+        # Личный чат: chat_id совпадает с user_id
+        self._chat_data.pop(user_id, None)
+        self.last_seen.pop(user_id, None)
+        return True
+
+
+def _dialogs(application) -> List[DialogHandler]:
+    return [h for group in application.handlers.values() for h in group if isinstance(h, DialogHandler)]
+
+
+def _percentile(ordered: List[int], pct: float) -> int:
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def user_data_report(application, top: int = 5) -> Dict[str, Any]:
+    """
+    Распределение размеров user_data в памяти процесса: число пользователей,
+    сумма, p50/p95/p99/max (байты pickle) и ключи с наибольшим суммарным объёмом.
+    """
+    sizes: List[int] = []
+    by_key: Counter = Counter()
+    for user_data in list(application.user_data.values()):
+        if not user_data:
+            continue
+        sizes.append(user_data_size(user_data))
+        for key, value in list(user_data.items()):
+            by_key[key] += len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    sizes.sort()
+    return {
+        "users": len(sizes),
+        "total_bytes": sum(sizes),
+        "p50_bytes": _percentile(sizes, 50),
+        "p95_bytes": _percentile(sizes, 95),
+        "p99_bytes": _percentile(sizes, 99),
+        "max_bytes": sizes[-1] if sizes else 0,
+        "top_keys": dict(by_key.most_common(top)),
+    }
+
+
+async def sweep_user_state(application, now: Optional[float] = None) -> Dict[str, int]:
+    """
+    Один проход: таймауты диалогов, затем выгрузка простаивающих пользователей
+    и публикация отчёта в /metrics. Возвращает {"expired", "evicted"}.
+    """
+    now = time.time() if now is None else now
+    dialogs = _dialogs(application)
+    expired = 0
+    for dialog in dialogs:
+        expired += await dialog.expire(application, now)
+
+    evicted = 0
+    if isinstance(application, StateApplication):
+        for user_id, seen in list(application.last_seen.items()):
+            if now - seen <= USER_STATE_IDLE_TTL:
+                continue
+            # Диалог без таймаута не обрываем молча
+            if any(dialog.has_user(user_id) for dialog in dialogs):
+                continue
+            if application.evict_user(user_id):
+                evicted += 1
+    if expired:
+        USER_STATE_EVICTIONS.inc("timeout", amount=expired)
+    if evicted:
+        USER_STATE_EVICTIONS.inc("idle", amount=evicted)
+
+    report = user_data_report(application)
+    USER_DATA_USERS.set(value=report["users"])
+    for stat in ("total", "p50", "p95", "p99", "max"):
+        USER_DATA_BYTES.set(stat, value=report[f"{stat}_bytes"])
+    return {"expired": expired, "evicted": evicted}
+
+
+async def run_user_state_janitor(application, interval: float = USER_STATE_SWEEP_INTERVAL) -> None:
+    """Бесконечный цикл проверки состояния пользователей (interval <= 0 — отключено)."""
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            result = await sweep_user_state(application)
+            if result["expired"] or result["evicted"]:
+                logger.info(
+                    "Состояние пользователей: завершено диалогов по таймауту %s, выгружено пользователей %s",
+                    result["expired"],
+                    result["evicted"],
+                )
+        except Exception:
+            logger.exception("Ошибка при очистке состояния пользователей")